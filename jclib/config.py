@@ -61,7 +61,7 @@ class SimpleConfigurable(metaclass=abc.ABCMeta):
             self.UID, self.FILENAME
         )
         utils.mkdir_exist_ok(user_path.parent)
-        with utils.safe_writer(user_path) as f:
+        with config_manager.writer(user_path) as f:
             self._do_save(f)
 
 
@@ -71,6 +71,7 @@ class ConfigManager:
     def __init__(self, pathprovider):
         super().__init__()
         self.pathprovider = pathprovider
+        self._group = None
 
     def get_config_paths(self, uid, filename):
         escaped = escape_dirname(uid)
@@ -119,8 +120,44 @@ class ConfigManager:
             with f:
                 callback(f, sitewide)
 
+    def writer(self, path):
+        """
+        Return a context manager to safely overwrite a configuration file.
+
+        :param path: The file to overwrite.
+        :type path: :class:`pathlib.Path`
+
+        During :meth:`writeback`, the file is replaced together with the files
+        written by the other handlers of :attr:`on_writeback`. Otherwise, it
+        is replaced when the context manager is left, using
+        :func:`~.utils.safe_writer`.
+        """
+        if self._group is not None:
+            return self._group.open(path)
+        return utils.safe_writer(path)
+
     def writeback(self):
-        self.on_writeback()
+        """
+        Emit :attr:`on_writeback` and commit the files written by the
+        handlers with :meth:`writer` as a group.
+
+        Like exceptions raised by the handlers, errors when committing the
+        files are logged and not re-raised.
+        """
+        group = utils.GroupWriter()
+        self._group = group
+        try:
+            self.on_writeback()
+        except:  # NOQA
+            group.abort()
+            raise
+        finally:
+            self._group = None
+
+        try:
+            group.commit()
+        except OSError:
+            logger.exception("failed to write back configuration")
 
 
 class XDGProvider:
@@ -143,6 +143,33 @@ class Accounts(jclib.config.SimpleConfigurable,
             if account.enabled:
                 self.on_account_enabled(account)
 
+    @staticmethod
+    def _enabled_jids_from_xso(xso):
+        return [
+            account_xso.jid.bare()
+            for account_xso in xso.accounts
+            if not account_xso.disabled
+        ]
+
+    def stored_enabled_jids(self) -> typing.List[JID]:
+        """
+        Return the addresses of the enabled accounts in the configuration.
+
+        The configuration is read without loading any accounts, so that data
+        for them can be prepared before :meth:`load` enables them.
+        """
+        try:
+            with jclib.config.config_manager.open_single(
+                    self.UID,
+                    self.FILENAME) as f:
+                xso = aioxmpp.xml.read_single_xso(
+                    f,
+                    jclib.xso.AccountsSettings
+                )
+        except OSError:
+            return []
+        return self._enabled_jids_from_xso(xso)
+
     def _do_load(self, f):
         assert not self._backend
         xso = aioxmpp.xml.read_single_xso(
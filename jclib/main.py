@@ -136,6 +136,13 @@ class Main:
             5,
             120,
         )
+        self.cache_evictor = jclib.storage.CacheEvictor(
+            jclib.storage.accounting,
+            jclib.storage.space.CACHE_QUOTA,
+        )
+        self.database_maintainer = jclib.storage.DatabaseMaintainer(
+            jclib.storage.accounting,
+        )
         self.roster = jclib.roster.RosterManager(
             self.accounts,
             self.client,
@@ -202,7 +209,14 @@ class Main:
         self.loop.remove_signal_handler(signal.SIGTERM)
         self.loop.remove_signal_handler(signal.SIGINT)
         del self.main_future
+        self.cache_evictor.stop()
+        self.database_maintainer.stop()
+        jclib.storage.engines.stop()
         self.writeman.force_writeback()
+        jclib.storage.append.close()
+        jclib.storage.xml.close()
+        jclib.storage.databases.close()
+        jclib.storage.engines.close_all()
 
     def quit(self):
         if self.main_future.done():
@@ -246,6 +260,21 @@ class Main:
 
         return singleton
 
+    @asyncio.coroutine
+    def preload_storage(self):
+        levels = [
+            jclib.storage.AccountLevel(jid)
+            for jid in self.accounts.stored_enabled_jids()
+        ]
+        try:
+            yield from jclib.storage.xml.preload(
+                jclib.storage.StorageType.CACHE,
+                levels,
+            )
+        except Exception:
+            logger.warning("failed to preload the XML storage",
+                           exc_info=True)
+
     @asyncio.coroutine
     def run_core(self):
         yield from self.main_future
@@ -260,7 +289,12 @@ class Main:
                 returncode = 1
                 return returncode
 
+            # the cached rosters are read when the accounts are enabled
+            yield from self.preload_storage()
             self.accounts.load()
+            self.cache_evictor.start()
+            self.database_maintainer.start()
+            jclib.storage.engines.start(self.loop)
 
             try:
                 returncode = yield from self.run_core()
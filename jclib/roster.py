@@ -31,9 +31,13 @@ import jclib.identity
 import jclib.instrumentable_list
 import jclib.metadata
 import jclib.storage
+import jclib.tasks
 import jclib.xso
 
 
+logger = logging.getLogger(__name__)
+
+
 class AbstractRosterItem(metaclass=abc.ABCMeta):
     def __init__(self,
                  account: jclib.identity.Account,
@@ -471,9 +475,9 @@ class AbstractRosterService(
                  writeman: jclib.storage.WriteManager):
         super().__init__(jclib.instrumentable_list.ModelList())
         self._writeman = writeman
-        self._writeman.on_writeback.connect(
+        self._writeback = writeman.register(
+            "{} of {}".format(type(self).__name__, account.jid),
             self.save,
-            self._writeman.on_writeback.WEAK,
         )
         self._account = account
 
@@ -681,13 +685,13 @@ class ContactRosterService(AbstractRosterService):
         self.__addrmap[wrapped.address] = wrapped
         self._backend.append(wrapped)
         self._dirty = True
-        self._writeman.request_writeback()
+        self._writeback.request_writeback()
 
     def _on_entry_removed(self, item):
         wrapped = self.__addrmap.pop(item.jid)
         self._backend.remove(wrapped)
         self._dirty = True
-        self._writeman.request_writeback()
+        self._writeback.request_writeback()
 
     def _on_entry_changed(self, item, _=None):
         wrapped = self.__addrmap[item.jid]
@@ -695,7 +699,7 @@ class ContactRosterService(AbstractRosterService):
         index = self._backend.index(wrapped)
         self._backend.refresh_data(slice(index, index + 1), None, None)
         self._dirty = True
-        self._writeman.request_writeback()
+        self._writeback.request_writeback()
 
     def _on_tag_added(self, tag: str):
         self.on_tag_added(tag)
@@ -775,19 +779,19 @@ class ConferenceBookmarkService(AbstractRosterService):
         item = MUCRosterItem.wrap(self._account, self, bookmark)
         self.__addrmap[item.address] = item
         self._backend.append(item)
-        self._writeman.request_writeback()
+        self._writeback.request_writeback()
 
     def _on_bookmark_removed(self, bookmark):
         item = self.__addrmap.pop(bookmark.jid)
         self._backend.remove(item)
-        self._writeman.request_writeback()
+        self._writeback.request_writeback()
 
     def _on_bookmark_changed(self, old_bookmark, new_bookmark):
         item = self.__addrmap[old_bookmark.jid]
         item.update(new_bookmark)
         index = self._backend.index(item)
         self._backend.refresh_data(slice(index, index + 1), None)
-        self._writeman.request_writeback()
+        self._writeback.request_writeback()
 
     def get_by_address(self, peer: aioxmpp.JID):
         return self.__addrmap[peer]
@@ -924,6 +928,7 @@ class RosterManager(
         self._client.on_client_stopped.connect(self._shutdown_client)
 
         self._client_svc_map = {}
+        self._peer_blob_warmups = []
 
         self._tags = jclib.instrumentable_list.ModelList()
         self._tags_counter = collections.Counter()
@@ -945,6 +950,52 @@ class RosterManager(
             self._backend.append_source(instance)
             svcs.append(instance)
 
+            if class_ is ContactRosterService and self._peer_blob_warmups:
+                self._start_peer_blob_warmups(account, instance)
+
+    def add_peer_blob_warmup(self, type_, namespace, names=None):
+        """
+        Warm up small blobs of the contacts whenever a roster is loaded.
+
+        :param type_: The storage type of the blobs.
+        :type type_: :class:`~.StorageType`
+        :param namespace: The namespace of the blobs.
+        :type namespace: :class:`str`
+        :param names: If given, only the blobs with these names are loaded.
+        :type names: iterable of :class:`str`
+
+        Right after the cached roster of an account has been loaded, the
+        :attr:`~.StorageLevel.PEER` level small blobs of all contacts are
+        loaded in the background using :meth:`.SmallBlobFrontend.warm`, so
+        that the first access to them does not hit the database.
+        """
+        self._peer_blob_warmups.append((type_, namespace, names))
+
+    def _start_peer_blob_warmups(self, account, contacts):
+        levels = [
+            jclib.storage.PeerLevel(account.jid, item.address)
+            for item in contacts
+        ]
+        if not levels:
+            return
+
+        for type_, namespace, names in self._peer_blob_warmups:
+            jclib.tasks.manager.start(
+                self._warm_peer_blobs(type_, levels, namespace, names)
+            )
+
+    async def _warm_peer_blobs(self, type_, levels, namespace, names):
+        try:
+            nblobs = await jclib.storage.small_blobs.warm(
+                type_, levels, namespace, names,
+            )
+        except Exception:
+            logger.warning("failed to warm up small blobs in %r",
+                           namespace, exc_info=True)
+            return
+        logger.debug("warmed up %d small blobs in %r for %d contacts",
+                     nblobs, namespace, len(levels))
+
     def _shutdown_client(self,
                          account: jclib.identity.Account,
                          client: jclib.client.Client):
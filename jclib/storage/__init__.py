@@ -1,5 +1,7 @@
-from .backends import XDGBackend
+from .backends import DirectoryBackend, XDGBackend
 from .frontends import (
+    AppendFrontend,
+    ContentAddressedBlobFrontend,
     DatabaseFrontend,
     LargeBlobFrontend,
     SmallBlobFrontend,
@@ -7,6 +9,8 @@ from .frontends import (
     GlobalLevel,
     AccountLevel,
     PeerLevel,
+    EngineRegistry,
+    engines,
 )
 from .common import StorageLevel, StorageType
 
@@ -16,7 +20,21 @@ _backend = XDGBackend(UNIX_APPNAME)
 
 databases = DatabaseFrontend(_backend)
 large_blobs = LargeBlobFrontend(_backend)
+content_blobs = ContentAddressedBlobFrontend(_backend)
 small_blobs = SmallBlobFrontend(_backend)
 xml = XMLFrontend(_backend)
+append = AppendFrontend(_backend)
 
-from .manager import WriteManager
+from .space import StorageAccounting, CacheEvictor
+from .maintenance import DatabaseMaintainer
+
+accounting = StorageAccounting({
+    "databases": databases,
+    "large_blobs": large_blobs,
+    "content_blobs": content_blobs,
+    "small_blobs": small_blobs,
+    "xml": xml,
+    "append": append,
+})
+
+from .manager import WriteManager, WritebackHandle
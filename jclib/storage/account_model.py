@@ -1,13 +1,24 @@
+from datetime import datetime
+
 import sqlalchemy
 
 from sqlalchemy import (
     Column,
+    ForeignKey,
+    Integer,
 )
 from sqlalchemy.ext.declarative import declarative_base
 
 import aioxmpp.xso
 
-from .common import JID, SmallBlobMixin
+from .common import (
+    JIDEntryMixin,
+    SmallBlobMixin,
+    chunked_in,
+    jid_id,
+    jid_ids,
+    migrate_to_jid_ids,
+)
 from ..utils import jabbercat_ns
 
 
@@ -16,25 +27,50 @@ class Base(declarative_base()):
     __table_args__ = {}
 
 
+class JIDEntry(JIDEntryMixin, Base):
+    __tablename__ = "jids"
+
+
 class SmallBlob(SmallBlobMixin, Base):
     __tablename__ = "smallblobs"
 
-    account = Column(
-        "account",
-        JID(),
+    account_id = Column(
+        "account_id",
+        Integer(),
+        ForeignKey(JIDEntry.id),
         primary_key=True,
     )
 
     @classmethod
-    def from_level_descriptor(cls, level):
+    def migrate(cls, connection):
+        """
+        Migrate a table with JID columns to JID ids.
+        """
+        return migrate_to_jid_ids(
+            connection,
+            cls.__table__,
+            ["account"],
+        )
+
+    @classmethod
+    def from_level_descriptor(cls, session, level):
         instance = cls()
-        instance.account = level.account
+        instance.account_id = jid_id(session, JIDEntry, level.account,
+                                     create=True)
         return instance
 
     @classmethod
-    def filter_by(cls, query, level, name):
+    def filter_by_level(cls, query, level):
+        """
+        Filter for the blobs of an account.
+        """
         return query.filter(
-            cls.account == level.account,
+            cls.account_id == jid_id(query.session, JIDEntry, level.account),
+        )
+
+    @classmethod
+    def filter_by(cls, query, level, name):
+        return cls.filter_by_level(query, level).filter(
             cls.name == name,
         )
 
@@ -46,6 +82,79 @@ class SmallBlob(SmallBlobMixin, Base):
         except sqlalchemy.orm.exc.NoResultFound:
             raise KeyError(level) from None
 
+    @classmethod
+    def iter_keys(cls, session):
+        """
+        Yield the level key and the name of each blob.
+
+        The level keys are ``(account,)`` tuples, which compare equal to the
+        corresponding account level descriptors.
+        """
+        rows = session.query(
+            JIDEntry.jid, cls.name,
+        ).join(
+            JIDEntry, cls.account_id == JIDEntry.id,
+        )
+        for account_jid, name in rows:
+            yield (account_jid,), name
+
+    @classmethod
+    def load_many(cls, session, levels, names=None, now=None):
+        """
+        Load the blobs of many accounts and mark them as accessed.
+
+        :param levels: The level descriptors of the accounts.
+        :param names: If given, only the blobs with these names are loaded.
+        :return: ``(level, name, data)`` tuples in primary key order.
+
+        The JID ids are looked up with :func:`~.common.jid_ids`. One query
+        ordered by primary key is issued per chunk of accounts; the accounts
+        and `names` of a query bind at most :data:`~.common.MAX_IN_VALUES`
+        parameters.
+        """
+        now = now or datetime.utcnow()
+        levels = list(levels)
+        ids = jid_ids(session, JIDEntry, [level.account for level in levels])
+        accounts = {}
+        for level in levels:
+            account_id = ids.get(level.account)
+            if account_id is not None:
+                accounts[account_id] = level
+
+        rows = []
+        # the access time is bound, too
+        for account_ids, names_chunk in chunked_in(sorted(accounts), names,
+                                                   nfixed=1):
+            criteria = [cls.account_id.in_(account_ids)]
+            if names_chunk is not None:
+                criteria.append(cls.name.in_(names_chunk))
+
+            rows.extend(session.query(
+                cls.account_id, cls.name, cls.data,
+            ).filter(*criteria).order_by(
+                cls.account_id, cls.name,
+            ))
+
+            session.query(cls).filter(*criteria).update(
+                {cls.accessed: now},
+                synchronize_session=False,
+            )
+
+        # the rows of a chunk of accounts are split by the chunks of names
+        rows.sort(key=lambda row: row[:2])
+        return [
+            (accounts[account_id], name, data)
+            for account_id, name, data in rows
+        ]
+
+
+#: Schema migrations of the small blob databases, see
+#: :func:`.migrations.upgrade`.
+MIGRATIONS = [
+    # 1: JIDs are stored in the jids table and referred to by id
+    SmallBlob.migrate,
+]
+
 
 class XMLStorageItem(aioxmpp.xso.XSO):
     TAG = jabbercat_ns.xml_storage_account, "account"
@@ -65,6 +174,10 @@ class XMLStorageItemType(aioxmpp.xso.AbstractElementType):
     def get_xso_types(self):
         return [XMLStorageItem]
 
+    @classmethod
+    def key_from_attributes(cls, attrs):
+        return aioxmpp.JID.fromstr(attrs["jid"])
+
     def unpack(self, obj):
         return obj.jid, obj.data
 
@@ -61,3 +61,22 @@ class XDGBackend(Backend):
                 ]
 
         raise ValueError("unknown StorageType")
+
+
+class DirectoryBackend(Backend):
+    """
+    Keep all storage types in subdirectories of a single directory.
+
+    :param path: The directory to use.
+    :type path: :class:`pathlib.Path`
+
+    This is useful to operate on storage which is separate from the storage
+    of the user, for example in tools and benchmarks.
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+
+    def type_base_paths(self, type_, writable):
+        return [self.path / type_.value]
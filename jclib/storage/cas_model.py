@@ -0,0 +1,111 @@
+import sqlalchemy
+
+from sqlalchemy import (
+    Column,
+    Integer,
+    String,
+    Unicode,
+)
+from sqlalchemy.ext.declarative import declarative_base
+
+from .common import TimestampsMixin
+
+
+class Base(declarative_base()):
+    __abstract__ = True
+    __table_args__ = {}
+
+
+class Object(Base):
+    __tablename__ = "objects"
+
+    digest = Column(
+        "digest",
+        String(64),
+        primary_key=True,
+    )
+
+    size = Column(
+        "size",
+        Integer(),
+        nullable=False,
+    )
+
+    refcount = Column(
+        "refcount",
+        Integer(),
+        nullable=False,
+        default=0,
+        index=True,
+    )
+
+
+class Reference(TimestampsMixin, Base):
+    __tablename__ = "refs"
+
+    level = Column(
+        "level",
+        Unicode(16),
+        primary_key=True,
+    )
+
+    key = Column(
+        "key",
+        Unicode(1023),
+        primary_key=True,
+    )
+
+    namespace = Column(
+        "namespace",
+        Unicode(255),
+        primary_key=True,
+    )
+
+    name = Column(
+        "name",
+        Unicode(255),
+        primary_key=True,
+    )
+
+    digest = Column(
+        "digest",
+        String(64),
+        nullable=False,
+        index=True,
+    )
+
+    @staticmethod
+    def level_key(level):
+        return level.level.value, str(level.key_path)
+
+    @classmethod
+    def from_level_descriptor(cls, level, namespace, name):
+        instance = cls()
+        instance.level, instance.key = cls.level_key(level)
+        instance.namespace = namespace
+        instance.name = name
+        return instance
+
+    @classmethod
+    def filter_by(cls, query, level, namespace, name):
+        level_value, key = cls.level_key(level)
+        return query.filter(
+            cls.level == level_value,
+            cls.key == key,
+            cls.namespace == namespace,
+            cls.name == name,
+        )
+
+    @classmethod
+    def get(cls, session, level, namespace, name, which=None):
+        which = which or [cls]
+        try:
+            return cls.filter_by(
+                session.query(*which), level, namespace, name
+            ).one()
+        except sqlalchemy.orm.exc.NoResultFound:
+            raise KeyError(level) from None
+
+
+#: Schema migrations of the content index, see :func:`.migrations.upgrade`.
+MIGRATIONS = []
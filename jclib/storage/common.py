@@ -1,14 +1,20 @@
+import collections
 import contextlib
 import enum
+import threading
 import uuid
+import weakref
 
 from datetime import datetime
 
+import sqlalchemy.event
+import sqlalchemy.orm
 import sqlalchemy.types
 import sqlalchemy.dialects.postgresql
 from sqlalchemy import (
     Column,
     DateTime,
+    Integer,
     LargeBinary,
     Unicode,
 )
@@ -143,6 +149,272 @@ class JID(sqlalchemy.types.TypeDecorator):
         return aioxmpp.JID.fromstr(value)
 
 
+class JIDEntryMixin:
+    """
+    Dictionary table mapping JIDs to integer ids.
+
+    Tables referring to many JIDs use the ids instead of the JIDs, which
+    keeps rows and indices small and makes comparisons cheap. Use
+    :func:`jid_id` to look up ids.
+    """
+
+    id = Column(
+        "id",
+        Integer(),
+        primary_key=True,
+    )
+
+    jid = Column(
+        "jid",
+        JID(),
+        nullable=False,
+        unique=True,
+    )
+
+
+#: Maximum number of ids cached per database.
+JID_ID_CACHE_SIZE = 4096
+
+_jid_id_caches = weakref.WeakKeyDictionary()
+_jid_id_lock = threading.Lock()
+
+
+def _remember_jid_id(bind, jid, id_):
+    with _jid_id_lock:
+        try:
+            cache = _jid_id_caches[bind]
+        except KeyError:
+            cache = collections.OrderedDict()
+            _jid_id_caches[bind] = cache
+        cache[jid] = id_
+        cache.move_to_end(jid)
+        while len(cache) > JID_ID_CACHE_SIZE:
+            cache.popitem(last=False)
+
+
+def _cached_jid_id(bind, jid):
+    with _jid_id_lock:
+        cache = _jid_id_caches.get(bind)
+        if cache is None or jid not in cache:
+            return None
+        cache.move_to_end(jid)
+        return cache[jid]
+
+
+def jid_id(session, entry_type, jid, *, create=False):
+    """
+    Return the id of a JID in a JID dictionary table.
+
+    :param session: The session to use.
+    :type session: :class:`sqlalchemy.orm.Session`
+    :param entry_type: The model of the dictionary table.
+    :type entry_type: subclass of :class:`JIDEntryMixin`
+    :param jid: The JID to look up.
+    :type jid: :class:`aioxmpp.JID`
+    :param create: Whether to add the JID to the table if it is not in
+        there.
+    :type create: :class:`bool`
+    :return: The id of the JID or :data:`None` if the JID is not in the
+        table and `create` is false.
+
+    Ids are cached in-process per database. Ids which are added by `session`
+    are only cached once the session is committed, so that ids from
+    rolled back transactions are never used.
+    """
+    bind = session.get_bind()
+    id_ = _cached_jid_id(bind, jid)
+    if id_ is not None:
+        return id_
+
+    pending = session.info.setdefault("new_jid_ids", {})
+    try:
+        return pending[jid]
+    except KeyError:
+        pass
+
+    id_ = session.query(entry_type.id).filter(
+        entry_type.jid == jid
+    ).scalar()
+    if id_ is not None:
+        _remember_jid_id(bind, jid, id_)
+        return id_
+
+    if not create:
+        return None
+
+    entry = entry_type()
+    entry.jid = jid
+    session.add(entry)
+    session.flush([entry])
+    pending[jid] = entry.id
+    return entry.id
+
+
+def jid_ids(session, entry_type, jids):
+    """
+    Return the ids of many JIDs in a JID dictionary table.
+
+    :param session: The session to use.
+    :type session: :class:`sqlalchemy.orm.Session`
+    :param entry_type: The model of the dictionary table.
+    :type entry_type: subclass of :class:`JIDEntryMixin`
+    :param jids: The JIDs to look up.
+    :type jids: iterable of :class:`aioxmpp.JID`
+    :rtype: :class:`dict`
+    :return: The ids of the JIDs which are in the table, by JID.
+
+    Like :func:`jid_id`, but the JIDs which are not cached are looked up
+    with one query per :data:`MAX_IN_VALUES` JIDs.
+    """
+    bind = session.get_bind()
+    pending = session.info.get("new_jid_ids", {})
+    result = {}
+    missing = []
+    for jid in set(jids):
+        id_ = _cached_jid_id(bind, jid)
+        if id_ is None:
+            id_ = pending.get(jid)
+        if id_ is None:
+            missing.append(jid)
+        else:
+            result[jid] = id_
+
+    for chunk in chunked(missing):
+        rows = session.query(entry_type.jid, entry_type.id).filter(
+            entry_type.jid.in_(chunk)
+        )
+        for jid, id_ in rows:
+            _remember_jid_id(bind, jid, id_)
+            result[jid] = id_
+
+    return result
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.orm.Session, "after_commit")
+def _commit_jid_ids(session):
+    pending = session.info.pop("new_jid_ids", None)
+    if not pending:
+        return
+    bind = session.get_bind()
+    for jid, id_ in pending.items():
+        _remember_jid_id(bind, jid, id_)
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.orm.Session, "after_rollback")
+def _rollback_jid_ids(session):
+    session.info.pop("new_jid_ids", None)
+
+
+def migrate_to_jid_ids(connection, table, jid_columns):
+    """
+    Migrate a table from JID columns to JID dictionary ids.
+
+    :param connection: The connection to use, within a transaction.
+    :param table: The new table.
+    :type table: :class:`sqlalchemy.Table`
+    :param jid_columns: The names of the old JID columns.
+    :type jid_columns: :class:`list` of :class:`str`
+    :return: Whether the table was migrated.
+
+    The old JID columns are called ``<name>`` and the new id columns
+    ``<name>_id``; all other columns are copied unchanged. The JID dictionary
+    table (``jids``) and the new table are created from the metadata of
+    `table`. Nothing is done if the table does not exist or has already been
+    migrated.
+    """
+    old_columns = [
+        row[1]
+        for row in connection.execute(
+            "PRAGMA table_info({})".format(table.name)
+        )
+    ]
+    if not old_columns or not set(jid_columns) <= set(old_columns):
+        return False
+
+    old_name = "{}_old".format(table.name)
+    connection.execute("ALTER TABLE {} RENAME TO {}".format(
+        table.name, old_name,
+    ))
+    table.metadata.create_all(connection)
+
+    connection.execute(
+        "INSERT OR IGNORE INTO jids (jid) {}".format(" UNION ".join(
+            "SELECT {} FROM {}".format(column, old_name)
+            for column in jid_columns
+        ))
+    )
+
+    copied = [
+        column for column in old_columns
+        if column not in jid_columns
+    ]
+    connection.execute(
+        "INSERT INTO {table} ({new_columns}) "
+        "SELECT {old_columns} FROM {old} {joins}".format(
+            table=table.name,
+            new_columns=", ".join(
+                ["{}_id".format(column) for column in jid_columns] + copied
+            ),
+            old_columns=", ".join(
+                ["j{}.id".format(i) for i in range(len(jid_columns))] +
+                ["o.{}".format(column) for column in copied]
+            ),
+            old="{} AS o".format(old_name),
+            joins=" ".join(
+                "JOIN jids AS j{i} ON j{i}.jid = o.{column}".format(
+                    i=i, column=column,
+                )
+                for i, column in enumerate(jid_columns)
+            ),
+        )
+    )
+    connection.execute("DROP TABLE {}".format(old_name))
+    return True
+
+
+#: Maximum number of values bound in a single ``IN`` clause. Older SQLite
+#: versions allow at most 999 bound parameters per statement.
+MAX_IN_VALUES = 900
+
+
+def chunked(values, size=MAX_IN_VALUES):
+    """
+    Split a sequence into chunks of at most `size` values.
+    """
+    for i in range(0, len(values), size):
+        yield values[i:i+size]
+
+
+def chunked_in(values, names=None, nfixed=0, size=MAX_IN_VALUES):
+    """
+    Split a sequence into chunks for statements with a second ``IN`` clause.
+
+    :param values: The values of the first ``IN`` clause.
+    :type values: :class:`~collections.abc.Sequence`
+    :param names: The values of the second ``IN`` clause, if any.
+    :param nfixed: The number of other parameters bound by the statement.
+    :return: Iterator over ``(values, names)`` chunk pairs. Each chunk of
+        `values` is yielded with each chunk of `names`; the chunk of `names`
+        is :data:`None` if `names` is :data:`None`.
+
+    A pair of chunks binds at most `size` parameters together with the
+    `nfixed` other parameters. The chunks of `names` use at most half of
+    that.
+    """
+    budget = size - nfixed
+    if names is None:
+        names_size = 0
+        names_chunks = [None]
+    else:
+        names = list(names)
+        names_size = min(len(names), budget // 2)
+        names_chunks = list(chunked(names, names_size)) if names else []
+
+    for values_chunk in chunked(values, budget - names_size):
+        for names_chunk in names_chunks:
+            yield values_chunk, names_chunk
+
+
 @contextlib.contextmanager
 def session_scope(sessionmaker):
     """Provide a transactional scope around a series of operations."""
@@ -1,26 +1,44 @@
 import abc
 import asyncio
 import base64
+import bisect
 import collections
+import collections.abc
+import concurrent.futures
+import contextlib
 import functools
 import hashlib
 import io
 import logging
+import mmap
 import os
 import pathlib
+import shutil
+import sqlite3
+import struct
 import urllib.parse
 import sys
+import threading
+import time
+import xml.parsers.expat
 import xml.sax
+import zlib
 
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import sqlalchemy
 
 import aioxmpp.xml
 
 from .. import utils
-from .common import StorageLevel
-from . import peer_model, account_model, common
+from .common import StorageLevel, StorageType
+from . import peer_model, account_model, cas_model, common, migrations
+
+
+logger = logging.getLogger(__name__)
+
+
+_EPOCH = datetime(1970, 1, 1)
 
 
 def encode_jid(jid):
@@ -45,6 +63,37 @@ def encode_jid(jid):
     return pathlib.Path(full_digest[:2]) / full_digest[2:4] / full_digest[4:]
 
 
+#: Number of path components of an encoded JID.
+_ENCODED_JID_DEPTH = 3
+
+
+@functools.lru_cache(4096)
+def _encode_jid_cached(jid):
+    """
+    Return :func:`encode_jid` of `jid` from a bounded cache.
+
+    Storage paths are resolved on each operation, usually for a small set of
+    accounts and peers, so that this avoids hashing the same JIDs over and
+    over.
+    """
+    return encode_jid(jid)
+
+
+@functools.lru_cache(4096)
+def _peer_key_path(account, peer):
+    return _encode_jid_cached(account) / _encode_jid_cached(peer)
+
+
+def _clear_path_caches():
+    """
+    Clear the caches of encoded JIDs.
+
+    This is only needed if :func:`encode_jid` is replaced, e.g. in tests.
+    """
+    _encode_jid_cached.cache_clear()
+    _peer_key_path.cache_clear()
+
+
 def encode_uuid(uid):
     return pathlib.Path(
         base64.b32encode(uid.bytes).decode("ascii").rstrip("=").lower()
@@ -55,6 +104,27 @@ def escape_path_part(part):
     return urllib.parse.quote(part, safe=" ")
 
 
+# monotonic time of the last statement executed on an engine created by
+# _get_engine
+_last_activity = 0.0
+
+
+def _note_activity(*args):
+    global _last_activity
+    _last_activity = time.monotonic()
+
+
+def idle_time():
+    """
+    Return the time since the storage databases were last used.
+
+    :rtype: :class:`float`
+    :return: The number of seconds since the last statement was executed
+        on a database opened by one of the frontends.
+    """
+    return time.monotonic() - _last_activity
+
+
 def _get_engine(path: pathlib.Path) -> sqlalchemy.engine.Engine:
     utils.mkdir_exist_ok(path.parent)
     engine = sqlalchemy.create_engine(
@@ -73,9 +143,451 @@ def _get_engine(path: pathlib.Path) -> sqlalchemy.engine.Engine:
         # emit our own BEGIN
         conn.execute("BEGIN")
 
+    sqlalchemy.event.listens_for(
+        engine, "before_cursor_execute",
+    )(_note_activity)
+
     return engine
 
 
+class _RegisteredEngine:
+    def __init__(self, engine, value, now):
+        super().__init__()
+        self.engine = engine
+        self.value = value
+        self.refs = 0
+        self.last_used = now
+
+
+class EngineRegistry:
+    """
+    Shared SQLAlchemy engines of the storage databases.
+
+    :param max_engines: Number of engines which are kept open while unused.
+    :type max_engines: :class:`int`
+    :param idle_timeout: Time in seconds after which an unused engine is
+        closed.
+    :type idle_timeout: :class:`float`
+
+    :meth:`get` opens the engine of a database on first use and hands the
+    same engine to all users of the database from then on. The connections
+    checked out from an engine count as references to it. Engines without
+    references are closed when they have not been used for `idle_timeout`
+    seconds, and when more than `max_engines` engines are open, least
+    recently used first. Idle engines are looked for on each :meth:`get`
+    and, while the registry is started (see :meth:`start`), every
+    `idle_timeout` seconds.
+
+    Closing an engine disposes its connection pool and removes it from the
+    registry. Engines obtained before remain usable and open connections as
+    needed, but :meth:`get` opens a new engine for the database.
+
+    The registry may be used from any thread.
+
+    .. attribute:: metrics
+
+       A :class:`collections.Counter` with the number of engines ``opened``,
+       closed because they were ``idle``, ``evicted`` to stay within
+       `max_engines` and ``closed`` by :meth:`close_all`.
+
+    .. autoattribute:: open_engines
+
+    .. autoattribute:: open_connections
+
+    .. automethod:: get
+
+    .. automethod:: start
+
+    .. automethod:: stop
+
+    .. automethod:: close_idle
+
+    .. automethod:: close_all
+    """
+
+    def __init__(self, *, max_engines=32, idle_timeout=300):
+        super().__init__()
+        self.max_engines = max_engines
+        self.idle_timeout = idle_timeout
+        self.metrics = collections.Counter()
+        # in least recently used order
+        self._engines = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # maps paths to [lock, users]; the locks serialise opening the
+        # engine of a database, so that setup runs once per database
+        self._open_locks = {}
+        self._timer = None
+
+    @property
+    def open_engines(self):
+        """
+        The number of engines in the registry.
+        """
+        with self._lock:
+            return len(self._engines)
+
+    @property
+    def open_connections(self):
+        """
+        The number of connections checked out from the engines in the
+        registry.
+        """
+        with self._lock:
+            return sum(entry.refs for entry in self._engines.values())
+
+    def _track(self, path, entry):
+        def checkout(*args):
+            with self._lock:
+                entry.refs += 1
+
+        def checkin(*args):
+            with self._lock:
+                entry.refs -= 1
+                entry.last_used = time.monotonic()
+                if self._engines.get(path) is entry:
+                    self._engines.move_to_end(path)
+
+        sqlalchemy.event.listens_for(entry.engine, "checkout")(checkout)
+        sqlalchemy.event.listens_for(entry.engine, "checkin")(checkin)
+
+    def _expire(self, now):
+        # must be called with _lock held; returns the engines to dispose
+        expired = []
+        cutoff = now - self.idle_timeout
+        for path, entry in list(self._engines.items()):
+            if entry.last_used >= cutoff:
+                break
+            if entry.refs:
+                continue
+            del self._engines[path]
+            expired.append(entry.engine)
+            self.metrics["idle"] += 1
+
+        # the most recently used engine is the one about to be returned
+        excess = len(self._engines) - self.max_engines
+        for path, entry in list(self._engines.items())[:-1]:
+            if excess <= 0:
+                break
+            if entry.refs:
+                continue
+            del self._engines[path]
+            expired.append(entry.engine)
+            self.metrics["evicted"] += 1
+            excess -= 1
+
+        return expired
+
+    def _dispose(self, engines):
+        for engine in engines:
+            logger.debug("closing engine %r", engine)
+            engine.dispose()
+
+    @contextlib.contextmanager
+    def _opening(self, path):
+        # holds the open lock of path; engines of other databases can be
+        # opened meanwhile
+        with self._lock:
+            entry = self._open_locks.get(path)
+            if entry is None:
+                entry = self._open_locks[path] = [threading.Lock(), 0]
+            entry[1] += 1
+
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._open_locks[path]
+
+    def get(self, path, setup=None):
+        """
+        Return the engine of a database, opening it if needed.
+
+        :param path: The path of the database.
+        :type path: :class:`pathlib.Path`
+        :param setup: Function to prepare a newly opened engine.
+        :return: The engine, or the value returned by `setup`.
+
+        `setup` is called with the engine when it is opened, for example to
+        upgrade the schema; its return value is what :meth:`get` returns
+        for the database until the engine is closed. All users of a
+        database thus have to pass equivalent `setup` functions. If `setup`
+        raises, the engine is closed again.
+
+        Concurrent calls for the same database wait for the engine to be
+        opened and set up once; engines of different databases are opened
+        independently.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._engines.get(path)
+            if entry is not None:
+                entry.last_used = now
+                self._engines.move_to_end(path)
+                expired = self._expire(now)
+
+        if entry is not None:
+            self._dispose(expired)
+            return entry.value
+
+        with self._opening(path):
+            with self._lock:
+                entry = self._engines.get(path)
+            if entry is not None:
+                return entry.value
+
+            engine = _get_engine(path)
+            try:
+                value = engine if setup is None else setup(engine)
+            except:  # NOQA
+                engine.dispose()
+                raise
+
+            entry = _RegisteredEngine(engine, value, time.monotonic())
+            self._track(path, entry)
+            with self._lock:
+                self._engines[path] = entry
+                self.metrics["opened"] += 1
+                expired = self._expire(now)
+
+        self._dispose(expired)
+        return value
+
+    def _schedule_close_idle(self, loop):
+        self._timer = loop.call_later(
+            self.idle_timeout,
+            self._close_idle_scheduled,
+            loop,
+        )
+
+    def _close_idle_scheduled(self, loop):
+        self._schedule_close_idle(loop)
+        try:
+            self.close_idle()
+        except Exception:
+            logger.warning("failed to close idle engines", exc_info=True)
+
+    def start(self, loop=None):
+        """
+        Close idle engines every `idle_timeout` seconds.
+
+        :param loop: The event loop to schedule the checks in.
+        :type loop: :class:`asyncio.AbstractEventLoop`
+        """
+        if self._timer is not None:
+            return
+        self._schedule_close_idle(loop or asyncio.get_event_loop())
+
+    def stop(self):
+        """
+        Stop closing idle engines periodically.
+        """
+        if self._timer is None:
+            return
+        self._timer.cancel()
+        self._timer = None
+
+    def close_idle(self):
+        """
+        Close the engines which have been unused for `idle_timeout` seconds.
+
+        :rtype: :class:`int`
+        :return: The number of engines closed.
+        """
+        with self._lock:
+            expired = self._expire(time.monotonic())
+        self._dispose(expired)
+        return len(expired)
+
+    def close_all(self):
+        """
+        Close all engines.
+
+        This is meant to be called on shutdown. Connections which are still
+        checked out are closed when they are returned.
+        """
+        with self._lock:
+            entries = list(self._engines.values())
+            self._engines.clear()
+            self.metrics["closed"] += len(entries)
+
+        in_use = sum(entry.refs for entry in entries)
+        if in_use:
+            logger.warning("closing engines with %d connections in use",
+                           in_use)
+        self._dispose(entry.engine for entry in entries)
+
+
+#: The :class:`EngineRegistry` used by the frontends.
+engines = EngineRegistry()
+
+
+EvictionCandidate = collections.namedtuple(
+    "EvictionCandidate",
+    [
+        "atime",
+        "size",
+        "evict",
+    ]
+)
+
+
+def _tree_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(str(path)):
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, filename)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+
+def _remove_trees(paths):
+    """
+    Remove directory trees.
+
+    Removal continues with the next tree if a tree cannot be removed
+    completely; the first error is re-raised at the end.
+    """
+    first_error = None
+    for path in paths:
+        try:
+            shutil.rmtree(str(path))
+        except FileNotFoundError:
+            pass
+        except OSError as exc:
+            if first_error is None:
+                first_error = exc
+    if first_error is not None:
+        raise first_error
+
+
+#: Number of database pages copied per step of an online backup.
+BACKUP_PAGES = 256
+
+#: Pause in seconds between two steps of an online backup, during which
+#: other connections may write to the database. A step which finds the
+#: database locked is retried after the same delay.
+BACKUP_SLEEP = 0.01
+
+# suffixes of the files SQLite keeps next to a database
+_SQLITE_AUX_SUFFIXES = ("-journal", "-wal", "-shm")
+
+
+def _is_backed_up(source_stat, destination):
+    # backups carry the mtime the source had when the backup started
+    try:
+        return destination.stat().st_mtime_ns == source_stat.st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def _backup_progress(status, remaining, total):
+    # sqlite3 only sleeps between steps when a step finds the database
+    # locked; pause after each step, so that writers are not starved
+    if remaining:
+        time.sleep(BACKUP_SLEEP)
+
+
+def _backup_database(source, destination):
+    """
+    Copy a SQLite database with the online backup API.
+
+    The database stays usable while it is copied; :data:`BACKUP_PAGES` pages
+    are copied at a time, with a pause of :data:`BACKUP_SLEEP` seconds in
+    between. Databases which have not been modified since the last backup
+    to `destination` are skipped.
+    """
+    try:
+        st = source.stat()
+    except FileNotFoundError:
+        return
+    if _is_backed_up(st, destination):
+        return
+
+    utils.mkdir_exist_ok(destination.parent)
+    tmppath = destination.with_name(destination.name + ".tmp")
+    src = sqlite3.connect(str(source))
+    try:
+        dst = sqlite3.connect(str(tmppath))
+        try:
+            src.backup(dst, pages=BACKUP_PAGES, progress=_backup_progress,
+                       sleep=BACKUP_SLEEP)
+        finally:
+            dst.close()
+    finally:
+        src.close()
+    os.utime(str(tmppath), ns=(st.st_atime_ns, st.st_mtime_ns))
+    os.replace(str(tmppath), str(destination))
+
+
+def _backup_file(source, destination, size=None, *, append_only=False):
+    """
+    Copy a file.
+
+    :param size: Number of bytes to copy; defaults to the size of the file.
+    :param append_only: If true, the file is only ever appended to and only
+        the data which is not in `destination` yet is copied.
+
+    Files which have not been modified since the last backup to
+    `destination` are skipped.
+    """
+    try:
+        st = source.stat()
+    except FileNotFoundError:
+        return
+    if _is_backed_up(st, destination):
+        return
+    if size is None:
+        size = st.st_size
+
+    offset = 0
+    if append_only:
+        try:
+            offset = destination.stat().st_size
+        except FileNotFoundError:
+            pass
+
+    utils.mkdir_exist_ok(destination.parent)
+    with source.open("rb") as src:
+        if 0 < offset <= size:
+            # cheap check that the file has not been replaced since
+            tail = min(offset, 64)
+            src.seek(offset - tail)
+            with destination.open("rb") as dst:
+                dst.seek(offset - tail)
+                if src.read(tail) != dst.read(tail):
+                    offset = 0
+        else:
+            offset = 0
+
+        if offset:
+            tmppath = destination
+            mode = "ab"
+        else:
+            tmppath = destination.with_name(destination.name + ".tmp")
+            mode = "wb"
+
+        src.seek(offset)
+        with tmppath.open(mode) as dst:
+            remaining = size - offset
+            while remaining > 0:
+                chunk = src.read(min(remaining, 1024*1024))
+                if not chunk:
+                    break
+                dst.write(chunk)
+                remaining -= len(chunk)
+
+    if size >= st.st_size:
+        # otherwise, the rest is copied on the next backup
+        os.utime(str(tmppath), ns=(st.st_atime_ns, st.st_mtime_ns))
+    if tmppath != destination:
+        os.replace(str(tmppath), str(destination))
+
+
 class LevelDescriptor(metaclass=abc.ABCMeta):
     @abc.abstractproperty
     def key_path(self):
@@ -95,7 +607,7 @@ class AccountLevel(collections.namedtuple("AccountLevel", ["account"])):
 
     @property
     def key_path(self):
-        return encode_jid(self.account)
+        return _encode_jid_cached(self.account)
 
 
 class PeerLevel(collections.namedtuple("PeerLevel", ["account", "peer"])):
@@ -103,10 +615,14 @@ class PeerLevel(collections.namedtuple("PeerLevel", ["account", "peer"])):
 
     @property
     def key_path(self):
-        return encode_jid(self.account) / encode_jid(self.peer)
+        return _peer_key_path(self.account, self.peer)
 
 
 class Frontend:
+    #: Whether :meth:`_eviction_candidates` returns objects, i.e. whether
+    #: the usage of the frontend can be reduced by eviction.
+    EVICTABLE = False
+
     def __init__(self, backend):
         super().__init__()
         self._backend = backend
@@ -126,7 +642,9 @@ class Frontend:
         :raises OSError: if not all data could be deleted.
 
         A common usecase is when an account/identity/peer has been removed.
-        Using the :class:`GlobalLevel` as `level` is not supported.
+        Using the :class:`GlobalLevel` as `level` is not supported. Clearing
+        an :class:`AccountLevel` also deletes the :class:`PeerLevel` data of
+        all peers of that account.
 
         The deletion attempts to continue when the first error is encountered.
         The first error is re-raised.
@@ -138,6 +656,74 @@ class Frontend:
         """
         raise NotImplementedError
 
+    async def usage(self, type_):
+        """
+        Return the amount of space used by the frontend.
+
+        :param type_: The storage type to account.
+        :type type_: :class:`StorageType`
+        :raises NotImplementedError: if the frontend does not support
+            accounting.
+        :rtype: :class:`collections.Counter`
+        :return: The number of bytes used, keyed by ``(level_type,
+            namespace)`` tuples.
+
+        Depending on the frontend, the number is either the size of the data
+        as stored in a database or the size of the files on disk.
+        """
+        raise NotImplementedError
+
+    async def backup(self, type_, destination):
+        """
+        Copy the data of the frontend to a backup.
+
+        :param type_: The storage type to back up.
+        :type type_: :class:`StorageType`
+        :param destination: The directory which takes the place of the base
+            path of `type_` in the backup.
+        :type destination: :class:`pathlib.Path`
+        :raises NotImplementedError: if the frontend does not support
+            backups.
+
+        The frontend stays usable while the backup runs and each file is
+        copied consistently. Files which have not changed since the previous
+        backup to `destination` are not copied again. Files which have been
+        deleted from the storage are kept in the backup.
+        """
+        raise NotImplementedError
+
+    def _eviction_candidates(self, type_):
+        """
+        Return the objects which may be deleted to free space.
+
+        :rtype: iterable of :class:`EvictionCandidate`
+
+        This is called in an executor. The `evict` attribute of each
+        candidate is a callable which deletes the object and returns the
+        number of bytes freed; it is called in an executor, too. Objects
+        which have been accessed after they were returned as candidate may
+        be spared by `evict`, which returns 0 then. Frontends which return
+        candidates set :attr:`EVICTABLE`.
+
+        The default implementation returns no candidates.
+        """
+        return []
+
+    def _database_paths(self, type_):
+        """
+        Return the paths of the existing SQLite databases of the frontend.
+
+        :rtype: iterable of :class:`pathlib.Path`
+
+        This is called in an executor. The default implementation returns no
+        paths.
+        """
+        return []
+
+    async def _run_in_executor(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, func, *args)
+
 
 class _PerLevelMixin:
     def _get_path(self, type_, level_type, namespace, frontend_name, name):
@@ -149,125 +735,603 @@ class _PerLevelMixin:
                 name)
 
 
-class _PerLevelKeyFileMixin:
-    def _get_path(self, type_, level, namespace, name):
-        return (self._backend.type_base_paths(type_, True)[0] /
-                level.level.value /
-                level.key_path /
-                escape_path_part(namespace) /
-                name)
+class _PathCache:
+    """
+    Bounded cache of the resolved storage paths of a frontend.
 
+    :param maxsize: Maximum number of paths kept.
+    :type maxsize: :class:`int`
 
-class DatabaseFrontend(Frontend):
+    The paths used least recently are dropped first. The cache may be used
+    from any thread.
     """
-    Storage frontend for accessing :attr:`~.StorageLevel.GLOBAL` SQLite
-    databases.
 
-    .. automethod:: connect
-    """
+    def __init__(self, maxsize=1024):
+        super().__init__()
+        self.maxsize = maxsize
+        self._paths = collections.OrderedDict()
+        self._lock = threading.Lock()
 
-    def _get_path(self, type_, namespace, name):
+    def get(self, key, resolve, *args):
+        """
+        Return the path cached for `key`, or resolve it by calling `resolve`
+        with `args`.
+        """
+        with self._lock:
+            try:
+                path = self._paths[key]
+            except KeyError:
+                pass
+            else:
+                self._paths.move_to_end(key)
+                return path
+
+        path = resolve(*args)
+        with self._lock:
+            path = self._paths.setdefault(key, path)
+            while len(self._paths) > self.maxsize:
+                self._paths.popitem(last=False)
+        return path
+
+
+class _PerLevelKeyFileMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._path_cache = _PathCache()
+
+    def _resolve_path(self, type_, level, namespace, name):
         return (self._backend.type_base_paths(type_, True)[0] /
-                StorageLevel.GLOBAL.value /
+                level.level.value /
+                level.key_path /
                 escape_path_part(namespace) /
-                "db" /
                 name)
 
-    @functools.lru_cache(32)
-    def get_engine(self, type_, namespace, name):
-        """
-        Return a SQLAlchemy engine for a database.
+    def _get_path(self, type_, level, namespace, name):
+        return self._path_cache.get(
+            (type_, level, namespace, name),
+            self._resolve_path,
+            type_, level, namespace, name,
+        )
 
-        :param type_: The storage type of the database.
-        :type type_: :class:`StorageType`
-        :param namespace: The namespace of the database.
-        :type namespace: :class:`str`
-        :param name: The name of the database.
-        :type name: :class:`str`
-        :rtype: :class:`sqlalchemy.engine.Engine`
-        :return: A session maker for the given database.
+    def _iter_subdirs(self, type_, subdir):
+        """
+        Yield the level type, namespace and path of each existing `subdir`
+        directory below the level keys and namespaces.
+        """
+        base = self._backend.type_base_paths(type_, True)[0]
+        for level_type, depth in [(StorageLevel.ACCOUNT, 1),
+                                  (StorageLevel.PEER, 2)]:
+            pattern = "/".join(
+                ["*"] * (depth * _ENCODED_JID_DEPTH + 1) + [subdir]
+            )
+            for path in (base / level_type.value).glob(pattern):
+                yield (level_type,
+                       urllib.parse.unquote(path.parent.name),
+                       path)
 
-        The sessionmakers returned by this function may be cached and shared.
+    def _level_roots(self, type_, level):
         """
-        path = self._get_path(type_, namespace, name)
-        engine = _get_engine(path)
-        return engine
+        Return the directories holding the data of a level key.
 
+        :return: Pairs of a directory and the number of path components
+            between the directory and the namespace directories.
 
-class FileLikeFrontend(metaclass=abc.ABCMeta):
-    @abc.abstractmethod
-    async def open(self, type_, level, namespace, name, mode="r", *,
-                   encoding=None):
+        For an :class:`AccountLevel`, this includes the directory of the
+        peers of the account.
         """
-        Return a file-like object.
+        base = self._backend.type_base_paths(type_, True)[0]
+        if level.level == StorageLevel.ACCOUNT:
+            return [
+                (base / StorageLevel.ACCOUNT.value / level.key_path, 0),
+                (base / StorageLevel.PEER.value / level.key_path,
+                 _ENCODED_JID_DEPTH),
+            ]
+        elif level.level == StorageLevel.PEER:
+            return [(base / StorageLevel.PEER.value / level.key_path, 0)]
+        raise ValueError("GLOBAL level not supported")
+
+    def _level_subdirs(self, level, subdir):
+        """
+        Return the existing `subdir` directories of all namespaces of a level
+        key, across all storage types.
+        """
+        result = []
+        for type_ in StorageType:
+            for root, depth in self._level_roots(type_, level):
+                pattern = "/".join(["*"] * (depth + 1) + [subdir])
+                result.extend(root.glob(pattern))
+        return result
 
-        :param type_: The storage type of the object to open.
-        :type type_: :class:`StorageType`
-        :param level: The information hierarchy level of the object to open.
-        :type level: :class:`LevelDescriptor`
-        :param namespace: The namespace of the object.
-        :type namespace: :class:`str`
-        :param name: The name of the object.
-        :type name: :class:`str`
-        :param mode: The file open mode to open the object with.
-        :type mode: :class:`str` (see :func:`open` and the note below)
-        :param encoding: The encoding to use to decode the file if it is
-            opened in text mode (see :func:`open`)
-        :type encoding: :class:`str` or :data:`None`
-        :raises ValueError: if the `encoding` is not :data:`None` for a binary
-            `mode`.
-        :raises OSError: if the object could not be opened
-        :return: The opened file
-        :rtype: :class:`io.IOBase` or :class:`io.TextIOBase`, depending on
-            `mode`
+    def _clear_subdirs(self, level, subdir):
+        _remove_trees(self._level_subdirs(level, subdir))
 
-        Implementations *may* support additional keyword arguments.
+    def _usage(self, type_, subdir):
+        usage = collections.Counter()
+        for level_type, namespace, path in self._iter_subdirs(type_, subdir):
+            size = _tree_size(path)
+            if size:
+                usage[level_type, namespace] += size
+        return usage
 
-        If the `mode` indicates the use of binary mode and `encoding` is not
-        :data:`None`, :class:`ValueError` is raised and the object is not
-        touched.
 
-        .. note::
+@functools.lru_cache(256)
+def _text_statement(statement):
+    # reusing the clause objects lets textual statements hit the compiled
+    # statement cache, which is keyed by identity
+    return sqlalchemy.text(statement)
 
-            Not all `mode` values supported by :func:`open` may be supported
-            by implementations.
 
-            However, the ``r``, ``rb`` (and implicitly ``rt``) modes are
-            supported by all implementations.
-        """
+class AsyncResult:
+    """
+    Wrap a :class:`sqlalchemy.engine.ResultProxy` so that fetching runs in an
+    executor.
 
-    @abc.abstractmethod
-    async def stat(self, type_, level, namespace, name):
-        """
-        Return meta-information about an object.
+    Instances are returned by :meth:`AsyncSession.execute`. Fetching rows
+    may block on the database, hence the fetch methods are coroutines. The
+    result can also be iterated asynchronously.
 
-        :param type_: The storage type of the object to look up.
-        :type type_: :class:`StorageType`
-        :param level: The information hierarchy level of the object to look up.
-        :type level: :class:`LevelDescriptor`
-        :param namespace: The namespace of the object.
-        :type namespace: :class:`str`
-        :param name: The name of the object.
-        :type name: :class:`str`
-        :raises OSError: if the object could not be queried
-        :return: A structure (see below for the attributes) describing the
-            metadata
+    .. autoattribute:: rowcount
 
-        The returned object has the following attributes:
+    .. autoattribute:: lastrowid
 
-        .. attribute:: st_size
+    .. automethod:: fetchone
 
-            The size of the object in bytes.
+    .. automethod:: fetchmany
 
-        .. attribute:: st_atime
+    .. automethod:: fetchall
 
-            The time of last access of the object, as seconds since UNIX epoch,
-            or absent if not supported.
+    .. automethod:: scalar
 
-        .. attribute:: st_mtime
+    .. automethod:: close
+    """
 
-            The time of last modification of the object, as seconds since
-            UNIX epoch, or absent if not supported.
+    def __init__(self, result, run):
+        super().__init__()
+        self._result = result
+        self._run = run
+
+    @property
+    def rowcount(self):
+        """
+        The number of rows affected by the statement.
+        """
+        return self._result.rowcount
+
+    @property
+    def lastrowid(self):
+        """
+        The rowid of the last inserted row.
+        """
+        return self._result.lastrowid
+
+    async def fetchone(self):
+        return await self._run(self._result.fetchone)
+
+    async def fetchmany(self, size=None):
+        return await self._run(self._result.fetchmany, size)
+
+    async def fetchall(self):
+        return await self._run(self._result.fetchall)
+
+    async def scalar(self):
+        return await self._run(self._result.scalar)
+
+    async def close(self):
+        return await self._run(self._result.close)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        row = await self.fetchone()
+        if row is None:
+            raise StopAsyncIteration
+        return row
+
+
+class AsyncSession:
+    """
+    Wrap a :class:`sqlalchemy.orm.Session` so that all operations run in an
+    executor.
+
+    Instances are obtained from :meth:`DatabaseFrontend.session`. All
+    operations of a session run on the same worker thread, so the operations
+    must not be issued concurrently; await each one before issuing the next.
+
+    .. automethod:: execute
+
+    .. automethod:: fetchall
+
+    .. automethod:: scalar
+
+    .. automethod:: run
+
+    .. automethod:: commit
+
+    .. automethod:: rollback
+
+    .. attribute:: sync_session
+
+        The wrapped session. It must only be used from within :meth:`run`.
+    """
+
+    def __init__(self, session, executor):
+        super().__init__()
+        self.sync_session = session
+        self._executor = executor
+
+    def _run(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self._executor, func, *args)
+
+    async def execute(self, statement, params=None):
+        """
+        Execute a statement.
+
+        :param statement: The statement to execute.
+        :type statement: :class:`str` or SQLAlchemy statement
+        :param params: Bound parameters for the statement.
+        :type params: :class:`dict` or :class:`list` of :class:`dict`
+        :rtype: :class:`AsyncResult`
+        """
+        if isinstance(statement, str):
+            statement = _text_statement(statement)
+        result = await self._run(
+            functools.partial(
+                self.sync_session.execute,
+                statement,
+                params,
+            )
+        )
+        return AsyncResult(result, self._run)
+
+    async def fetchall(self, statement, params=None):
+        """
+        Execute a statement and return all rows of the result.
+        """
+        result = await self.execute(statement, params)
+        return await result.fetchall()
+
+    async def scalar(self, statement, params=None):
+        """
+        Execute a statement and return the first column of the first row of
+        the result.
+        """
+        if isinstance(statement, str):
+            statement = _text_statement(statement)
+        return await self._run(
+            functools.partial(
+                self.sync_session.scalar,
+                statement,
+                params,
+            )
+        )
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Call a function with the wrapped session in the executor.
+
+        :param func: The function to call.
+        :return: The return value of `func`.
+
+        This allows to use the ORM query API, for example::
+
+            blobs = await session.run(
+                lambda session: session.query(Blob).all()
+            )
+        """
+        return await self._run(
+            functools.partial(func, self.sync_session, *args, **kwargs)
+        )
+
+    async def commit(self):
+        await self._run(self.sync_session.commit)
+
+    async def rollback(self):
+        await self._run(self.sync_session.rollback)
+
+
+class _AsyncSessionContext:
+    def __init__(self, frontend, type_, namespace, name):
+        super().__init__()
+        self._frontend = frontend
+        self._args = type_, namespace, name
+        self._worker = None
+        self._session = None
+
+    async def __aenter__(self):
+        self._worker = await self._frontend._acquire_worker()
+        try:
+            engine = self._frontend.get_engine(*self._args)
+            self._session = AsyncSession(
+                sqlalchemy.orm.sessionmaker(bind=engine)(),
+                self._worker,
+            )
+        except:  # NOQA
+            self._frontend._release_worker(self._worker)
+            raise
+        return self._session
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        try:
+            try:
+                if exc_type is None:
+                    await self._session.commit()
+                else:
+                    await self._session.rollback()
+            finally:
+                await self._session._run(self._session.sync_session.close)
+        finally:
+            self._frontend._release_worker(self._worker)
+
+
+class DatabaseFrontend(Frontend):
+    """
+    Storage frontend for accessing :attr:`~.StorageLevel.GLOBAL` SQLite
+    databases.
+
+    :param max_sessions: Maximum number of concurrently open sessions
+        obtained from :meth:`session`.
+
+    .. automethod:: connect
+
+    .. automethod:: session
+
+    .. automethod:: get_engine
+
+    .. automethod:: upgrade_schema
+
+    .. automethod:: backup
+
+    .. automethod:: close
+    """
+
+    #: Maximum number of compiled statements cached per database.
+    STATEMENT_CACHE_SIZE = 256
+
+    def __init__(self, backend, *, max_sessions=4):
+        super().__init__(backend)
+        self._max_sessions = max_sessions
+        self._session_slots = None
+        # single-threaded executors, one per concurrently open session; a
+        # session keeps its connection on the same thread for its lifetime
+        self._idle_workers = []
+        self._closed = False
+
+    def _get_path(self, type_, namespace, name):
+        return (self._backend.type_base_paths(type_, True)[0] /
+                StorageLevel.GLOBAL.value /
+                escape_path_part(namespace) /
+                "db" /
+                name)
+
+    def get_engine(self, type_, namespace, name):
+        """
+        Return a SQLAlchemy engine for a database.
+
+        :param type_: The storage type of the database.
+        :type type_: :class:`StorageType`
+        :param namespace: The namespace of the database.
+        :type namespace: :class:`str`
+        :param name: The name of the database.
+        :type name: :class:`str`
+        :rtype: :class:`sqlalchemy.engine.Engine`
+        :return: An engine for the given database.
+
+        The engine is shared through :data:`engines` and caches the compiled
+        statements executed on it.
+        """
+        return engines.get(
+            self._get_path(type_, namespace, name),
+            self._setup_engine,
+        )
+
+    def _setup_engine(self, engine):
+        return engine.execution_options(
+            compiled_cache=sqlalchemy.util.LRUCache(
+                self.STATEMENT_CACHE_SIZE
+            ),
+        )
+
+    def session(self, type_, namespace, name):
+        """
+        Open a session on a database for use from a coroutine.
+
+        :param type_: The storage type of the database.
+        :type type_: :class:`StorageType`
+        :param namespace: The namespace of the database.
+        :type namespace: :class:`str`
+        :param name: The name of the database.
+        :type name: :class:`str`
+        :rtype: asynchronous context manager yielding :class:`AsyncSession`
+
+        All database operations of the session run in an executor owned by
+        the frontend. When the context is left, the session is committed (or
+        rolled back, if the context is left with an exception) and closed.
+        At most `max_sessions` sessions are open at the same time; further
+        sessions wait for one to be closed before they are opened.
+
+        Compiled Core statements are cached per database, so executing the
+        same statement object repeatedly does not compile it again.
+        """
+        return _AsyncSessionContext(self, type_, namespace, name)
+
+    async def _acquire_worker(self):
+        if self._session_slots is None:
+            self._session_slots = asyncio.Semaphore(self._max_sessions)
+        await self._session_slots.acquire()
+        if self._idle_workers:
+            return self._idle_workers.pop()
+        return concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def _release_worker(self, worker):
+        if self._closed:
+            worker.shutdown(wait=False)
+        else:
+            self._idle_workers.append(worker)
+        self._session_slots.release()
+
+    def upgrade_schema(self, type_, namespace, name, metadata,
+                       schema_migrations=()):
+        """
+        Bring the schema of a database up to date and return its engine.
+
+        :param type_: The storage type of the database.
+        :type type_: :class:`StorageType`
+        :param namespace: The namespace of the database.
+        :type namespace: :class:`str`
+        :param name: The name of the database.
+        :type name: :class:`str`
+        :param metadata: The current schema of the database.
+        :type metadata: :class:`sqlalchemy.MetaData`
+        :param schema_migrations: Migrations from older schema versions.
+        :rtype: :class:`sqlalchemy.engine.Engine`
+        :return: The engine returned by :meth:`get_engine`.
+
+        See :func:`.migrations.upgrade` for details on how migrations are
+        applied. This should be called once before the database is used,
+        as it blocks while migrations run.
+        """
+        engine = self.get_engine(type_, namespace, name)
+        migrations.upgrade(engine, metadata, schema_migrations)
+        return engine
+
+    def _usage(self, type_):
+        usage = collections.Counter()
+        base = (self._backend.type_base_paths(type_, True)[0] /
+                StorageLevel.GLOBAL.value)
+        for path in base.glob("*/db"):
+            namespace = urllib.parse.unquote(path.parent.name)
+            usage[StorageLevel.GLOBAL, namespace] += _tree_size(path)
+        return usage
+
+    async def clear(self, level):
+        """
+        See :meth:`.Frontend.clear`.
+
+        Databases only exist on the :attr:`~.StorageLevel.GLOBAL` level, so
+        there is nothing to delete.
+        """
+        if level.level == StorageLevel.GLOBAL:
+            raise ValueError("GLOBAL level not supported")
+
+    async def usage(self, type_):
+        """
+        See :meth:`.Frontend.usage`.
+
+        The size of the database files is reported.
+        """
+        return await self._run_in_executor(self._usage, type_)
+
+    def _database_paths(self, type_):
+        base = self._backend.type_base_paths(type_, True)[0]
+        return [
+            path
+            for path in (base / StorageLevel.GLOBAL.value).glob("*/db/*")
+            if not path.name.endswith(_SQLITE_AUX_SUFFIXES)
+        ]
+
+    def _backup(self, type_, destination):
+        base = self._backend.type_base_paths(type_, True)[0]
+        for path in self._database_paths(type_):
+            _backup_database(path, destination / path.relative_to(base))
+
+    async def backup(self, type_, destination):
+        """
+        See :meth:`.Frontend.backup`.
+
+        The databases are copied with the SQLite online backup API, which
+        copies a few pages at a time and lets other connections write in
+        between.
+        """
+        await self._run_in_executor(self._backup, type_, destination)
+
+    def close(self):
+        """
+        Stop the worker threads of the sessions.
+
+        This is meant to be called on shutdown. The workers of sessions which
+        are still open are stopped when the sessions are closed.
+        """
+        self._closed = True
+        while self._idle_workers:
+            self._idle_workers.pop().shutdown(wait=True)
+
+
+class FileLikeFrontend(metaclass=abc.ABCMeta):
+    @abc.abstractmethod
+    async def open(self, type_, level, namespace, name, mode="r", *,
+                   encoding=None):
+        """
+        Return a file-like object.
+
+        :param type_: The storage type of the object to open.
+        :type type_: :class:`StorageType`
+        :param level: The information hierarchy level of the object to open.
+        :type level: :class:`LevelDescriptor`
+        :param namespace: The namespace of the object.
+        :type namespace: :class:`str`
+        :param name: The name of the object.
+        :type name: :class:`str`
+        :param mode: The file open mode to open the object with.
+        :type mode: :class:`str` (see :func:`open` and the note below)
+        :param encoding: The encoding to use to decode the file if it is
+            opened in text mode (see :func:`open`)
+        :type encoding: :class:`str` or :data:`None`
+        :raises ValueError: if the `encoding` is not :data:`None` for a binary
+            `mode`.
+        :raises OSError: if the object could not be opened
+        :return: The opened file
+        :rtype: :class:`io.IOBase` or :class:`io.TextIOBase`, depending on
+            `mode`
+
+        Implementations *may* support additional keyword arguments.
+
+        If the `mode` indicates the use of binary mode and `encoding` is not
+        :data:`None`, :class:`ValueError` is raised and the object is not
+        touched.
+
+        .. note::
+
+            Not all `mode` values supported by :func:`open` may be supported
+            by implementations.
+
+            However, the ``r``, ``rb`` (and implicitly ``rt``) modes are
+            supported by all implementations.
+        """
+
+    @abc.abstractmethod
+    async def stat(self, type_, level, namespace, name):
+        """
+        Return meta-information about an object.
+
+        :param type_: The storage type of the object to look up.
+        :type type_: :class:`StorageType`
+        :param level: The information hierarchy level of the object to look up.
+        :type level: :class:`LevelDescriptor`
+        :param namespace: The namespace of the object.
+        :type namespace: :class:`str`
+        :param name: The name of the object.
+        :type name: :class:`str`
+        :raises OSError: if the object could not be queried
+        :return: A structure (see below for the attributes) describing the
+            metadata
+
+        The returned object has the following attributes:
+
+        .. attribute:: st_size
+
+            The size of the object in bytes.
+
+        .. attribute:: st_atime
+
+            The time of last access of the object, as seconds since UNIX epoch,
+            or absent if not supported.
+
+        .. attribute:: st_mtime
+
+            The time of last modification of the object, as seconds since
+            UNIX epoch, or absent if not supported.
 
         .. attribute:: st_ctime
 
@@ -308,6 +1372,133 @@ class FileLikeFrontend(metaclass=abc.ABCMeta):
         """
 
 
+_HAS_BLOBOPEN = hasattr(sqlite3.Connection, "blobopen")
+
+
+class _SmallBlobReader(io.RawIOBase):
+    """
+    Read-only raw stream on top of SQLite incremental blob I/O.
+
+    :param path: The path of the database.
+    :type path: :class:`pathlib.Path`
+    :param table: The table of the blob.
+    :type table: :class:`str`
+    :param rowid: The rowid of the blob.
+    :type rowid: :class:`int`
+
+    Only the bytes which are actually requested are read from the database.
+    The stream keeps its own read-only connection until it is closed, but
+    opens the blob only for the duration of each read, so that no lock on
+    the database is held between reads. The connection may be used from any
+    thread, one at a time. Reads fail with :class:`sqlite3.OperationalError`
+    if the blob has been modified or deleted since the stream was opened.
+
+    The stream is opened blocking and should be created in an executor.
+    """
+
+    def __init__(self, path, table, rowid):
+        super().__init__()
+        self._table = table
+        self._rowid = rowid
+        self._position = 0
+        # mode=ro: never create a database which has been deleted meanwhile
+        self._connection = sqlite3.connect(
+            "file:{}?mode=ro".format(urllib.parse.quote(str(path))),
+            uri=True,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        try:
+            self._connection.execute("BEGIN")
+            try:
+                self._data_version = self._get_data_version()
+                self._version = self._get_version()
+            finally:
+                self._connection.execute("COMMIT")
+        except:  # NOQA
+            self._connection.close()
+            raise
+        _, self._size = self._version
+
+    def _get_data_version(self):
+        return self._connection.execute(
+            "PRAGMA data_version"
+        ).fetchone()[0]
+
+    def _get_version(self):
+        row = self._connection.execute(
+            "SELECT st_mtime, length(data) FROM {} WHERE rowid = ?".format(
+                self._table
+            ),
+            (self._rowid,),
+        ).fetchone()
+        if row is None:
+            raise sqlite3.OperationalError("blob has been deleted")
+        return tuple(row)
+
+    def _read(self, offset, size):
+        """
+        Read `size` bytes at `offset` from the blob.
+        """
+        self._connection.execute("BEGIN")
+        try:
+            # the data version only changes when another connection commits
+            # to the database; only then the row needs to be checked
+            data_version = self._get_data_version()
+            if data_version != self._data_version:
+                if self._get_version() != self._version:
+                    raise sqlite3.OperationalError("blob has been modified")
+                self._data_version = data_version
+
+            with self._connection.blobopen(self._table, "data", self._rowid,
+                                           readonly=True) as blob:
+                blob.seek(min(offset, len(blob)))
+                return blob.read(size)
+        finally:
+            self._connection.execute("COMMIT")
+
+    def close(self):
+        if not self.closed:
+            self._connection.close()
+        super().close()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        data = self._read(self._position, len(b))
+        n = len(data)
+        b[:n] = data
+        self._position += n
+        return n
+
+    def readall(self):
+        data = self._read(self._position,
+                          max(self._size - self._position, 0))
+        self._position += len(data)
+        return data
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self._size + offset
+        else:
+            raise ValueError("invalid whence ({})".format(whence))
+        if position < 0:
+            raise ValueError("negative seek position {}".format(position))
+        self._position = position
+        return position
+
+    def tell(self):
+        return self._position
+
+
 class SmallBlobFrontend(FileLikeFrontend, Frontend):
     """
     Storage frontend for storing a huge number of small pieces of data.
@@ -333,20 +1524,48 @@ class SmallBlobFrontend(FileLikeFrontend, Frontend):
     :attr:`st_atime`, :attr:`st_mtime`, :attr:`st_birthtime`, and
     :attr:`st_size` attributes.
 
+    :param prefetch_size: Maximum number of bytes of blob data kept in memory
+        by :meth:`warm`.
+    :param miss_cache_size: Maximum number of blobs remembered as missing.
+
+    Blobs which the database reported as missing are remembered, together
+    with the size and modification time of the database file at the time of
+    the query. :meth:`load`, :meth:`open`, :meth:`stat` and :meth:`unlink`
+    report such blobs as missing without querying the database as long as
+    the database file has not changed since; any write to the database,
+    from this or another process, makes them query it again. Misses are not
+    remembered while the database file has been modified very recently,
+    since the modification time may not tell apart writes made in quick
+    succession.
+
     .. automethod:: store
 
     .. automethod:: load
 
+    .. automethod:: warm
+
     Part of the file-like frontend interface:
 
     .. automethod:: open
 
+    .. automethod:: open_async
+
     .. automethod:: stat
 
     .. automethod:: unlink
 
-    """
-    StatTuple = collections.namedtuple(
+    Space management:
+
+    .. automethod:: clear
+
+    .. automethod:: usage
+
+    .. automethod:: backup
+
+    """
+    EVICTABLE = True
+
+    StatTuple = collections.namedtuple(
         "StatTuple",
         [
             "st_size",
@@ -360,13 +1579,39 @@ class SmallBlobFrontend(FileLikeFrontend, Frontend):
         StorageLevel.PEER: (
             peer_model.Base,
             peer_model.SmallBlob,
+            peer_model.MIGRATIONS,
         ),
         StorageLevel.ACCOUNT: (
             account_model.Base,
             account_model.SmallBlob,
+            account_model.MIGRATIONS,
         ),
     }
 
+    #: Minimum age in seconds of the last modification of a database file
+    #: for misses to be remembered, see :meth:`_database_signature`.
+    MISS_CACHE_MIN_AGE = 2
+
+    def __init__(self, backend, *, prefetch_size=4*1024*1024,
+                 miss_cache_size=4096):
+        super().__init__(backend)
+        self.prefetch_size = prefetch_size
+        self.miss_cache_size = miss_cache_size
+        # blobs loaded by warm() which have not been loaded since, in least
+        # recently warmed order
+        self._prefetched = collections.OrderedDict()
+        self._prefetched_bytes = 0
+        self._prefetch_lock = threading.Lock()
+        # bumped on invalidations which cannot be tracked per key
+        self._prefetch_generation = 0
+        self._warming = 0
+        # keys written while warm() calls are running
+        self._written_while_warming = set()
+        # maps the keys of blobs which were found missing to the database
+        # path and its signature at that time, in least recently used order
+        self._misses = collections.OrderedDict()
+        self._misses_lock = threading.Lock()
+
     def _get_path(self, type_, level_type, namespace):
         return (self._backend.type_base_paths(type_, True)[0] /
                 StorageLevel.GLOBAL.value /
@@ -379,39 +1624,113 @@ class SmallBlobFrontend(FileLikeFrontend, Frontend):
             raise ValueError("GLOBAL level not supported")
 
         try:
-            base, *_ = self.LEVEL_INFO[level_type]
+            base, _, schema_migrations = self.LEVEL_INFO[level_type]
         except KeyError as exc:
             raise ValueError(
                 "unknown storage level: {}".format(exc)
             ) from None
 
-        base.metadata.create_all(engine)
+        migrations.upgrade(engine, base.metadata, schema_migrations)
 
-    @functools.lru_cache(32)
-    def _get_sessionmaker(self, type_, level_type, namespace):
-        path = self._get_path(type_, level_type, namespace)
-        engine = _get_engine(path)
+    def _open_database(self, level_type, engine):
         self._init_engine(engine, level_type)
         return sqlalchemy.orm.sessionmaker(bind=engine)
 
-    def _store_blob(self, type_, level, namespace, name, data):
+    def _get_sessionmaker(self, type_, level_type, namespace):
+        return engines.get(
+            self._get_path(type_, level_type, namespace),
+            functools.partial(self._open_database, level_type),
+        )
+
+    def _database_signature(self, path, min_age=0):
+        """
+        Return a value which changes when the database at `path` is written.
+
+        :param min_age: If the database file has been modified less than
+            this many seconds ago, :data:`None` is returned.
+        :return: The signature or :data:`None` if the database is not a file
+            or does not exist.
+
+        The signature consists of the inode, size and modification time of
+        the database file and its write-ahead log, if any.
+        """
+        if not path or path == ":memory:":
+            return None
+        signature = []
+        for suffix in ["", "-wal"]:
+            try:
+                stat = os.stat(str(path) + suffix)
+            except FileNotFoundError:
+                if not suffix:
+                    return None
+                signature.append(None)
+                continue
+            if time.time() - stat.st_mtime < min_age:
+                return None
+            signature.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+        return tuple(signature)
+
+    def _remember_missing(self, key, path, signature):
+        if signature is None:
+            return
+        with self._misses_lock:
+            self._misses[key] = path, signature
+            self._misses.move_to_end(key)
+            while len(self._misses) > self.miss_cache_size:
+                self._misses.popitem(last=False)
+
+    def _is_known_missing(self, type_, level, namespace, name):
+        """
+        Return true if the blob is known to be missing from the database.
+        """
+        key = self._prefetch_key(type_, level, namespace, name)
+        with self._misses_lock:
+            try:
+                path, signature = self._misses[key]
+            except KeyError:
+                return False
+        if self._database_signature(path) == signature:
+            with self._misses_lock:
+                if key in self._misses:
+                    self._misses.move_to_end(key)
+            return True
+        with self._misses_lock:
+            if self._misses.get(key, (None, None))[1] == signature:
+                del self._misses[key]
+        return False
+
+    def _query_blob(self, type_, level, namespace, name, func):
+        """
+        Call `func` with a session and the blob model, remembering the blob
+        as missing if it raises :class:`KeyError`.
+        """
         sessionmaker = self._get_sessionmaker(
             type_,
             level.level,
             namespace)
 
-        _, blob_type, *_ = self.LEVEL_INFO[level.level]
+        path = sessionmaker.kw["bind"].url.database
+        # taken before the query, so that writes made while it runs change
+        # the signature
+        signature = self._database_signature(
+            path,
+            min_age=self.MISS_CACHE_MIN_AGE,
+        )
 
-        blob = blob_type.from_level_descriptor(level)
-        blob.data = data
-        blob.name = name
-        blob.touch_mtime()
+        _, blob_type, *_ = self.LEVEL_INFO[level.level]
 
         with common.session_scope(sessionmaker) as session:
-            session.merge(blob)
+            try:
+                return func(session, blob_type)
+            except KeyError:
+                self._remember_missing(
+                    self._prefetch_key(type_, level, namespace, name),
+                    path,
+                    signature,
+                )
+                raise
 
-    def _load_blob(self, type_, level, namespace, name, query, *,
-                   touch=False):
+    def _store_blob(self, type_, level, namespace, name, data):
         sessionmaker = self._get_sessionmaker(
             type_,
             level.level,
@@ -420,11 +1739,144 @@ class SmallBlobFrontend(FileLikeFrontend, Frontend):
         _, blob_type, *_ = self.LEVEL_INFO[level.level]
 
         with common.session_scope(sessionmaker) as session:
+            blob = blob_type.from_level_descriptor(session, level)
+            blob.data = data
+            blob.name = name
+            blob.touch_mtime()
+            session.merge(blob)
+
+    def _load_blob(self, type_, level, namespace, name, query, *,
+                   touch=False):
+        def load(session, blob_type):
             info = blob_type.get(session, level, name, query)
             if touch:
                 blob_type.get(session, level, name).touch_atime()
             return info
 
+        return self._query_blob(type_, level, namespace, name, load)
+
+    def _get_rowid(self, type_, level, namespace, name):
+        def get_rowid(session, blob_type):
+            blob_type.get(session, level, name).touch_atime()
+            rowid, = blob_type.get(
+                session, level, name,
+                [sqlalchemy.literal_column("rowid")],
+            )
+            return blob_type.__tablename__, rowid
+
+        return self._query_blob(type_, level, namespace, name, get_rowid)
+
+    def _iter_databases(self, type_):
+        """
+        Yield the level type and namespace of each existing database.
+        """
+        base = (self._backend.type_base_paths(type_, True)[0] /
+                StorageLevel.GLOBAL.value)
+        for level_type in self.LEVEL_INFO:
+            for path in base.glob(
+                    "*/smallblobs/{}.sqlite".format(level_type.value)):
+                yield level_type, path.parent.parent.name
+
+    def _usage(self, type_):
+        usage = collections.Counter()
+        for level_type, namespace in list(self._iter_databases(type_)):
+            _, blob_type, *_ = self.LEVEL_INFO[level_type]
+            sessionmaker = self._get_sessionmaker(
+                type_,
+                level_type,
+                namespace)
+            with common.session_scope(sessionmaker) as session:
+                size = session.query(sqlalchemy.sql.func.sum(
+                    sqlalchemy.sql.func.length(blob_type.data)
+                )).scalar()
+            usage[level_type, namespace] += size or 0
+        return usage
+
+    def _clear(self, level):
+        if level.level == StorageLevel.GLOBAL:
+            raise ValueError("GLOBAL level not supported")
+
+        first_error = None
+        for type_ in StorageType:
+            for level_type, namespace in list(self._iter_databases(type_)):
+                if (level.level == StorageLevel.PEER and
+                        level_type != StorageLevel.PEER):
+                    continue
+
+                _, blob_type, *_ = self.LEVEL_INFO[level_type]
+                sessionmaker = self._get_sessionmaker(
+                    type_,
+                    level_type,
+                    namespace)
+                try:
+                    with common.session_scope(sessionmaker) as session:
+                        blob_type.filter_by_level(
+                            session.query(blob_type),
+                            level,
+                        ).delete(synchronize_session=False)
+                except Exception as exc:
+                    if first_error is None:
+                        first_error = exc
+
+        if first_error is not None:
+            raise first_error
+
+    @staticmethod
+    def _evict_row(sessionmaker, blob_type, rowid, accessed):
+        with common.session_scope(sessionmaker) as session:
+            return session.query(blob_type).filter(
+                sqlalchemy.literal_column("rowid") == rowid,
+                blob_type.accessed == accessed,
+            ).delete(synchronize_session=False)
+
+    def _evict_prefetched_row(self, sessionmaker, blob_type, rowid, accessed,
+                              size):
+        # the key of the row is not known here
+        self._invalidate_prefetched()
+        if not self._evict_row(sessionmaker, blob_type, rowid, accessed):
+            return 0
+        return size
+
+    def _eviction_candidates(self, type_):
+        candidates = []
+        for level_type, namespace in list(self._iter_databases(type_)):
+            _, blob_type, *_ = self.LEVEL_INFO[level_type]
+            sessionmaker = self._get_sessionmaker(
+                type_,
+                level_type,
+                namespace)
+            with common.session_scope(sessionmaker) as session:
+                rows = session.query(
+                    sqlalchemy.literal_column("rowid"),
+                    blob_type.accessed,
+                    sqlalchemy.sql.func.length(blob_type.data),
+                ).all()
+
+            for rowid, accessed, size in rows:
+                candidates.append(EvictionCandidate(
+                    atime=(accessed - _EPOCH).total_seconds(),
+                    size=size or 0,
+                    # rows which have been accessed in the meantime are
+                    # kept
+                    evict=functools.partial(
+                        self._evict_prefetched_row,
+                        sessionmaker, blob_type, rowid, accessed, size or 0,
+                    ),
+                ))
+        return candidates
+
+    def _open_blob(self, type_, level, namespace, name):
+        table, rowid = self._get_rowid(type_, level, namespace, name)
+        try:
+            return _SmallBlobReader(
+                self._get_path(type_, level.level, namespace),
+                table,
+                rowid,
+            )
+        except sqlite3.OperationalError:
+            # the row vanished between looking up the rowid and opening it
+            raise KeyError(rowid) from None
+
     async def _load_in_executor(self, type_, level, namespace, name, query, *,
                                 touch=False):
         loop = asyncio.get_event_loop()
@@ -459,6 +1911,142 @@ class SmallBlobFrontend(FileLikeFrontend, Frontend):
             type_, level, namespace, name,
         )
 
+    @staticmethod
+    def _prefetch_key(type_, level, namespace, name):
+        return type_, level, namespace, name
+
+    def _take_prefetched(self, key):
+        with self._prefetch_lock:
+            data = self._prefetched.pop(key, None)
+            if data is not None:
+                self._prefetched_bytes -= len(data)
+            return data
+
+    def _invalidate_prefetched(self, key=None, level=None):
+        """
+        Drop prefetched blobs.
+
+        :param key: The key of the blob to drop.
+        :param level: Drop all blobs of this level key, including the peers
+            of an account level key.
+
+        If neither is given, all blobs are dropped.
+        """
+        with self._prefetch_lock:
+            if key is not None:
+                data = self._prefetched.pop(key, None)
+                if data is not None:
+                    self._prefetched_bytes -= len(data)
+                if self._warming:
+                    self._written_while_warming.add(key)
+                return
+
+            self._prefetch_generation += 1
+            for other in list(self._prefetched):
+                # the level keys of peers start with the account
+                if level is not None and other[1][:len(level)] != level:
+                    continue
+                self._prefetched_bytes -= len(self._prefetched.pop(other))
+
+    def _begin_warm(self):
+        with self._prefetch_lock:
+            self._warming += 1
+            return self._prefetch_generation
+
+    def _finish_warm(self, generation, blobs):
+        with self._prefetch_lock:
+            self._warming -= 1
+            written = self._written_while_warming
+            if not self._warming:
+                self._written_while_warming = set()
+
+            if generation != self._prefetch_generation:
+                return 0
+
+            nadded = 0
+            for key, data in blobs:
+                if key in written or len(data) > self.prefetch_size:
+                    continue
+                old = self._prefetched.pop(key, None)
+                if old is not None:
+                    self._prefetched_bytes -= len(old)
+                self._prefetched[key] = data
+                self._prefetched_bytes += len(data)
+                nadded += 1
+
+            while self._prefetched_bytes > self.prefetch_size:
+                _, old = self._prefetched.popitem(last=False)
+                self._prefetched_bytes -= len(old)
+
+            return nadded
+
+    def _load_many(self, type_, levels, namespace, names):
+        by_level_type = collections.defaultdict(list)
+        for level in levels:
+            if level.level not in self.LEVEL_INFO:
+                raise ValueError("GLOBAL level not supported")
+            by_level_type[level.level].append(level)
+
+        result = []
+        for level_type, levels in by_level_type.items():
+            if not self._get_path(type_, level_type, namespace).exists():
+                continue
+
+            _, blob_type, *_ = self.LEVEL_INFO[level_type]
+            sessionmaker = self._get_sessionmaker(
+                type_,
+                level_type,
+                namespace)
+
+            with common.session_scope(sessionmaker) as session:
+                result.extend(
+                    (self._prefetch_key(type_, level, namespace, name), data)
+                    for level, name, data in blob_type.load_many(
+                        session, levels, names,
+                    )
+                )
+        return result
+
+    async def warm(self, type_, levels, namespace, names=None):
+        """
+        Load the blobs of many level keys into memory.
+
+        :param type_: The storage type to use.
+        :type type_: :class:`~.StorageType`
+        :param levels: The level keys to load the blobs of.
+        :type levels: iterable of :class:`~.LevelDescriptor`
+        :param namespace: The namespace to load the blobs from.
+        :type namespace: :class:`str`
+        :param names: If given, only the blobs with these names are loaded.
+        :type names: iterable of :class:`str`
+        :rtype: :class:`int`
+        :return: The number of blobs loaded into memory.
+
+        The blobs are loaded with as few queries as possible, ordered by
+        primary key, and their access time is updated. The next
+        :meth:`load` (or text mode :meth:`open`) of each blob is served from
+        memory, after which it is dropped from memory again.
+
+        At most `prefetch_size` bytes are kept in memory; the blobs warmed
+        least recently are dropped first. This is intended to be called in
+        the background, when it is known that the blobs will be needed soon,
+        for example for all peers of a freshly loaded roster.
+        """
+        levels = list(levels)
+        if names is not None:
+            names = list(names)
+
+        generation = self._begin_warm()
+        try:
+            blobs = await self._run_in_executor(
+                self._load_many,
+                type_, levels, namespace, names,
+            )
+        except:  # NOQA
+            self._finish_warm(generation, [])
+            raise
+        return self._finish_warm(generation, blobs)
+
     async def store(self, type_, level, namespace, name, data):
         """
         Store `data` as a small blob.
@@ -479,16 +2067,22 @@ class SmallBlobFrontend(FileLikeFrontend, Frontend):
         it is silently overwritten.
         """
 
+        key = self._prefetch_key(type_, level, namespace, name)
+        self._invalidate_prefetched(key)
         loop = asyncio.get_event_loop()
-        await loop.run_in_executor(
-            None,
-            self._store_blob,
-            type_,
-            level,
-            namespace,
-            name,
-            data,
-        )
+        try:
+            await loop.run_in_executor(
+                None,
+                self._store_blob,
+                type_,
+                level,
+                namespace,
+                name,
+                data,
+            )
+        finally:
+            # a warm() may have read the old data in the meantime
+            self._invalidate_prefetched(key)
 
     async def load(self, type_, level, namespace, name):
         """
@@ -507,6 +2101,15 @@ class SmallBlobFrontend(FileLikeFrontend, Frontend):
         :return: The stored data.
         """
 
+        data = self._take_prefetched(
+            self._prefetch_key(type_, level, namespace, name),
+        )
+        if data is not None:
+            return data
+
+        if self._is_known_missing(type_, level, namespace, name):
+            raise KeyError(level)
+
         data, = await self._load_in_executor(
             type_, level, namespace, name,
             [
@@ -526,6 +2129,20 @@ class SmallBlobFrontend(FileLikeFrontend, Frontend):
 
         * `mode` must be one of ``r``, ``rb``, or ``rt``, otherwise
           :class:`ValueError` is raised.
+
+        The returned file reads the blob incrementally using SQLite
+        incremental blob I/O, so that partial reads do not load the whole
+        blob. The file is opened in the executor and keeps a connection to
+        the database until it is closed; the blob itself is only opened for
+        the duration of each read, so that an open file does not keep other
+        connections from writing to the database. Modifying or deleting the
+        blob while the file is open causes subsequent reads to fail with
+        :class:`sqlite3.OperationalError`.
+
+        The returned file object itself is blocking; use :meth:`open_async`
+        to obtain a file whose reads run in the executor, too. If incremental
+        blob I/O is not available (Python older than 3.11), the whole blob is
+        loaded and wrapped in a :class:`io.BytesIO` or :class:`io.StringIO`.
         """
         if utils.is_write_mode(mode):
             raise ValueError(
@@ -539,7 +2156,15 @@ class SmallBlobFrontend(FileLikeFrontend, Frontend):
             )
 
         try:
-            raw = await self.load(type_, level, namespace, name)
+            if _HAS_BLOBOPEN:
+                if self._is_known_missing(type_, level, namespace, name):
+                    raise KeyError(level)
+                f = await self._run_in_executor(
+                    self._open_blob,
+                    type_, level, namespace, name,
+                )
+            else:
+                raw = await self.load(type_, level, namespace, name)
         except KeyError as exc:
             raise FileNotFoundError(
                 "{!r} does not exist in namespace {!r} for {}".format(
@@ -549,6 +2174,14 @@ class SmallBlobFrontend(FileLikeFrontend, Frontend):
                 )
             ) from exc
 
+        if _HAS_BLOBOPEN:
+            if binary_mode:
+                return f
+            return io.TextIOWrapper(
+                io.BufferedReader(f),
+                encoding=encoding or sys.getdefaultencoding(),
+            )
+
         if binary_mode:
             return io.BytesIO(raw)
         else:
@@ -556,6 +2189,21 @@ class SmallBlobFrontend(FileLikeFrontend, Frontend):
             text = raw.decode(encoding)
             return io.StringIO(text)
 
+    async def open_async(self, type_, level, namespace, name, mode="r", *,
+                         encoding=None):
+        """
+        Open a blob for asynchronous reading.
+
+        The arguments are the same as for :meth:`open`.
+
+        :rtype: :class:`AsyncFile`
+        :return: The opened file, wrapped so that all operations run in the
+            executor.
+        """
+        f = await self.open(type_, level, namespace, name, mode,
+                            encoding=encoding)
+        return AsyncFile(f)
+
     async def stat(self, type_, level, namespace, name):
         """
         See :meth:`.FileLikeFrontend.stat` for general documentation of the
@@ -573,6 +2221,8 @@ class SmallBlobFrontend(FileLikeFrontend, Frontend):
         epoch = datetime(1970, 1, 1)
 
         try:
+            if self._is_known_missing(type_, level, namespace, name):
+                raise KeyError(level)
             accessed, created, modified, size = await self._load_in_executor(
                 type_, level, namespace, name,
                 [
@@ -604,7 +2254,18 @@ class SmallBlobFrontend(FileLikeFrontend, Frontend):
         :meth:`unlink` method.
         """
 
-        deleted = await self._unlink_in_executor(type_, level, namespace, name)
+        key = self._prefetch_key(type_, level, namespace, name)
+        self._invalidate_prefetched(key)
+        if self._is_known_missing(type_, level, namespace, name):
+            deleted = 0
+        else:
+            try:
+                deleted = await self._unlink_in_executor(
+                    type_, level, namespace, name,
+                )
+            finally:
+                self._invalidate_prefetched(key)
+
         if deleted == 0:
             raise FileNotFoundError(
                 "{!r} does not exist in namespace {!r} for {}".format(
@@ -614,6 +2275,123 @@ class SmallBlobFrontend(FileLikeFrontend, Frontend):
                 )
             )
 
+    async def clear(self, level):
+        """
+        See :meth:`.Frontend.clear`.
+        """
+        self._invalidate_prefetched(level=level)
+        try:
+            await self._run_in_executor(self._clear, level)
+        finally:
+            self._invalidate_prefetched(level=level)
+
+    async def usage(self, type_):
+        """
+        See :meth:`.Frontend.usage`.
+
+        The total length of the stored blobs is reported, which may be
+        considerably less than the size of the database files.
+        """
+        return await self._run_in_executor(self._usage, type_)
+
+    def _database_paths(self, type_):
+        return [
+            self._get_path(type_, level_type, namespace)
+            for level_type, namespace in self._iter_databases(type_)
+        ]
+
+    def _list_blobs(self, type_):
+        """
+        Return the level descriptor, namespace and name of each blob.
+        """
+        level_classes = {
+            StorageLevel.ACCOUNT: AccountLevel,
+            StorageLevel.PEER: PeerLevel,
+        }
+        result = []
+        for level_type, namespace in list(self._iter_databases(type_)):
+            _, blob_type, *_ = self.LEVEL_INFO[level_type]
+            sessionmaker = self._get_sessionmaker(
+                type_,
+                level_type,
+                namespace)
+            with common.session_scope(sessionmaker) as session:
+                result.extend(
+                    (level_classes[level_type](*level_key), namespace, name)
+                    for level_key, name in blob_type.iter_keys(session)
+                )
+        return result
+
+    def _backup(self, type_, destination):
+        base = self._backend.type_base_paths(type_, True)[0]
+        for path in self._database_paths(type_):
+            _backup_database(path, destination / path.relative_to(base))
+
+    async def backup(self, type_, destination):
+        """
+        See :meth:`.Frontend.backup`.
+
+        The databases are copied with the SQLite online backup API, which
+        copies a few pages at a time and lets other connections write in
+        between.
+        """
+        await self._run_in_executor(self._backup, type_, destination)
+
+
+class AsyncFile:
+    """
+    Wrap a file object so that blocking operations run in an executor.
+
+    :param f: The file object to wrap.
+    :param executor: The executor to use (:data:`None` for the default
+        executor of the event loop).
+
+    All methods are coroutines which forward to the respective method of the
+    wrapped file in the executor. :class:`AsyncFile` can be used as
+    asynchronous context manager, which closes the file on exit.
+
+    .. attribute:: raw
+
+        The wrapped file object.
+    """
+
+    def __init__(self, f, *, executor=None):
+        super().__init__()
+        self.raw = f
+        self._executor = executor
+
+    def _run(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self._executor, func, *args)
+
+    @property
+    def closed(self):
+        return self.raw.closed
+
+    async def read(self, size=-1):
+        return await self._run(self.raw.read, size)
+
+    async def readinto(self, b):
+        return await self._run(self.raw.readinto, b)
+
+    async def write(self, data):
+        return await self._run(self.raw.write, data)
+
+    async def seek(self, offset, whence=io.SEEK_SET):
+        return await self._run(self.raw.seek, offset, whence)
+
+    async def flush(self):
+        return await self._run(self.raw.flush)
+
+    async def close(self):
+        return await self._run(self.raw.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        await self.close()
+
 
 class LargeBlobFrontend(_PerLevelKeyFileMixin, FileLikeFrontend, Frontend):
     """
@@ -624,94 +2402,1553 @@ class LargeBlobFrontend(_PerLevelKeyFileMixin, FileLikeFrontend, Frontend):
     level keys and names exist. Usage with :attr:`~.StorageLevel.PEER` is
     discouraged due to the high load it places on the file system.
 
-    Each blob is stored in its own file.
+    Each blob is stored in its own file. All file system operations are run
+    in the default executor of the event loop.
+
+    The :class:`LargeBlobFrontend` supports the :class:`FileLikeFrontend`
+    interface. :meth:`stat` supports all attributes :class:`os.stat_result`
+    supports.
+
+    .. automethod:: open
+
+    .. automethod:: open_async
+
+    .. automethod:: open_mmap
+
+    .. automethod:: stat
+
+    .. automethod:: unlink
+
+    Space management:
+
+    .. automethod:: clear
+
+    .. automethod:: usage
+    """
+
+    EVICTABLE = True
+
+    def _get_blob_path(self, type_, level, namespace, name):
+        return self._get_path(
+            type_,
+            level,
+            namespace,
+            pathlib.Path("largeblobs") / name,
+        )
+
+    @staticmethod
+    def _open_file(path, mode, kwargs):
+        if utils.is_write_mode(mode):
+            utils.mkdir_exist_ok(path.parent)
+
+        return path.open(mode, **kwargs)
+
+    @staticmethod
+    def _map_file(path):
+        with path.open("rb") as f:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty files cannot be mapped
+                return memoryview(b"")
+        return memoryview(mapped)
+
+    @staticmethod
+    def _evict_file(path, size):
+        path.unlink()
+        return size
+
+    def _eviction_candidates(self, type_):
+        for _, _, base in self._iter_subdirs(type_, "largeblobs"):
+            for dirpath, _, filenames in os.walk(str(base)):
+                for filename in filenames:
+                    path = pathlib.Path(dirpath) / filename
+                    try:
+                        stat = path.stat()
+                    except FileNotFoundError:
+                        continue
+                    # file systems mounted with noatime or relatime do not
+                    # update the atime on (each) read
+                    yield EvictionCandidate(
+                        atime=max(stat.st_atime, stat.st_mtime),
+                        size=stat.st_size,
+                        evict=functools.partial(
+                            self._evict_file,
+                            path,
+                            stat.st_size,
+                        ),
+                    )
+
+    async def open(self, type_, level, namespace, name, mode="r", **kwargs):
+        """
+        See :meth:`~.FileLikeFrontend.open`.
+
+        The file is opened (and directories are created, if needed) in the
+        executor. The returned file object itself is blocking; use
+        :meth:`open_async` to obtain a file whose operations run in the
+        executor, too.
+        """
+
+        path = self._get_blob_path(type_, level, namespace, name)
+        return await self._run_in_executor(
+            self._open_file,
+            path, mode, kwargs,
+        )
+
+    async def open_async(self, type_, level, namespace, name, mode="r",
+                         **kwargs):
+        """
+        Open a blob for asynchronous access.
+
+        The arguments are the same as for :meth:`open`.
+
+        :rtype: :class:`AsyncFile`
+        :return: The opened file, wrapped so that all operations run in the
+            executor.
+        """
+
+        f = await self.open(type_, level, namespace, name, mode, **kwargs)
+        return AsyncFile(f)
+
+    async def open_mmap(self, type_, level, namespace, name):
+        """
+        Map a blob read-only into memory.
+
+        :param type_: The storage type of the object to map.
+        :type type_: :class:`StorageType`
+        :param level: The information hierarchy level of the object to map.
+        :type level: :class:`LevelDescriptor`
+        :param namespace: The namespace of the object.
+        :type namespace: :class:`str`
+        :param name: The name of the object.
+        :type name: :class:`str`
+        :raises OSError: if the object could not be opened
+        :rtype: :class:`memoryview`
+        :return: A read-only view on the contents of the object.
+
+        The data is served from the page cache of the operating system without
+        copying it into the process. The mapping is released when the last
+        reference to the returned view (and views derived from it) is gone.
+
+        Replacing the blob while it is mapped is safe if the new data is
+        written to a new file (which is then renamed over the old one);
+        truncating it in-place invalidates the mapping.
+        """
+
+        path = self._get_blob_path(type_, level, namespace, name)
+        return await self._run_in_executor(self._map_file, path)
+
+    async def stat(self, type_, level, namespace, name):
+        """
+        See :meth:`~.FileLikeFrontend.stat`.
+        """
+
+        path = self._get_blob_path(type_, level, namespace, name)
+        return await self._run_in_executor(path.stat)
+
+    async def unlink(self, type_, level, namespace, name):
+        """
+        See :meth:`~.FileLikeFrontend.unlink`.
+        """
+
+        path = self._get_blob_path(type_, level, namespace, name)
+        return await self._run_in_executor(path.unlink)
+
+    async def clear(self, level):
+        """
+        See :meth:`.Frontend.clear`.
+        """
+        await self._run_in_executor(self._clear_subdirs, level, "largeblobs")
+
+    async def usage(self, type_):
+        """
+        See :meth:`.Frontend.usage`.
+
+        The size of the blob files is reported.
+        """
+        return await self._run_in_executor(self._usage, type_, "largeblobs")
+
+
+class ContentAddressedBlobFrontend(FileLikeFrontend, Frontend):
+    """
+    Storage frontend for large blobs which are likely to be duplicated.
+
+    Each distinct blob is stored exactly once in a file named after its
+    SHA-256 digest. The (level key, namespace, name) triples are references
+    to the content in an SQLite index, which also keeps a reference count per
+    stored object. Storing the same data under multiple names (e.g. the same
+    avatar for several peers) thus only costs disk space and write I/O once.
+
+    Objects whose reference count dropped to zero are removed by
+    :meth:`collect_garbage`, not when the last reference is removed.
+
+    Like with :class:`SmallBlobFrontend`, :meth:`open` can only be used for
+    reading; to store blobs, :meth:`store` must be used. :meth:`stat`
+    supports the :attr:`st_atime`, :attr:`st_mtime`, :attr:`st_birthtime`,
+    and :attr:`st_size` attributes.
+
+    .. automethod:: store
+
+    .. automethod:: open_mmap
+
+    .. automethod:: collect_garbage
+
+    Part of the file-like frontend interface:
+
+    .. automethod:: open
+
+    .. automethod:: stat
+
+    .. automethod:: unlink
+
+    Space management:
+
+    .. automethod:: clear
+
+    .. automethod:: usage
+    """
+
+    EVICTABLE = True
+
+    StatTuple = collections.namedtuple(
+        "StatTuple",
+        [
+            "st_size",
+            "st_atime",
+            "st_mtime",
+            "st_birthtime",
+        ]
+    )
+
+    def __init__(self, backend):
+        super().__init__(backend)
+        # serialises reference count changes with garbage collection
+        self._lock = threading.Lock()
+
+    def _get_base_path(self, type_):
+        return (self._backend.type_base_paths(type_, True)[0] /
+                StorageLevel.GLOBAL.value /
+                escape_path_part(utils.jabbercat_ns.core) /
+                "cas")
+
+    def _get_object_path(self, type_, digest):
+        return (self._get_base_path(type_) /
+                "objects" /
+                digest[:2] /
+                digest[2:])
+
+    def _get_index_path(self, type_):
+        return self._get_base_path(type_) / "index.sqlite"
+
+    def _open_index(self, engine):
+        migrations.upgrade(engine, cas_model.Base.metadata,
+                           cas_model.MIGRATIONS)
+        return sqlalchemy.orm.sessionmaker(bind=engine)
+
+    def _get_sessionmaker(self, type_):
+        return engines.get(self._get_index_path(type_), self._open_index)
+
+    def _add_reference(self, type_, level, namespace, name, digest, size):
+        with common.session_scope(self._get_sessionmaker(type_)) as session:
+            obj = session.query(cas_model.Object).get(digest)
+            if obj is None:
+                obj = cas_model.Object(digest=digest, size=size, refcount=0)
+                session.add(obj)
+
+            try:
+                ref = cas_model.Reference.get(session, level, namespace, name)
+            except KeyError:
+                ref = cas_model.Reference.from_level_descriptor(
+                    level, namespace, name,
+                )
+                session.add(ref)
+            else:
+                if ref.digest == digest:
+                    ref.touch_mtime()
+                    return
+                session.query(cas_model.Object).get(ref.digest).refcount -= 1
+
+            ref.digest = digest
+            ref.touch_mtime()
+            obj.refcount += 1
+
+    def _store_blob(self, type_, level, namespace, name, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._get_object_path(type_, digest)
+
+        with self._lock:
+            if path.exists():
+                self._add_reference(type_, level, namespace, name,
+                                    digest, len(data))
+                return
+
+        utils.mkdir_exist_ok(path.parent)
+        with utils.safe_writer(path) as f:
+            f.write(data)
+
+        with self._lock:
+            self._add_reference(type_, level, namespace, name,
+                                digest, len(data))
+
+    def _lookup(self, type_, level, namespace, name, *, touch=False):
+        with common.session_scope(self._get_sessionmaker(type_)) as session:
+            try:
+                ref = cas_model.Reference.get(session, level, namespace, name)
+            except KeyError as exc:
+                raise FileNotFoundError(
+                    "{!r} does not exist in namespace {!r} for {}".format(
+                        name,
+                        namespace,
+                        level,
+                    )
+                ) from exc
+            if touch:
+                ref.touch_atime()
+            size = session.query(cas_model.Object).get(ref.digest).size
+            return ref.digest, size, ref.accessed, ref.created, ref.modified
+
+    def _open_blob(self, type_, level, namespace, name, mode, kwargs):
+        digest, *_ = self._lookup(type_, level, namespace, name, touch=True)
+        return self._get_object_path(type_, digest).open(mode, **kwargs)
+
+    def _map_blob(self, type_, level, namespace, name):
+        digest, *_ = self._lookup(type_, level, namespace, name, touch=True)
+        return LargeBlobFrontend._map_file(
+            self._get_object_path(type_, digest)
+        )
+
+    def _unlink_blob(self, type_, level, namespace, name):
+        with self._lock, \
+                common.session_scope(self._get_sessionmaker(type_)) as session:
+            try:
+                ref = cas_model.Reference.get(session, level, namespace, name)
+            except KeyError as exc:
+                raise FileNotFoundError(
+                    "{!r} does not exist in namespace {!r} for {}".format(
+                        name,
+                        namespace,
+                        level,
+                    )
+                ) from exc
+            session.query(cas_model.Object).get(ref.digest).refcount -= 1
+            session.delete(ref)
+
+    def _collect_garbage(self, type_):
+        freed = 0
+        with self._lock, \
+                common.session_scope(self._get_sessionmaker(type_)) as session:
+            unreferenced = session.query(cas_model.Object).filter(
+                cas_model.Object.refcount <= 0
+            ).all()
+            for obj in unreferenced:
+                try:
+                    self._get_object_path(type_, obj.digest).unlink()
+                except FileNotFoundError:
+                    pass
+                freed += obj.size
+                session.delete(obj)
+        return len(unreferenced), freed
+
+    def _has_index(self, type_):
+        return self._get_index_path(type_).exists()
+
+    def _database_paths(self, type_):
+        if not self._has_index(type_):
+            return []
+        return [self._get_index_path(type_)]
+
+    def _usage(self, type_):
+        usage = collections.Counter()
+        if not self._has_index(type_):
+            return usage
+
+        with common.session_scope(self._get_sessionmaker(type_)) as session:
+            # shared content is split evenly between its references
+            rows = session.query(
+                cas_model.Reference.level,
+                cas_model.Reference.namespace,
+                sqlalchemy.sql.func.sum(
+                    cas_model.Object.size * 1.0 / cas_model.Object.refcount
+                ),
+            ).join(
+                cas_model.Object,
+                cas_model.Object.digest == cas_model.Reference.digest,
+            ).group_by(
+                cas_model.Reference.level,
+                cas_model.Reference.namespace,
+            ).all()
+            garbage = session.query(
+                sqlalchemy.sql.func.sum(cas_model.Object.size)
+            ).filter(
+                cas_model.Object.refcount <= 0
+            ).scalar()
+
+        for level, namespace, size in rows:
+            usage[StorageLevel(level), namespace] += round(size or 0)
+        if garbage:
+            usage[StorageLevel.GLOBAL, utils.jabbercat_ns.core] += garbage
+        return usage
+
+    def _clear(self, level):
+        if level.level == StorageLevel.GLOBAL:
+            raise ValueError("GLOBAL level not supported")
+
+        _, key = cas_model.Reference.level_key(level)
+        conditions = [sqlalchemy.and_(
+            cas_model.Reference.level == level.level.value,
+            cas_model.Reference.key == key,
+        )]
+        if level.level == StorageLevel.ACCOUNT:
+            prefix = key + "/"
+            conditions.append(sqlalchemy.and_(
+                cas_model.Reference.level == StorageLevel.PEER.value,
+                sqlalchemy.sql.func.substr(
+                    cas_model.Reference.key, 1, len(prefix)
+                ) == prefix,
+            ))
+
+        first_error = None
+        for type_ in StorageType:
+            if not self._has_index(type_):
+                continue
+            try:
+                with self._lock, common.session_scope(
+                        self._get_sessionmaker(type_)) as session:
+                    refs = session.query(cas_model.Reference).filter(
+                        sqlalchemy.or_(*conditions)
+                    ).all()
+                    for ref in refs:
+                        session.query(cas_model.Object).get(
+                            ref.digest
+                        ).refcount -= 1
+                        session.delete(ref)
+                self._collect_garbage(type_)
+            except Exception as exc:
+                if first_error is None:
+                    first_error = exc
+
+        if first_error is not None:
+            raise first_error
+
+    def _evict_reference(self, type_, level, key, namespace, name, accessed):
+        with self._lock, \
+                common.session_scope(self._get_sessionmaker(type_)) as session:
+            ref = session.query(cas_model.Reference).filter(
+                cas_model.Reference.level == level,
+                cas_model.Reference.key == key,
+                cas_model.Reference.namespace == namespace,
+                cas_model.Reference.name == name,
+                cas_model.Reference.accessed == accessed,
+            ).one_or_none()
+            if ref is None:
+                # removed or accessed in the meantime
+                return 0
+
+            obj = session.query(cas_model.Object).get(ref.digest)
+            obj.refcount -= 1
+            session.delete(ref)
+            if obj.refcount > 0:
+                return 0
+            try:
+                self._get_object_path(type_, obj.digest).unlink()
+            except FileNotFoundError:
+                pass
+            session.delete(obj)
+            return obj.size
+
+    def _eviction_candidates(self, type_):
+        if not self._has_index(type_):
+            return []
+
+        with common.session_scope(self._get_sessionmaker(type_)) as session:
+            rows = session.query(
+                cas_model.Reference.level,
+                cas_model.Reference.key,
+                cas_model.Reference.namespace,
+                cas_model.Reference.name,
+                cas_model.Reference.accessed,
+                cas_model.Object.size,
+                cas_model.Object.refcount,
+            ).join(
+                cas_model.Object,
+                cas_model.Object.digest == cas_model.Reference.digest,
+            ).all()
+
+        return [
+            EvictionCandidate(
+                atime=(accessed - _EPOCH).total_seconds(),
+                # only the last reference frees the content
+                size=size // max(refcount, 1),
+                evict=functools.partial(
+                    self._evict_reference,
+                    type_, level, key, namespace, name, accessed,
+                ),
+            )
+            for level, key, namespace, name, accessed, size, refcount in rows
+        ]
+
+    async def store(self, type_, level, namespace, name, data):
+        """
+        Store `data` as a content-addressed blob.
+
+        :param type_: The storage type to use.
+        :type type_: :class:`~.StorageType`
+        :param level: The storage level to store the data in.
+        :type level: :class:`~.LevelDescriptor`
+        :param namespace: The namespace to store the data in.
+        :type namespace: :class:`str`
+        :param name: The name of the data.
+        :type name: :class:`str`
+        :param data: Data to store.
+        :type data: :class:`bytes`
+
+        If an object with the same name in the same namespace, level key and
+        storage type exists, the reference is silently replaced. If the same
+        data is already stored, no data is written.
+        """
+
+        await self._run_in_executor(
+            self._store_blob,
+            type_, level, namespace, name, data,
+        )
+
+    async def open(self, type_, level, namespace, name, mode="r", *,
+                   encoding=None):
+        """
+        See :meth:`.FileLikeFrontend.open` for general documentation of the
+        :meth:`open` method.
+
+        The following limitations apply:
+
+        * `mode` must be one of ``r``, ``rb``, or ``rt``, otherwise
+          :class:`ValueError` is raised.
+        """
+        if utils.is_write_mode(mode):
+            raise ValueError(
+                "writable open modes are not supported by "
+                "ContentAddressedBlobFrontend"
+            )
+
+        if mode.endswith("b") and encoding:
+            raise ValueError(
+                "binary mode doesn't take an encoding argument"
+            )
+
+        return await self._run_in_executor(
+            self._open_blob,
+            type_, level, namespace, name,
+            mode, {"encoding": encoding} if encoding else {},
+        )
+
+    async def open_mmap(self, type_, level, namespace, name):
+        """
+        Map a blob read-only into memory.
+
+        See :meth:`.LargeBlobFrontend.open_mmap` for details.
+        """
+
+        return await self._run_in_executor(
+            self._map_blob,
+            type_, level, namespace, name,
+        )
+
+    async def stat(self, type_, level, namespace, name):
+        """
+        See :meth:`.FileLikeFrontend.stat` for general documentation of the
+        :meth:`stat` method.
+
+        The timestamps refer to the reference, not to the shared content.
+        """
+
+        epoch = datetime(1970, 1, 1)
+
+        _, size, accessed, created, modified = await self._run_in_executor(
+            self._lookup,
+            type_, level, namespace, name,
+        )
+
+        return self.StatTuple(
+            st_atime=(accessed - epoch).total_seconds(),
+            st_birthtime=(created - epoch).total_seconds(),
+            st_mtime=(modified - epoch).total_seconds(),
+            st_size=size,
+        )
+
+    async def unlink(self, type_, level, namespace, name):
+        """
+        See :meth:`.FileLikeFrontend.unlink` for general documentation of the
+        :meth:`unlink` method.
+
+        Only the reference is removed; the content is removed by
+        :meth:`collect_garbage` once it is not referenced anymore.
+        """
+
+        await self._run_in_executor(
+            self._unlink_blob,
+            type_, level, namespace, name,
+        )
+
+    async def collect_garbage(self, type_):
+        """
+        Delete all content which is not referenced anymore.
+
+        :param type_: The storage type to collect garbage in.
+        :type type_: :class:`~.StorageType`
+        :return: The number of objects deleted and the number of bytes freed.
+        :rtype: :class:`tuple` of two :class:`int`
+        """
+
+        return await self._run_in_executor(self._collect_garbage, type_)
+
+    async def clear(self, level):
+        """
+        See :meth:`.Frontend.clear`.
+
+        Content which is not referenced anymore afterwards is deleted, too.
+        """
+        await self._run_in_executor(self._clear, level)
+
+    async def usage(self, type_):
+        """
+        See :meth:`.Frontend.usage`.
+
+        The size of content shared between references is split evenly
+        between them. The size of unreferenced content is reported for the
+        :attr:`~.StorageLevel.GLOBAL` level and the core namespace.
+        """
+        return await self._run_in_executor(self._usage, type_)
+
+
+class _AppendHandle:
+    def __init__(self, f, index_path, offset, max_ts, header=b""):
+        super().__init__()
+        self.f = f
+        self.buffer = bytearray(header)
+        self.index_path = index_path
+        self.index_f = None
+        self.index_buffer = bytearray()
+        # offset of the end of the file including the buffer, and the
+        # highest timestamp of all records before that offset
+        self.offset = offset + len(header)
+        self.max_ts = max_ts
+        # a handle on an existing file starts with an index entry
+        self.records_since_index = 0 if header else None
+        self.bytes_since_index = 0
+
+    def flush(self, sync=False):
+        nbytes = len(self.buffer) + len(self.index_buffer)
+        if self.buffer:
+            # the buffer is kept if writing fails, so that it is retried
+            self.f.write(self.buffer)
+            self.buffer = bytearray()
+        self.f.flush()
+        if sync:
+            os.fsync(self.f.fileno())
+
+        # the index is written after the data it points to
+        if self.index_buffer:
+            if self.index_f is None:
+                utils.mkdir_exist_ok(self.index_path.parent)
+                self.index_f = self.index_path.open("ab")
+            self.index_f.write(self.index_buffer)
+            self.index_buffer = bytearray()
+        if self.index_f is not None:
+            self.index_f.flush()
+            if sync:
+                os.fsync(self.index_f.fileno())
+        return nbytes
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.f.close()
+            if self.index_f is not None:
+                self.index_f.close()
+
+
+class AppendFrontend(_PerLevelKeyFileMixin, Frontend):
+    """
+    Storage frontend for data on which only append and read operations are
+    made.
+
+    :param max_handles: Number of files to keep open for appending.
+    :param buffer_size: Number of bytes to buffer per file before writing.
+    :param flush_interval: Maximum time in seconds data is kept in the buffer
+        before it is written to the file.
+    :param index_records: Maximum number of records between two entries of
+        the time index.
+    :param index_bytes: Maximum number of bytes between two entries of the
+        time index.
+
+    Data is stored in one file per name and day. Each file starts with
+    :attr:`FILE_MAGIC`. Each call to :meth:`submit` appends a record to the
+    file, which consists of a header (length, CRC32 checksum and timestamp)
+    and the data. :meth:`read_records` iterates over the records.
+
+    Files written by earlier versions contain the unframed data and no
+    magic; they cannot be converted, since the record boundaries are not
+    known. When such a file is appended to, it is renamed to
+    ``<name>-<timestamp>.legacy`` and a new file is started. The reader
+    skips files without the magic.
+
+    Submitted data is buffered in memory. The buffers are written when they
+    exceed `buffer_size`, after `flush_interval` (if an event loop runs) or
+    when :meth:`flush_all` or :meth:`flush_all_async` is called (e.g. by the
+    :class:`~.WriteManager` on writeback). All file operations, including
+    opening the files and locating the end of the time index, are done by a
+    worker thread, which keeps the most recently used files open.
+
+    Next to each file, a sparse time index is kept in a ``.index``
+    directory. Every `index_records` records or `index_bytes` bytes, an
+    entry with a byte offset and the highest timestamp of all records before
+    that offset is appended. :meth:`read_records` uses it to seek close to
+    the start of the requested time range. Since the index stores the
+    highest timestamp seen so far, records do not need to be submitted in
+    chronological order.
+
+    .. automethod:: submit
+
+    .. automethod:: read_records
+
+    .. automethod:: flush_all
+
+    .. automethod:: flush_all_async
+
+    .. automethod:: close
+
+    Space management:
+
+    .. automethod:: clear
+
+    .. automethod:: usage
+
+    .. automethod:: backup
+    """
+
+    #: Bytes at the start of each file written by this frontend.
+    FILE_MAGIC = b"JCAPPND\x01"
+
+    RECORD_HEADER = struct.Struct("<IIq")
+    INDEX_ENTRY = struct.Struct("<qQ")
+
+    _MIN_TS = -2**63
+
+    def __init__(self, backend, *,
+                 max_handles=16,
+                 buffer_size=65536,
+                 flush_interval=1.0,
+                 index_records=64,
+                 index_bytes=65536):
+        super().__init__(backend)
+        self.max_handles = max_handles
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.index_records = index_records
+        self.index_bytes = index_bytes
+        # maps paths to the list of (timestamp, record) which have not been
+        # handed to the worker thread, and to the size of the records
+        self._pending = {}
+        self._pending_size = collections.Counter()
+        self._scheduled_flush = None
+        # only used by the worker thread: the open files and the records
+        # which could not be appended to their file yet
+        self._handles = collections.OrderedDict()
+        self._unwritten = {}
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    @staticmethod
+    def _day_path(ts, name):
+        return (pathlib.Path("append") /
+                str(ts.year) /
+                "{:02d}-{:02d}".format(ts.month, ts.day) /
+                name)
+
+    @staticmethod
+    def _index_path(path):
+        return path.parent / ".index" / path.name
+
+    @staticmethod
+    def _to_ts_us(ts):
+        return (ts - _EPOCH) // timedelta(microseconds=1)
+
+    @classmethod
+    def _encode_record(cls, ts, data):
+        ts_us = cls._to_ts_us(ts)
+        checksum = zlib.crc32(data, zlib.crc32(struct.pack("<q", ts_us)))
+        return cls.RECORD_HEADER.pack(len(data), checksum, ts_us) + data
+
+    def _iter_raw(self, path, offset=0):
+        header_size = self.RECORD_HEADER.size
+        with path.open("rb") as f:
+            if f.read(len(self.FILE_MAGIC)) != self.FILE_MAGIC:
+                self.logger.warning("%r is not an append file, skipping it",
+                                    str(path))
+                return
+            f.seek(max(offset, len(self.FILE_MAGIC)))
+            while True:
+                header = f.read(header_size)
+                if len(header) < header_size:
+                    if header:
+                        self.logger.warning("truncated record header in %r",
+                                            str(path))
+                    return
+                size, checksum, ts_us = self.RECORD_HEADER.unpack(header)
+                data = f.read(size)
+                if len(data) < size:
+                    self.logger.warning("truncated record in %r", str(path))
+                    return
+                if zlib.crc32(data,
+                              zlib.crc32(header[8:])) != checksum:
+                    self.logger.warning(
+                        "checksum mismatch in %r at offset %d, "
+                        "ignoring the rest of the file",
+                        str(path),
+                        f.tell() - size - header_size,
+                    )
+                    return
+                yield ts_us, data
+
+    def _read_file(self, path, offset=0):
+        for ts_us, data in self._iter_raw(path, offset):
+            yield _EPOCH + timedelta(microseconds=ts_us), data
+
+    def _read_index(self, path):
+        """
+        Return the index entries for a file, as two lists of highest
+        timestamps before and byte offsets.
+        """
+        try:
+            raw = self._index_path(path).read_bytes()
+            size = path.stat().st_size
+        except FileNotFoundError:
+            return [], []
+
+        max_tss, offsets = [], []
+        entry_size = self.INDEX_ENTRY.size
+        for i in range(len(raw) // entry_size):
+            max_ts, offset = self.INDEX_ENTRY.unpack_from(raw, i * entry_size)
+            if offset > size:
+                # the data did not make it to disk
+                break
+            max_tss.append(max_ts)
+            offsets.append(offset)
+        return max_tss, offsets
+
+    def _find_offset(self, path, since):
+        """
+        Return the offset in `path` before which all records are older than
+        `since`.
+        """
+        max_tss, offsets = self._read_index(path)
+        i = bisect.bisect_left(max_tss, self._to_ts_us(since)) - 1
+        if i < 0:
+            return len(self.FILE_MAGIC)
+        return offsets[i]
+
+    def _scan_max_ts(self, path):
+        max_tss, offsets = self._read_index(path)
+        if max_tss:
+            max_ts, offset = max_tss[-1], offsets[-1]
+        else:
+            max_ts, offset = self._MIN_TS, 0
+        for ts_us, _ in self._iter_raw(path, offset):
+            max_ts = max(max_ts, ts_us)
+        return max_ts
+
+    def _rotate_legacy(self, path):
+        legacy_path = path.parent / "{}-{}.legacy".format(
+            path.name,
+            datetime.utcnow().isoformat(),
+        )
+        self.logger.warning(
+            "%r was written by an earlier version, moving it to %r",
+            str(path),
+            str(legacy_path),
+        )
+        os.replace(str(path), str(legacy_path))
+        try:
+            self._index_path(path).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _is_legacy(self, path):
+        try:
+            with path.open("rb") as f:
+                magic = f.read(len(self.FILE_MAGIC))
+        except FileNotFoundError:
+            return False
+        return bool(magic) and magic != self.FILE_MAGIC
+
+    def _open_handle(self, path):
+        utils.mkdir_exist_ok(path.parent)
+        if self._is_legacy(path):
+            self._rotate_legacy(path)
+
+        f = path.open("ab")
+        try:
+            offset = f.tell()
+            if offset:
+                return _AppendHandle(f, self._index_path(path), offset,
+                                     self._scan_max_ts(path))
+            return _AppendHandle(f, self._index_path(path), 0, self._MIN_TS,
+                                 header=self.FILE_MAGIC)
+        except:  # NOQA
+            f.close()
+            raise
+
+    def _get_handle(self, path):
+        try:
+            self._handles.move_to_end(path)
+            return self._handles[path]
+        except KeyError:
+            pass
+
+        while len(self._handles) >= self.max_handles:
+            _, handle = self._handles.popitem(last=False)
+            handle.close()
+
+        handle = self._open_handle(path)
+        self._handles[path] = handle
+        return handle
+
+    def _append(self, handle, ts, record):
+        if (handle.records_since_index is None or
+                handle.records_since_index >= self.index_records or
+                handle.bytes_since_index >= self.index_bytes):
+            handle.index_buffer += self.INDEX_ENTRY.pack(
+                handle.max_ts,
+                handle.offset,
+            )
+            handle.records_since_index = 0
+            handle.bytes_since_index = 0
+
+        handle.buffer += record
+        handle.offset += len(record)
+        handle.max_ts = max(handle.max_ts, self._to_ts_us(ts))
+        handle.records_since_index += 1
+        handle.bytes_since_index += len(record)
+
+    def _write(self, batches, sync):
+        """
+        Append records to their files and write the buffers.
+
+        This runs on the worker thread. Records which cannot be written are
+        kept and retried on the next call; the first error is re-raised
+        after all files have been processed.
+        """
+        for path, records in batches.items():
+            self._unwritten.setdefault(path, []).extend(records)
+
+        error = None
+        for path in list(self._unwritten):
+            try:
+                handle = self._get_handle(path)
+            except Exception as exc:
+                error = error or exc
+                continue
+            for ts, record in self._unwritten.pop(path):
+                self._append(handle, ts, record)
+
+        nbytes = 0
+        for handle in self._handles.values():
+            if not (sync or handle.buffer or handle.index_buffer):
+                continue
+            try:
+                nbytes += handle.flush(sync)
+            except Exception as exc:
+                error = error or exc
+
+        if error is not None:
+            raise error
+        return nbytes
+
+    def _take_pending(self):
+        if self._scheduled_flush is not None:
+            self._scheduled_flush.cancel()
+            self._scheduled_flush = None
+        batches, self._pending = self._pending, {}
+        self._pending_size.clear()
+        return batches
+
+    def _write_done(self, fut):
+        if fut.cancelled() or fut.exception() is None:
+            return
+        self.logger.warning(
+            "failed to write records, will retry with the next flush",
+            exc_info=fut.exception(),
+        )
+
+    def _submit_write(self, batches):
+        self._executor.submit(self._write, batches, False).add_done_callback(
+            self._write_done,
+        )
+
+    def _schedule_flush(self):
+        if self._scheduled_flush is not None or self.flush_interval is None:
+            return
+        try:
+            loop = asyncio.get_event_loop()
+        except RuntimeError:
+            return
+        if not loop.is_running():
+            # nobody would run the timer; flush_all has to be called
+            return
+        self._scheduled_flush = loop.call_later(
+            self.flush_interval,
+            self._scheduled_flush_all,
+        )
+
+    def _scheduled_flush_all(self):
+        self._scheduled_flush = None
+        self._submit_write(self._take_pending())
+
+    def submit(self, type_, level, namespace, name, data, ts=None):
+        """
+        Append a record.
+
+        :param type_: The storage type to use.
+        :type type_: :class:`~.StorageType`
+        :param level: The storage level to store the data in.
+        :type level: :class:`~.LevelDescriptor`
+        :param namespace: The namespace to store the data in.
+        :type namespace: :class:`str`
+        :param name: The name of the log.
+        :type name: :class:`str`
+        :param data: The record data.
+        :type data: :class:`bytes`
+        :param ts: The timestamp of the record (defaults to now, in UTC).
+        :type ts: :class:`datetime.datetime`
+
+        The record is buffered in memory and written by the worker thread;
+        see the class documentation for when that happens. This method does
+        not block.
+        """
+        now = ts or datetime.utcnow()
+        path = self._get_path(
+            type_,
+            level,
+            namespace,
+            self._day_path(now, name),
+        )
+
+        record = self._encode_record(now, data)
+        self._pending.setdefault(path, []).append((now, record))
+        self._pending_size[path] += len(record)
+        if self._pending_size[path] >= self.buffer_size:
+            del self._pending_size[path]
+            self._submit_write({path: self._pending.pop(path)})
+        else:
+            self._schedule_flush()
+
+    def read_records(self, type_, level, namespace, name, *,
+                     since=None, until=None):
+        """
+        Iterate over records in chronological order of the day files.
+
+        :param type_: The storage type to use.
+        :type type_: :class:`~.StorageType`
+        :param level: The storage level to read the data from.
+        :type level: :class:`~.LevelDescriptor`
+        :param namespace: The namespace to read the data from.
+        :type namespace: :class:`str`
+        :param name: The name of the log.
+        :type name: :class:`str`
+        :param since: If given, skip records older than this timestamp.
+        :type since: :class:`datetime.datetime`
+        :param until: If given, skip records newer than this timestamp.
+        :type until: :class:`datetime.datetime`
+        :return: Iterator over the timestamp and data of each record.
+        :rtype: iterator of :class:`tuple` of :class:`datetime.datetime` and
+            :class:`bytes`
+
+        Buffered data is written before reading. Reading a file stops at
+        the first truncated or corrupt record. If `since` is given, the time
+        index is used to skip the parts of the files which only contain
+        older records.
+
+        .. note::
+
+            This is a blocking generator; it reads the files lazily while it
+            is iterated.
+        """
+        self.flush_all()
+
+        base = self._get_path(type_, level, namespace, pathlib.Path("append"))
+        for path in self._iter_day_files(base, name, since, until):
+            if since is not None:
+                offset = self._find_offset(path, since)
+            else:
+                offset = 0
+
+            for ts, data in self._read_file(path, offset):
+                if since is not None and ts < since:
+                    continue
+                if until is not None and ts > until:
+                    continue
+                yield ts, data
+
+    @staticmethod
+    def _iter_day_files(base, name, since, until):
+        try:
+            years = sorted(
+                (int(p.name), p)
+                for p in base.iterdir()
+                if p.name.isdigit()
+            )
+        except FileNotFoundError:
+            return
+
+        for year, year_path in years:
+            for day_path in sorted(year_path.iterdir()):
+                try:
+                    month, day = map(int, day_path.name.split("-"))
+                except ValueError:
+                    continue
+                date = datetime(year, month, day).date()
+                if since is not None and date < since.date():
+                    continue
+                if until is not None and date > until.date():
+                    return
+                path = day_path / name
+                if path.exists():
+                    yield path
+
+    def flush_all(self, sync=False):
+        """
+        Write all buffered records to their files and wait for the writes to
+        finish.
+
+        :param sync: If true, the files are also synced to disk.
+        :type sync: :class:`bool`
+        :rtype: :class:`int`
+        :return: The number of bytes written.
+
+        If writing fails, the records are kept and written by the next flush,
+        and the exception is re-raised.
+        """
+        return self._executor.submit(
+            self._write,
+            self._take_pending(),
+            sync,
+        ).result()
+
+    async def flush_all_async(self, sync=False):
+        """
+        Write all buffered records to their files without blocking the event
+        loop.
+
+        :param sync: If true, the files are also synced to disk.
+        :type sync: :class:`bool`
+        :rtype: :class:`int`
+        :return: The number of bytes written.
+
+        See :meth:`flush_all`.
+        """
+        return await asyncio.wrap_future(self._executor.submit(
+            self._write,
+            self._take_pending(),
+            sync,
+        ))
+
+    def _close_handles(self, roots=None):
+        for path in list(self._handles):
+            if roots is None or any(root in path.parents for root in roots):
+                self._handles.pop(path).close()
+
+    def close(self):
+        """
+        Write all buffered records and close all open files.
+
+        The frontend can still be used afterwards; files are opened again
+        as needed.
+        """
+        self.flush_all()
+        self._executor.submit(self._close_handles).result()
+
+    def _clear(self, level, roots):
+        self._close_handles(roots)
+        for path in list(self._unwritten):
+            if any(root in path.parents for root in roots):
+                del self._unwritten[path]
+        self._clear_subdirs(level, "append")
+
+    async def clear(self, level):
+        """
+        See :meth:`.Frontend.clear`.
+
+        Buffered records of the level key are dropped and its open files are
+        closed first; records which are submitted concurrently may survive
+        the deletion.
+        """
+        roots = [
+            root
+            for type_ in StorageType
+            for root, _ in self._level_roots(type_, level)
+        ]
+        for path in list(self._pending):
+            if any(root in path.parents for root in roots):
+                del self._pending[path]
+                del self._pending_size[path]
+
+        await asyncio.wrap_future(self._executor.submit(
+            self._clear,
+            level,
+            roots,
+        ))
+
+    async def usage(self, type_):
+        """
+        See :meth:`.Frontend.usage`.
+
+        The size of the files, including the time index, is reported.
+        """
+        return await self._run_in_executor(self._usage, type_, "append")
+
+    def _backup(self, type_, destination, sizes):
+        base = self._backend.type_base_paths(type_, True)[0]
+        roots = list((base / StorageLevel.GLOBAL.value).glob("*/append"))
+        roots.extend(path for _, _, path in self._iter_subdirs(type_,
+                                                                "append"))
+        for root in roots:
+            for dirpath, _, filenames in os.walk(str(root)):
+                for filename in filenames:
+                    path = pathlib.Path(dirpath) / filename
+                    _backup_file(
+                        path,
+                        destination / path.relative_to(base),
+                        sizes.get(path),
+                        append_only=True,
+                    )
+
+    def _handle_offsets(self):
+        return {
+            path: handle.offset
+            for path, handle in self._handles.items()
+        }
+
+    async def backup(self, type_, destination):
+        """
+        See :meth:`.Frontend.backup`.
+
+        Buffered records are written first. Files are copied up to the size
+        they had at that point, so that only complete records end up in the
+        backup; records submitted while the backup runs are copied by the
+        next backup. Since the files are only appended to, only the data
+        added since the previous backup is copied.
+        """
+        await self.flush_all_async()
+        sizes = await asyncio.wrap_future(self._executor.submit(
+            self._handle_offsets,
+        ))
+        await self._run_in_executor(self._backup, type_, destination, sizes)
+
+
+class _XMLItemIndex:
+    """
+    Locate the items of an XML storage document without parsing them.
+
+    :param raw: The serialised storage.
+    :type raw: :class:`bytes`
+    :param storage_cls: The storage XSO class.
+    :raises xml.parsers.expat.ExpatError: if the document is not well-formed
+
+    A single pass with the expat parser records the byte range of the root
+    element start and end tags and of each item element together with the
+    item key, which is taken from the item attributes. Items whose key
+    attributes are missing or invalid are skipped; their byte offsets are
+    recorded in :attr:`skipped`.
+    """
+
+    def __init__(self, raw, storage_cls):
+        super().__init__()
+        item_type = storage_cls.items.type_
+        item_tag = " ".join(item_type.get_xso_types()[0].TAG)
+
+        self.raw = raw
+        self.ranges = {}
+        self.head = None
+        self.tail_start = len(raw)
+        self.skipped = []
+
+        parser = xml.parsers.expat.ParserCreate(namespace_separator=" ")
+        depth = 0
+        item = None
+        # (kind, key, start) of the construct whose end is only known at the
+        # next event
+        pending = None
+
+        def resolve():
+            nonlocal pending
+            if pending is None:
+                return
+            kind, key, start = pending
+            pending = None
+            end = parser.CurrentByteIndex
+            if kind == "head":
+                self.head = (start, end)
+            elif key is not None:
+                self.ranges[key] = (start, end)
+
+        def start_element(name, attrs):
+            nonlocal depth, pending, item
+            resolve()
+            if depth == 0:
+                pending = ("head", None, parser.CurrentByteIndex)
+            elif depth == 1:
+                key = None
+                if name == item_tag:
+                    try:
+                        key = item_type.key_from_attributes(attrs)
+                    except (KeyError, ValueError):
+                        self.skipped.append(parser.CurrentByteIndex)
+                item = (key, parser.CurrentByteIndex)
+            depth += 1
+
+        def end_element(name):
+            nonlocal depth, pending
+            resolve()
+            depth -= 1
+            if depth == 1:
+                key, start = item
+                pending = ("item", key, start)
+            elif depth == 0:
+                self.tail_start = parser.CurrentByteIndex
+
+        def character_data(data):
+            resolve()
+
+        parser.StartElementHandler = start_element
+        parser.EndElementHandler = end_element
+        parser.CharacterDataHandler = character_data
+        parser.Parse(raw, True)
+
+        if self.head is None:
+            raise xml.parsers.expat.ExpatError("no root element")
+
+    def extract(self, key):
+        """
+        Return a document containing only the item with the given key.
+        """
+        head_start, head_end = self.head
+        start, end = self.ranges[key]
+        return b"".join([
+            self.raw[head_start:head_end],
+            self.raw[start:end],
+            self.raw[self.tail_start:],
+        ])
+
+
+class _LazyXMLItems(collections.abc.MutableMapping):
+    """
+    Mapping of the items of an XML storage which parses items on first
+    access.
+    """
+
+    def __init__(self, index, storage_cls, logger):
+        super().__init__()
+        self._index = index
+        self._unparsed = set(index.ranges)
+        self._parsed = {}
+        self._storage_cls = storage_cls
+        self._logger = logger
+
+    def _parse(self, key):
+        self._unparsed.discard(key)
+        try:
+            storage = aioxmpp.xml.read_single_xso(
+                io.BytesIO(self._index.extract(key)),
+                self._storage_cls,
+            )
+            data = storage.items[key]
+        except Exception:
+            self._logger.warning(
+                "failed to parse item %r from XML storage, dropping it",
+                key,
+                exc_info=True,
+            )
+            raise KeyError(key) from None
+        self._parsed[key] = data
+        return data
+
+    def __getitem__(self, key):
+        try:
+            return self._parsed[key]
+        except KeyError:
+            pass
+        if key not in self._unparsed:
+            raise KeyError(key)
+        return self._parse(key)
+
+    def __setitem__(self, key, value):
+        self._unparsed.discard(key)
+        self._parsed[key] = value
+
+    def __delitem__(self, key):
+        if key in self._unparsed:
+            self._unparsed.discard(key)
+            return
+        del self._parsed[key]
+
+    def __contains__(self, key):
+        return key in self._parsed or key in self._unparsed
+
+    def __iter__(self):
+        yield from list(self._parsed)
+        yield from list(self._unparsed)
+
+    def __len__(self):
+        return len(self._parsed) + len(self._unparsed)
+
+    @property
+    def nparsed(self):
+        return len(self._parsed)
+
+    @property
+    def index(self):
+        return self._index
+
+    def parsed_keys(self):
+        return list(self._parsed)
+
+    def unparsed_keys(self):
+        return list(self._unparsed)
+
+
+class _LazyXMLStorage:
+    def __init__(self, items):
+        super().__init__()
+        self.items = items
+
+
+class _XMLStorageSnapshot:
+    """
+    Copy of an XML storage which was opened lazily, for writing it back.
+
+    :param storage: Storage XSO with copies of the items which have been
+        parsed.
+    :param index: The index of the document the storage was loaded from.
+    :type index: :class:`_XMLItemIndex`
+    :param raw_keys: The keys of the items which have not been parsed.
+
+    The items which have not been parsed are written as they appear in the
+    loaded document, so that taking and writing the snapshot does not need
+    to parse and serialise them.
+    """
+
+    def __init__(self, storage, index, raw_keys):
+        super().__init__()
+        self.storage = storage
+        self.index = index
+        self.raw_keys = raw_keys
+
+    @property
+    def items(self):
+        return self.storage.items
+
+    def write(self, f):
+        if not self.raw_keys:
+            aioxmpp.xml.write_single_xso(self.storage, f)
+            return
+
+        raw = memoryview(self.index.raw)
+        head_start, head_end = self.index.head
+        f.write(raw[head_start:head_end])
+        # the generator does not know about the namespace declarations of
+        # the root element, so that each item declares its namespace
+        gen = aioxmpp.xml.XMPPXMLGenerator(
+            f,
+            short_empty_elements=True,
+            sorted_attributes=True,
+        )
+        item_type = type(self.storage).items.type_
+        for item in self.storage.items.items():
+            item_type.pack(item).xso_serialise_to_sax(gen)
+        for key in self.raw_keys:
+            start, end = self.index.ranges[key]
+            f.write(raw[start:end])
+        f.write(raw[self.index.tail_start:])
 
-    The :class:`LargeBlobFrontend` supports the :class:`FileLikeFrontend`
-    interface. :meth:`stat` supports all attributes :class:`os.stat_result`
-    supports.
 
-    .. automethod:: open
+def _write_xml_storage(data, f):
+    if isinstance(data, _XMLStorageSnapshot):
+        data.write(f)
+    else:
+        aioxmpp.xml.write_single_xso(data, f)
 
-    .. automethod:: stat
 
-    .. automethod:: unlink
+class XMLFrontend(Frontend):
     """
+    Manage snippets of XSO-defined XML data.
 
-    async def open(self, type_, level, namespace, name, mode="r", **kwargs):
-        """
-        See :meth:`~.FileLikeFrontend.open`.
-        """
+    :param shards: Number of files to distribute the data of a level type
+        over, or :data:`None` to use a single file.
+    :type shards: :class:`int` or :data:`None`
 
-        path = self._get_path(
-            type_,
-            level,
-            namespace,
-            pathlib.Path("largeblobs") / name,
-        )
+    The snippet XSO definitions need to be registered before they can be read
+    or written. By default, data is stored in a single file for each level
+    type and type combination (and for each account, for
+    :attr:`~.StorageLevel.PEER` data).
 
-        if utils.is_write_mode(mode):
-            utils.mkdir_exist_ok(path.parent)
+    If `shards` is set, the items are distributed over `shards` files by a
+    hash of the account (for :attr:`~.StorageLevel.ACCOUNT` data) or peer
+    (for :attr:`~.StorageLevel.PEER` data) address. Changing or reading the
+    data of one item then only needs to write or parse a fraction of the
+    data. Data in the single-file layout is migrated transparently when it is
+    first opened (on a worker thread, if it is opened by one of the
+    asynchronous accessors); the old file is renamed with a ``.migrated``
+    suffix after the shards have been written.
 
-        return path.open(mode, **kwargs)
+    Storages modified with :meth:`put` are marked as dirty; only dirty
+    storages are written back by :meth:`flush_all` and
+    :meth:`flush_all_async`. Writing happens on a snapshot of the data in a
+    single dedicated worker thread, so that writebacks of the same storage
+    are applied in order.
 
-    async def stat(self, type_, level, namespace, name):
-        """
-        See :meth:`~.FileLikeFrontend.stat`.
-        """
+    :param journal: Append changed items to a journal instead of rewriting
+        the storage files on writeback.
+    :type journal: :class:`bool`
+    :param journal_threshold: Size in bytes above which a journal is folded
+        into its storage file.
+    :type journal_threshold: :class:`int`
 
-        path = self._get_path(
-            type_,
-            level,
-            namespace,
-            pathlib.Path("largeblobs") / name,
-        )
-        return path.stat()
+    In journaled mode, a writeback appends one record per dirty storage to a
+    journal file next to the storage file; the record contains only the
+    items which were changed with :meth:`put` since the last writeback. The
+    journals written by a writeback are synced together after all records
+    have been appended. Once a journal grows beyond `journal_threshold`, the
+    worker thread folds it into the storage file (a checkpoint) and removes
+    it.
 
-    async def unlink(self, type_, level, namespace, name):
-        """
-        See :meth:`~.FileLikeFrontend.unlink`.
-        """
+    Journals are replayed whenever a storage file is loaded, independent of
+    `journal`. A torn record at the end of a journal (e.g. after a crash) is
+    discarded.
 
-        path = self._get_path(
-            type_,
-            level,
-            namespace,
-            pathlib.Path("largeblobs") / name,
-        )
-        return path.unlink()
+    :meth:`get`, :meth:`get_all` and :meth:`put` read a storage from disk
+    when it is first used, blocking the caller. Coroutines should use the
+    asynchronous variants, which open the storage on a worker thread, or
+    :meth:`preload` the storages they are going to use.
 
+    .. automethod:: get_async
 
-class AppendFrontend(_PerLevelKeyFileMixin, Frontend):
-    """
-    Storage frontend for data on which only append and read operations are
-    made.
-    """
+    .. automethod:: get_all_async
 
-    def submit(self, type_, level, namespace, name, data, ts=None):
-        now = ts or datetime.utcnow()
-        path = self._get_path(
-            type_,
-            level,
-            namespace,
-            pathlib.Path("append") /
-            str(now.year) /
-            "{:02d}-{:02d}".format(now.month, now.day) /
-            name,
-        )
-        utils.mkdir_exist_ok(path.parent)
-        with path.open("ab") as f:
-            f.write(data)
+    .. automethod:: put_async
 
+    .. automethod:: preload
 
-class XMLFrontend(Frontend):
-    """
-    Manage snippets of XSO-defined XML data.
+    .. automethod:: clear
 
-    The snippet XSO definitions need to be registered before they can be read
-    or written. Data is stored in a single file for each level type and type
-    combination.
+    .. automethod:: usage
+
+    .. automethod:: backup
+
+    .. automethod:: close
     """
 
+    #: Header of a journal record: length and CRC32 of the serialised delta.
+    JOURNAL_RECORD_HEADER = struct.Struct("<II")
+
     LEVEL_INFO = {
         StorageLevel.ACCOUNT: (
             account_model.XMLStorage,
@@ -725,33 +3962,106 @@ class XMLFrontend(Frontend):
         ),
     }
 
-    def __init__(self, backend):
+    def __init__(self, backend, *, shards=None, journal=False,
+                 journal_threshold=1024*1024):
         super().__init__(backend)
+        self.shards = shards
+        self.journal = journal
+        self.journal_threshold = journal_threshold
         self.__open_storages = {}
+        # maps (type_, cache key) to the set of changed item keys, or None if
+        # the storage needs to be rewritten completely
+        self.__dirty = {}
+        self.__migrations_checked = set()
+        self.__pending_migrations = set()
+        # maps (type_, legacy path) to the future of a migration being read
+        # by _migrate_async
+        self.__migrating = {}
+        # maps (type_, cache key) to the future of a storage being loaded by
+        # _open_async
+        self.__loading = {}
+        self._path_cache = _PathCache()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def _get_path(self, type_, level_type, account=None, shard=None):
+        return self._path_cache.get(
+            (type_, level_type, account, shard),
+            self._resolve_path,
+            type_, level_type, account, shard,
+        )
+
+    def _resolve_path(self, type_, level_type, account, shard):
+        if shard is None:
+            filename = "{}.xml".format(level_type.value)
+        else:
+            filename = pathlib.Path(level_type.value) / "{:02x}.xml".format(
+                shard
+            )
 
-    def _get_path(self, type_, level_type, account=None):
         if level_type == StorageLevel.PEER:
             return (self._backend.type_base_paths(type_, True)[0] /
                     StorageLevel.ACCOUNT.value /
-                    encode_jid(account) /
+                    _encode_jid_cached(account) /
                     escape_path_part(utils.jabbercat_ns.core) /
                     "xml-storage" /
-                    "{}.xml".format(level_type.value))
+                    filename)
         else:
             return (self._backend.type_base_paths(type_, True)[0] /
                     StorageLevel.GLOBAL.value /
                     escape_path_part(utils.jabbercat_ns.core) /
                     "xml-storage" /
-                    "{}.xml".format(level_type.value))
+                    filename)
+
+    def _shard_of(self, jid):
+        digest = hashlib.sha256(str(jid).encode("utf-8")).digest()
+        return int.from_bytes(digest[:4], "little") % self.shards
+
+    def _shard_key(self, level_type, item_key):
+        """
+        Return the cache key of the shard holding the item with the key
+        `item_key` (as used in the storage XSO).
+        """
+        if level_type == StorageLevel.PEER:
+            account, peer = item_key
+            return level_type, account, self._shard_of(peer)
+        return level_type, None, self._shard_of(item_key)
+
+    def _cache_key(self, level):
+        if self.shards is None:
+            _, cache_key_func, _ = self.LEVEL_INFO[level.level]
+            return cache_key_func(level)
+
+        _, _, key_func = self.LEVEL_INFO[level.level]
+        return self._shard_key(level.level, key_func(level))
 
     def _load_from_file(self, path, storage_cls):
+        """
+        Open a storage from a file.
+
+        Only the positions and keys of the items are determined; the items
+        are parsed when they are first accessed. The journal of the storage,
+        if any, is replayed on top of the file contents.
+        """
+        storage = self._read_file(path, storage_cls)
+        self._replay_journal(path, storage_cls, storage)
+        return storage
+
+    def _read_file(self, path, storage_cls):
         try:
             with path.open("rb") as f:
-                return aioxmpp.xml.read_single_xso(
-                    f,
-                    storage_cls,
+                index = _XMLItemIndex(f.read(), storage_cls)
+            for offset in index.skipped:
+                self.logger.warning(
+                    "XML storage at %r has an item with an invalid key at "
+                    "offset %d, dropping it",
+                    str(path),
+                    offset,
                 )
-        except xml.sax.SAXException:  # parser error
+            return _LazyXMLStorage(
+                _LazyXMLItems(index, storage_cls, self.logger)
+            )
+        except (xml.sax.SAXException,
+                xml.parsers.expat.ExpatError):  # parser error
             bak_path = path.parent / ("{}-{}.bak".format(
                 path.parts[-1],
                 datetime.utcnow().isoformat(),
@@ -777,6 +4087,59 @@ class XMLFrontend(Frontend):
             )
         return storage_cls()
 
+    @staticmethod
+    def _journal_path(path):
+        return path.with_suffix(".journal")
+
+    def _replay_journal(self, path, storage_cls, storage):
+        journal_path = self._journal_path(path)
+        try:
+            with journal_path.open("rb") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return
+
+        header = self.JOURNAL_RECORD_HEADER
+        offset = 0
+        while offset + header.size <= len(raw):
+            length, crc = header.unpack_from(raw, offset)
+            start = offset + header.size
+            record = raw[start:start+length]
+            if len(record) < length or zlib.crc32(record) != crc:
+                break
+            try:
+                delta = aioxmpp.xml.read_single_xso(
+                    io.BytesIO(record),
+                    storage_cls,
+                )
+            except Exception:
+                self.logger.warning(
+                    "failed to parse journal record at offset %d of %r",
+                    offset,
+                    str(journal_path),
+                    exc_info=True,
+                )
+                break
+            for item_key in list(delta.items):
+                storage.items[item_key] = delta.items[item_key]
+            offset = start + length
+
+        if offset < len(raw):
+            self.logger.warning(
+                "discarding %d bytes of truncated or corrupt records at the "
+                "end of journal %r",
+                len(raw) - offset,
+                str(journal_path),
+            )
+            # later records would be appended after the garbage otherwise
+            os.truncate(str(journal_path), offset)
+
+    def _discard_journal(self, path):
+        try:
+            self._journal_path(path).unlink()
+        except FileNotFoundError:
+            pass
+
     def _load(self, type_, level):
         path = self._get_path(
             type_,
@@ -787,7 +4150,14 @@ class XMLFrontend(Frontend):
         storage_cls, _, _ = self.LEVEL_INFO[level.level]
         return self._load_from_file(path, storage_cls)
 
-    def _save(self, data, type_, level_type, *args):
+    def _save(self, data, type_, level_type, *args, group=None):
+        """
+        Write a storage file.
+
+        If `group` is given, the file is only staged in the
+        :class:`~.utils.GroupWriter` and the caller has to discard the
+        journal of the returned path once the group is committed.
+        """
         path = self._get_path(
             type_,
             level_type,
@@ -795,19 +4165,262 @@ class XMLFrontend(Frontend):
         )
         utils.mkdir_exist_ok(path.parent)
 
-        with utils.safe_writer(path) as f:
-            aioxmpp.xml.write_single_xso(data, f)
+        if group is not None:
+            with group.open(path) as f:
+                _write_xml_storage(data, f)
+            return path
+
+        with utils.GroupWriter() as group:
+            with group.open(path) as f:
+                _write_xml_storage(data, f)
+
+        # the journal is contained in data
+        self._discard_journal(path)
+        return path
+
+    def _append_journal(self, data, type_, level_type, *args):
+        """
+        Append a delta record to the journal of a storage.
+
+        :return: The open journal file, the path of the journal, whether
+            the journal was created and the size of the record in bytes.
+
+        The record is written, but not synced.
+        """
+        buf = io.BytesIO()
+        aioxmpp.xml.write_single_xso(data, buf)
+        record = buf.getvalue()
+
+        path = self._journal_path(self._get_path(type_, level_type, *args))
+        utils.mkdir_exist_ok(path.parent)
+        f = path.open("ab")
+        try:
+            created = f.tell() == 0
+            f.write(self.JOURNAL_RECORD_HEADER.pack(
+                len(record),
+                zlib.crc32(record),
+            ))
+            f.write(record)
+            f.flush()
+        except:  # NOQA
+            f.close()
+            raise
+        return f, path, created, self.JOURNAL_RECORD_HEADER.size + len(record)
+
+    def _checkpoint(self, type_, key):
+        """
+        Fold the journal of a storage into the storage file.
+
+        This works on the data on disk only and must be called on the worker
+        thread.
+        """
+        level_type, *args = key
+        storage_cls, _, _ = self.LEVEL_INFO[level_type]
+        path = self._get_path(type_, level_type, *args)
+        self.logger.debug("checkpointing XML storage journal of %r",
+                          str(path))
+        self._save(
+            self._copy_storage(
+                storage_cls,
+                self._load_from_file(path, storage_cls),
+            ),
+            type_, level_type, *args,
+        )
+
+    def _open_shard(self, type_, cache_key):
+        try:
+            return self.__open_storages[type_, cache_key]
+        except KeyError:
+            pass
+
+        level_type, *args = cache_key
+        storage_cls, _, _ = self.LEVEL_INFO[level_type]
+        data = self._load_from_file(
+            self._get_path(type_, level_type, *args),
+            storage_cls,
+        )
+        self.__open_storages[type_, cache_key] = data
+        return data
+
+    def _read_migration(self, type_, level_type, account, open_keys):
+        """
+        Read the data to migrate from the single-file layout.
+
+        :param open_keys: The cache keys of the shards which are open
+            already.
+        :return: The path of the legacy file, the items to migrate as
+            ``(shard_key, item_key, item_data)`` tuples and the shards which
+            are not open yet, by cache key; or :data:`None` if there is no
+            legacy file.
+
+        This only reads files and may be called on a worker thread.
+        """
+        path = self._get_path(type_, level_type, account)
+        if not path.exists():
+            return None
+
+        self.logger.info("migrating XML storage %r to sharded layout",
+                         str(path))
+
+        storage_cls, _, _ = self.LEVEL_INFO[level_type]
+        legacy = self._load_from_file(path, storage_cls)
+        items = []
+        shards = {}
+        for item_key in list(legacy.items):
+            try:
+                item_data = legacy.items[item_key]
+            except KeyError:
+                continue
+            shard_key = self._shard_key(level_type, item_key)
+            if shard_key not in open_keys and shard_key not in shards:
+                shards[shard_key] = self._load_from_file(
+                    self._get_path(type_, *shard_key),
+                    storage_cls,
+                )
+            items.append((shard_key, item_key, item_data))
+        return path, items, shards
+
+    def _apply_migration(self, type_, migration):
+        """
+        Distribute the items read by :meth:`_read_migration` over the
+        shards.
+
+        Items which already exist in a shard are not overwritten; they can
+        only stem from an earlier, interrupted migration.
+        """
+        path, items, shards = migration
+        for shard_key, item_key, item_data in items:
+            try:
+                shard = self.__open_storages[type_, shard_key]
+            except KeyError:
+                if shard_key in shards:
+                    shard = shards[shard_key]
+                    self.__open_storages[type_, shard_key] = shard
+                else:
+                    # closed since the migration was read
+                    shard = self._open_shard(type_, shard_key)
+            if item_key not in shard.items:
+                shard.items[item_key] = item_data
+            self.__dirty[type_, shard_key] = None
+
+        self.__pending_migrations.add(path)
+
+    def _open_keys(self, type_):
+        return {key for other, key in self.__open_storages if other == type_}
+
+    def _migrate(self, type_, level_type, account):
+        """
+        Distribute the data from the single-file layout over the shards.
+        """
+        path = self._get_path(type_, level_type, account)
+        if (type_, path) in self.__migrations_checked:
+            return
+        self.__migrations_checked.add((type_, path))
+
+        migration = self._read_migration(type_, level_type, account,
+                                         self._open_keys(type_))
+        if migration is not None:
+            self._apply_migration(type_, migration)
+
+    def _migrated(self, type_, key, migrating):
+        if self.__migrating.get(key) is not migrating:
+            # invalidated by clear()
+            return
+        del self.__migrating[key]
+        if (migrating.cancelled() or migrating.exception() is not None or
+                key in self.__migrations_checked):
+            # a failed migration is retried by _open
+            return
+        self.__migrations_checked.add(key)
+        migration = migrating.result()
+        if migration is not None:
+            self._apply_migration(type_, migration)
+
+    async def _migrate_async(self, type_, level_type, account):
+        """
+        Like :meth:`_migrate`, but the data is read on a worker thread.
+        """
+        path = self._get_path(type_, level_type, account)
+        key = type_, path
+        if key in self.__migrations_checked:
+            return
+
+        try:
+            migrating = self.__migrating[key]
+        except KeyError:
+            migrating = asyncio.ensure_future(self._run_in_executor(
+                self._read_migration,
+                type_, level_type, account,
+                self._open_keys(type_),
+            ))
+            self.__migrating[key] = migrating
+            migrating.add_done_callback(
+                functools.partial(self._migrated, type_, key)
+            )
+
+        await asyncio.shield(migrating)
 
     def _open(self, type_, level):
-        _, cache_key_func, _ = self.LEVEL_INFO[level.level]
-        cache_key = cache_key_func(level)
+        cache_key = self._cache_key(level)
         try:
             return self.__open_storages[type_, cache_key]
         except KeyError:
+            pass
+
+        if self.shards is None:
             data = self._load(type_, level)
             self.__open_storages[type_, cache_key] = data
             return data
 
+        level_type, account, _ = cache_key
+        self._migrate(type_, level_type, account)
+        return self._open_shard(type_, cache_key)
+
+    async def _load_async(self, type_, cache_key):
+        level_type, *_ = cache_key
+        storage_cls, _, _ = self.LEVEL_INFO[level_type]
+        return await self._run_in_executor(
+            self._load_from_file,
+            self._get_path(type_, *cache_key),
+            storage_cls,
+        )
+
+    def _loaded(self, key, loading):
+        if self.__loading.get(key) is not loading:
+            # invalidated by clear()
+            return
+        del self.__loading[key]
+        if loading.cancelled() or loading.exception() is not None:
+            return
+        # keep a storage which has been opened synchronously meanwhile
+        self.__open_storages.setdefault(key, loading.result())
+
+    async def _open_async(self, type_, level):
+        cache_key = self._cache_key(level)
+        key = type_, cache_key
+        if key in self.__open_storages:
+            return self.__open_storages[key]
+
+        if self.shards is not None:
+            level_type, account, _ = cache_key
+            await self._migrate_async(type_, level_type, account)
+            if key in self.__open_storages:
+                return self.__open_storages[key]
+
+        try:
+            loading = self.__loading[key]
+        except KeyError:
+            loading = asyncio.ensure_future(
+                self._load_async(type_, cache_key)
+            )
+            self.__loading[key] = loading
+            loading.add_done_callback(functools.partial(self._loaded, key))
+
+        # cancelling one caller must not abort the load for the others
+        await asyncio.shield(loading)
+        # the storage is open now, unless the load was invalidated
+        return self._open(type_, level)
+
     @classmethod
     def register(cls, level_type, xso_type):
         """
@@ -876,6 +4489,45 @@ class XMLFrontend(Frontend):
         except KeyError:
             return aioxmpp.xso.model.XSOList()
 
+    async def get_async(self, type_, level, xso_type):
+        """
+        Return the first instance of an XSO.
+
+        Like :meth:`get`, but the storage is opened on a worker thread if
+        it is not open yet.
+        """
+        await self._open_async(type_, level)
+        return self.get(type_, level, xso_type)
+
+    async def get_all_async(self, type_, level, xso_type):
+        """
+        Return all instances of an XSO.
+
+        Like :meth:`get_all`, but the storage is opened on a worker thread
+        if it is not open yet.
+        """
+        await self._open_async(type_, level)
+        return self.get_all(type_, level, xso_type)
+
+    async def preload(self, type_, levels):
+        """
+        Open the storages of several level descriptors.
+
+        :param type_: The storage type.
+        :type type_: :class:`~.StorageType`
+        :param levels: The level descriptors.
+        :type levels: iterable of :class:`~.LevelDescriptor`
+
+        The storages are loaded in parallel on worker threads. Afterwards,
+        :meth:`get`, :meth:`get_all` and :meth:`put` do not block on disk
+        access for these levels. Level descriptors which share a storage
+        file load it only once.
+        """
+        await asyncio.gather(*(
+            self._open_async(type_, level)
+            for level in levels
+        ))
+
     @staticmethod
     def _put_into(items, key, xso):
         if isinstance(xso, aioxmpp.xso.XSO):
@@ -911,18 +4563,324 @@ class XMLFrontend(Frontend):
         """
         data = self._open(type_, level)
         _, _, key_func = self.LEVEL_INFO[level.level]
-        self._put_into(data.items, key_func(level), xso)
+        item_key = key_func(level)
+        self._put_into(data.items, item_key, xso)
+        item_keys = self.__dirty.setdefault(
+            (type_, self._cache_key(level)),
+            set(),
+        )
+        if item_keys is not None:
+            item_keys.add(item_key)
 
-    def _writeback(self, type_, key):
+    async def put_async(self, type_, level, xso):
+        """
+        Put one or more XSOs.
+
+        Like :meth:`put`, but the storage is opened on a worker thread if it
+        is not open yet.
+        """
+        await self._open_async(type_, level)
+        self.put(type_, level, xso)
+
+    @staticmethod
+    def _copy_items(storage_cls, data, item_keys):
+        copy = storage_cls()
+        for item_key in item_keys:
+            try:
+                item_data = data.items[item_key]
+            except KeyError:
+                # unparseable item
+                continue
+            copy.items[item_key] = {
+                tag: aioxmpp.xso.model.XSOList(xsos)
+                for tag, xsos in item_data.items()
+            }
+        return copy
+
+    @classmethod
+    def _copy_storage(cls, storage_cls, data, item_keys=None):
+        if item_keys is not None:
+            return cls._copy_items(storage_cls, data, item_keys)
+
+        items = data.items
+        if not isinstance(items, _LazyXMLItems):
+            return cls._copy_items(storage_cls, data, list(items))
+
+        # the items which have not been parsed are copied from the loaded
+        # document
+        return _XMLStorageSnapshot(
+            cls._copy_items(storage_cls, data, items.parsed_keys()),
+            items.index,
+            items.unparsed_keys(),
+        )
+
+    def _snapshot(self, type_, key, item_keys=None):
+        """
+        Return a copy of an open storage which is not affected by subsequent
+        :meth:`put` calls.
+
+        If `item_keys` is given, only the items with these keys are copied.
+        Items which have not been parsed yet are not parsed for the copy.
+        """
+        storage_cls, _, _ = self.LEVEL_INFO[key[0]]
+        return self._copy_storage(
+            storage_cls,
+            self.__open_storages[type_, key],
+            item_keys,
+        )
+
+    def _take_snapshots(self):
+        """
+        Take snapshots of all dirty storages.
+
+        :return: A list of ``(type_, key, data, partial)`` tuples and the
+            set of legacy files whose migration is complete once the
+            snapshots are written. If `partial` is true, `data` contains only
+            the changed items and is appended to the journal.
+        """
+        dirty, self.__dirty = self.__dirty, {}
+        migrations, self.__pending_migrations = \
+            self.__pending_migrations, set()
+        snapshots = []
+        for (type_, key), item_keys in dirty.items():
+            partial = self.journal and item_keys is not None
+            snapshots.append((
+                type_, key,
+                self._snapshot(type_, key, item_keys if partial else None),
+                partial,
+            ))
+        return snapshots, migrations
+
+    def _write_snapshots(self, snapshots, migrations=()):
+        """
+        Write snapshots taken with :meth:`_take_snapshots`.
+
+        :return: The number of bytes written.
+        """
+        journals = []
+        saved = []
         try:
-            data = self.__open_storages[type_, key]
-        except KeyError:
-            return
-        self._save(data, type_, *key)
+            # the storage files are committed together, so that the syncs
+            # of all files and directories are batched
+            group = utils.GroupWriter()
+            try:
+                for type_, key, data, partial in snapshots:
+                    if partial:
+                        journals.append(
+                            (type_, key) +
+                            self._append_journal(data, type_, *key)
+                        )
+                    else:
+                        saved.append(
+                            self._save(data, type_, *key, group=group)
+                        )
+            except:  # NOQA
+                group.abort()
+                raise
+            nbytes = group.commit()
+
+            # the journals are contained in the saved data
+            for path in saved:
+                self._discard_journal(path)
+
+            # sync all journals in one go
+            utils.fsync_all(f.fileno() for _, _, f, _, _, _ in journals)
+            for dirpath in {path.parent
+                            for _, _, _, path, created, _ in journals
+                            if created}:
+                utils.fsync_dir(dirpath)
+        finally:
+            for _, _, f, _, _, _ in journals:
+                f.close()
+
+        for type_, key, _, path, _, size in journals:
+            nbytes += size
+            if path.stat().st_size >= self.journal_threshold:
+                self._checkpoint(type_, key)
+
+        # the migrated data is on disk now
+        for path in migrations:
+            os.replace(str(path), str(path) + ".migrated")
+            self._discard_journal(path)
+
+        return nbytes
+
+    def _submit_writeback(self):
+        snapshots, migrations = self._take_snapshots()
+        return (snapshots, migrations), self._executor.submit(
+            self._write_snapshots,
+            snapshots,
+            migrations,
+        )
+
+    def _usage(self, type_):
+        usage = collections.Counter()
+        base = self._backend.type_base_paths(type_, True)[0]
+        core = escape_path_part(utils.jabbercat_ns.core)
+        roots = [base / StorageLevel.GLOBAL.value / core / "xml-storage"]
+        roots.extend((base / StorageLevel.ACCOUNT.value).glob(
+            "/".join(["*"] * _ENCODED_JID_DEPTH + [core, "xml-storage"])
+        ))
+
+        for root in roots:
+            for dirpath, _, filenames in os.walk(str(root)):
+                for filename in filenames:
+                    path = pathlib.Path(dirpath) / filename
+                    # the first component is the level type, followed by
+                    # the suffix or the shard directory
+                    level_name = path.relative_to(root).parts[0].split(
+                        ".", 1
+                    )[0]
+                    try:
+                        level_type = StorageLevel(level_name)
+                        size = path.lstat().st_size
+                    except (ValueError, FileNotFoundError):
+                        continue
+                    usage[level_type, utils.jabbercat_ns.core] += size
+        return usage
+
+    def _remove_peer_storages(self, account):
+        _remove_trees(
+            self._get_path(type_, StorageLevel.PEER, account).parent
+            for type_ in StorageType
+        )
+
+    def _forget_peer_storages(self, account):
+        for type_, (level_type, *args) in list(self.__open_storages):
+            if level_type == StorageLevel.PEER and args[0] == account:
+                key = (level_type, *args)
+                del self.__open_storages[type_, key]
+                self.__dirty.pop((type_, key), None)
+        # loads in progress must not add the storages back
+        for type_, (level_type, *args) in list(self.__loading):
+            if level_type == StorageLevel.PEER and args[0] == account:
+                del self.__loading[type_, (level_type, *args)]
+
+    async def clear(self, level):
+        """
+        See :meth:`.Frontend.clear`.
+
+        The data is removed from the storages, which are then written back.
+        """
+        if level.level == StorageLevel.GLOBAL:
+            raise ValueError("GLOBAL level not supported")
+
+        _, _, key_func = self.LEVEL_INFO[level.level]
+        for type_ in StorageType:
+            data = await self._open_async(type_, level)
+            try:
+                del data.items[key_func(level)]
+            except KeyError:
+                continue
+            # journal records cannot express the deletion
+            self.__dirty[type_, self._cache_key(level)] = None
+
+        if level.level == StorageLevel.ACCOUNT:
+            self._forget_peer_storages(level.account)
+            for type_ in StorageType:
+                path = self._get_path(type_, StorageLevel.PEER, level.account)
+                self.__pending_migrations.discard(path)
+                self.__migrating.pop((type_, path), None)
+
+        await self.flush_all_async()
+
+        if level.level == StorageLevel.ACCOUNT:
+            # run after all pending writebacks
+            await asyncio.wrap_future(self._executor.submit(
+                self._remove_peer_storages,
+                level.account,
+            ))
+            # storages may have been opened from the old files meanwhile
+            self._forget_peer_storages(level.account)
+
+    async def usage(self, type_):
+        """
+        See :meth:`.Frontend.usage`.
+
+        The size of the storage files, including journals, is reported for
+        the core namespace.
+        """
+        return await self._run_in_executor(self._usage, type_)
+
+    def _backup(self, type_, destination):
+        base = self._backend.type_base_paths(type_, True)[0]
+        core = escape_path_part(utils.jabbercat_ns.core)
+        roots = [base / StorageLevel.GLOBAL.value / core / "xml-storage"]
+        roots.extend((base / StorageLevel.ACCOUNT.value).glob(
+            "/".join(["*"] * _ENCODED_JID_DEPTH + [core, "xml-storage"])
+        ))
+
+        for root in roots:
+            for dirpath, _, filenames in os.walk(str(root)):
+                for filename in filenames:
+                    path = pathlib.Path(dirpath) / filename
+                    _backup_file(path, destination / path.relative_to(base))
+
+    async def backup(self, type_, destination):
+        """
+        See :meth:`.Frontend.backup`.
+
+        Dirty storages are written back first. The files are copied by the
+        thread which writes the storages back, so no writeback can interfere
+        with the copy.
+        """
+        await self.flush_all_async()
+        await asyncio.wrap_future(self._executor.submit(
+            self._backup,
+            type_,
+            destination,
+        ))
+
+    def close(self):
+        """
+        Stop the worker thread.
+
+        This is meant to be called on shutdown, after the last writeback; it
+        waits for the work queued on the thread to finish. The frontend
+        cannot be used afterwards.
+        """
+        self._executor.shutdown(wait=True)
+
+    def _writeback_failed(self, state):
+        snapshots, migrations = state
+        # journal records may have been written partially; rewrite the
+        # storages completely
+        for type_, key, *_ in snapshots:
+            self.__dirty[type_, key] = None
+        self.__pending_migrations.update(migrations)
 
     def flush_all(self):
         """
-        Write back all open XML storages and closes them.
+        Write back all dirty XML storages and wait for the writes to finish.
+
+        :rtype: :class:`int`
+        :return: The number of bytes written.
+
+        This blocks until all previously started writebacks have finished,
+        too. If writing fails, the storages stay dirty and the exception is
+        re-raised.
+        """
+        snapshots, fut = self._submit_writeback()
+        try:
+            return fut.result()
+        except:  # NOQA
+            self._writeback_failed(snapshots)
+            raise
+
+    async def flush_all_async(self):
+        """
+        Write back all dirty XML storages without blocking the event loop.
+
+        :rtype: :class:`int`
+        :return: The number of bytes written.
+
+        The data is snapshotted when this method is called; the snapshot is
+        serialised and written in a worker thread. If writing fails, the
+        storages stay dirty and the exception is re-raised.
         """
-        for type_, key in self.__open_storages.keys():
-            self._writeback(type_, key)
+        snapshots, fut = self._submit_writeback()
+        try:
+            return await asyncio.wrap_future(fut)
+        except:  # NOQA
+            self._writeback_failed(snapshots)
+            raise
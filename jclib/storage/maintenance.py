@@ -0,0 +1,423 @@
+"""
+Background maintenance of the SQLite databases used by the storage frontends.
+
+.. autoclass:: DatabaseMaintainer
+
+.. autofunction:: maintain_database
+
+.. autoclass:: MaintenanceResult
+
+.. autodata:: VACUUM_THRESHOLD
+
+.. autodata:: VACUUM_PAGES
+
+.. autodata:: ANALYSIS_LIMIT
+"""
+import asyncio
+import collections
+import logging
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+import jclib.tasks
+
+from .common import StorageType
+from . import frontends
+
+
+logger = logging.getLogger(__name__)
+
+
+#: Fraction of free pages at which a database without incremental vacuum
+#: is vacuumed and switched to incremental vacuum.
+VACUUM_THRESHOLD = 0.25
+
+#: Maximum number of free pages released by one maintenance of a database.
+VACUUM_PAGES = 1024
+
+#: Approximate number of rows per index examined by ``ANALYZE``.
+ANALYSIS_LIMIT = 1000
+
+# number of SQLite virtual machine instructions between deadline checks
+_PROGRESS_STEPS = 1000
+
+_AUTO_VACUUM_INCREMENTAL = 2
+
+
+MaintenanceResult = collections.namedtuple(
+    "MaintenanceResult",
+    [
+        "path",
+        "ok",
+        "errors",
+        "analyzed",
+        "freed_pages",
+        "duration",
+        "complete",
+    ]
+)
+MaintenanceResult.__doc__ = """
+Outcome of :func:`maintain_database`.
+
+.. attribute:: path
+
+   The path of the database.
+
+.. attribute:: ok
+
+   Whether the integrity check passed, or :data:`None` if it did not finish.
+
+.. attribute:: errors
+
+   The problems reported by the integrity check.
+
+.. attribute:: analyzed
+
+   Whether the statistics of the query planner have been updated.
+
+.. attribute:: freed_pages
+
+   The number of pages by which the database shrank.
+
+.. attribute:: duration
+
+   The time spent in seconds.
+
+.. attribute:: complete
+
+   Whether all steps finished; false if the time budget ran out or the
+   database was busy.
+"""
+
+
+def _vacuum(connection, vacuum_threshold, vacuum_pages):
+    page_count = connection.execute("PRAGMA page_count").fetchone()[0]
+    free_pages = connection.execute("PRAGMA freelist_count").fetchone()[0]
+    if not free_pages:
+        return 0
+
+    mode = connection.execute("PRAGMA auto_vacuum").fetchone()[0]
+    if mode == _AUTO_VACUUM_INCREMENTAL:
+        # the pragma frees one page per step and execute() only steps once
+        connection.executescript(
+            "PRAGMA incremental_vacuum({:d});".format(vacuum_pages)
+        )
+    elif free_pages >= page_count * vacuum_threshold:
+        # switching the mode takes effect with the next full VACUUM; further
+        # deletions can then be reclaimed incrementally
+        connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        connection.execute("VACUUM")
+    else:
+        return 0
+
+    return (page_count -
+            connection.execute("PRAGMA page_count").fetchone()[0])
+
+
+def maintain_database(path, deadline, *,
+                      abort=None,
+                      vacuum_threshold=VACUUM_THRESHOLD,
+                      vacuum_pages=VACUUM_PAGES):
+    """
+    Check and tidy up a SQLite database.
+
+    :param path: The path of the database.
+    :type path: :class:`pathlib.Path`
+    :param deadline: :func:`time.monotonic` time at which to give up.
+    :type deadline: :class:`float`
+    :param abort: If given and set, the maintenance is given up, too.
+    :type abort: :class:`threading.Event`
+    :param vacuum_threshold: See :data:`VACUUM_THRESHOLD`.
+    :param vacuum_pages: See :data:`VACUUM_PAGES`.
+    :raises FileNotFoundError: if the database does not exist.
+    :rtype: :class:`MaintenanceResult`
+
+    The following steps are run, each one only if the previous one
+    succeeded:
+
+    1. ``PRAGMA quick_check``.
+    2. ``ANALYZE`` if the database has never been analyzed and ``PRAGMA
+       optimize`` otherwise, with ``PRAGMA analysis_limit`` set to
+       :data:`ANALYSIS_LIMIT`.
+    3. ``PRAGMA incremental_vacuum`` if the database supports it. Otherwise,
+       if at least `vacuum_threshold` of its pages are free, the database is
+       switched to incremental vacuum with a full ``VACUUM``.
+
+    The steps are interrupted when the deadline passes or `abort` is set.
+    They do not wait for locks, so that a database which is in use is
+    skipped rather than blocked. Both leave the result incomplete. This
+    blocks and should be called in an executor.
+    """
+    started = time.monotonic()
+    ok = None
+    errors = []
+    analyzed = False
+    freed_pages = 0
+    complete = False
+
+    def interrupt():
+        return (time.monotonic() >= deadline or
+                (abort is not None and abort.is_set()))
+
+    if not path.exists():
+        raise FileNotFoundError(
+            "database {} does not exist".format(path)
+        )
+
+    # mode=rw: never create a database which has been deleted meanwhile
+    connection = sqlite3.connect(
+        "file:{}?mode=rw".format(urllib.parse.quote(str(path))),
+        uri=True,
+        timeout=0,
+        isolation_level=None,
+    )
+    try:
+        connection.set_progress_handler(interrupt, _PROGRESS_STEPS)
+
+        rows = connection.execute("PRAGMA quick_check").fetchall()
+        errors = [message for message, in rows if message != "ok"]
+        ok = not errors
+
+        if ok:
+            connection.execute(
+                "PRAGMA analysis_limit = {:d}".format(ANALYSIS_LIMIT)
+            )
+            has_stats = connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+            ).fetchone() is not None
+            if has_stats:
+                connection.execute("PRAGMA optimize").fetchall()
+            else:
+                connection.execute("ANALYZE")
+            analyzed = True
+
+            freed_pages = _vacuum(connection, vacuum_threshold, vacuum_pages)
+
+        complete = True
+    except sqlite3.OperationalError as exc:
+        # interrupted or locked
+        logger.debug("maintenance of %s incomplete: %s", path, exc)
+    except sqlite3.DatabaseError as exc:
+        ok = False
+        errors.append(str(exc))
+        complete = True
+    finally:
+        connection.close()
+
+    return MaintenanceResult(
+        path=path,
+        ok=ok,
+        errors=errors,
+        analyzed=analyzed,
+        freed_pages=freed_pages,
+        duration=time.monotonic() - started,
+        complete=complete,
+    )
+
+
+class DatabaseMaintainer:
+    """
+    Maintain the SQLite databases of the storage frontends while idle.
+
+    :param accounting: The accounting whose frontends to maintain.
+    :type accounting: :class:`~.StorageAccounting`
+    :param interval: Delay in seconds between two maintenance runs.
+    :type interval: :class:`float`
+    :param idle_delay: Time in seconds without any database use after which
+        the storage is considered idle.
+    :type idle_delay: :class:`float`
+    :param time_budget: Maximum time in seconds spent on maintenance per
+        run.
+    :type time_budget: :class:`float`
+    :param max_attempts: Number of incomplete maintenances of a database
+        after which it is skipped until the next round.
+    :type max_attempts: :class:`int`
+
+    Each run calls :func:`maintain_database` on the databases of all
+    frontends and storage types, one at a time and only while the storage is
+    idle (see :func:`~.frontends.idle_time`). When the time budget of a run
+    is used up, the run ends and the next one resumes with the databases
+    which have not been maintained yet, including those which were busy;
+    the databases whose maintenance did not finish are retried after the
+    others. A database whose maintenance did not finish `max_attempts` times
+    in a row, for example because it is too large to be checked within the
+    time budget, is skipped with a warning. Once all databases have been
+    maintained or skipped, the next run starts over.
+
+    The runs happen in a task of :data:`jclib.tasks.manager`, which shows the
+    database being maintained and the progress of the run. Stopping the
+    maintainer cancels the task and interrupts the running maintenance.
+
+    .. attribute:: metrics
+
+       A :class:`collections.Counter` with the number of ``runs``, maintained
+       ``databases``, ``incomplete`` maintenances, ``skipped`` databases,
+       ``integrity_failures``, ``analyzed`` databases and ``freed_pages``,
+       and the ``time`` spent in seconds.
+
+    .. attribute:: results
+
+       The latest :class:`MaintenanceResult` of each database, by path.
+
+    .. automethod:: start
+
+    .. automethod:: stop
+
+    .. automethod:: run
+    """
+
+    def __init__(self, accounting, *,
+                 interval=3600,
+                 idle_delay=30,
+                 time_budget=5,
+                 max_attempts=3):
+        super().__init__()
+        self._accounting = accounting
+        self.interval = interval
+        self.idle_delay = idle_delay
+        self.time_budget = time_budget
+        self.max_attempts = max_attempts
+        self.metrics = collections.Counter()
+        self.results = {}
+        self._pending = []
+        # number of incomplete maintenances in a row, by path
+        self._attempts = collections.Counter()
+        self._task = None
+
+    def _database_paths(self):
+        paths = []
+        for frontend in self._accounting.frontends.values():
+            for type_ in StorageType:
+                paths.extend(frontend._database_paths(type_))
+        return sorted(set(paths))
+
+    def _annotate(self, text, progress_ratio=None):
+        if self._task is None:
+            return
+        self._task.text = text
+        self._task.progress_ratio = progress_ratio
+
+    async def _wait_for_idle(self):
+        while True:
+            idle = frontends.idle_time()
+            if idle >= self.idle_delay:
+                return
+            await asyncio.sleep(self.idle_delay - idle)
+
+    def _record(self, result):
+        self.results[result.path] = result
+        self.metrics["time"] += result.duration
+        if not result.complete:
+            self.metrics["incomplete"] += 1
+            return
+
+        self.metrics["databases"] += 1
+        self.metrics["freed_pages"] += result.freed_pages
+        if result.analyzed:
+            self.metrics["analyzed"] += 1
+        if result.ok is False:
+            self.metrics["integrity_failures"] += 1
+            logger.error("integrity check of %s failed: %s",
+                         result.path, "; ".join(result.errors))
+
+    async def run(self):
+        """
+        Maintain databases until the time budget is used up.
+
+        :rtype: :class:`int`
+        :return: The number of databases which have been maintained.
+        """
+        loop = asyncio.get_event_loop()
+        self.metrics["runs"] += 1
+
+        if not self._pending:
+            self._pending = await loop.run_in_executor(
+                None,
+                self._database_paths,
+            )
+        total = len(self._pending)
+
+        abort = threading.Event()
+        budget = self.time_budget
+        nmaintained = 0
+        try:
+            for i, path in enumerate(list(self._pending)):
+                if budget <= 0:
+                    break
+
+                await self._wait_for_idle()
+
+                self._annotate("Maintaining {}".format(path.name), i / total)
+                try:
+                    result = await loop.run_in_executor(
+                        None,
+                        lambda: maintain_database(
+                            path,
+                            time.monotonic() + budget,
+                            abort=abort,
+                        ),
+                    )
+                except FileNotFoundError:
+                    self._pending.remove(path)
+                    self._attempts.pop(path, None)
+                    continue
+
+                self._record(result)
+                budget -= result.duration
+                self._pending.remove(path)
+                if result.complete:
+                    self._attempts.pop(path, None)
+                    nmaintained += 1
+                    continue
+
+                self._attempts[path] += 1
+                if self._attempts[path] < self.max_attempts:
+                    # let the other databases go first on the next run
+                    self._pending.append(path)
+                    continue
+
+                del self._attempts[path]
+                self.metrics["skipped"] += 1
+                logger.warning(
+                    "maintenance of %s did not finish in %d attempts, "
+                    "skipping it until the next round",
+                    path, self.max_attempts,
+                )
+        except asyncio.CancelledError:
+            abort.set()
+            raise
+        finally:
+            self._annotate(None)
+
+        logger.debug("maintained %d databases, %d pending",
+                     nmaintained, len(self._pending))
+        return nmaintained
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning("database maintenance failed", exc_info=True)
+
+    def start(self):
+        """
+        Start maintaining the databases periodically in a background task.
+        """
+        if self._task is not None:
+            return
+        self._task = jclib.tasks.manager.start(self._run())
+
+    def stop(self):
+        """
+        Stop the background task.
+        """
+        if self._task is None:
+            return
+        self._task.asyncio_task.cancel()
+        self._task = None
@@ -1,5 +1,9 @@
 import asyncio
+import collections
+import concurrent.futures
 import logging
+import time
+import weakref
 
 from datetime import timedelta
 
@@ -12,6 +16,105 @@ import jclib.utils
 logger = logging.getLogger(__name__)
 
 
+class WritebackHandle:
+    """
+    Registration of a component with a :class:`WriteManager`.
+
+    Handles are created with :meth:`WriteManager.register`. The component
+    calls :meth:`request_writeback` when its data has changed; on the next
+    writeback, the callback of the handle is called (once, no matter how often
+    a writeback was requested in the meantime).
+
+    .. attribute:: name
+
+       The name of the component, used in logs.
+
+    .. attribute:: metrics
+
+       A :class:`collections.Counter` with the number of ``writebacks``, the
+       number of ``failures``, the ``time`` spent in the event loop in
+       seconds, the ``write_time`` spent in the writeback thread in seconds
+       and the ``bytes`` written, as far as reported by the callback.
+
+    .. autoattribute:: dirty
+
+    .. automethod:: request_writeback
+
+    .. automethod:: close
+    """
+
+    def __init__(self, manager, name, callback):
+        super().__init__()
+        self._manager = manager
+        self.name = name
+        self._callback = callback
+        self.metrics = collections.Counter()
+
+    @property
+    def dirty(self):
+        """
+        Whether a writeback has been requested which has not happened yet.
+        """
+        return self in self._manager._dirty
+
+    def request_writeback(self):
+        """
+        Schedule a writeback of this handle.
+
+        :rtype: :class:`asyncio.Future`
+        :return: A future which completes when the writeback has finished.
+
+        See :meth:`WriteManager.request_writeback` for details.
+        """
+        self._manager._mark_dirty(self)
+        return self._manager.request_writeback()
+
+    def close(self):
+        """
+        Unregister the handle.
+
+        A pending writeback of the handle is dropped.
+        """
+        self._manager._dirty.pop(self, None)
+        self._manager._handles.discard(self)
+
+    def _record(self, nbytes):
+        self.metrics["writebacks"] += 1
+        if nbytes is not None:
+            self.metrics["bytes"] += nbytes
+
+    def _call(self):
+        """
+        Run the callback in the event loop.
+
+        :return: The function to call in the writeback thread, if any.
+        """
+        started = time.monotonic()
+        try:
+            result = self._callback()
+        except:  # NOQA
+            self.metrics["failures"] += 1
+            raise
+        finally:
+            self.metrics["time"] += time.monotonic() - started
+
+        if callable(result):
+            return result
+        self._record(result)
+        return None
+
+    def _write(self, write):
+        started = time.monotonic()
+        try:
+            nbytes = write()
+        except:  # NOQA
+            self.metrics["failures"] += 1
+            raise
+        finally:
+            self.metrics["write_time"] += time.monotonic() - started
+        self._record(nbytes)
+
+
 class WriteManager:
     """
     Manage storage writebacks.
@@ -21,47 +124,283 @@ class WriteManager:
     :param max_delay: Hard upper bound for the delay between the request for
         a writeback and the actual writeback.
 
-    Writebacks are **not** emitted regularly; instead, users have to
-    call :meth:`request_writeback` to schedule a writeback. When a writeback
-    occurs, :meth:`on_writeback` is emitted.
+    Writebacks are **not** emitted regularly; instead, components
+    :meth:`register` a handle and call
+    :meth:`WritebackHandle.request_writeback` to schedule a writeback.
+
+    A writeback happens in two phases. In the event loop, the callbacks of
+    the handles which requested it are called and :meth:`on_writeback` is
+    emitted; this phase should only copy data. Then, the functions returned
+    by the callbacks are called in a writeback thread, while the XML and
+    append storages are written by their worker threads. The futures
+    returned by :meth:`request_writeback` complete when the second phase has
+    finished. If anything failed, the next writeback is scheduled right away.
+
+    :meth:`force_writeback` runs both phases and blocks until everything has
+    been written.
 
     .. signal:: on_writeback()
 
         Emits when a writeback occurs.
 
+        Handlers of this signal run on every writeback; use :meth:`register`
+        to only run when needed.
+
+    .. autoattribute:: handles
+
+    .. automethod:: register
+
     .. automethod:: request_writeback
+
+    .. automethod:: force_writeback
     """
 
     on_writeback = aioxmpp.callbacks.Signal()
 
     def __init__(self, delay, max_delay, *, loop=None):
         super().__init__()
+        self._loop = loop
         self._scheduler = jclib.utils.DelayedInvocation(
             self._writeback_scheduled,
             delay,
             max_delay=max_delay,
             loop=loop,
         )
+        # a single thread, so that writes happen in the order of the
+        # writebacks
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._handles = weakref.WeakSet()
+        # dirty handles are kept alive until they have been written back
+        self._dirty = collections.OrderedDict()
+        # completes with the next writeback
+        self._completion = None
+        # the callbacks of the storage handles block until the storages have
+        # been written; they are only called by force_writeback, scheduled
+        # writebacks use _flush_storages_async
+        self._xml_handle = self.register(
+            "XML storage",
+            lambda: jclib.storage.xml.flush_all(),
+        )
+        self._append_handle = self.register(
+            "append storage",
+            lambda: jclib.storage.append.flush_all(sync=True),
+        )
+
+    @property
+    def handles(self):
+        """
+        The registered :class:`WritebackHandle` instances, including the
+        handles of the XML and append storages.
+        """
+        return list(self._handles)
+
+    def register(self, name, callback):
+        """
+        Register a component for writebacks.
+
+        :param name: Name of the component, for logs and metrics.
+        :type name: :class:`str`
+        :param callback: Function to call on writeback.
+        :rtype: :class:`WritebackHandle`
+
+        `callback` is called in the event loop without arguments. It should
+        take a snapshot of the data to write and return a function which
+        writes the snapshot; that function is called without arguments in
+        the writeback thread. Callbacks which are cheap may write directly
+        instead. The function (or the callback, if it does not return a
+        function) may return the number of bytes written. If either raises,
+        the exception is logged and the writeback is retried on the next
+        writeback.
+
+        The manager only keeps a weak reference to the handle, unless a
+        writeback has been requested. The component should keep a reference
+        to the handle for as long as it exists.
+        """
+        handle = WritebackHandle(self, name, callback)
+        self._handles.add(handle)
+        return handle
+
+    def _mark_dirty(self, handle):
+        self._dirty[handle] = None
+
+    def _take_completion(self):
+        completion, self._completion = self._completion, None
+        return completion
+
+    def _snapshot(self):
+        """
+        Run the callbacks of the dirty handles and emit :meth:`on_writeback`.
+
+        :return: The handles and functions to call in the writeback thread.
+
+        The storage handles are not called; the storages are flushed on every
+        writeback after this.
+        """
+        dirty, self._dirty = self._dirty, collections.OrderedDict()
+        dirty.pop(self._xml_handle, None)
+        dirty.pop(self._append_handle, None)
+        writes = []
+        for handle in dirty:
+            try:
+                write = handle._call()
+            except Exception:
+                logger.exception("writeback of %s failed", handle.name)
+                # retry with the next writeback
+                self._mark_dirty(handle)
+                continue
+            if write is not None:
+                writes.append((handle, write))
+        self.on_writeback()
+        return writes
+
+    def _write(self, writes):
+        """
+        Call the write functions; this runs in the writeback thread.
+
+        :return: The handles whose writes failed.
+        """
+        failed = []
+        for handle, write in writes:
+            try:
+                handle._write(write)
+            except Exception:
+                logger.exception("writeback of %s failed", handle.name)
+                failed.append(handle)
+        return failed
+
+    @staticmethod
+    def _complete(completion, exc=None):
+        if completion is None or completion.done():
+            return
+        if exc is None:
+            completion.set_result(None)
+            return
+        completion.set_exception(exc)
+        # the exception has been logged already
+        completion.exception()
+
+    async def _flush_async(self, handle, flush):
+        started = time.monotonic()
+        try:
+            nbytes = await flush()
+        except:  # NOQA
+            handle.metrics["failures"] += 1
+            # retry with the next writeback
+            self._mark_dirty(handle)
+            raise
+        finally:
+            handle.metrics["write_time"] += time.monotonic() - started
+        handle._record(nbytes)
+
+    async def _flush_storages_async(self):
+        """
+        Flush the append and XML storages in their worker threads.
+
+        Failures of the append storage are logged; failures of the XML
+        storage are raised.
+        """
+        try:
+            # the records are written to the files without syncing, which is
+            # cheap
+            await self._flush_async(
+                self._append_handle,
+                jclib.storage.append.flush_all_async,
+            )
+        except Exception:
+            logger.exception("writeback of %s failed",
+                             self._append_handle.name)
+        await self._flush_async(
+            self._xml_handle,
+            jclib.storage.xml.flush_all_async,
+        )
+
+    async def _finish_writeback(self, writes, completion):
+        loop = asyncio.get_event_loop()
+        try:
+            # the storages are written by their own worker threads,
+            # concurrently with the writes of the handles
+            storages_flush = asyncio.ensure_future(
+                self._flush_storages_async(),
+            )
+            try:
+                failed = await loop.run_in_executor(
+                    self._executor,
+                    self._write,
+                    writes,
+                )
+            finally:
+                await storages_flush
+        except Exception as exc:
+            self._complete(completion, exc)
+            raise
+        else:
+            for handle in failed:
+                self._mark_dirty(handle)
+            self._complete(completion)
+        finally:
+            if self._dirty:
+                # failed handles would otherwise wait for the next request
+                self._scheduler()
 
     def _writeback_scheduled(self, invocations):
         logger.debug("executing scheduled writeback for %d clients",
                      len(invocations))
-        self._do_writeback()
+        completion = self._take_completion()
+        writes = self._snapshot()
+        jclib.utils.logged_async(
+            self._finish_writeback(writes, completion),
+            loop=self._loop,
+            name="storage writeback",
+        )
 
     def _do_writeback(self):
-        self.on_writeback()
-        jclib.storage.xml.flush_all()
+        completion = self._take_completion()
+        try:
+            writes = self._snapshot()
+            # queued after the writes of scheduled writebacks
+            failed = self._executor.submit(self._write, writes).result()
+            for handle in failed:
+                self._mark_dirty(handle)
+            try:
+                self._append_handle._call()
+            except Exception:
+                logger.exception("writeback of %s failed",
+                                 self._append_handle.name)
+                self._mark_dirty(self._append_handle)
+            self._xml_handle._call()
+        except Exception as exc:
+            self._complete(completion, exc)
+            raise
+        self._complete(completion)
 
     def request_writeback(self):
         """
         Schedule a writeback in at most `max_delay` and at least approximately
         `delay` seconds.
+
+        :rtype: :class:`asyncio.Future`
+        :return: A future which completes when the writeback has finished.
+
+        Without a handle, only :meth:`on_writeback` handlers and the storages
+        are written back (together with handles which requested a writeback,
+        if any).
+
+        If writing the storages fails, the future raises the exception.
+        Failures of handles are logged and retried with the next writeback,
+        but do not fail the future.
         """
+        if self._completion is None:
+            loop = self._loop or asyncio.get_event_loop()
+            self._completion = loop.create_future()
         self._scheduler()
+        return self._completion
 
     def force_writeback(self):
         """
         Force a writeback right now.
+
+        This blocks until the writes of previous writebacks have finished,
+        too. The append storage is synced to disk.
         """
         logger.debug("writeback forced", stack_info=True)
         self._do_writeback()
@@ -0,0 +1,167 @@
+"""
+Schema versioning for the SQLite databases used by the storage frontends.
+
+The schema version of a database is kept in its ``PRAGMA user_version``. A
+database schema is described by its :class:`sqlalchemy.MetaData` and a list of
+migrations; migration ``i`` upgrades a database from version ``i`` to version
+``i + 1``, so the current version of a schema is the length of its migration
+list.
+
+.. autofunction:: upgrade
+
+.. autofunction:: get_schema_version
+
+.. autofunction:: set_schema_version
+
+.. autofunction:: run_batched
+
+.. autodata:: BATCH_SIZE
+"""
+import inspect
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+#: Default number of rows affected per transaction by :func:`run_batched`.
+BATCH_SIZE = 1000
+
+
+def get_schema_version(connection):
+    """
+    Return the schema version of a database.
+
+    :param connection: A connection to the database.
+    :type connection: :class:`sqlalchemy.engine.Connection`
+    :rtype: :class:`int`
+    """
+    return connection.execute("PRAGMA user_version").scalar()
+
+
+def set_schema_version(connection, version):
+    """
+    Set the schema version of a database.
+
+    :param connection: A connection to the database.
+    :type connection: :class:`sqlalchemy.engine.Connection`
+    :param version: The new schema version.
+    :type version: :class:`int`
+
+    The version is changed as part of the current transaction of
+    `connection`.
+    """
+    # PRAGMA does not support bound parameters
+    connection.execute("PRAGMA user_version = {:d}".format(version))
+
+
+def _has_tables(connection):
+    return connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' LIMIT 1"
+    ).scalar() is not None
+
+
+def run_batched(connection, statement, *, batch_size=BATCH_SIZE, **params):
+    """
+    Execute a statement repeatedly, yielding after each batch.
+
+    :param connection: The connection to use.
+    :type connection: :class:`sqlalchemy.engine.Connection`
+    :param statement: The statement to execute.
+    :type statement: :class:`str`
+    :param batch_size: The maximum number of rows affected by one execution.
+    :type batch_size: :class:`int`
+
+    `statement` is executed with the additional bound parameter
+    ``batch_size`` until it affects fewer than `batch_size` rows. It must
+    therefore restrict itself to ``:batch_size`` rows which have not been
+    processed yet, for example::
+
+        UPDATE t SET b = a WHERE rowid IN (
+            SELECT rowid FROM t WHERE b IS NULL LIMIT :batch_size
+        )
+
+    This is a generator intended to be used with ``yield from`` in a migration
+    (see :func:`upgrade`), which makes each batch a transaction of its own.
+    """
+    while True:
+        result = connection.execute(
+            statement,
+            batch_size=batch_size,
+            **params
+        )
+        if result.rowcount < batch_size:
+            return
+        yield
+
+
+def _run_migration(connection, migration, new_version):
+    transaction = connection.begin()
+    try:
+        result = migration(connection)
+        if inspect.isgenerator(result):
+            # each yield marks the end of a batch; committing in between
+            # keeps the database usable by other connections
+            for _ in result:
+                transaction.commit()
+                transaction = connection.begin()
+        set_schema_version(connection, new_version)
+    except:  # NOQA
+        transaction.rollback()
+        raise
+    transaction.commit()
+
+
+def upgrade(engine, metadata, migrations=()):
+    """
+    Bring the schema of a database up to date.
+
+    :param engine: The engine of the database.
+    :type engine: :class:`sqlalchemy.engine.Engine`
+    :param metadata: The current schema.
+    :type metadata: :class:`sqlalchemy.MetaData`
+    :param migrations: Migrations from older schema versions.
+    :type migrations: :class:`~collections.abc.Sequence` of callables
+    :raises RuntimeError: if the database has a newer schema version than
+        the one described by `migrations`.
+
+    An empty database is created from `metadata` and stamped with the current
+    version right away.
+
+    Otherwise, each pending migration is called with a
+    :class:`sqlalchemy.engine.Connection` on which a transaction has been
+    started and the version is increased in the same transaction when the
+    migration returns. If a migration returns a generator, the transaction
+    is committed and a new one is started whenever the generator yields,
+    which allows to process large tables in batches (see
+    :func:`run_batched`). Such migrations must be written so that they can
+    resume from a partially applied state, since only the last transaction
+    increases the version.
+
+    Finally, tables and indices which are part of `metadata` but missing from
+    the database are created.
+    """
+    current_version = len(migrations)
+
+    with engine.connect() as connection:
+        with connection.begin():
+            version = get_schema_version(connection)
+            if version > current_version:
+                raise RuntimeError(
+                    "database schema version {} is newer than the "
+                    "supported version {}".format(version, current_version)
+                )
+
+            if version == 0 and not _has_tables(connection):
+                metadata.create_all(connection)
+                set_schema_version(connection, current_version)
+                return
+
+        for new_version, migration in enumerate(migrations[version:],
+                                                version + 1):
+            logger.info("migrating %s to schema version %d",
+                        engine.url, new_version)
+            _run_migration(connection, migration, new_version)
+
+        with connection.begin():
+            metadata.create_all(connection)
@@ -1,13 +1,27 @@
+import collections
+
+from datetime import datetime
+
 import sqlalchemy
 
 from sqlalchemy import (
     Column,
+    ForeignKey,
+    Integer,
 )
 from sqlalchemy.ext.declarative import declarative_base
 
 import aioxmpp.xso
 
-from .common import UUID, JID, SmallBlobMixin
+from .common import (
+    JIDEntryMixin,
+    SmallBlobMixin,
+    StorageLevel,
+    chunked_in,
+    jid_id,
+    jid_ids,
+    migrate_to_jid_ids,
+)
 from ..utils import jabbercat_ns
 
 
@@ -16,33 +30,65 @@ class Base(declarative_base()):
     __table_args__ = {}
 
 
+class JIDEntry(JIDEntryMixin, Base):
+    __tablename__ = "jids"
+
+
 class SmallBlob(SmallBlobMixin, Base):
     __tablename__ = "smallblobs"
 
-    account = Column(
-        "account",
-        JID(),
+    account_id = Column(
+        "account_id",
+        Integer(),
+        ForeignKey(JIDEntry.id),
         primary_key=True
     )
 
-    peer = Column(
-        "peer",
-        JID(),
+    peer_id = Column(
+        "peer_id",
+        Integer(),
+        ForeignKey(JIDEntry.id),
         primary_key=True,
     )
 
     @classmethod
-    def from_level_descriptor(cls, level):
+    def migrate(cls, connection):
+        """
+        Migrate a table with JID columns to JID ids.
+        """
+        return migrate_to_jid_ids(
+            connection,
+            cls.__table__,
+            ["account", "peer"],
+        )
+
+    @classmethod
+    def from_level_descriptor(cls, session, level):
         instance = cls()
-        instance.account = level.account
-        instance.peer = level.peer
+        instance.account_id = jid_id(session, JIDEntry, level.account,
+                                     create=True)
+        instance.peer_id = jid_id(session, JIDEntry, level.peer,
+                                  create=True)
         return instance
 
+    @classmethod
+    def filter_by_level(cls, query, level):
+        """
+        Filter for the blobs of a peer, or of all peers of an account if
+        `level` is an account level descriptor.
+        """
+        query = query.filter(
+            cls.account_id == jid_id(query.session, JIDEntry, level.account),
+        )
+        if level.level == StorageLevel.PEER:
+            query = query.filter(
+                cls.peer_id == jid_id(query.session, JIDEntry, level.peer),
+            )
+        return query
+
     @classmethod
     def filter_by(cls, query, level, name):
-        return query.filter(
-            cls.account == level.account,
-            cls.peer == level.peer,
+        return cls.filter_by_level(query, level).filter(
             cls.name == name,
         )
 
@@ -54,6 +100,93 @@ class SmallBlob(SmallBlobMixin, Base):
         except sqlalchemy.orm.exc.NoResultFound:
             raise KeyError(level) from None
 
+    @classmethod
+    def iter_keys(cls, session):
+        """
+        Yield the level key and the name of each blob.
+
+        The level keys are ``(account, peer)`` tuples, which compare equal to
+        the corresponding peer level descriptors.
+        """
+        account = sqlalchemy.orm.aliased(JIDEntry)
+        peer = sqlalchemy.orm.aliased(JIDEntry)
+        rows = session.query(
+            account.jid, peer.jid, cls.name,
+        ).join(
+            account, cls.account_id == account.id,
+        ).join(
+            peer, cls.peer_id == peer.id,
+        )
+        for account_jid, peer_jid, name in rows:
+            yield (account_jid, peer_jid), name
+
+    @classmethod
+    def load_many(cls, session, levels, names=None, now=None):
+        """
+        Load the blobs of many peers and mark them as accessed.
+
+        :param levels: The level descriptors of the peers.
+        :param names: If given, only the blobs with these names are loaded.
+        :return: ``(level, name, data)`` tuples in primary key order.
+
+        The JID ids are looked up with :func:`~.common.jid_ids`. One query
+        ordered by primary key is issued per account and chunk of peers; the
+        peers and `names` of a query bind at most
+        :data:`~.common.MAX_IN_VALUES` parameters.
+        """
+        now = now or datetime.utcnow()
+        levels = list(levels)
+        ids = jid_ids(
+            session,
+            JIDEntry,
+            [jid for level in levels for jid in (level.account, level.peer)],
+        )
+        accounts = collections.defaultdict(dict)
+        for level in levels:
+            account_id = ids.get(level.account)
+            peer_id = ids.get(level.peer)
+            if account_id is None or peer_id is None:
+                continue
+            accounts[account_id][peer_id] = level
+
+        rows = []
+        for account_id, peers in sorted(accounts.items()):
+            # the account id and the access time are bound, too
+            for peer_ids, names_chunk in chunked_in(sorted(peers), names,
+                                                    nfixed=2):
+                criteria = [
+                    cls.account_id == account_id,
+                    cls.peer_id.in_(peer_ids),
+                ]
+                if names_chunk is not None:
+                    criteria.append(cls.name.in_(names_chunk))
+
+                rows.extend(session.query(
+                    cls.account_id, cls.peer_id, cls.name, cls.data,
+                ).filter(*criteria).order_by(
+                    cls.account_id, cls.peer_id, cls.name,
+                ))
+
+                session.query(cls).filter(*criteria).update(
+                    {cls.accessed: now},
+                    synchronize_session=False,
+                )
+
+        # the rows of a chunk of peers are split by the chunks of names
+        rows.sort(key=lambda row: row[:3])
+        return [
+            (accounts[account_id][peer_id], name, data)
+            for account_id, peer_id, name, data in rows
+        ]
+
+
+#: Schema migrations of the small blob databases, see
+#: :func:`.migrations.upgrade`.
+MIGRATIONS = [
+    # 1: JIDs are stored in the jids table and referred to by id
+    SmallBlob.migrate,
+]
+
 
 class XMLStorageItem(aioxmpp.xso.XSO):
     TAG = jabbercat_ns.xml_storage_peer, "peer"
@@ -78,6 +211,13 @@ class XMLStorageItemType(aioxmpp.xso.AbstractElementType):
     def get_xso_types(self):
         return [XMLStorageItem]
 
+    @classmethod
+    def key_from_attributes(cls, attrs):
+        return (
+            aioxmpp.JID.fromstr(attrs["account"]),
+            aioxmpp.JID.fromstr(attrs["peer"]),
+        )
+
     def unpack(self, obj):
         return (obj.account, obj.peer), obj.data
 
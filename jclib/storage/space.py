@@ -0,0 +1,275 @@
+import asyncio
+import logging
+
+import jclib.tasks
+
+from .common import StorageType
+
+
+logger = logging.getLogger(__name__)
+
+
+#: Default quota of the :attr:`~.StorageType.CACHE` storage in bytes.
+CACHE_QUOTA = 256 * 1024 * 1024
+
+
+def _raise_first_error(results):
+    for result in results:
+        if isinstance(result, NotImplementedError):
+            continue
+        if isinstance(result, BaseException):
+            raise result
+
+
+class StorageAccounting:
+    """
+    Account for and manage the space used by storage frontends.
+
+    :param frontends: The frontends to manage, by name.
+    :type frontends: :class:`dict` mapping :class:`str` to
+        :class:`~.Frontend`
+
+    Frontends which raise :class:`NotImplementedError` are skipped by all
+    operations.
+
+    .. automethod:: usage
+
+    .. automethod:: total_usage
+
+    .. automethod:: clear
+
+    .. automethod:: evict
+
+    .. automethod:: backup
+    """
+
+    def __init__(self, frontends):
+        super().__init__()
+        self.frontends = dict(frontends)
+
+    async def usage(self, type_, *, evictable=False):
+        """
+        Return the space used by each frontend.
+
+        :param type_: The storage type to account.
+        :type type_: :class:`~.StorageType`
+        :param evictable: If true, only the frontends whose objects can be
+            evicted (see :attr:`.Frontend.EVICTABLE`) are queried.
+        :type evictable: :class:`bool`
+        :rtype: :class:`dict`
+        :return: The :meth:`.Frontend.usage` of each frontend by name.
+
+        The frontends are queried concurrently.
+        """
+        names = [
+            name
+            for name, frontend in self.frontends.items()
+            if not evictable or frontend.EVICTABLE
+        ]
+        results = await asyncio.gather(
+            *(self.frontends[name].usage(type_) for name in names),
+            return_exceptions=True
+        )
+        _raise_first_error(results)
+        return {
+            name: result
+            for name, result in zip(names, results)
+            if not isinstance(result, NotImplementedError)
+        }
+
+    async def total_usage(self, type_, *, evictable=False):
+        """
+        Return the space used by all frontends in bytes.
+
+        :param type_: The storage type to account.
+        :type type_: :class:`~.StorageType`
+        :param evictable: If true, only count the frontends whose objects can
+            be evicted.
+        :type evictable: :class:`bool`
+        :rtype: :class:`int`
+        """
+        usage = await self.usage(type_, evictable=evictable)
+        return sum(sum(counter.values()) for counter in usage.values())
+
+    async def clear(self, level):
+        """
+        Delete all data of a level key from all frontends.
+
+        :param level: The level descriptor of the key to remove.
+        :type level: :class:`~.LevelDescriptor`
+
+        See :meth:`.Frontend.clear` for details. The frontends are cleared
+        concurrently. If any frontend fails, the first error is re-raised
+        after all frontends have finished.
+        """
+        results = await asyncio.gather(
+            *(frontend.clear(level)
+              for frontend in self.frontends.values()),
+            return_exceptions=True
+        )
+        _raise_first_error(results)
+
+    async def evict(self, type_, nbytes):
+        """
+        Delete the least recently accessed objects.
+
+        :param type_: The storage type to delete objects from.
+        :type type_: :class:`~.StorageType`
+        :param nbytes: The number of bytes to free.
+        :type nbytes: :class:`int`
+        :rtype: :class:`int`
+        :return: The number of bytes freed.
+
+        Objects are deleted across all frontends in order of their last
+        access until at least `nbytes` have been freed or no objects are
+        left. Objects which cannot be deleted are skipped. Only the bytes
+        which were actually freed are counted; objects which are spared
+        because they have been accessed in the meantime count as zero.
+        """
+        loop = asyncio.get_event_loop()
+
+        candidates = []
+        for frontend in self.frontends.values():
+            candidates.extend(await loop.run_in_executor(
+                None,
+                lambda frontend=frontend: list(
+                    frontend._eviction_candidates(type_)
+                ),
+            ))
+        candidates.sort(key=lambda candidate: candidate.atime)
+
+        freed = 0
+        for candidate in candidates:
+            if freed >= nbytes:
+                break
+            try:
+                freed += await loop.run_in_executor(None, candidate.evict)
+            except FileNotFoundError:
+                continue
+            except Exception:
+                logger.warning("failed to evict object", exc_info=True)
+                continue
+
+        logger.debug("evicted %d bytes from %s storage", freed, type_)
+        return freed
+
+    async def backup(self, destination, types=None):
+        """
+        Back up the data of all frontends.
+
+        :param destination: The directory to store the backup in.
+        :type destination: :class:`pathlib.Path`
+        :param types: The storage types to back up (defaults to all types).
+        :type types: iterable of :class:`~.StorageType`
+
+        The data of each storage type is copied into a subdirectory of
+        `destination` named after the type; see :meth:`.Frontend.backup` for
+        details. Frontends are backed up one after the other to keep the
+        impact on other disk access low. If any frontend fails, the backup
+        continues with the next one and the first error is re-raised at the
+        end.
+        """
+        if types is None:
+            types = list(StorageType)
+
+        results = []
+        for type_ in types:
+            for name, frontend in self.frontends.items():
+                logger.debug("backing up %s storage of %s", type_, name)
+                try:
+                    await frontend.backup(type_, destination / type_.value)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as exc:
+                    results.append(exc)
+        _raise_first_error(results)
+
+
+class CacheEvictor:
+    """
+    Keep the :attr:`~.StorageType.CACHE` storage within a quota.
+
+    :param accounting: The accounting to use.
+    :type accounting: :class:`StorageAccounting`
+    :param quota: Maximum size of the cache in bytes.
+    :type quota: :class:`int`
+    :param interval: Delay in seconds between two checks.
+    :type interval: :class:`float`
+    :param low_watermark: Fraction of `quota` to shrink the cache to when it
+        exceeds the quota.
+    :type low_watermark: :class:`float`
+
+    When started, the usage of the cache is checked every `interval`
+    seconds. If it exceeds `quota`, the least recently accessed objects are
+    deleted until it is below `low_watermark` times `quota`. Only the usage
+    of frontends whose objects can be evicted counts against the quota;
+    data which is never evicted (such as the XML storage) could otherwise
+    keep the cache above the quota forever.
+
+    .. automethod:: start
+
+    .. automethod:: stop
+
+    .. automethod:: check
+    """
+
+    def __init__(self, accounting, quota, *,
+                 interval=600,
+                 low_watermark=0.9):
+        super().__init__()
+        self._accounting = accounting
+        self.quota = quota
+        self.interval = interval
+        self.low_watermark = low_watermark
+        self._task = None
+
+    async def check(self):
+        """
+        Check the cache usage and evict objects if it exceeds the quota.
+
+        :rtype: :class:`int`
+        :return: The number of bytes freed.
+        """
+        usage = await self._accounting.total_usage(
+            StorageType.CACHE,
+            evictable=True,
+        )
+        if usage <= self.quota:
+            return 0
+
+        logger.info(
+            "evictable cache objects use %d bytes (quota: %d bytes), "
+            "evicting",
+            usage, self.quota,
+        )
+        return await self._accounting.evict(
+            StorageType.CACHE,
+            usage - int(self.quota * self.low_watermark),
+        )
+
+    async def _run(self):
+        while True:
+            try:
+                await self.check()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning("cache eviction failed", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """
+        Start checking the cache periodically in a background task.
+        """
+        if self._task is not None:
+            return
+        self._task = jclib.tasks.manager.start(self._run())
+
+    def stop(self):
+        """
+        Stop the background task.
+        """
+        if self._task is None:
+            return
+        self._task.asyncio_task.cancel()
+        self._task = None
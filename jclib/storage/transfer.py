@@ -0,0 +1,555 @@
+"""
+Moving data between storage frontends.
+
+Data which is stored in a frontend unfit for its access pattern can be
+copied or moved to another frontend with :func:`transfer`. The frontends
+are wrapped in endpoints which address each piece of data with a
+:class:`Key` and exchange it as :class:`bytes` or, to stream it, as
+binary file objects:
+
+.. autoclass:: Key
+
+.. autoclass:: SmallBlobEndpoint
+
+.. autoclass:: LargeBlobEndpoint
+
+.. autoclass:: XMLEndpoint
+
+.. autofunction:: transfer
+
+.. autoclass:: TransferResult
+
+.. autoclass:: Checkpoint
+
+.. autofunction:: make_keys
+"""
+import asyncio
+import collections
+import hashlib
+import io
+import itertools
+import json
+import logging
+import os
+import shutil
+
+import aioxmpp.xml
+import aioxmpp.xso
+
+from .. import utils
+from .common import StorageLevel
+
+
+logger = logging.getLogger(__name__)
+
+
+utils.jabbercat_ns.xml_storage_transfer = \
+    "https://xmlns.jabbercat.org/storage/transfer/1.0"
+
+
+#: Default number of keys transferred between two checkpoints.
+BATCH_SIZE = 100
+
+#: Size of the chunks in which data is copied and compared.
+CHUNK_SIZE = 1024*1024
+
+
+Key = collections.namedtuple(
+    "Key",
+    [
+        "type_",
+        "level",
+        "namespace",
+        "name",
+    ]
+)
+Key.__doc__ = """
+Address of a piece of data in a frontend.
+
+For :class:`XMLEndpoint`, `namespace` and `name` are the namespace and the
+local name of the XSO type.
+"""
+
+
+def make_keys(type_, levels, namespace, names):
+    """
+    Return the keys of the given names for each level descriptor.
+
+    :rtype: :class:`list` of :class:`Key`
+
+    This is useful with endpoints which cannot list the data they hold.
+    """
+    return [
+        Key(type_, level, namespace, name)
+        for level, name in itertools.product(levels, names)
+    ]
+
+
+def _encode_key(key):
+    return json.dumps(
+        [
+            key.type_.value,
+            key.level.level.value,
+            [str(jid) for jid in key.level],
+            key.namespace,
+            key.name,
+        ],
+        separators=(",", ":"),
+    )
+
+
+class Checkpoint:
+    """
+    Record of the keys which have been transferred.
+
+    :param path: The file to keep the record in.
+    :type path: :class:`pathlib.Path`
+
+    The record is appended to and survives interruptions, so that a
+    transfer which is restarted with the same checkpoint skips the keys
+    which have been transferred before. Use a separate checkpoint for each
+    pair of endpoints.
+
+    .. automethod:: add
+
+    .. automethod:: close
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self._done = set()
+        try:
+            with path.open("r", encoding="utf-8") as f:
+                for line in f:
+                    # a torn last line is not a complete record
+                    if line.endswith("\n"):
+                        self._done.add(line[:-1])
+        except FileNotFoundError:
+            pass
+        utils.mkdir_exist_ok(path.parent)
+        self._f = path.open("a", encoding="utf-8")
+
+    def __contains__(self, key):
+        return _encode_key(key) in self._done
+
+    def __len__(self):
+        return len(self._done)
+
+    def add(self, keys):
+        """
+        Record keys as transferred.
+
+        :param keys: The keys.
+        :type keys: iterable of :class:`Key`
+
+        The record is synced to disk before this returns.
+        """
+        for key in keys:
+            encoded = _encode_key(key)
+            if encoded in self._done:
+                continue
+            self._done.add(encoded)
+            self._f.write(encoded + "\n")
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def close(self):
+        """
+        Close the checkpoint file.
+        """
+        self._f.close()
+
+
+class _HashingReader:
+    """
+    Binary file wrapper which hashes the data read through it.
+    """
+
+    def __init__(self, f):
+        super().__init__()
+        self._f = f
+        self._hash = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self._f.read(size)
+        self._hash.update(data)
+        return data
+
+    def digest(self):
+        """
+        Read the rest of the file and return the digest of all its data.
+
+        This blocks on file I/O.
+        """
+        while self.read(CHUNK_SIZE):
+            pass
+        return self._hash.digest()
+
+
+async def _digest(f):
+    reader = f if isinstance(f, _HashingReader) else _HashingReader(f)
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, reader.digest)
+
+
+class Endpoint:
+    """
+    Adapter between :func:`transfer` and a frontend.
+
+    :func:`transfer` uses :meth:`open` and :meth:`write_file`, which
+    exchange the data as binary file objects. By default, they hold the
+    data in memory and use :meth:`read` and :meth:`write`; endpoints for
+    large data override them to copy it in chunks.
+    """
+
+    #: Whether the endpoint implements :meth:`remove`.
+    CAN_REMOVE = False
+
+    def __init__(self, frontend):
+        super().__init__()
+        self.frontend = frontend
+
+    async def keys(self, type_):
+        """
+        Return the keys of all data of a storage type.
+
+        :raises NotImplementedError: if the frontend cannot list its data.
+        """
+        raise NotImplementedError
+
+    async def read(self, key):
+        """
+        Return the data stored under a key.
+
+        :raises KeyError: if there is no such data.
+        """
+        raise NotImplementedError
+
+    async def write(self, key, data):
+        """
+        Store data under a key.
+
+        The data only needs to be persistent after the next :meth:`flush`.
+        """
+        raise NotImplementedError
+
+    async def open(self, key):
+        """
+        Return a binary file object to read the data stored under a key.
+
+        :raises KeyError: if there is no such data.
+
+        The caller closes the file. Reading it may block.
+        """
+        return io.BytesIO(await self.read(key))
+
+    async def write_file(self, key, f):
+        """
+        Store the data read from a binary file object under a key.
+
+        Reading `f` may block. See :meth:`write`.
+        """
+        loop = asyncio.get_event_loop()
+        data = await loop.run_in_executor(None, f.read)
+        await self.write(key, data)
+
+    async def remove(self, key):
+        """
+        Delete the data stored under a key.
+
+        :raises KeyError: if there is no such data.
+        """
+        raise NotImplementedError
+
+    async def flush(self):
+        """
+        Make all writes and removals persistent.
+        """
+
+
+class SmallBlobEndpoint(Endpoint):
+    """
+    Endpoint for a :class:`~.SmallBlobFrontend`.
+
+    This endpoint can list its data.
+    """
+
+    CAN_REMOVE = True
+
+    async def keys(self, type_):
+        blobs = await self.frontend._run_in_executor(
+            self.frontend._list_blobs,
+            type_,
+        )
+        return [
+            Key(type_, level, namespace, name)
+            for level, namespace, name in blobs
+        ]
+
+    async def read(self, key):
+        return await self.frontend.load(*key)
+
+    async def write(self, key, data):
+        await self.frontend.store(*key, data)
+
+    async def remove(self, key):
+        try:
+            await self.frontend.unlink(*key)
+        except FileNotFoundError as exc:
+            raise KeyError(key) from exc
+
+
+class LargeBlobEndpoint(Endpoint):
+    """
+    Endpoint for a :class:`~.LargeBlobFrontend`.
+
+    The frontend cannot list its data, since the level keys cannot be
+    recovered from the file names. The keys have to be passed to
+    :func:`transfer` explicitly, see :func:`make_keys`.
+
+    Blobs are written atomically using :func:`~.utils.safe_writer`. When
+    used by :func:`transfer`, they are read and written in chunks of
+    :data:`CHUNK_SIZE` bytes instead of being held in memory.
+    """
+
+    CAN_REMOVE = True
+
+    def _open(self, key):
+        path = self.frontend._get_blob_path(*key)
+        try:
+            return path.open("rb")
+        except FileNotFoundError as exc:
+            raise KeyError(key) from exc
+
+    def _read(self, key):
+        with self._open(key) as f:
+            return f.read()
+
+    def _write_file(self, key, f):
+        path = self.frontend._get_blob_path(*key)
+        utils.mkdir_exist_ok(path.parent)
+        with utils.safe_writer(path) as dest:
+            shutil.copyfileobj(f, dest, CHUNK_SIZE)
+
+    async def read(self, key):
+        return await self.frontend._run_in_executor(self._read, key)
+
+    async def write(self, key, data):
+        await self.write_file(key, io.BytesIO(data))
+
+    async def open(self, key):
+        return await self.frontend._run_in_executor(self._open, key)
+
+    async def write_file(self, key, f):
+        await self.frontend._run_in_executor(self._write_file, key, f)
+
+    async def remove(self, key):
+        try:
+            await self.frontend.unlink(*key)
+        except FileNotFoundError as exc:
+            raise KeyError(key) from exc
+
+
+class _XSOContainer(aioxmpp.xso.XSO):
+    TAG = utils.jabbercat_ns.xml_storage_transfer, "xsos"
+
+    items = aioxmpp.xso.ChildList([])
+
+
+class XMLEndpoint(Endpoint):
+    """
+    Endpoint for a :class:`~.XMLFrontend`.
+
+    :param xso_types: The XSO types to transfer.
+    :type xso_types: iterable of :class:`aioxmpp.xso.XSO` subclasses
+
+    The data of a key is the list of all instances of the XSO type for the
+    level key (see :meth:`~.XMLFrontend.get_all`), serialised as children
+    of a container element. The XSO types have to be registered with the
+    frontend.
+
+    The frontend cannot list its data and does not support removal.
+    :func:`transfer` thus refuses to move data out of it; copy it and
+    :meth:`~.Frontend.clear` the levels afterwards instead.
+    """
+
+    def __init__(self, frontend, xso_types):
+        super().__init__(frontend)
+        self._xso_types = {}
+        for xso_type in xso_types:
+            self._xso_types[xso_type.TAG] = xso_type
+            if xso_type.TAG not in _XSOContainer.CHILD_MAP:
+                _XSOContainer.register_child(_XSOContainer.items, xso_type)
+
+    def _xso_type(self, key):
+        try:
+            return self._xso_types[key.namespace, key.name]
+        except KeyError:
+            raise ValueError(
+                "no XSO type for {{{}}}{}".format(key.namespace, key.name)
+            ) from None
+
+    async def read(self, key):
+        xsos = self.frontend.get_all(key.type_, key.level,
+                                     self._xso_type(key))
+        if not xsos:
+            raise KeyError(key)
+        container = _XSOContainer()
+        container.items.extend(xsos)
+        return aioxmpp.xml.serialize_single_xso(container).encode("utf-8")
+
+    async def write(self, key, data):
+        xso_type = self._xso_type(key)
+        container = aioxmpp.xml.read_single_xso(io.BytesIO(data),
+                                                _XSOContainer)
+        xsos = [xso for xso in container.items if isinstance(xso, xso_type)]
+        if not xsos:
+            raise ValueError("no {} in data".format(xso_type.__name__))
+        self.frontend.put(key.type_, key.level, xsos)
+
+    async def flush(self):
+        await self.frontend.flush_all_async()
+
+
+TransferResult = collections.namedtuple(
+    "TransferResult",
+    [
+        "transferred",
+        "skipped",
+        "missing",
+        "mismatched",
+    ]
+)
+TransferResult.__doc__ = """
+Outcome of :func:`transfer`.
+
+.. attribute:: transferred
+
+   Number of keys which have been copied (or moved) and verified.
+
+.. attribute:: skipped
+
+   Number of keys which were recorded in the checkpoint already.
+
+.. attribute:: missing
+
+   Number of keys for which the source has no data.
+
+.. attribute:: mismatched
+
+   The keys whose data could not be read back unchanged from the
+   destination. Their data is left in the source.
+"""
+
+
+async def transfer(source, destination, keys, *,
+                   checkpoint=None,
+                   move=False,
+                   verify=True,
+                   batch_size=BATCH_SIZE):
+    """
+    Copy or move data from one endpoint to another.
+
+    :param source: The endpoint to read from.
+    :type source: :class:`Endpoint`
+    :param destination: The endpoint to write to.
+    :type destination: :class:`Endpoint`
+    :param keys: The keys to transfer.
+    :type keys: iterable of :class:`Key`
+    :param checkpoint: Record of the keys transferred so far.
+    :type checkpoint: :class:`Checkpoint`
+    :param move: Whether to remove the data from the source.
+    :type move: :class:`bool`
+    :param verify: Whether to read back the data from the destination.
+    :type verify: :class:`bool`
+    :param batch_size: Number of keys to transfer between two checkpoints.
+    :type batch_size: :class:`int`
+    :raises ValueError: if `move` is true and `source` cannot remove data.
+    :rtype: :class:`TransferResult`
+
+    The keys are processed one at a time, in batches of `batch_size` keys.
+    The data of a key is streamed from :meth:`Endpoint.open` of the source
+    to :meth:`Endpoint.write_file` of the destination, so that at most the
+    data of a single key is held in memory. At the end of
+    each batch, the destination is flushed and the transferred keys are
+    added to `checkpoint`. Only then, if `move` is true, the data is removed
+    from the source. Interrupting a transfer thus never loses data, and
+    restarting it with the same checkpoint continues after the last complete
+    batch.
+
+    If `verify` is true, the data of each key is read back from the
+    destination and its digest is compared with the digest of the data from
+    the source. Keys whose data differs are neither recorded nor removed
+    from the source.
+    """
+    if move and not source.CAN_REMOVE:
+        raise ValueError(
+            "cannot move data out of {}, which does not support "
+            "removal".format(type(source).__name__)
+        )
+
+    transferred = 0
+    skipped = 0
+    missing = 0
+    mismatched = []
+
+    async def finish_batch(batch):
+        await destination.flush()
+        if checkpoint is not None:
+            checkpoint.add(batch)
+        if not move:
+            return
+        for key in batch:
+            try:
+                await source.remove(key)
+            except KeyError:
+                pass
+        await source.flush()
+
+    batch = []
+    for key in keys:
+        if checkpoint is not None and key in checkpoint:
+            skipped += 1
+            continue
+
+        try:
+            f = await source.open(key)
+        except KeyError:
+            missing += 1
+            continue
+
+        with f:
+            reader = _HashingReader(f)
+            await destination.write_file(key, reader)
+            if verify:
+                digest = await _digest(reader)
+
+        if verify:
+            try:
+                f = await destination.open(key)
+            except KeyError:
+                written = None
+            else:
+                with f:
+                    written = await _digest(f)
+            if written != digest:
+                logger.error("data of %r changed during transfer", key)
+                mismatched.append(key)
+                continue
+
+        batch.append(key)
+        transferred += 1
+        if len(batch) >= batch_size:
+            await finish_batch(batch)
+            logger.debug("transferred %d keys", transferred)
+            batch = []
+
+    if batch:
+        await finish_batch(batch)
+
+    return TransferResult(
+        transferred=transferred,
+        skipped=skipped,
+        missing=missing,
+        mismatched=mismatched,
+    )
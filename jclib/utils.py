@@ -1,5 +1,6 @@
 import asyncio
 import binascii
+import concurrent.futures
 import contextlib
 import functools
 import hashlib
@@ -9,6 +10,7 @@ import os.path
 import pathlib
 import struct
 import tempfile
+import threading
 import time
 import types
 import typing
@@ -39,8 +41,15 @@ jclib_avatars_uid = "avatars"
 KEYRING_SERVICE_NAME = "net.zombofant.jclib"
 KEYRING_JID_FORMAT = "xmpp:{bare!s}"
 
+#: Number of threads used by :func:`fsync_all`.
+FSYNC_THREADS = 8
+
 logger = logging.getLogger(__name__)
 
+# the threads of fsync_all(), created on first use
+_fsync_executor = None
+_fsync_executor_lock = threading.Lock()
+
 
 if not hasattr(asyncio, "ensure_future"):
     asyncio.ensure_future = getattr(asyncio, "async")
@@ -484,6 +493,173 @@ def safe_writer(destpath, mode="wb", extra_paranoia=False):
                 fsync_dir(destpath.parent)
 
 
+def _get_fsync_executor():
+    global _fsync_executor
+    with _fsync_executor_lock:
+        if _fsync_executor is None:
+            _fsync_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=FSYNC_THREADS,
+                thread_name_prefix="fsync",
+            )
+        return _fsync_executor
+
+
+def _fsync_each(fds):
+    for fd in fds:
+        os.fsync(fd)
+
+
+def fsync_all(fds, max_threads=None):
+    """
+    Call :func:`os.fsync` on several file descriptors concurrently.
+
+    :param fds: The file descriptors to sync.
+    :type fds: iterable of :class:`int`
+    :param max_threads: Maximum number of concurrent syncs (defaults to
+        :data:`FSYNC_THREADS`).
+    :type max_threads: :class:`int`
+
+    Concurrent syncs of files on the same file system are usually combined
+    into a single journal commit by the file system, so that syncing several
+    files costs little more than syncing one. The syncs run in a pool of
+    :data:`FSYNC_THREADS` threads which is shared by all calls. This returns
+    when all syncs have finished; if a sync failed, its exception is
+    re-raised.
+    """
+    fds = list(fds)
+    if max_threads is None:
+        max_threads = FSYNC_THREADS
+    if len(fds) <= 1 or max_threads <= 1:
+        _fsync_each(fds)
+        return
+
+    nthreads = min(len(fds), max_threads)
+    executor = _get_fsync_executor()
+    futures = [
+        executor.submit(_fsync_each, fds[i::nthreads])
+        for i in range(nthreads)
+    ]
+    concurrent.futures.wait(futures)
+    for fut in futures:
+        fut.result()
+
+
+class GroupWriter:
+    """
+    Safely overwrite several files at once.
+
+    :param sync_dirs: Whether to sync the directories of the files after
+        replacing them.
+    :type sync_dirs: :class:`bool`
+
+    This is like :func:`safe_writer`, but the replacements of all files are
+    committed together: the temporary files are synced concurrently (see
+    :func:`fsync_all`), then all target files are replaced and finally each
+    affected directory is synced once. Used as context manager, the group
+    is committed when the context is left normally and aborted otherwise.
+
+    Each file is replaced atomically, but the group as a whole is not: after
+    a crash during :meth:`commit`, some files may have been replaced while
+    others have not. The temporary files stay open until the group is
+    committed or aborted.
+
+    .. automethod:: open
+
+    .. automethod:: commit
+
+    .. automethod:: abort
+    """
+
+    def __init__(self, *, sync_dirs=True):
+        super().__init__()
+        self.sync_dirs = sync_dirs
+        self._staged = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+
+    @contextlib.contextmanager
+    def open(self, destpath, mode="wb"):
+        """
+        Stage a replacement for a file.
+
+        :param destpath: The file to replace.
+        :type destpath: :class:`pathlib.Path`
+        :param mode: The mode to open the temporary file in.
+
+        The context manager provides the temporary file to write the new
+        contents to. If an exception is raised in the context, the temporary
+        file is discarded and the file is not replaced. Otherwise, the file
+        is replaced on :meth:`commit`.
+        """
+        destpath = pathlib.Path(destpath)
+        tmpfile = tempfile.NamedTemporaryFile(
+            mode=mode,
+            dir=str(destpath.parent),
+            delete=False,
+        )
+        try:
+            yield tmpfile
+            tmpfile.flush()
+            size = os.fstat(tmpfile.fileno()).st_size
+        except:  # NOQA
+            tmpfile.close()
+            os.unlink(tmpfile.name)
+            raise
+        self._staged.append((tmpfile, destpath, size))
+
+    def abort(self):
+        """
+        Discard all staged replacements.
+        """
+        staged, self._staged = self._staged, []
+        for tmpfile, _, _ in staged:
+            tmpfile.close()
+            try:
+                os.unlink(tmpfile.name)
+            except FileNotFoundError:
+                pass
+
+    def commit(self):
+        """
+        Replace the files with the staged replacements.
+
+        :rtype: :class:`int`
+        :return: The total size of the files in bytes.
+
+        If syncing fails, no file is replaced. If replacing a file fails, the
+        files staged after it are not replaced. In both cases, the remaining
+        temporary files are discarded and the exception is re-raised.
+        """
+        dirs = set()
+        nbytes = 0
+        try:
+            fsync_all(tmpfile.fileno() for tmpfile, _, _ in self._staged)
+            for tmpfile, _, _ in self._staged:
+                tmpfile.close()
+            while self._staged:
+                tmpfile, destpath, size = self._staged[0]
+                os.replace(tmpfile.name, str(destpath))
+                del self._staged[0]
+                dirs.add(destpath.parent)
+                nbytes += size
+        except:  # NOQA
+            self.abort()
+            raise
+
+        if self.sync_dirs:
+            for path in sorted(dirs):
+                fsync_dir(path)
+
+        return nbytes
+
+
 class DelayedInvocation:
     """
     Callable object which batches invocations and forwards them to a sink after
@@ -589,6 +765,8 @@ class DelayedInvocation:
     def _invoke(self):
         calls = self._calls
         self._calls = []
+        # the next invocation starts a new delay, even from within the sink
+        self._scheduled_call = None
         self.sink(calls)
 
     def __call__(self, *args, **kwargs):
@@ -1,10 +1,14 @@
+import functools
 import unittest
 import unittest.mock
 
+from datetime import datetime
+
 import sqlalchemy.sql
 
 import aioxmpp
 
+import jclib.storage.common
 import jclib.storage.frontends
 import jclib.storage.account_model as account_model
 
@@ -21,10 +25,21 @@ class TestSmallBlob(unittest.TestCase):
         self.db = inmemory_database(account_model.Base)
 
     def test_from_level_descriptor(self):
-        descriptor = unittest.mock.Mock(["account"])
-        blob = account_model.SmallBlob.from_level_descriptor(descriptor)
-        self.assertIsInstance(blob, account_model.SmallBlob)
-        self.assertEqual(blob.account, descriptor.account)
+        descriptor = jclib.storage.frontends.AccountLevel(
+            self.account,
+        )
+
+        with session_scope(self.db) as session:
+            blob = account_model.SmallBlob.from_level_descriptor(
+                session, descriptor
+            )
+            self.assertIsInstance(blob, account_model.SmallBlob)
+            self.assertEqual(
+                blob.account_id,
+                jclib.storage.common.jid_id(
+                    session, account_model.JIDEntry, self.account,
+                ),
+            )
 
     def test_filter_selects_by_primary_key(self):
         descriptor = jclib.storage.frontends.AccountLevel(
@@ -32,7 +47,7 @@ class TestSmallBlob(unittest.TestCase):
         )
 
         with session_scope(self.db) as session:
-            blob = account_model.SmallBlob.from_level_descriptor(descriptor)
+            blob = account_model.SmallBlob.from_level_descriptor(session, descriptor)
             blob.data = b"foo"
             blob.name = "name"
             session.add(blob)
@@ -64,7 +79,7 @@ class TestSmallBlob(unittest.TestCase):
         )
 
         with session_scope(self.db) as session:
-            blob = account_model.SmallBlob.from_level_descriptor(descriptor)
+            blob = account_model.SmallBlob.from_level_descriptor(session, descriptor)
             blob.data = b"foo"
             blob.name = "name"
             session.add(blob)
@@ -80,7 +95,7 @@ class TestSmallBlob(unittest.TestCase):
         )
 
         with session_scope(self.db) as session:
-            blob = account_model.SmallBlob.from_level_descriptor(descriptor)
+            blob = account_model.SmallBlob.from_level_descriptor(session, descriptor)
             blob.data = b"foo"
             blob.name = "name"
             session.add(blob)
@@ -112,7 +127,7 @@ class TestSmallBlob(unittest.TestCase):
         )
 
         with session_scope(self.db) as session:
-            blob = account_model.SmallBlob.from_level_descriptor(descriptor)
+            blob = account_model.SmallBlob.from_level_descriptor(session, descriptor)
             blob.data = b"foo"
             blob.name = "name"
             session.add(blob)
@@ -133,3 +148,141 @@ class TestSmallBlob(unittest.TestCase):
                     descriptor,
                     "othername"
                 )
+
+    def test_load_many(self):
+        other = aioxmpp.JID.fromstr("juliet@capulet.lit")
+        levels = [
+            jclib.storage.frontends.AccountLevel(account)
+            for account in [self.account, other]
+        ]
+        now = datetime(2020, 1, 1)
+
+        with session_scope(self.db) as session:
+            for level in levels:
+                for name in ["a", "b"]:
+                    blob = account_model.SmallBlob.from_level_descriptor(
+                        session, level,
+                    )
+                    blob.data = "{}/{}".format(level.account, name).encode()
+                    blob.name = name
+                    session.add(blob)
+
+        with session_scope(self.db) as session:
+            result = account_model.SmallBlob.load_many(
+                session,
+                levels[:1] + [jclib.storage.frontends.AccountLevel(
+                    aioxmpp.JID.fromstr("unknown@server.example"),
+                )],
+                now=now,
+            )
+
+        self.assertEqual(
+            result,
+            [
+                (levels[0], name,
+                 "{}/{}".format(self.account, name).encode())
+                for name in ["a", "b"]
+            ]
+        )
+
+        with session_scope(self.db) as session:
+            self.assertEqual(
+                session.query(account_model.SmallBlob).filter(
+                    account_model.SmallBlob.accessed == now
+                ).count(),
+                2,
+            )
+
+    def test_load_many_budgets_accounts_and_names_per_statement(self):
+        accounts = [
+            aioxmpp.JID.fromstr("account{}@server.example".format(i))
+            for i in range(5)
+        ]
+        levels = [
+            jclib.storage.frontends.AccountLevel(account)
+            for account in accounts
+        ]
+        names = ["a", "b", "c"]
+
+        with session_scope(self.db) as session:
+            for level in reversed(levels):
+                for name in names:
+                    blob = account_model.SmallBlob.from_level_descriptor(
+                        session, level,
+                    )
+                    blob.data = "{}/{}".format(level.account, name).encode()
+                    blob.name = name
+                    session.add(blob)
+
+        statements = []
+
+        def record_statement(conn, cursor, statement, parameters, context,
+                             executemany):
+            statements.append((statement, parameters))
+
+        engine = self.db.kw["bind"]
+        sqlalchemy.event.listen(engine, "before_cursor_execute",
+                                record_statement)
+        jclib.storage.common._jid_id_caches.clear()
+        with session_scope(self.db) as session, \
+                unittest.mock.patch(
+                    "jclib.storage.account_model.chunked_in",
+                    new=functools.partial(jclib.storage.common.chunked_in,
+                                          size=4)):
+            result = account_model.SmallBlob.load_many(
+                session, levels, names,
+            )
+            ids = {
+                account: jclib.storage.common.jid_id(
+                    session, account_model.JIDEntry, account,
+                )
+                for account in accounts
+            }
+        sqlalchemy.event.remove(engine, "before_cursor_execute",
+                                record_statement)
+
+        self.assertEqual(
+            result,
+            sorted(
+                [
+                    (level, name,
+                     "{}/{}".format(level.account, name).encode())
+                    for level in levels
+                    for name in names
+                ],
+                key=lambda row: (ids[row[0].account], row[1]),
+            ),
+        )
+        self.assertEqual(
+            len([statement for statement, _ in statements
+                 if "FROM jids" in statement]),
+            1,
+        )
+        for statement, parameters in statements:
+            if "smallblobs" in statement:
+                self.assertLessEqual(len(parameters), 4)
+
+    def test_iter_keys(self):
+        other = aioxmpp.JID.fromstr("juliet@capulet.lit")
+        levels = [
+            jclib.storage.frontends.AccountLevel(account)
+            for account in [self.account, other]
+        ]
+
+        with session_scope(self.db) as session:
+            for level, name in [(levels[0], "a"), (levels[0], "b"),
+                                (levels[1], "a")]:
+                blob = account_model.SmallBlob.from_level_descriptor(
+                    session, level,
+                )
+                blob.data = b"x"
+                blob.name = name
+                session.add(blob)
+
+        with session_scope(self.db) as session:
+            keys = set(account_model.SmallBlob.iter_keys(session))
+
+        self.assertEqual(
+            keys,
+            {(levels[0], "a"), (levels[0], "b"), (levels[1], "a")},
+        )
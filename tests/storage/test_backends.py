@@ -134,3 +134,17 @@ class TestXDGBackend(unittest.TestCase):
                 unittest.mock.sentinel.appnamed1,
             ]
         )
+
+
+class TestDirectoryBackend(unittest.TestCase):
+    def setUp(self):
+        self.path = pathlib.Path("/foo")
+        self.b = backends.DirectoryBackend(self.path)
+
+    def test_type_base_paths(self):
+        for type_, writable in itertools.product(backends.StorageType,
+                                                [False, True]):
+            self.assertSequenceEqual(
+                list(self.b.type_base_paths(type_, writable)),
+                [self.path / type_.value],
+            )
@@ -1,8 +1,22 @@
 import contextlib
+import functools
 import unittest
 import unittest.mock
 
+import aioxmpp
+
+import sqlalchemy
+
 import jclib.storage.common as common
+import jclib.storage.peer_model as peer_model
+
+from jclib.testutils import (
+    inmemory_database
+)
+
+
+TEST_JID1 = aioxmpp.JID.fromstr("romeo@montague.lit")
+TEST_JID2 = aioxmpp.JID.fromstr("juliet@capulet.lit")
 
 
 class Testsession_scope(unittest.TestCase):
@@ -48,3 +62,207 @@ class Testsession_scope(unittest.TestCase):
         self.session.commit.assert_not_called()
         self.session.rollback.assert_called_once_with()
         self.session.close.assert_called_once_with()
+
+
+class Testjid_id(unittest.TestCase):
+    def setUp(self):
+        self.db = inmemory_database(peer_model.Base)
+
+    def test_returns_None_for_unknown_jid(self):
+        with common.session_scope(self.db) as session:
+            self.assertIsNone(
+                common.jid_id(session, peer_model.JIDEntry, TEST_JID1)
+            )
+
+    def test_create_assigns_distinct_ids(self):
+        with common.session_scope(self.db) as session:
+            id1 = common.jid_id(session, peer_model.JIDEntry, TEST_JID1,
+                                create=True)
+            id2 = common.jid_id(session, peer_model.JIDEntry, TEST_JID2,
+                                create=True)
+            self.assertNotEqual(id1, id2)
+            self.assertEqual(
+                common.jid_id(session, peer_model.JIDEntry, TEST_JID1),
+                id1,
+            )
+
+        with common.session_scope(self.db) as session:
+            self.assertEqual(
+                session.query(peer_model.JIDEntry.jid).filter(
+                    peer_model.JIDEntry.id == id1
+                ).scalar(),
+                TEST_JID1,
+            )
+
+    def test_committed_ids_are_served_from_cache(self):
+        with common.session_scope(self.db) as session:
+            id_ = common.jid_id(session, peer_model.JIDEntry, TEST_JID1,
+                                create=True)
+
+        with common.session_scope(self.db) as session:
+            session.query(peer_model.JIDEntry).delete()
+
+        with common.session_scope(self.db) as session:
+            self.assertEqual(
+                common.jid_id(session, peer_model.JIDEntry, TEST_JID1),
+                id_,
+            )
+
+    def test_rolled_back_ids_are_not_cached(self):
+        with self.assertRaises(RuntimeError):
+            with common.session_scope(self.db) as session:
+                common.jid_id(session, peer_model.JIDEntry, TEST_JID1,
+                              create=True)
+                raise RuntimeError()
+
+        with common.session_scope(self.db) as session:
+            self.assertIsNone(
+                common.jid_id(session, peer_model.JIDEntry, TEST_JID1)
+            )
+
+
+class Testjid_ids(unittest.TestCase):
+    def setUp(self):
+        self.db = inmemory_database(peer_model.Base)
+        self.statements = []
+        sqlalchemy.event.listen(
+            self.db.kw["bind"],
+            "before_cursor_execute",
+            self._record_statement,
+        )
+
+    def _record_statement(self, conn, cursor, statement, parameters,
+                          context, executemany):
+        if statement.startswith("SELECT"):
+            self.statements.append(parameters)
+
+    def test_looks_up_uncached_jids_in_chunks(self):
+        jids = [
+            aioxmpp.JID.fromstr("peer{}@server.example".format(i))
+            for i in range(5)
+        ]
+
+        with common.session_scope(self.db) as session:
+            ids = {
+                jid: common.jid_id(session, peer_model.JIDEntry, jid,
+                                   create=True)
+                for jid in jids[1:]
+            }
+
+        common._jid_id_caches.clear()
+        with common.session_scope(self.db) as session:
+            self.assertEqual(
+                common.jid_id(session, peer_model.JIDEntry, jids[1]),
+                ids[jids[1]],
+            )
+            del self.statements[:]
+
+            with unittest.mock.patch(
+                    "jclib.storage.common.chunked",
+                    new=functools.partial(common.chunked, size=2)):
+                result = common.jid_ids(
+                    session, peer_model.JIDEntry, jids + [jids[2]],
+                )
+
+        self.assertEqual(result, ids)
+        # the cached id is not queried
+        self.assertEqual(len(self.statements), 2)
+        self.assertCountEqual(
+            [param for params in self.statements for param in params],
+            [str(jid) for jid in jids if jid != jids[1]],
+        )
+
+    def test_returns_uncommitted_ids_of_session(self):
+        with common.session_scope(self.db) as session:
+            id_ = common.jid_id(session, peer_model.JIDEntry, TEST_JID1,
+                                create=True)
+            self.assertEqual(
+                common.jid_ids(session, peer_model.JIDEntry, [TEST_JID1]),
+                {TEST_JID1: id_},
+            )
+
+
+class Testchunked_in(unittest.TestCase):
+    def test_without_names(self):
+        self.assertEqual(
+            list(common.chunked_in(list(range(5)), size=2)),
+            [([0, 1], None), ([2, 3], None), ([4], None)],
+        )
+
+    def test_budgets_values_names_and_fixed_parameters(self):
+        values = list(range(20))
+        names = ["n{}".format(i) for i in range(7)]
+
+        chunks = list(common.chunked_in(values, names, nfixed=1, size=9))
+
+        for values_chunk, names_chunk in chunks:
+            self.assertLessEqual(len(values_chunk) + len(names_chunk) + 1, 9)
+        self.assertCountEqual(
+            [(value, name)
+             for values_chunk, names_chunk in chunks
+             for value in values_chunk
+             for name in names_chunk],
+            [(value, name) for value in values for name in names],
+        )
+
+    def test_few_names_leave_budget_to_values(self):
+        chunks = list(common.chunked_in(list(range(10)), ["a"], size=6))
+        self.assertEqual(
+            chunks,
+            [([0, 1, 2, 3, 4], ["a"]), ([5, 6, 7, 8, 9], ["a"])],
+        )
+
+    def test_no_names_yield_nothing(self):
+        self.assertEqual(list(common.chunked_in([1, 2], [])), [])
+
+
+class Testmigrate_to_jid_ids(unittest.TestCase):
+    def setUp(self):
+        self.engine = sqlalchemy.create_engine("sqlite:///:memory:")
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_noop_without_table(self):
+        with self.engine.begin() as connection:
+            self.assertFalse(peer_model.SmallBlob.migrate(connection))
+
+    def test_noop_on_migrated_table(self):
+        with self.engine.begin() as connection:
+            peer_model.Base.metadata.create_all(connection)
+            self.assertFalse(peer_model.SmallBlob.migrate(connection))
+
+    def test_migrates_rows(self):
+        with self.engine.begin() as connection:
+            connection.execute(
+                "CREATE TABLE smallblobs (account VARCHAR(2047), "
+                "peer VARCHAR(2047), name VARCHAR(255), data BLOB, "
+                "st_birthtime DATETIME, st_mtime DATETIME, "
+                "st_atime DATETIME, PRIMARY KEY (account, peer, name))"
+            )
+            connection.execute(
+                "INSERT INTO smallblobs (account, peer, name, data) "
+                "VALUES (?, ?, 'name', ?)",
+                str(TEST_JID1), str(TEST_JID2), b"foo",
+            )
+            connection.execute(
+                "INSERT INTO smallblobs (account, peer, name, data) "
+                "VALUES (?, ?, 'name', ?)",
+                str(TEST_JID1), str(TEST_JID1), b"bar",
+            )
+
+            self.assertTrue(peer_model.SmallBlob.migrate(connection))
+
+        sessionmaker = sqlalchemy.orm.sessionmaker(bind=self.engine)
+        with common.session_scope(sessionmaker) as session:
+            level = unittest.mock.Mock(["account", "peer", "level"])
+            level.account = TEST_JID1
+            level.peer = TEST_JID2
+            level.level = common.StorageLevel.PEER
+            blob = peer_model.SmallBlob.filter_by(
+                session.query(peer_model.SmallBlob), level, "name",
+            ).one()
+            self.assertEqual(blob.data, b"foo")
+
+            self.assertEqual(session.query(peer_model.SmallBlob).count(), 2)
+            self.assertEqual(session.query(peer_model.JIDEntry).count(), 2)
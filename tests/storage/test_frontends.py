@@ -1,22 +1,33 @@
 import asyncio
+import collections
 import contextlib
+import gc
 import itertools
 import io
+import os
 import pathlib
+import sqlite3
 import tempfile
+import threading
+import time
 import unittest
 import unittest.mock
 import uuid
+import weakref
+import xml.parsers.expat
 import xml.sax
 
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import aioxmpp
 
+import sqlalchemy
+
 import jclib.storage.account_model
 import jclib.storage.common
 import jclib.storage.peer_model
 import jclib.storage.frontends as frontends
+import jclib.utils
 
 from aioxmpp.testutils import (
     run_coroutine,
@@ -50,6 +61,14 @@ class MockBackend(jclib.storage.backends.Backend):
         self.__tempdir.__exit__(exc_type, exc_value, tb)
 
 
+class DirectoryBackend(jclib.storage.backends.Backend):
+    def __init__(self, path):
+        self.path = path
+
+    def type_base_paths(self, type_, writable):
+        return [self.path / type_.value]
+
+
 class Data1(aioxmpp.xso.XSO):
     TAG = (NS, "data1")
 
@@ -189,6 +208,11 @@ class Testencode_uuid(unittest.TestCase):
 
 
 class TestAccountLevel(unittest.TestCase):
+    def setUp(self):
+        # the key paths are cached with the patched encode_jid otherwise
+        frontends._clear_path_caches()
+        self.addCleanup(frontends._clear_path_caches)
+
     def test_key_path(self):
         il = frontends.AccountLevel(
             unittest.mock.sentinel.account,
@@ -210,8 +234,26 @@ class TestAccountLevel(unittest.TestCase):
                 encode_jid()
             )
 
+    def test_key_path_is_cached(self):
+        with unittest.mock.patch(
+                "jclib.storage.frontends.encode_jid") as encode_jid:
+            result1 = frontends.AccountLevel(
+                unittest.mock.sentinel.account,
+            ).key_path
+            result2 = frontends.AccountLevel(
+                unittest.mock.sentinel.account,
+            ).key_path
+
+        encode_jid.assert_called_once_with(unittest.mock.sentinel.account)
+        self.assertIs(result1, result2)
+
 
 class TestPeerLevel(unittest.TestCase):
+    def setUp(self):
+        # the key paths are cached with the patched encode_jid otherwise
+        frontends._clear_path_caches()
+        self.addCleanup(frontends._clear_path_caches)
+
     def test_key_path(self):
         encoded = unittest.mock.MagicMock()
 
@@ -249,6 +291,29 @@ class TestPeerLevel(unittest.TestCase):
                 encoded.jid0.__truediv__()
             )
 
+    def test_key_path_is_cached(self):
+        account = aioxmpp.JID.fromstr("juliet@capulet.lit")
+        peers = [
+            aioxmpp.JID.fromstr("romeo@montague.lit"),
+            aioxmpp.JID.fromstr("tybalt@capulet.lit"),
+        ]
+
+        with unittest.mock.patch(
+                "jclib.storage.frontends.encode_jid",
+                wraps=frontends.encode_jid) as encode_jid:
+            results = [
+                frontends.PeerLevel(account, peer).key_path
+                for peer in peers * 2
+            ]
+
+        # the account is only encoded once
+        self.assertEqual(len(encode_jid.mock_calls), 3)
+        self.assertEqual(results[:2], results[2:])
+        self.assertEqual(
+            results[0],
+            frontends.encode_jid(account) / frontends.encode_jid(peers[0]),
+        )
+
 
 class Test_PerLevelMixin(unittest.TestCase):
     class Frontend(frontends._PerLevelMixin, frontends.Frontend):
@@ -364,6 +429,49 @@ class Test_PerLevelKeyFileMixin(unittest.TestCase):
         )
 
 
+    def test__get_path_is_cached(self):
+        self.backend.type_base_paths.return_value = [pathlib.Path("/base")]
+        level = frontends.AccountLevel(
+            aioxmpp.JID.fromstr("juliet@capulet.lit"),
+        )
+
+        result1 = self.f._get_path(
+            jclib.storage.common.StorageType.CACHE,
+            level,
+            "urn:test",
+            "name",
+        )
+        result2 = self.f._get_path(
+            jclib.storage.common.StorageType.CACHE,
+            frontends.AccountLevel(
+                aioxmpp.JID.fromstr("juliet@capulet.lit"),
+            ),
+            "urn:test",
+            "name",
+        )
+
+        self.assertIs(result1, result2)
+        self.backend.type_base_paths.assert_called_once_with(
+            jclib.storage.common.StorageType.CACHE,
+            True,
+        )
+
+    def test__get_path_cache_does_not_keep_frontend_alive(self):
+        self.backend.type_base_paths.return_value = [pathlib.Path("/base")]
+        self.f._get_path(
+            jclib.storage.common.StorageType.CACHE,
+            frontends.AccountLevel(
+                aioxmpp.JID.fromstr("juliet@capulet.lit"),
+            ),
+            "urn:test",
+            "name",
+        )
+
+        ref = weakref.ref(self.f)
+        del self.f
+        gc.collect()
+        self.assertIsNone(ref())
+
 class Test_get_engine(unittest.TestCase):
     def test__get_engine(self):
         path = unittest.mock.Mock()
@@ -400,11 +508,322 @@ class Test_get_engine(unittest.TestCase):
                     unittest.mock.call()(unittest.mock.ANY),
                     unittest.mock.call(create_engine(), "begin"),
                     unittest.mock.call()(unittest.mock.ANY),
+                    unittest.mock.call(create_engine(),
+                                       "before_cursor_execute"),
+                    unittest.mock.call()(frontends._note_activity),
                 ]
             )
 
             self.assertEqual(result, create_engine())
 
+    def test_statements_reset_idle_time(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            engine = frontends._get_engine(
+                pathlib.Path(tmpdir) / "test.sqlite"
+            )
+            try:
+                with unittest.mock.patch.object(frontends, "_last_activity",
+                                                0.0):
+                    self.assertGreater(frontends.idle_time(), 1)
+                    engine.execute("SELECT 1")
+                    self.assertLess(frontends.idle_time(), 1)
+            finally:
+                engine.dispose()
+
+
+class TestEngineRegistry(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.base = pathlib.Path(self.tmpdir.name)
+        self.r = frontends.EngineRegistry(max_engines=2, idle_timeout=10)
+        self.addCleanup(self.r.close_all)
+
+    def test_shares_engines(self):
+        engine = self.r.get(self.base / "a.sqlite")
+        self.assertIsInstance(engine, sqlalchemy.engine.Engine)
+        self.assertIs(self.r.get(self.base / "a.sqlite"), engine)
+        self.assertIsNot(self.r.get(self.base / "b.sqlite"), engine)
+        self.assertEqual(self.r.open_engines, 2)
+        self.assertEqual(self.r.metrics["opened"], 2)
+
+    def test_calls_setup_once(self):
+        setup = unittest.mock.Mock()
+
+        result = self.r.get(self.base / "a.sqlite", setup)
+        self.assertIs(self.r.get(self.base / "a.sqlite", setup), result)
+
+        setup.assert_called_once_with(unittest.mock.ANY)
+        self.assertEqual(result, setup())
+
+    def test_opens_different_databases_concurrently(self):
+        entered = threading.Event()
+        release = threading.Event()
+
+        def blocking_setup(engine):
+            entered.set()
+            release.wait(5)
+            return engine
+
+        thread = threading.Thread(
+            target=self.r.get,
+            args=(self.base / "a.sqlite", blocking_setup),
+        )
+        thread.start()
+        try:
+            self.assertTrue(entered.wait(5))
+            # returns while the setup of a.sqlite is still running
+            self.assertIsInstance(self.r.get(self.base / "b.sqlite"),
+                                  sqlalchemy.engine.Engine)
+        finally:
+            release.set()
+            thread.join()
+
+        self.assertEqual(self.r.open_engines, 2)
+        self.assertFalse(self.r._open_locks)
+
+    def test_concurrent_opens_of_a_database_set_it_up_once(self):
+        release = threading.Event()
+        calls = []
+
+        def blocking_setup(engine):
+            calls.append(engine)
+            release.wait(5)
+            return engine
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    self.r.get(self.base / "a.sqlite", blocking_setup),
+                ),
+            )
+            for _ in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, calls * 3)
+        self.assertFalse(self.r._open_locks)
+
+    def test_closes_engine_if_setup_fails(self):
+        setup = unittest.mock.Mock(side_effect=RuntimeError())
+
+        with self.assertRaises(RuntimeError):
+            self.r.get(self.base / "a.sqlite", setup)
+
+        self.assertEqual(self.r.open_engines, 0)
+
+    def test_counts_checked_out_connections(self):
+        engine = self.r.get(self.base / "a.sqlite")
+
+        with engine.connect():
+            self.assertEqual(self.r.open_connections, 1)
+            with engine.connect():
+                self.assertEqual(self.r.open_connections, 2)
+        self.assertEqual(self.r.open_connections, 0)
+
+    def test_evicts_least_recently_used_engine(self):
+        a = self.r.get(self.base / "a.sqlite")
+        self.r.get(self.base / "b.sqlite")
+        self.r.get(self.base / "a.sqlite")
+
+        with unittest.mock.patch.object(type(a), "dispose") as dispose:
+            self.r.get(self.base / "c.sqlite")
+
+        dispose.assert_called_once_with()
+        self.assertEqual(self.r.open_engines, 2)
+        self.assertEqual(self.r.metrics["evicted"], 1)
+        self.assertIs(self.r.get(self.base / "a.sqlite"), a)
+
+    def test_does_not_evict_engines_in_use(self):
+        a = self.r.get(self.base / "a.sqlite")
+        b = self.r.get(self.base / "b.sqlite")
+
+        with a.connect(), b.connect():
+            self.r.get(self.base / "c.sqlite")
+            self.assertEqual(self.r.open_engines, 3)
+
+        self.assertIs(self.r.get(self.base / "a.sqlite"), a)
+        self.assertEqual(self.r.open_engines, 2)
+
+    def test_closes_idle_engines(self):
+        with unittest.mock.patch("time.monotonic", return_value=100):
+            a = self.r.get(self.base / "a.sqlite")
+            b = self.r.get(self.base / "b.sqlite")
+
+        with unittest.mock.patch("time.monotonic", return_value=112):
+            with a.connect():
+                self.assertEqual(self.r.close_idle(), 1)
+
+        with unittest.mock.patch("time.monotonic", return_value=120):
+            self.assertEqual(self.r.close_idle(), 0)
+
+        with unittest.mock.patch("time.monotonic", return_value=123):
+            self.assertEqual(self.r.close_idle(), 1)
+            self.assertIsNot(self.r.get(self.base / "a.sqlite"), a)
+            self.assertIsNot(self.r.get(self.base / "b.sqlite"), b)
+
+        self.assertEqual(self.r.metrics["idle"], 2)
+
+    def test_start_closes_idle_engines_periodically(self):
+        loop = unittest.mock.Mock()
+
+        self.r.start(loop)
+        self.r.start(loop)
+
+        loop.call_later.assert_called_once_with(
+            10, self.r._close_idle_scheduled, loop,
+        )
+        loop.call_later.reset_mock()
+
+        with unittest.mock.patch.object(self.r, "close_idle") as close_idle:
+            close_idle.side_effect = RuntimeError()
+            with self.assertLogs("jclib.storage.frontends", "WARNING"):
+                self.r._close_idle_scheduled(loop)
+
+        close_idle.assert_called_once_with()
+        loop.call_later.assert_called_once_with(
+            10, self.r._close_idle_scheduled, loop,
+        )
+
+        self.r.stop()
+        loop.call_later().cancel.assert_called_once_with()
+        self.r.stop()
+
+    def test_close_all(self):
+        a = self.r.get(self.base / "a.sqlite")
+        a.execute("CREATE TABLE foo (bar INTEGER)")
+
+        self.r.close_all()
+
+        self.assertEqual(self.r.open_engines, 0)
+        self.assertEqual(self.r.metrics["closed"], 1)
+        # engines obtained before stay usable
+        self.assertEqual(a.execute("SELECT * FROM foo").fetchall(), [])
+        self.assertIsNot(self.r.get(self.base / "a.sqlite"), a)
+
+
+class Test_backup(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = pathlib.Path(self.tmpdir.name)
+        self.source = self.path / "src" / "file"
+        self.destination = self.path / "dst" / "sub" / "file"
+        self.source.parent.mkdir()
+
+    def _query(self, path, statement):
+        conn = sqlite3.connect(str(path))
+        try:
+            return conn.execute(statement).fetchall()
+        finally:
+            conn.close()
+
+    def test__backup_database(self):
+        conn = sqlite3.connect(str(self.source))
+        conn.execute("CREATE TABLE foo (bar INTEGER)")
+        conn.executemany("INSERT INTO foo (bar) VALUES (?)",
+                         [(i,) for i in range(1000)])
+        conn.commit()
+
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(
+                unittest.mock.patch.object(frontends, "BACKUP_PAGES", 1)
+            )
+            sleep = stack.enter_context(
+                unittest.mock.patch("time.sleep")
+            )
+            frontends._backup_database(self.source, self.destination)
+
+        npages, = self._query(self.source, "PRAGMA page_count")[0]
+        # a pause between each two steps
+        self.assertEqual(
+            sleep.mock_calls,
+            [unittest.mock.call(frontends.BACKUP_SLEEP)] * (npages - 1),
+        )
+        self.assertEqual(
+            self._query(self.destination, "SELECT COUNT(*) FROM foo"),
+            [(1000,)],
+        )
+        self.assertEqual(
+            self.destination.stat().st_mtime_ns,
+            self.source.stat().st_mtime_ns,
+        )
+
+        with unittest.mock.patch("sqlite3.connect") as connect:
+            frontends._backup_database(self.source, self.destination)
+        connect.assert_not_called()
+
+        conn.execute("DELETE FROM foo WHERE bar >= 10")
+        conn.commit()
+        conn.close()
+        # make sure that the mtime changes
+        os.utime(str(self.source), ns=(0, 0))
+
+        frontends._backup_database(self.source, self.destination)
+
+        self.assertEqual(
+            self._query(self.destination, "SELECT COUNT(*) FROM foo"),
+            [(10,)],
+        )
+        self.assertFalse(
+            self.destination.with_name("file.tmp").exists()
+        )
+
+    def test__backup_database_ignores_missing_source(self):
+        frontends._backup_database(self.source, self.destination)
+        self.assertFalse(self.destination.exists())
+
+    def test__backup_file_append_only_copies_tail(self):
+        self.source.write_bytes(b"foo")
+        frontends._backup_file(self.source, self.destination,
+                               append_only=True)
+        self.assertEqual(self.destination.read_bytes(), b"foo")
+
+        with self.source.open("ab") as f:
+            f.write(b"bar")
+        os.utime(str(self.source), ns=(0, 0))
+
+        with unittest.mock.patch("os.replace") as replace:
+            frontends._backup_file(self.source, self.destination,
+                                   append_only=True)
+        replace.assert_not_called()
+
+        self.assertEqual(self.destination.read_bytes(), b"foobar")
+        self.assertEqual(self.destination.stat().st_mtime_ns, 0)
+
+    def test__backup_file_recopies_replaced_file(self):
+        self.source.write_bytes(b"foo")
+        frontends._backup_file(self.source, self.destination,
+                               append_only=True)
+
+        self.source.write_bytes(b"bazbar")
+        os.utime(str(self.source), ns=(0, 0))
+        frontends._backup_file(self.source, self.destination,
+                               append_only=True)
+
+        self.assertEqual(self.destination.read_bytes(), b"bazbar")
+
+    def test__backup_file_copies_prefix(self):
+        self.source.write_bytes(b"foobar")
+        frontends._backup_file(self.source, self.destination, 3,
+                               append_only=True)
+        self.assertEqual(self.destination.read_bytes(), b"foo")
+        # not stamped, so that the rest is copied next time
+        self.assertNotEqual(
+            self.destination.stat().st_mtime_ns,
+            self.source.stat().st_mtime_ns,
+        )
+
+        frontends._backup_file(self.source, self.destination,
+                               append_only=True)
+        self.assertEqual(self.destination.read_bytes(), b"foobar")
+
 
 class TestDatabaseFrontend(unittest.TestCase):
     def setUp(self):
@@ -457,20 +876,14 @@ class TestDatabaseFrontend(unittest.TestCase):
 
     def test_get_engine(self):
         with contextlib.ExitStack() as stack:
-            _get_engine = stack.enter_context(
-                unittest.mock.patch(
-                    "jclib.storage.frontends._get_engine"
-                )
+            get = stack.enter_context(
+                unittest.mock.patch.object(frontends.engines, "get")
             )
 
             _get_path = stack.enter_context(
                 unittest.mock.patch.object(self.f, "_get_path")
             )
 
-            sessionmaker = stack.enter_context(
-                unittest.mock.patch("sqlalchemy.orm.sessionmaker")
-            )
-
             result = self.f.get_engine(
                 unittest.mock.sentinel.type_,
                 unittest.mock.sentinel.level,
@@ -483,19 +896,280 @@ class TestDatabaseFrontend(unittest.TestCase):
                 unittest.mock.sentinel.namespace,
             )
 
-            _get_engine.assert_called_once_with(_get_path())
+            get.assert_called_once_with(_get_path(), self.f._setup_engine)
+
+            self.assertEqual(result, get())
+
+    def test__setup_engine_caches_compiled_statements(self):
+        engine = unittest.mock.Mock()
+
+        result = self.f._setup_engine(engine)
+
+        engine.execution_options.assert_called_once_with(
+            compiled_cache=unittest.mock.ANY,
+        )
+        _, _, kwargs = engine.execution_options.mock_calls[0]
+        self.assertIsInstance(kwargs["compiled_cache"],
+                              sqlalchemy.util.LRUCache)
+        self.assertEqual(result, engine.execution_options())
+
+    def test_upgrade_schema(self):
+        with contextlib.ExitStack() as stack:
+            get_engine = stack.enter_context(
+                unittest.mock.patch.object(self.f, "get_engine")
+            )
+
+            upgrade = stack.enter_context(
+                unittest.mock.patch(
+                    "jclib.storage.migrations.upgrade",
+                )
+            )
+
+            result = self.f.upgrade_schema(
+                unittest.mock.sentinel.type_,
+                unittest.mock.sentinel.namespace,
+                unittest.mock.sentinel.name,
+                unittest.mock.sentinel.metadata,
+                unittest.mock.sentinel.migrations,
+            )
+
+            get_engine.assert_called_once_with(
+                unittest.mock.sentinel.type_,
+                unittest.mock.sentinel.namespace,
+                unittest.mock.sentinel.name,
+            )
+
+            upgrade.assert_called_once_with(
+                get_engine(),
+                unittest.mock.sentinel.metadata,
+                unittest.mock.sentinel.migrations,
+            )
+
+            self.assertEqual(result, get_engine())
+
+    def test_usage_reports_database_files(self):
+        with MockBackend() as backend:
+            self.f = frontends.DatabaseFrontend(backend)
+            engine = self.f.get_engine(
+                jclib.storage.common.StorageType.CACHE,
+                "urn:test",
+                "foo.sqlite",
+            )
+            engine.execute("CREATE TABLE foo (bar INTEGER)")
+            engine.dispose()
+
+            usage = run_coroutine(self.f.usage(
+                jclib.storage.common.StorageType.CACHE,
+            ))
+
+        self.assertEqual(list(usage),
+                         [(frontends.StorageLevel.GLOBAL, "urn:test")])
+        self.assertGreater(usage[frontends.StorageLevel.GLOBAL, "urn:test"],
+                           0)
+
+    def test_clear_rejects_global_level(self):
+        with self.assertRaises(ValueError):
+            run_coroutine(self.f.clear(frontends.GlobalLevel()))
+
+        run_coroutine(self.f.clear(frontends.AccountLevel(
+            aioxmpp.JID.fromstr("juliet@capulet.lit"),
+        )))
+
+    def test_backup(self):
+        type_ = jclib.storage.common.StorageType.DATA
+
+        with MockBackend() as backend, \
+                tempfile.TemporaryDirectory() as dest:
+            dest = pathlib.Path(dest)
+            self.f = frontends.DatabaseFrontend(backend)
+            engine = self.f.get_engine(type_, "urn:test", "foo.sqlite")
+            engine.execute("CREATE TABLE foo (bar INTEGER)")
+            engine.execute("INSERT INTO foo (bar) VALUES (42)")
+
+            run_coroutine(self.f.backup(type_, dest / type_.value))
+            engine.dispose()
+
+            restored = frontends.DatabaseFrontend(DirectoryBackend(dest))
+            engine = restored.get_engine(type_, "urn:test", "foo.sqlite")
+            self.assertEqual(
+                engine.execute("SELECT bar FROM foo").fetchall(),
+                [(42,)],
+            )
+            engine.dispose()
+
+    def test__database_paths(self):
+        type_ = jclib.storage.common.StorageType.DATA
+
+        with MockBackend() as backend:
+            self.f = frontends.DatabaseFrontend(backend)
+            self.assertEqual(self.f._database_paths(type_), [])
 
-            sessionmaker.assert_not_called()
+            engine = self.f.get_engine(type_, "urn:test", "foo.sqlite")
+            engine.execute("CREATE TABLE foo (bar INTEGER)")
+            engine.dispose()
 
             self.assertEqual(
-                result,
-                _get_engine(),
+                self.f._database_paths(type_),
+                [self.f._get_path(type_, "urn:test", "foo.sqlite")],
+            )
+            self.assertEqual(
+                self.f._database_paths(
+                    jclib.storage.common.StorageType.CACHE
+                ),
+                [],
+            )
+
+    def _session(self):
+        return self.f.session(
+            jclib.storage.common.StorageType.CACHE,
+            "urn:test",
+            "foo.sqlite",
+        )
+
+    def test_session_commits_on_clean_exit(self):
+        async def write():
+            async with self._session() as session:
+                await session.execute("CREATE TABLE foo (bar INTEGER)")
+                result = await session.execute(
+                    "INSERT INTO foo (bar) VALUES (:bar)",
+                    {"bar": 23},
+                )
+                self.assertEqual(result.rowcount, 1)
+
+        async def read():
+            async with self._session() as session:
+                return await session.fetchall("SELECT bar FROM foo")
+
+        with MockBackend() as backend:
+            self.f = frontends.DatabaseFrontend(backend)
+            run_coroutine(write())
+            self.assertEqual(run_coroutine(read()), [(23,)])
+
+    def test_session_rolls_back_on_exception(self):
+        class FooException(Exception):
+            pass
+
+        async def write():
+            async with self._session() as session:
+                await session.execute("CREATE TABLE foo (bar INTEGER)")
+
+            with self.assertRaises(FooException):
+                async with self._session() as session:
+                    await session.execute("INSERT INTO foo (bar) VALUES (1)")
+                    raise FooException()
+
+            async with self._session() as session:
+                return await session.scalar("SELECT COUNT(*) FROM foo")
+
+        with MockBackend() as backend:
+            self.f = frontends.DatabaseFrontend(backend)
+            self.assertEqual(run_coroutine(write()), 0)
+
+    def test_session_result_can_be_iterated(self):
+        async def run():
+            async with self._session() as session:
+                await session.execute("CREATE TABLE foo (bar INTEGER)")
+                await session.execute(
+                    "INSERT INTO foo (bar) VALUES (:bar)",
+                    [{"bar": 1}, {"bar": 2}],
+                )
+                rows = []
+                result = await session.execute(
+                    "SELECT bar FROM foo ORDER BY bar"
+                )
+                async for row in result:
+                    rows.append(tuple(row))
+                return rows
+
+        with MockBackend() as backend:
+            self.f = frontends.DatabaseFrontend(backend)
+            self.assertEqual(run_coroutine(run()), [(1,), (2,)])
+
+    def test_session_runs_on_a_single_worker_thread(self):
+        async def run():
+            async with self._session() as session:
+                idents = set()
+                for _ in range(3):
+                    idents.add(await session.run(
+                        lambda session: threading.get_ident()
+                    ))
+                    await session.execute("SELECT 1")
+                return idents
+
+        with MockBackend() as backend:
+            self.f = frontends.DatabaseFrontend(backend)
+            idents = run_coroutine(run())
+
+        self.assertEqual(len(idents), 1)
+        self.assertNotIn(threading.get_ident(), idents)
+
+    def test_session_limits_concurrency(self):
+        events = []
+
+        async def use(i):
+            async with self._session() as session:
+                events.append(("enter", i))
+                await session.execute("SELECT 1")
+                events.append(("exit", i))
+
+        async def run():
+            await asyncio.gather(use(1), use(2))
+
+        with MockBackend() as backend:
+            self.f = frontends.DatabaseFrontend(backend, max_sessions=1)
+            run_coroutine(run())
+
+        self.assertEqual(
+            events,
+            [("enter", 1), ("exit", 1), ("enter", 2), ("exit", 2)],
+        )
+        self.assertEqual(len(self.f._idle_workers), 1)
+
+    def test_session_caches_compiled_statements(self):
+        table = sqlalchemy.table("foo", sqlalchemy.column("bar"))
+        statement = sqlalchemy.select([table.c.bar])
+
+        async def run():
+            async with self._session() as session:
+                await session.execute("CREATE TABLE foo (bar INTEGER)")
+                await session.fetchall(statement)
+                await session.fetchall(statement)
+                await session.fetchall("SELECT bar FROM foo")
+                await session.fetchall("SELECT bar FROM foo")
+
+        with MockBackend() as backend:
+            self.f = frontends.DatabaseFrontend(backend)
+            run_coroutine(run())
+            engine = self.f.get_engine(
+                jclib.storage.common.StorageType.CACHE,
+                "urn:test",
+                "foo.sqlite",
             )
 
-    def test_get_engine_is_lru_cache(self):
-        self.assertTrue(hasattr(type(self.f).get_engine, "cache_info"))
+        cache = engine.get_execution_options()["compiled_cache"]
+        self.assertEqual(len(cache), 3)
+
+
+    def test_close_stops_workers(self):
+        async def use():
+            async with self._session() as session:
+                await session.execute("SELECT 1")
+
+        with MockBackend() as backend:
+            self.f = frontends.DatabaseFrontend(backend)
+            run_coroutine(use())
+            worker, = self.f._idle_workers
+
+            self.f.close()
 
+            self.assertFalse(self.f._idle_workers)
+            with self.assertRaises(RuntimeError):
+                worker.submit(int)
 
+            # workers of sessions which are closed afterwards are stopped,
+            # too
+            run_coroutine(use())
+            self.assertFalse(self.f._idle_workers)
 
 class TestLargeBlobFrontend(unittest.TestCase):
     def setUp(self):
@@ -693,6 +1367,124 @@ class TestLargeBlobFrontend(unittest.TestCase):
 
             mkdir_exist_ok.assert_not_called()
 
+    def test_open_async_write_read_cycle(self):
+        level = frontends.AccountLevel(
+            aioxmpp.JID.fromstr("juliet@capulet.lit"),
+        )
+
+        with MockBackend() as backend:
+            self.f = frontends.LargeBlobFrontend(backend)
+
+            f = run_coroutine(self.f.open_async(
+                jclib.storage.common.StorageType.CACHE,
+                level,
+                "urn:test",
+                "blob",
+                "wb",
+            ))
+            self.assertIsInstance(f, frontends.AsyncFile)
+            run_coroutine(f.write(b"foobar"))
+            run_coroutine(f.close())
+            self.assertTrue(f.closed)
+
+            f = run_coroutine(self.f.open_async(
+                jclib.storage.common.StorageType.CACHE,
+                level,
+                "urn:test",
+                "blob",
+                "rb",
+            ))
+            run_coroutine(f.seek(3))
+            self.assertEqual(run_coroutine(f.read()), b"bar")
+            run_coroutine(f.close())
+
+    def test_open_mmap_returns_readonly_view(self):
+        level = frontends.AccountLevel(
+            aioxmpp.JID.fromstr("juliet@capulet.lit"),
+        )
+
+        with MockBackend() as backend:
+            self.f = frontends.LargeBlobFrontend(backend)
+
+            for name, data in [("blob", b"foobar"), ("empty", b"")]:
+                with run_coroutine(self.f.open(
+                        jclib.storage.common.StorageType.CACHE,
+                        level,
+                        "urn:test",
+                        name,
+                        "wb")) as f:
+                    f.write(data)
+
+                view = run_coroutine(self.f.open_mmap(
+                    jclib.storage.common.StorageType.CACHE,
+                    level,
+                    "urn:test",
+                    name,
+                ))
+
+                self.assertIsInstance(view, memoryview)
+                self.assertTrue(view.readonly)
+                self.assertEqual(bytes(view), data)
+                view.release()
+
+    def test_open_mmap_raises_FileNotFoundError(self):
+        with MockBackend() as backend:
+            self.f = frontends.LargeBlobFrontend(backend)
+
+            with self.assertRaises(FileNotFoundError):
+                run_coroutine(self.f.open_mmap(
+                    jclib.storage.common.StorageType.CACHE,
+                    frontends.AccountLevel(
+                        aioxmpp.JID.fromstr("juliet@capulet.lit"),
+                    ),
+                    "urn:test",
+                    "blob",
+                ))
+
+    def test_usage_clear_and_eviction_candidates(self):
+        account = aioxmpp.JID.fromstr("juliet@capulet.lit")
+        other = aioxmpp.JID.fromstr("romeo@montague.lit")
+        type_ = jclib.storage.common.StorageType.CACHE
+        levels = [
+            frontends.AccountLevel(account),
+            frontends.PeerLevel(account, other),
+            frontends.AccountLevel(other),
+        ]
+
+        with MockBackend() as backend:
+            self.f = frontends.LargeBlobFrontend(backend)
+
+            for i, level in enumerate(levels):
+                with run_coroutine(self.f.open(
+                        type_, level, "urn:test", "blob", "wb")) as f:
+                    f.write(b"x" * (i + 1))
+
+            self.assertEqual(
+                run_coroutine(self.f.usage(type_)),
+                collections.Counter({
+                    (frontends.StorageLevel.ACCOUNT, "urn:test"): 4,
+                    (frontends.StorageLevel.PEER, "urn:test"): 2,
+                }),
+            )
+
+            candidates = list(self.f._eviction_candidates(type_))
+            self.assertCountEqual(
+                [candidate.size for candidate in candidates],
+                [1, 2, 3],
+            )
+
+            run_coroutine(self.f.clear(levels[0]))
+
+            for level in levels[:2]:
+                with self.assertRaises(FileNotFoundError):
+                    run_coroutine(self.f.stat(
+                        type_, level, "urn:test", "blob",
+                    ))
+            run_coroutine(self.f.stat(type_, levels[2], "urn:test", "blob"))
+
+            candidate, = self.f._eviction_candidates(type_)
+            self.assertEqual(candidate.evict(), 3)
+            self.assertEqual(run_coroutine(self.f.usage(type_)), {})
 
 class TestSmallBlobFrontend(unittest.TestCase):
     def setUp(self):
@@ -744,17 +1536,9 @@ class TestSmallBlobFrontend(unittest.TestCase):
 
     def test__init_engine_for_peer(self):
         with contextlib.ExitStack() as stack:
-            peer_metadata = stack.enter_context(
-                unittest.mock.patch.object(
-                    jclib.storage.peer_model.Base,
-                    "metadata"
-                )
-            )
-
-            account_metadata = stack.enter_context(
-                unittest.mock.patch.object(
-                    jclib.storage.account_model.Base,
-                    "metadata"
+            upgrade = stack.enter_context(
+                unittest.mock.patch(
+                    "jclib.storage.migrations.upgrade",
                 )
             )
 
@@ -763,25 +1547,17 @@ class TestSmallBlobFrontend(unittest.TestCase):
                 frontends.StorageLevel.PEER,
             )
 
-            peer_metadata.create_all.assert_called_once_with(
+            upgrade.assert_called_once_with(
                 unittest.mock.sentinel.engine,
+                jclib.storage.peer_model.Base.metadata,
+                jclib.storage.peer_model.MIGRATIONS,
             )
 
-            account_metadata.create_all.assert_not_called()
-
     def test__init_engine_for_account(self):
         with contextlib.ExitStack() as stack:
-            peer_metadata = stack.enter_context(
-                unittest.mock.patch.object(
-                    jclib.storage.peer_model.Base,
-                    "metadata"
-                )
-            )
-
-            account_metadata = stack.enter_context(
-                unittest.mock.patch.object(
-                    jclib.storage.account_model.Base,
-                    "metadata"
+            upgrade = stack.enter_context(
+                unittest.mock.patch(
+                    "jclib.storage.migrations.upgrade",
                 )
             )
 
@@ -790,12 +1566,12 @@ class TestSmallBlobFrontend(unittest.TestCase):
                 frontends.StorageLevel.ACCOUNT,
             )
 
-            account_metadata.create_all.assert_called_once_with(
+            upgrade.assert_called_once_with(
                 unittest.mock.sentinel.engine,
+                jclib.storage.account_model.Base.metadata,
+                jclib.storage.account_model.MIGRATIONS,
             )
 
-            peer_metadata.create_all.assert_not_called()
-
     def test__init_engine_fails_for_global(self):
         with contextlib.ExitStack() as stack:
             peer_metadata = stack.enter_context(
@@ -852,24 +1628,14 @@ class TestSmallBlobFrontend(unittest.TestCase):
 
     def test__get_sessionmaker(self):
         with contextlib.ExitStack() as stack:
-            _get_engine = stack.enter_context(
-                unittest.mock.patch(
-                    "jclib.storage.frontends._get_engine"
-                )
+            get = stack.enter_context(
+                unittest.mock.patch.object(frontends.engines, "get")
             )
 
             _get_path = stack.enter_context(
                 unittest.mock.patch.object(self.f, "_get_path")
             )
 
-            _init_engine = stack.enter_context(
-                unittest.mock.patch.object(self.f, "_init_engine")
-            )
-
-            sessionmaker = stack.enter_context(
-                unittest.mock.patch("sqlalchemy.orm.sessionmaker")
-            )
-
             result = self.f._get_sessionmaker(
                 unittest.mock.sentinel.type_,
                 unittest.mock.sentinel.level,
@@ -882,22 +1648,33 @@ class TestSmallBlobFrontend(unittest.TestCase):
                 unittest.mock.sentinel.namespace,
             )
 
-            _get_engine.assert_called_once_with(_get_path())
+            get.assert_called_once_with(_get_path(), unittest.mock.ANY)
+
+            self.assertEqual(result, get())
+
+        _, (_, setup), _ = get.mock_calls[0]
+
+        with contextlib.ExitStack() as stack:
+            _init_engine = stack.enter_context(
+                unittest.mock.patch.object(self.f, "_init_engine")
+            )
+
+            sessionmaker = stack.enter_context(
+                unittest.mock.patch("sqlalchemy.orm.sessionmaker")
+            )
+
+            result = setup(unittest.mock.sentinel.engine)
 
             _init_engine.assert_called_once_with(
-                _get_engine(),
+                unittest.mock.sentinel.engine,
                 unittest.mock.sentinel.level,
             )
 
-            sessionmaker.assert_called_once_with(bind=_get_engine())
-
-            self.assertEqual(
-                result,
-                sessionmaker()
+            sessionmaker.assert_called_once_with(
+                bind=unittest.mock.sentinel.engine,
             )
 
-    def test__get_sessionmaker_is_lru_cache(self):
-        self.assertTrue(hasattr(type(self.f)._get_sessionmaker, "cache_info"))
+            self.assertEqual(result, sessionmaker())
 
     def test__store_blob_peer(self):
         with contextlib.ExitStack() as stack:
@@ -921,6 +1698,12 @@ class TestSmallBlobFrontend(unittest.TestCase):
                 )
             )
 
+            jid_id = stack.enter_context(
+                unittest.mock.patch(
+                    "jclib.storage.peer_model.jid_id",
+                )
+            )
+
             self.f._store_blob(
                 unittest.mock.sentinel.type_,
                 frontends.PeerLevel(
@@ -955,15 +1738,26 @@ class TestSmallBlobFrontend(unittest.TestCase):
                 jclib.storage.peer_model.SmallBlob,
             )
 
-            self.assertEqual(
-                blob.account,
-                unittest.mock.sentinel.account,
+            self.assertCountEqual(
+                jid_id.mock_calls,
+                [
+                    unittest.mock.call(
+                        _get_sessionmaker()(),
+                        jclib.storage.peer_model.JIDEntry,
+                        unittest.mock.sentinel.account,
+                        create=True,
+                    ),
+                    unittest.mock.call(
+                        _get_sessionmaker()(),
+                        jclib.storage.peer_model.JIDEntry,
+                        unittest.mock.sentinel.peer,
+                        create=True,
+                    ),
+                ]
             )
 
-            self.assertEqual(
-                blob.peer,
-                unittest.mock.sentinel.peer,
-            )
+            self.assertEqual(blob.account_id, jid_id())
+            self.assertEqual(blob.peer_id, jid_id())
 
             self.assertEqual(
                 blob.data,
@@ -997,6 +1791,12 @@ class TestSmallBlobFrontend(unittest.TestCase):
                 )
             )
 
+            jid_id = stack.enter_context(
+                unittest.mock.patch(
+                    "jclib.storage.account_model.jid_id",
+                )
+            )
+
             self.f._store_blob(
                 unittest.mock.sentinel.type_,
                 frontends.AccountLevel(
@@ -1030,11 +1830,15 @@ class TestSmallBlobFrontend(unittest.TestCase):
                 jclib.storage.account_model.SmallBlob,
             )
 
-            self.assertEqual(
-                blob.account,
+            jid_id.assert_called_once_with(
+                _get_sessionmaker()(),
+                jclib.storage.account_model.JIDEntry,
                 unittest.mock.sentinel.account,
+                create=True,
             )
 
+            self.assertEqual(blob.account_id, jid_id())
+
             self.assertEqual(
                 blob.data,
                 unittest.mock.sentinel.data,
@@ -1046,6 +1850,11 @@ class TestSmallBlobFrontend(unittest.TestCase):
             )
 
     def test_store_uses__store_blob(self):
+        level = frontends.PeerLevel(
+            aioxmpp.JID.fromstr("juliet@capulet.lit"),
+            aioxmpp.JID.fromstr("romeo@montague.lit"),
+        )
+
         with contextlib.ExitStack() as stack:
             _store_blob = stack.enter_context(
                 unittest.mock.patch.object(self.f, "_store_blob")
@@ -1062,7 +1871,7 @@ class TestSmallBlobFrontend(unittest.TestCase):
 
             run_coroutine(self.f.store(
                 unittest.mock.sentinel.type_,
-                unittest.mock.sentinel.level,
+                level,
                 unittest.mock.sentinel.namespace,
                 unittest.mock.sentinel.name,
                 unittest.mock.sentinel.data,
@@ -1072,7 +1881,7 @@ class TestSmallBlobFrontend(unittest.TestCase):
                 None,
                 _store_blob,
                 unittest.mock.sentinel.type_,
-                unittest.mock.sentinel.level,
+                level,
                 unittest.mock.sentinel.namespace,
                 unittest.mock.sentinel.name,
                 unittest.mock.sentinel.data,
@@ -1577,6 +2386,12 @@ class TestSmallBlobFrontend(unittest.TestCase):
 
         for mode in modes:
             with contextlib.ExitStack() as stack:
+                stack.enter_context(
+                    unittest.mock.patch.object(
+                        frontends, "_HAS_BLOBOPEN", new=False,
+                    )
+                )
+
                 getdefaultencoding = stack.enter_context(
                     unittest.mock.patch("sys.getdefaultencoding")
                 )
@@ -1633,6 +2448,12 @@ class TestSmallBlobFrontend(unittest.TestCase):
 
         for mode in modes:
             with contextlib.ExitStack() as stack:
+                stack.enter_context(
+                    unittest.mock.patch.object(
+                        frontends, "_HAS_BLOBOPEN", new=False,
+                    )
+                )
+
                 getdefaultencoding = stack.enter_context(
                     unittest.mock.patch("sys.getdefaultencoding")
                 )
@@ -1688,6 +2509,12 @@ class TestSmallBlobFrontend(unittest.TestCase):
 
         for mode in modes:
             with contextlib.ExitStack() as stack:
+                stack.enter_context(
+                    unittest.mock.patch.object(
+                        frontends, "_HAS_BLOBOPEN", new=False,
+                    )
+                )
+
                 BytesIO = stack.enter_context(
                     unittest.mock.patch("io.BytesIO")
                 )
@@ -1760,6 +2587,12 @@ class TestSmallBlobFrontend(unittest.TestCase):
             exc = KeyError()
 
             with contextlib.ExitStack() as stack:
+                stack.enter_context(
+                    unittest.mock.patch.object(
+                        frontends, "_HAS_BLOBOPEN", new=False,
+                    )
+                )
+
                 load = stack.enter_context(
                     unittest.mock.patch.object(
                         self.f, "load",
@@ -1789,6 +2622,191 @@ class TestSmallBlobFrontend(unittest.TestCase):
                 exc,
             )
 
+    @unittest.skipUnless(frontends._HAS_BLOBOPEN,
+                         "requires sqlite3 incremental blob I/O")
+    def test_open_binary_reads_blob_incrementally(self):
+        level = frontends.PeerLevel(
+            aioxmpp.JID.fromstr("juliet@capulet.lit"),
+            aioxmpp.JID.fromstr("romeo@montague.lit"),
+        )
+        type_ = jclib.storage.common.StorageType.CACHE
+        data = bytes(range(256)) * 16
+
+        with MockBackend() as backend:
+            self.f = frontends.SmallBlobFrontend(backend)
+            run_coroutine(self.f.store(type_, level, "urn:test",
+                                       "some name", data))
+
+            with contextlib.ExitStack() as stack:
+                load = stack.enter_context(unittest.mock.patch.object(
+                    self.f, "load",
+                    new=CoroutineMock()
+                ))
+
+                f = run_coroutine(self.f.open(
+                    type_, level, "urn:test", "some name", "rb",
+                ))
+
+                connect = stack.enter_context(unittest.mock.patch(
+                    "sqlite3.connect",
+                ))
+
+                with f:
+                    self.assertEqual(f.read(4), data[:4])
+                    f.seek(1000)
+                    self.assertEqual(f.tell(), 1000)
+                    self.assertEqual(f.read(), data[1000:])
+
+            self.assertTrue(f.closed)
+            load.assert_not_called()
+            # reads use the connection of the file
+            connect.assert_not_called()
+
+            frontends.engines.close_all()
+
+    @unittest.skipUnless(frontends._HAS_BLOBOPEN,
+                         "requires sqlite3 incremental blob I/O")
+    def test_open_text_reads_blob_incrementally(self):
+        level = frontends.PeerLevel(
+            aioxmpp.JID.fromstr("juliet@capulet.lit"),
+            aioxmpp.JID.fromstr("romeo@montague.lit"),
+        )
+        type_ = jclib.storage.common.StorageType.CACHE
+        text = "äöü\n" * 1000
+
+        with MockBackend() as backend:
+            self.f = frontends.SmallBlobFrontend(backend)
+            run_coroutine(self.f.store(type_, level, "urn:test",
+                                       "some name", text.encode("utf-8")))
+
+            with unittest.mock.patch.object(
+                    self.f, "load", new=CoroutineMock()) as load:
+                f = run_coroutine(self.f.open(
+                    type_, level, "urn:test", "some name", "r",
+                    encoding="utf-8",
+                ))
+
+            with f:
+                self.assertEqual(f.readline(), "äöü\n")
+                self.assertEqual(f.read(), text[4:])
+
+            load.assert_not_called()
+
+            frontends.engines.close_all()
+
+    @unittest.skipUnless(frontends._HAS_BLOBOPEN,
+                         "requires sqlite3 incremental blob I/O")
+    def test_open_async_reads_in_executor(self):
+        level = frontends.PeerLevel(
+            aioxmpp.JID.fromstr("juliet@capulet.lit"),
+            aioxmpp.JID.fromstr("romeo@montague.lit"),
+        )
+        type_ = jclib.storage.common.StorageType.CACHE
+        data = bytes(range(256)) * 16
+        threads = []
+
+        with MockBackend() as backend:
+            self.f = frontends.SmallBlobFrontend(backend)
+            run_coroutine(self.f.store(type_, level, "urn:test",
+                                       "some name", data))
+
+            f = run_coroutine(self.f.open_async(
+                type_, level, "urn:test", "some name", "rb",
+            ))
+            self.assertIsInstance(f, frontends.AsyncFile)
+
+            readinto = f.raw.readinto
+
+            def record_thread(b):
+                threads.append(threading.current_thread())
+                return readinto(b)
+
+            f.raw.readinto = record_thread
+
+            async def read():
+                async with f:
+                    head = await f.read(4)
+                    await f.seek(1000)
+                    return head, await f.read()
+
+            self.assertEqual(
+                run_coroutine(read()),
+                (data[:4], data[1000:]),
+            )
+            self.assertTrue(f.closed)
+            self.assertTrue(threads)
+            self.assertNotIn(threading.current_thread(), threads)
+
+            frontends.engines.close_all()
+
+    @unittest.skipUnless(frontends._HAS_BLOBOPEN,
+                         "requires sqlite3 incremental blob I/O")
+    def test_open_binary_does_not_lock_database_between_reads(self):
+        level = frontends.PeerLevel(
+            aioxmpp.JID.fromstr("juliet@capulet.lit"),
+            aioxmpp.JID.fromstr("romeo@montague.lit"),
+        )
+        type_ = jclib.storage.common.StorageType.CACHE
+        data = bytes(range(256)) * 16
+
+        with MockBackend() as backend:
+            self.f = frontends.SmallBlobFrontend(backend)
+            run_coroutine(self.f.store(type_, level, "urn:test", "a", data))
+            run_coroutine(self.f.store(type_, level, "urn:test", "b", data))
+
+            a = run_coroutine(self.f.open(type_, level, "urn:test", "a",
+                                          "rb"))
+            b = run_coroutine(self.f.open(type_, level, "urn:test", "b",
+                                          "rb"))
+            with a, b:
+                self.assertEqual(a.read(4), data[:4])
+                self.assertEqual(b.read(4), data[:4])
+
+                started = time.monotonic()
+                run_coroutine(self.f.store(type_, level, "urn:test", "c",
+                                           b"foo"))
+                run_coroutine(self.f.store(type_, level, "urn:test", "b",
+                                           b"bar"))
+                self.assertLess(time.monotonic() - started, 1)
+
+                self.assertEqual(a.read(), data[4:])
+                with self.assertRaises(sqlite3.OperationalError):
+                    b.read(4)
+
+            self.assertEqual(
+                run_coroutine(self.f.load(type_, level, "urn:test", "c")),
+                b"foo",
+            )
+
+            frontends.engines.close_all()
+
+    @unittest.skipUnless(frontends._HAS_BLOBOPEN,
+                         "requires sqlite3 incremental blob I/O")
+    def test_open_binary_raises_FileNotFoundError_for_missing_blob(self):
+        descriptor = frontends.PeerLevel(
+            aioxmpp.JID.fromstr("juliet@capulet.lit"),
+            aioxmpp.JID.fromstr("romeo@montague.lit"),
+        )
+
+        with contextlib.ExitStack() as stack:
+            _get_sessionmaker = stack.enter_context(
+                unittest.mock.patch.object(self.f, "_get_sessionmaker")
+            )
+            _get_sessionmaker.return_value = inmemory_database(
+                jclib.storage.peer_model.Base,
+            )
+
+            with self.assertRaises(FileNotFoundError) as ctx:
+                run_coroutine(self.f.open(
+                    unittest.mock.sentinel.type_,
+                    descriptor,
+                    unittest.mock.sentinel.namespace,
+                    "some name",
+                    "rb",
+                ))
+
+        self.assertIsInstance(ctx.exception.__cause__, KeyError)
+
     def test_stat_uses__load_in_executor(self):
         EPOCH = datetime(1970, 1, 1)
 
@@ -2097,134 +3115,1092 @@ class TestSmallBlobFrontend(unittest.TestCase):
                 len(data2)
             )
 
+    def test_usage_clear_and_eviction_candidates(self):
+        account = aioxmpp.JID.fromstr("juliet@capulet.lit")
+        other = aioxmpp.JID.fromstr("romeo@montague.lit")
+        type_ = jclib.storage.common.StorageType.CACHE
 
-class TestAppendFrontend(unittest.TestCase):
-    def setUp(self):
-        self.backend = unittest.mock.Mock()
-        self.f = frontends.AppendFrontend(self.backend)
+        with MockBackend() as backend:
+            self.f = frontends.SmallBlobFrontend(backend)
+
+            for level, namespace, data in [
+                    (frontends.AccountLevel(account), "urn:a", b"x"),
+                    (frontends.PeerLevel(account, other), "urn:a", b"xx"),
+                    (frontends.PeerLevel(other, account), "urn:a", b"xxx"),
+                    (frontends.PeerLevel(account, other), "urn:b", b"xxxx")]:
+                run_coroutine(self.f.store(
+                    type_, level, namespace, "blob", data,
+                ))
 
-    def test_uses_per_level_key_file_mixin(self):
-        self.assertIsInstance(
-            self.f,
-            frontends._PerLevelKeyFileMixin
-        )
+            self.assertEqual(
+                run_coroutine(self.f.usage(type_)),
+                collections.Counter({
+                    (frontends.StorageLevel.ACCOUNT, "urn:a"): 1,
+                    (frontends.StorageLevel.PEER, "urn:a"): 5,
+                    (frontends.StorageLevel.PEER, "urn:b"): 4,
+                }),
+            )
 
-    def test_submit_creates_directory_and_appends(self):
-        ts = unittest.mock.Mock()
-        ts.year = 1234
-        ts.month = 2
-        ts.day = 1
+            run_coroutine(self.f.clear(frontends.AccountLevel(account)))
 
-        with contextlib.ExitStack() as stack:
-            _get_path = stack.enter_context(
-                unittest.mock.patch.object(
-                    self.f,
-                    "_get_path",
-                )
-            )
-            _get_path.return_value.open.return_value = unittest.mock.MagicMock(
-                ["__enter__", "__exit__"]
+            self.assertEqual(
+                run_coroutine(self.f.usage(type_)),
+                collections.Counter({
+                    (frontends.StorageLevel.PEER, "urn:a"): 3,
+                }),
             )
-            _get_path.return_value.open.return_value.__enter__.return_value = \
-                unittest.mock.Mock()
+            run_coroutine(self.f.load(
+                type_, frontends.PeerLevel(other, account), "urn:a", "blob",
+            ))
 
-            datetime = stack.enter_context(
-                unittest.mock.patch("jclib.storage.frontends.datetime")
-            )
+            candidate, = self.f._eviction_candidates(type_)
+            self.assertEqual(candidate.size, 3)
+            self.assertEqual(candidate.evict(), 3)
 
-            mkdir_exist_ok = stack.enter_context(
-                unittest.mock.patch("jclib.utils.mkdir_exist_ok")
-            )
+            with self.assertRaises(KeyError):
+                run_coroutine(self.f.load(
+                    type_, frontends.PeerLevel(other, account), "urn:a",
+                    "blob",
+                ))
 
-            self.f.submit(
-                unittest.mock.sentinel.type_,
-                unittest.mock.sentinel.level,
-                unittest.mock.sentinel.namespace,
-                "filename",
-                unittest.mock.sentinel.data,
-                ts=ts,
-            )
+    def test_backup(self):
+        level = frontends.PeerLevel(
+            aioxmpp.JID.fromstr("juliet@capulet.lit"),
+            aioxmpp.JID.fromstr("romeo@montague.lit"),
+        )
+        type_ = jclib.storage.common.StorageType.CACHE
 
-            datetime.utcnow.assert_not_called()
+        with MockBackend() as backend, \
+                tempfile.TemporaryDirectory() as dest:
+            dest = pathlib.Path(dest)
+            self.f = frontends.SmallBlobFrontend(backend)
+            run_coroutine(self.f.store(type_, level, "urn:test", "blob",
+                                       b"foo"))
 
-            _get_path.assert_called_once_with(
-                unittest.mock.sentinel.type_,
-                unittest.mock.sentinel.level,
-                unittest.mock.sentinel.namespace,
-                pathlib.Path("append") / "1234" / "02-01" / "filename"
-            )
+            run_coroutine(self.f.backup(type_, dest / type_.value))
 
-            mkdir_exist_ok.assert_called_once_with(
-                _get_path().parent
+            restored = frontends.SmallBlobFrontend(DirectoryBackend(dest))
+            self.assertEqual(
+                run_coroutine(restored.load(type_, level, "urn:test",
+                                            "blob")),
+                b"foo",
             )
 
-            _get_path().open.assert_called_once_with("ab")
-            _get_path().open().__enter__.assert_called_once_with()
+    def test__database_paths(self):
+        level = frontends.PeerLevel(
+            aioxmpp.JID.fromstr("juliet@capulet.lit"),
+            aioxmpp.JID.fromstr("romeo@montague.lit"),
+        )
+        type_ = jclib.storage.common.StorageType.CACHE
 
-            f = _get_path().open().__enter__()
-            f.write.assert_called_once_with(unittest.mock.sentinel.data)
+        with MockBackend() as backend:
+            self.f = frontends.SmallBlobFrontend(backend)
+            self.assertEqual(list(self.f._database_paths(type_)), [])
 
-    def test_submit_uses_current_datetime_if_ts_not_given(self):
-        ts = unittest.mock.Mock()
-        ts.year = 2345
-        ts.month = 12
-        ts.day = 2
+            run_coroutine(self.f.store(type_, level, "urn:test", "blob",
+                                       b"foo"))
 
-        with contextlib.ExitStack() as stack:
-            _get_path = stack.enter_context(
-                unittest.mock.patch.object(
-                    self.f,
-                    "_get_path",
-                )
-            )
-            _get_path.return_value.open.return_value = unittest.mock.MagicMock(
-                ["__enter__", "__exit__"]
+            self.assertEqual(
+                list(self.f._database_paths(type_)),
+                [self.f._get_path(type_, frontends.StorageLevel.PEER,
+                                  "urn:test")],
             )
-            _get_path.return_value.open.return_value.__enter__.return_value = \
-                unittest.mock.Mock()
 
-            datetime = stack.enter_context(
-                unittest.mock.patch("jclib.storage.frontends.datetime")
+    def _warm_setup(self, backend, **kwargs):
+        self.f = frontends.SmallBlobFrontend(backend, **kwargs)
+        account = aioxmpp.JID.fromstr("juliet@capulet.lit")
+        levels = [
+            frontends.PeerLevel(
+                account,
+                aioxmpp.JID.fromstr("peer{}@server.example".format(i)),
             )
-            datetime.utcnow.return_value = ts
+            for i in range(3)
+        ]
+        for i, level in enumerate(levels):
+            run_coroutine(self.f.store(
+                jclib.storage.common.StorageType.CACHE, level, "urn:test",
+                "avatar", "data{}".format(i).encode(),
+            ))
+        return levels
 
-            self.f.submit(
-                unittest.mock.sentinel.type_,
-                unittest.mock.sentinel.level,
-                unittest.mock.sentinel.namespace,
-                "filename",
-                unittest.mock.sentinel.data,
-            )
+    def test_warm_serves_next_load_from_memory(self):
+        type_ = jclib.storage.common.StorageType.CACHE
 
-            datetime.utcnow.assert_called_once_with()
+        with MockBackend() as backend:
+            levels = self._warm_setup(backend)
 
-            _get_path.assert_called_once_with(
-                unittest.mock.sentinel.type_,
-                unittest.mock.sentinel.level,
-                unittest.mock.sentinel.namespace,
-                pathlib.Path("append") / "2345" / "12-02" / "filename"
+            self.assertEqual(
+                run_coroutine(self.f.warm(type_, levels, "urn:test")),
+                3,
+            )
+
+            with unittest.mock.patch.object(
+                    self.f, "_load_in_executor") as _load_in_executor:
+                for i, level in enumerate(levels):
+                    self.assertEqual(
+                        run_coroutine(self.f.load(
+                            type_, level, "urn:test", "avatar",
+                        )),
+                        "data{}".format(i).encode(),
+                    )
+            _load_in_executor.assert_not_called()
+
+            # served only once
+            self.assertEqual(self.f._prefetched_bytes, 0)
+            self.assertEqual(
+                run_coroutine(self.f.load(
+                    type_, levels[0], "urn:test", "avatar",
+                )),
+                b"data0",
             )
 
-            _get_path().open.assert_called_once_with("ab")
-            _get_path().open().__enter__.assert_called_once_with()
+    def test_warm_filters_by_name(self):
+        type_ = jclib.storage.common.StorageType.CACHE
 
-            f = _get_path().open().__enter__()
-            f.write.assert_called_once_with(unittest.mock.sentinel.data)
+        with MockBackend() as backend:
+            levels = self._warm_setup(backend)
 
+            self.assertEqual(
+                run_coroutine(self.f.warm(type_, levels, "urn:test",
+                                          ["other"])),
+                0,
+            )
 
-class TestXMLFrontend(unittest.TestCase):
-    def setUp(self):
-        self.backend = unittest.mock.Mock()
-        self.f = frontends.XMLFrontend(self.backend)
+    def test_warm_does_not_create_databases(self):
+        type_ = jclib.storage.common.StorageType.CACHE
 
-    def test__get_path(self):
-        level_type = unittest.mock.Mock()
-        path_mock = unittest.mock.MagicMock()
-        self.backend.type_base_paths.return_value = [path_mock]
+        with MockBackend() as backend:
+            levels = self._warm_setup(backend)
 
-        with contextlib.ExitStack() as stack:
-            escape_path_part = stack.enter_context(
-                unittest.mock.patch("jclib.storage.frontends.escape_path_part")
+            self.assertEqual(
+                run_coroutine(self.f.warm(type_, levels, "urn:other")),
+                0,
+            )
+            self.assertFalse(self.f._get_path(
+                type_, frontends.StorageLevel.PEER, "urn:other",
+            ).exists())
+
+    def test_warm_respects_prefetch_size(self):
+        type_ = jclib.storage.common.StorageType.CACHE
+
+        with MockBackend() as backend:
+            levels = self._warm_setup(backend, prefetch_size=10)
+
+            run_coroutine(self.f.warm(type_, levels, "urn:test"))
+
+            # the least recently warmed blobs were dropped
+            self.assertEqual(self.f._prefetched_bytes, 10)
+            self.assertCountEqual(
+                [key[1] for key in self.f._prefetched],
+                levels[1:],
+            )
+
+    def test_store_unlink_and_clear_drop_prefetched_blobs(self):
+        type_ = jclib.storage.common.StorageType.CACHE
+
+        with MockBackend() as backend:
+            levels = self._warm_setup(backend)
+            run_coroutine(self.f.warm(type_, levels, "urn:test"))
+
+            run_coroutine(self.f.store(type_, levels[0], "urn:test",
+                                       "avatar", b"new"))
+            self.assertEqual(
+                run_coroutine(self.f.load(
+                    type_, levels[0], "urn:test", "avatar",
+                )),
+                b"new",
+            )
+
+            run_coroutine(self.f.unlink(type_, levels[1], "urn:test",
+                                        "avatar"))
+            with self.assertRaises(KeyError):
+                run_coroutine(self.f.load(
+                    type_, levels[1], "urn:test", "avatar",
+                ))
+
+            run_coroutine(self.f.clear(
+                frontends.AccountLevel(levels[2].account),
+            ))
+            self.assertFalse(self.f._prefetched)
+
+    def test_warm_drops_blobs_written_while_running(self):
+        type_ = jclib.storage.common.StorageType.CACHE
+
+        with MockBackend() as backend:
+            levels = self._warm_setup(backend)
+
+            generation = self.f._begin_warm()
+            blobs = self.f._load_many(type_, levels, "urn:test", None)
+            self.f._invalidate_prefetched(self.f._prefetch_key(
+                type_, levels[0], "urn:test", "avatar",
+            ))
+
+            self.assertEqual(self.f._finish_warm(generation, blobs), 2)
+            self.assertFalse(self.f._written_while_warming)
+
+            generation = self.f._begin_warm()
+            self.f._invalidate_prefetched()
+            self.assertEqual(self.f._finish_warm(generation, blobs), 0)
+
+    def _age_databases(self, type_):
+        # make the databases old enough for misses to be remembered
+        mtime = time.time() - 10
+        for path in self.f._database_paths(type_):
+            os.utime(str(path), (mtime, mtime))
+
+    def test_misses_skip_the_executor_while_database_is_unchanged(self):
+        type_ = jclib.storage.common.StorageType.CACHE
+
+        with MockBackend() as backend:
+            levels = self._warm_setup(backend)
+            self._age_databases(type_)
+
+            self.assertFalse(self.f._is_known_missing(
+                type_, levels[0], "urn:test", "other",
+            ))
+            with self.assertRaises(KeyError):
+                run_coroutine(self.f.load(
+                    type_, levels[0], "urn:test", "other",
+                ))
+            self.assertTrue(self.f._is_known_missing(
+                type_, levels[0], "urn:test", "other",
+            ))
+
+            with contextlib.ExitStack() as stack:
+                _load_in_executor = stack.enter_context(
+                    unittest.mock.patch.object(self.f, "_load_in_executor")
+                )
+                _unlink_in_executor = stack.enter_context(
+                    unittest.mock.patch.object(self.f, "_unlink_in_executor")
+                )
+                _run_in_executor = stack.enter_context(
+                    unittest.mock.patch.object(self.f, "_run_in_executor")
+                )
+
+                with self.assertRaises(KeyError):
+                    run_coroutine(self.f.load(
+                        type_, levels[0], "urn:test", "other",
+                    ))
+
+                with self.assertRaises(FileNotFoundError):
+                    run_coroutine(self.f.stat(
+                        type_, levels[0], "urn:test", "other",
+                    ))
+
+                with self.assertRaises(FileNotFoundError):
+                    run_coroutine(self.f.open(
+                        type_, levels[0], "urn:test", "other", "rb",
+                    ))
+
+                with self.assertRaises(FileNotFoundError):
+                    run_coroutine(self.f.unlink(
+                        type_, levels[0], "urn:test", "other",
+                    ))
+
+            _load_in_executor.assert_not_called()
+            _unlink_in_executor.assert_not_called()
+            _run_in_executor.assert_not_called()
+
+            self.assertEqual(
+                run_coroutine(self.f.load(
+                    type_, levels[0], "urn:test", "avatar",
+                )),
+                b"data0",
+            )
+
+    def test_misses_are_rechecked_after_database_changes(self):
+        type_ = jclib.storage.common.StorageType.CACHE
+
+        with MockBackend() as backend:
+            levels = self._warm_setup(backend)
+            self._age_databases(type_)
+
+            with self.assertRaises(KeyError):
+                run_coroutine(self.f.load(
+                    type_, levels[0], "urn:test", "other",
+                ))
+            self.assertTrue(self.f._is_known_missing(
+                type_, levels[0], "urn:test", "other",
+            ))
+
+            # written through another instance, as another process would
+            other = frontends.SmallBlobFrontend(backend)
+            run_coroutine(other.store(
+                type_, levels[0], "urn:test", "other", b"foo",
+            ))
+
+            self.assertFalse(self.f._is_known_missing(
+                type_, levels[0], "urn:test", "other",
+            ))
+            self.assertEqual(
+                run_coroutine(self.f.load(
+                    type_, levels[0], "urn:test", "other",
+                )),
+                b"foo",
+            )
+
+    def test_misses_in_recently_modified_database_are_not_remembered(self):
+        type_ = jclib.storage.common.StorageType.CACHE
+
+        with MockBackend() as backend:
+            levels = self._warm_setup(backend)
+
+            with self.assertRaises(KeyError):
+                run_coroutine(self.f.load(
+                    type_, levels[0], "urn:test", "other",
+                ))
+
+            self.assertFalse(self.f._is_known_missing(
+                type_, levels[0], "urn:test", "other",
+            ))
+            self.assertFalse(self.f._misses)
+
+    def test_miss_cache_is_bounded(self):
+        type_ = jclib.storage.common.StorageType.CACHE
+
+        with MockBackend() as backend:
+            levels = self._warm_setup(backend, miss_cache_size=2)
+            self._age_databases(type_)
+
+            for name in ["a", "b", "c"]:
+                with self.assertRaises(KeyError):
+                    run_coroutine(self.f.load(
+                        type_, levels[0], "urn:test", name,
+                    ))
+
+            self.assertEqual(len(self.f._misses), 2)
+            self.assertFalse(self.f._is_known_missing(
+                type_, levels[0], "urn:test", "a",
+            ))
+            for name in ["b", "c"]:
+                self.assertTrue(self.f._is_known_missing(
+                    type_, levels[0], "urn:test", name,
+                ))
+
+    def test_eviction_keeps_keys_stored_concurrently(self):
+        type_ = jclib.storage.common.StorageType.CACHE
+
+        with MockBackend() as backend:
+            levels = self._warm_setup(backend)
+
+            candidate, *_ = self.f._eviction_candidates(type_)
+            _evict_row = self.f._evict_row
+
+            def evict_racing_with_store(*args):
+                deleted = _evict_row(*args)
+                run_coroutine(self.f.store(type_, levels[0], "urn:test",
+                                           "avatar", b"new"))
+                return deleted
+
+            with unittest.mock.patch.object(
+                    self.f, "_evict_row", new=evict_racing_with_store):
+                candidate.evict()
+
+            self.assertEqual(
+                run_coroutine(self.f.load(
+                    type_, levels[0], "urn:test", "avatar",
+                )),
+                b"new",
+            )
+
+    def test_eviction_spares_blobs_accessed_after_scan(self):
+        level = frontends.PeerLevel(
+            aioxmpp.JID.fromstr("juliet@capulet.lit"),
+            aioxmpp.JID.fromstr("romeo@montague.lit"),
+        )
+        type_ = jclib.storage.common.StorageType.CACHE
+
+        with MockBackend() as backend:
+            self.f = frontends.SmallBlobFrontend(backend)
+            run_coroutine(self.f.store(type_, level, "urn:a", "blob", b"x"))
+
+            candidate, = self.f._eviction_candidates(type_)
+            run_coroutine(self.f.load(type_, level, "urn:a", "blob"))
+            self.assertEqual(candidate.evict(), 0)
+
+            self.assertEqual(
+                run_coroutine(self.f.load(type_, level, "urn:a", "blob")),
+                b"x",
+            )
+
+class TestContentAddressedBlobFrontend(unittest.TestCase):
+    def setUp(self):
+        self.backend = MockBackend().__enter__()
+        self.f = frontends.ContentAddressedBlobFrontend(self.backend)
+        self.type_ = jclib.storage.common.StorageType.CACHE
+        self.account = aioxmpp.JID.fromstr("juliet@capulet.lit")
+        self.level1 = frontends.PeerLevel(
+            self.account,
+            aioxmpp.JID.fromstr("romeo@montague.lit"),
+        )
+        self.level2 = frontends.PeerLevel(
+            self.account,
+            aioxmpp.JID.fromstr("tybalt@capulet.lit"),
+        )
+
+    def tearDown(self):
+        self.backend.__exit__(None, None, None)
+
+    def _objects(self):
+        return [
+            p for p in (self.f._get_base_path(self.type_) /
+                        "objects").glob("*/*")
+        ]
+
+    def test_offers_filelike_interface(self):
+        self.assertIsInstance(
+            self.f,
+            frontends.FileLikeFrontend
+        )
+
+    def test_store_deduplicates_content(self):
+        for level in [self.level1, self.level2]:
+            run_coroutine(self.f.store(
+                self.type_, level, "urn:test", "avatar", b"foobar",
+            ))
+
+        self.assertEqual(len(self._objects()), 1)
+
+        for level in [self.level1, self.level2]:
+            with run_coroutine(self.f.open(
+                    self.type_, level, "urn:test", "avatar", "rb")) as f:
+                self.assertEqual(f.read(), b"foobar")
+
+            self.assertEqual(
+                bytes(run_coroutine(self.f.open_mmap(
+                    self.type_, level, "urn:test", "avatar",
+                ))),
+                b"foobar",
+            )
+
+            self.assertEqual(
+                run_coroutine(self.f.stat(
+                    self.type_, level, "urn:test", "avatar",
+                )).st_size,
+                6,
+            )
+
+    def test_store_does_not_rewrite_existing_content(self):
+        run_coroutine(self.f.store(
+            self.type_, self.level1, "urn:test", "avatar", b"foobar",
+        ))
+
+        with unittest.mock.patch("jclib.utils.safe_writer") as safe_writer:
+            run_coroutine(self.f.store(
+                self.type_, self.level2, "urn:test", "avatar", b"foobar",
+            ))
+
+        safe_writer.assert_not_called()
+
+    def test_collect_garbage_removes_only_unreferenced_content(self):
+        for level in [self.level1, self.level2]:
+            run_coroutine(self.f.store(
+                self.type_, level, "urn:test", "avatar", b"foobar",
+            ))
+
+        run_coroutine(self.f.unlink(
+            self.type_, self.level1, "urn:test", "avatar",
+        ))
+
+        self.assertEqual(
+            run_coroutine(self.f.collect_garbage(self.type_)),
+            (0, 0),
+        )
+        self.assertEqual(len(self._objects()), 1)
+
+        run_coroutine(self.f.store(
+            self.type_, self.level2, "urn:test", "avatar", b"baz",
+        ))
+
+        self.assertEqual(
+            run_coroutine(self.f.collect_garbage(self.type_)),
+            (1, 6),
+        )
+
+        objects = self._objects()
+        self.assertEqual(len(objects), 1)
+        self.assertEqual(objects[0].read_bytes(), b"baz")
+
+    def test__database_paths(self):
+        self.assertEqual(self.f._database_paths(self.type_), [])
+
+        run_coroutine(self.f.store(
+            self.type_, self.level1, "urn:test", "avatar", b"foobar",
+        ))
+
+        self.assertEqual(
+            self.f._database_paths(self.type_),
+            [self.f._get_base_path(self.type_) / "index.sqlite"],
+        )
+
+    def test_unlink_and_open_raise_FileNotFoundError_for_missing(self):
+        with self.assertRaises(FileNotFoundError):
+            run_coroutine(self.f.open(
+                self.type_, self.level1, "urn:test", "avatar", "rb",
+            ))
+
+        with self.assertRaises(FileNotFoundError):
+            run_coroutine(self.f.unlink(
+                self.type_, self.level1, "urn:test", "avatar",
+            ))
+
+    def test_open_rejects_write_modes(self):
+        with self.assertRaisesRegex(
+                ValueError,
+                "writable open modes are not supported"):
+            run_coroutine(self.f.open(
+                self.type_, self.level1, "urn:test", "avatar", "wb",
+            ))
+
+    def test_usage_splits_shared_content(self):
+        for level in [self.level1, self.level2]:
+            run_coroutine(self.f.store(
+                self.type_, level, "urn:test", "avatar", b"x" * 10,
+            ))
+        run_coroutine(self.f.store(
+            self.type_, frontends.AccountLevel(self.account), "urn:other",
+            "avatar", b"y" * 3,
+        ))
+
+        self.assertEqual(
+            run_coroutine(self.f.usage(self.type_)),
+            collections.Counter({
+                (frontends.StorageLevel.PEER, "urn:test"): 10,
+                (frontends.StorageLevel.ACCOUNT, "urn:other"): 3,
+            }),
+        )
+
+    def test_clear_account_removes_peer_references_and_content(self):
+        other = frontends.PeerLevel(
+            aioxmpp.JID.fromstr("romeo@montague.lit"),
+            self.account,
+        )
+        run_coroutine(self.f.store(
+            self.type_, self.level1, "urn:test", "avatar", b"foo",
+        ))
+        run_coroutine(self.f.store(
+            self.type_, other, "urn:test", "avatar", b"bar",
+        ))
+
+        run_coroutine(self.f.clear(frontends.AccountLevel(self.account)))
+
+        with self.assertRaises(FileNotFoundError):
+            run_coroutine(self.f.stat(
+                self.type_, self.level1, "urn:test", "avatar",
+            ))
+        run_coroutine(self.f.stat(self.type_, other, "urn:test", "avatar"))
+        self.assertEqual(len(self._objects()), 1)
+
+    def test_eviction_frees_content_with_last_reference(self):
+        for level in [self.level1, self.level2]:
+            run_coroutine(self.f.store(
+                self.type_, level, "urn:test", "avatar", b"x" * 10,
+            ))
+
+        candidates = self.f._eviction_candidates(self.type_)
+        self.assertEqual([c.size for c in candidates], [5, 5])
+
+        self.assertEqual(candidates[0].evict(), 0)
+        self.assertEqual(len(self._objects()), 1)
+        self.assertEqual(candidates[1].evict(), 10)
+        self.assertEqual(self._objects(), [])
+        self.assertEqual(run_coroutine(self.f.usage(self.type_)), {})
+
+class TestAppendFrontend(unittest.TestCase):
+    def setUp(self):
+        self.backend = unittest.mock.Mock()
+        self.f = frontends.AppendFrontend(self.backend)
+
+    def test_uses_per_level_key_file_mixin(self):
+        self.assertIsInstance(
+            self.f,
+            frontends._PerLevelKeyFileMixin
+        )
+
+    def test_submit_buffers_framed_record_without_file_access(self):
+        level = frontends.AccountLevel(
+            aioxmpp.JID.fromstr("juliet@capulet.lit"),
+        )
+        type_ = jclib.storage.common.StorageType.DATA
+        ts = datetime(1234, 2, 1, 10, 0, 0)
+
+        with contextlib.ExitStack() as stack:
+            backend = stack.enter_context(MockBackend())
+            self.f = frontends.AppendFrontend(backend)
+
+            threads = []
+            open_handle = self.f._open_handle
+
+            def record_thread(path):
+                threads.append(threading.get_ident())
+                return open_handle(path)
+
+            stack.enter_context(
+                unittest.mock.patch.object(
+                    self.f,
+                    "_open_handle",
+                    side_effect=record_thread,
+                )
+            )
+
+            datetime_ = stack.enter_context(
+                unittest.mock.patch("jclib.storage.frontends.datetime")
+            )
+
+            self.f.submit(type_, level, "urn:test", "filename", b"foo",
+                          ts=ts)
+
+            datetime_.utcnow.assert_not_called()
+
+            path = self.f._get_path(
+                type_, level, "urn:test",
+                pathlib.Path("append") / "1234" / "02-01" / "filename",
+            )
+            self.assertFalse(path.parent.exists())
+
+            nbytes = self.f.flush_all()
+
+            self.assertEqual(len(threads), 1)
+            self.assertNotEqual(threads[0], threading.get_ident())
+
+            record = self.f._encode_record(ts, b"foo")
+            self.assertEqual(
+                path.read_bytes(),
+                self.f.FILE_MAGIC + record,
+            )
+            # no index entry before the first record
+            self.assertEqual(nbytes, len(self.f.FILE_MAGIC) + len(record))
+            self.f.close()
+
+    def test_submit_uses_current_datetime_if_ts_not_given(self):
+        ts = datetime(2345, 12, 2)
+
+        with contextlib.ExitStack() as stack:
+            _get_path = stack.enter_context(
+                unittest.mock.patch.object(
+                    self.f,
+                    "_get_path",
+                )
+            )
+
+            datetime_ = stack.enter_context(
+                unittest.mock.patch("jclib.storage.frontends.datetime")
+            )
+            datetime_.utcnow.return_value = ts
+
+            self.f.submit(
+                unittest.mock.sentinel.type_,
+                unittest.mock.sentinel.level,
+                unittest.mock.sentinel.namespace,
+                "filename",
+                b"foo",
+            )
+
+            datetime_.utcnow.assert_called_once_with()
+
+            _get_path.assert_called_once_with(
+                unittest.mock.sentinel.type_,
+                unittest.mock.sentinel.level,
+                unittest.mock.sentinel.namespace,
+                pathlib.Path("append") / "2345" / "12-02" / "filename"
+            )
+
+    def test_flush_reuses_open_handle(self):
+        level = frontends.AccountLevel(
+            aioxmpp.JID.fromstr("juliet@capulet.lit"),
+        )
+        type_ = jclib.storage.common.StorageType.DATA
+
+        with MockBackend() as backend:
+            self.f = frontends.AppendFrontend(backend)
+
+            with unittest.mock.patch.object(
+                    self.f,
+                    "_open_handle",
+                    wraps=self.f._open_handle) as open_handle:
+                for i in range(3):
+                    self.f.submit(type_, level, "urn:test", "filename",
+                                  b"foo", ts=datetime(2017, 1, 1, 0, 0, i))
+                    self.f.flush_all()
+
+            self.assertEqual(open_handle.call_count, 1)
+            self.f.close()
+
+    def test_submit_hands_full_buffer_to_worker(self):
+        level = frontends.AccountLevel(
+            aioxmpp.JID.fromstr("juliet@capulet.lit"),
+        )
+        type_ = jclib.storage.common.StorageType.DATA
+        ts = datetime(2017, 1, 1)
+
+        with MockBackend() as backend:
+            self.f = frontends.AppendFrontend(backend, buffer_size=32)
+
+            self.f.submit(type_, level, "urn:test", "filename", b"x" * 32,
+                          ts=ts)
+            self.assertFalse(self.f._pending)
+
+            # wait for the worker thread
+            self.f._executor.submit(lambda: None).result()
+
+            path = self.f._get_path(
+                type_, level, "urn:test",
+                self.f._day_path(ts, "filename"),
+            )
+            self.assertEqual(
+                path.read_bytes(),
+                self.f.FILE_MAGIC + self.f._encode_record(ts, b"x" * 32),
+            )
+            self.f.close()
+
+    def test_evicts_least_recently_used_handle(self):
+        level = frontends.AccountLevel(
+            aioxmpp.JID.fromstr("juliet@capulet.lit"),
+        )
+        type_ = jclib.storage.common.StorageType.DATA
+        ts = datetime(2017, 1, 1)
+
+        with MockBackend() as backend:
+            self.f = frontends.AppendFrontend(backend, max_handles=2)
+
+            for name in ["a", "b", "a", "c"]:
+                self.f.submit(type_, level, "urn:test", name, b"foo", ts=ts)
+                self.f.flush_all()
+
+            self.assertCountEqual(
+                self.f._handles,
+                [
+                    self.f._get_path(type_, level, "urn:test",
+                                     self.f._day_path(ts, name))
+                    for name in ["a", "c"]
+                ],
+            )
+            self.f.close()
+
+    def test_schedules_flush_only_with_running_loop(self):
+        level = frontends.AccountLevel(
+            aioxmpp.JID.fromstr("juliet@capulet.lit"),
+        )
+        type_ = jclib.storage.common.StorageType.DATA
+        ts = datetime(2017, 1, 1)
+
+        with MockBackend() as backend:
+            self.f = frontends.AppendFrontend(backend, flush_interval=0.01)
+            path = self.f._get_path(type_, level, "urn:test",
+                                    self.f._day_path(ts, "log"))
+
+            self.f.submit(type_, level, "urn:test", "log", b"foo", ts=ts)
+            self.assertIsNone(self.f._scheduled_flush)
+
+            async def submit_and_wait():
+                self.f.submit(type_, level, "urn:test", "log", b"bar", ts=ts)
+                self.assertIsNotNone(self.f._scheduled_flush)
+                await asyncio.sleep(0.05)
+                # wait for the worker thread
+                await asyncio.wrap_future(
+                    self.f._executor.submit(lambda: None)
+                )
+
+            run_coroutine(submit_and_wait())
+
+            self.assertIsNone(self.f._scheduled_flush)
+            self.assertEqual(
+                list(self.f._read_file(path)),
+                [(ts, b"foo"), (ts, b"bar")],
+            )
+            self.f.close()
+
+    def test_failed_write_is_retried_by_next_flush(self):
+        level = frontends.AccountLevel(
+            aioxmpp.JID.fromstr("juliet@capulet.lit"),
+        )
+        type_ = jclib.storage.common.StorageType.DATA
+        ts = datetime(2017, 1, 1)
+
+        with MockBackend() as backend:
+            self.f = frontends.AppendFrontend(backend)
+            self.f.submit(type_, level, "urn:test", "log", b"foo", ts=ts)
+
+            with unittest.mock.patch(
+                    "jclib.utils.mkdir_exist_ok",
+                    side_effect=OSError()):
+                with self.assertRaises(OSError):
+                    self.f.flush_all()
+
+            self.f.submit(type_, level, "urn:test", "log", b"bar", ts=ts)
+            run_coroutine(self.f.flush_all_async(sync=True))
+
+            self.assertSequenceEqual(
+                list(self.f.read_records(type_, level, "urn:test", "log")),
+                [(ts, b"foo"), (ts, b"bar")],
+            )
+            self.f.close()
+
+    def test_rotates_legacy_file_on_append(self):
+        level = frontends.AccountLevel(
+            aioxmpp.JID.fromstr("juliet@capulet.lit"),
+        )
+        type_ = jclib.storage.common.StorageType.DATA
+        ts = datetime(2017, 1, 1)
+
+        with MockBackend() as backend:
+            self.f = frontends.AppendFrontend(backend)
+            path = self.f._get_path(type_, level, "urn:test",
+                                    self.f._day_path(ts, "log"))
+            path.parent.mkdir(parents=True)
+            path.write_bytes(b"unframed legacy data")
+
+            with self.assertLogs(self.f.logger, "WARNING"):
+                self.assertSequenceEqual(
+                    list(self.f.read_records(type_, level, "urn:test",
+                                             "log")),
+                    [],
+                )
+            self.assertEqual(path.read_bytes(), b"unframed legacy data")
+
+            self.f.submit(type_, level, "urn:test", "log", b"foo", ts=ts)
+            self.f.flush_all()
+
+            legacy, = path.parent.glob("log-*.legacy")
+            self.assertEqual(legacy.read_bytes(), b"unframed legacy data")
+            self.assertSequenceEqual(
+                list(self.f.read_records(type_, level, "urn:test", "log")),
+                [(ts, b"foo")],
+            )
+            self.f.close()
+
+    def test_submit_read_records_cycle(self):
+        level = frontends.AccountLevel(
+            aioxmpp.JID.fromstr("juliet@capulet.lit"),
+        )
+        type_ = jclib.storage.common.StorageType.DATA
+        records = [
+            (datetime(2016, 12, 31, 23, 59, 59, 999999), b"foo"),
+            (datetime(2017, 1, 1, 0, 0, 0), b""),
+            (datetime(2017, 1, 1, 12, 0, 0), b"bar"),
+            (datetime(2017, 2, 10, 8, 0, 0), b"baz"),
+        ]
+
+        with MockBackend() as backend:
+            self.f = frontends.AppendFrontend(backend)
+
+            for ts, data in records:
+                self.f.submit(type_, level, "urn:test", "log", data, ts=ts)
+                self.f.submit(type_, level, "urn:test", "other", b"x", ts=ts)
+
+            self.assertSequenceEqual(
+                list(self.f.read_records(type_, level, "urn:test", "log")),
+                records,
+            )
+
+            self.assertSequenceEqual(
+                list(self.f.read_records(
+                    type_, level, "urn:test", "log",
+                    since=datetime(2017, 1, 1, 0, 0, 0),
+                    until=datetime(2017, 1, 31),
+                )),
+                records[1:3],
+            )
+
+            self.f.close()
+
+            self.assertSequenceEqual(
+                list(self.f.read_records(type_, level, "urn:other", "log")),
+                [],
+            )
+
+    def test_read_records_uses_index_to_skip_old_records(self):
+        level = frontends.AccountLevel(
+            aioxmpp.JID.fromstr("juliet@capulet.lit"),
+        )
+        type_ = jclib.storage.common.StorageType.DATA
+        base = datetime(2017, 1, 1)
+        records = [
+            (base + timedelta(seconds=i), "{}".format(i).encode("ascii"))
+            for i in range(100)
+        ]
+
+        with MockBackend() as backend:
+            self.f = frontends.AppendFrontend(backend, index_records=10)
+
+            for ts, data in records[:50]:
+                self.f.submit(type_, level, "urn:test", "log", data, ts=ts)
+            # re-opening an existing file continues the index
+            self.f.close()
+            for ts, data in records[50:]:
+                self.f.submit(type_, level, "urn:test", "log", data, ts=ts)
+            self.f.close()
+
+            path = self.f._get_path(
+                type_, level, "urn:test",
+                self.f._day_path(base, "log"),
+            )
+            max_tss, offsets = self.f._read_index(path)
+            self.assertEqual(len(offsets), 9)
+            self.assertEqual(offsets, sorted(offsets))
+
+            since = base + timedelta(seconds=73)
+            offset = self.f._find_offset(path, since)
+            self.assertGreater(offset, 0)
+            self.assertLessEqual(
+                len(list(self.f._read_file(path, offset))),
+                37,
+            )
+            self.assertEqual(
+                next(self.f._read_file(path, offset))[0],
+                base + timedelta(seconds=70),
+            )
+
+            self.assertSequenceEqual(
+                list(self.f.read_records(
+                    type_, level, "urn:test", "log",
+                    since=since,
+                )),
+                records[73:],
+            )
+
+    def test_index_handles_out_of_order_timestamps(self):
+        level = frontends.AccountLevel(
+            aioxmpp.JID.fromstr("juliet@capulet.lit"),
+        )
+        type_ = jclib.storage.common.StorageType.DATA
+        base = datetime(2017, 1, 1)
+        records = [
+            (base + timedelta(seconds=(i * 7) % 20), bytes([i]))
+            for i in range(20)
+        ]
+
+        with MockBackend() as backend:
+            self.f = frontends.AppendFrontend(backend, index_records=3)
+
+            for ts, data in records:
+                self.f.submit(type_, level, "urn:test", "log", data, ts=ts)
+
+            since = base + timedelta(seconds=15)
+            self.assertCountEqual(
+                list(self.f.read_records(
+                    type_, level, "urn:test", "log",
+                    since=since,
+                )),
+                [(ts, data) for ts, data in records if ts >= since],
+            )
+
+            self.f.close()
+
+    def test_read_records_stops_at_corrupt_record(self):
+        level = frontends.AccountLevel(
+            aioxmpp.JID.fromstr("juliet@capulet.lit"),
+        )
+        type_ = jclib.storage.common.StorageType.DATA
+        ts = datetime(2017, 1, 1)
+
+        with MockBackend() as backend:
+            self.f = frontends.AppendFrontend(backend)
+            for data in [b"foo", b"bar", b"baz"]:
+                self.f.submit(type_, level, "urn:test", "log", data, ts=ts)
+            self.f.close()
+
+            path = self.f._get_path(
+                type_, level, "urn:test",
+                self.f._day_path(ts, "log"),
+            )
+            raw = bytearray(path.read_bytes())
+            record_size = self.f.RECORD_HEADER.size + 3
+            raw[len(self.f.FILE_MAGIC) + record_size +
+                self.f.RECORD_HEADER.size] ^= 0xff
+            path.write_bytes(bytes(raw[:-1]))
+
+            self.assertSequenceEqual(
+                list(self.f.read_records(type_, level, "urn:test", "log")),
+                [(ts, b"foo")],
+            )
+
+    def test_usage_and_clear(self):
+        account = aioxmpp.JID.fromstr("juliet@capulet.lit")
+        other = aioxmpp.JID.fromstr("romeo@montague.lit")
+        type_ = jclib.storage.common.StorageType.DATA
+        ts = datetime(2017, 1, 1)
+
+        with MockBackend() as backend:
+            self.f = frontends.AppendFrontend(backend)
+            for level in [frontends.AccountLevel(account),
+                          frontends.PeerLevel(account, other),
+                          frontends.PeerLevel(other, account)]:
+                self.f.submit(type_, level, "urn:test", "log", b"data", ts)
+            self.f.flush_all()
+
+            usage = run_coroutine(self.f.usage(type_))
+            self.assertCountEqual(
+                usage,
+                [(frontends.StorageLevel.ACCOUNT, "urn:test"),
+                 (frontends.StorageLevel.PEER, "urn:test")],
+            )
+            peer_usage = usage[frontends.StorageLevel.PEER, "urn:test"]
+
+            run_coroutine(self.f.clear(frontends.AccountLevel(account)))
+
+            self.assertEqual(
+                run_coroutine(self.f.usage(type_)),
+                collections.Counter({
+                    (frontends.StorageLevel.PEER, "urn:test"):
+                        peer_usage // 2,
+                }),
+            )
+            self.assertEqual(
+                list(self.f.read_records(
+                    type_, frontends.PeerLevel(account, other),
+                    "urn:test", "log",
+                )),
+                [],
+            )
+            self.f.close()
+
+    def test_backup_copies_flushed_records_incrementally(self):
+        level = frontends.PeerLevel(
+            aioxmpp.JID.fromstr("juliet@capulet.lit"),
+            aioxmpp.JID.fromstr("romeo@montague.lit"),
+        )
+        type_ = jclib.storage.common.StorageType.DATA
+        ts = datetime(2017, 1, 1)
+
+        with MockBackend() as backend, \
+                tempfile.TemporaryDirectory() as dest:
+            dest = pathlib.Path(dest)
+            self.f = frontends.AppendFrontend(backend, flush_interval=None)
+            self.f.submit(type_, level, "urn:test", "log", b"foo", ts)
+
+            run_coroutine(self.f.backup(type_, dest / type_.value))
+
+            self.f.submit(type_, level, "urn:test", "log", b"bar", ts)
+
+            with unittest.mock.patch("os.replace") as replace:
+                run_coroutine(self.f.backup(type_, dest / type_.value))
+            # only appended
+            replace.assert_not_called()
+            self.f.close()
+
+            restored = frontends.AppendFrontend(DirectoryBackend(dest))
+            self.assertEqual(
+                list(restored.read_records(type_, level, "urn:test", "log")),
+                [(ts, b"foo"), (ts, b"bar")],
+            )
+
+
+class TestXMLFrontend(unittest.TestCase):
+    def setUp(self):
+        frontends._clear_path_caches()
+        self.addCleanup(frontends._clear_path_caches)
+        self.backend = unittest.mock.Mock()
+        self.f = frontends.XMLFrontend(self.backend)
+
+    def test__get_path(self):
+        level_type = unittest.mock.Mock()
+        path_mock = unittest.mock.MagicMock()
+        self.backend.type_base_paths.return_value = [path_mock]
+
+        with contextlib.ExitStack() as stack:
+            escape_path_part = stack.enter_context(
+                unittest.mock.patch("jclib.storage.frontends.escape_path_part")
             )
 
             result = self.f._get_path(
@@ -2261,6 +4237,31 @@ class TestXMLFrontend(unittest.TestCase):
             path_mock.__truediv__().__truediv__().__truediv__().__truediv__()
         )
 
+    def test__get_path_is_cached_per_frontend(self):
+        self.backend.type_base_paths.return_value = [pathlib.Path("/base")]
+        account = aioxmpp.JID.fromstr("juliet@capulet.lit")
+
+        result1 = self.f._get_path(
+            jclib.storage.common.StorageType.CACHE,
+            frontends.StorageLevel.PEER,
+            account,
+        )
+        result2 = self.f._get_path(
+            jclib.storage.common.StorageType.CACHE,
+            frontends.StorageLevel.PEER,
+            account=account,
+        )
+        self.assertIs(result1, result2)
+        self.backend.type_base_paths.assert_called_once_with(
+            jclib.storage.common.StorageType.CACHE,
+            True,
+        )
+
+        ref = weakref.ref(self.f)
+        del self.f
+        gc.collect()
+        self.assertIsNone(ref())
+
     def test__get_path_peer(self):
         path_mock = unittest.mock.MagicMock()
         level_type = frontends.StorageLevel.PEER
@@ -2324,8 +4325,12 @@ class TestXMLFrontend(unittest.TestCase):
         path.open.return_value = file_
 
         with contextlib.ExitStack() as stack:
-            read_single_xso = stack.enter_context(
-                unittest.mock.patch("aioxmpp.xml.read_single_xso"),
+            _XMLItemIndex = stack.enter_context(
+                unittest.mock.patch("jclib.storage.frontends._XMLItemIndex"),
+            )
+
+            _LazyXMLItems = stack.enter_context(
+                unittest.mock.patch("jclib.storage.frontends._LazyXMLItems"),
             )
 
             result = self.f._load_from_file(
@@ -2337,16 +4342,206 @@ class TestXMLFrontend(unittest.TestCase):
             "rb",
         )
 
-        read_single_xso.assert_called_once_with(
-            file_,
+        _XMLItemIndex.assert_called_once_with(
+            file_.read(),
+            unittest.mock.sentinel.storage_cls,
+        )
+
+        _LazyXMLItems.assert_called_once_with(
+            _XMLItemIndex(),
             unittest.mock.sentinel.storage_cls,
+            self.f.logger,
         )
 
         self.assertEqual(
-            result,
-            read_single_xso(),
+            result.items,
+            _LazyXMLItems(),
+        )
+
+    def test__load_from_file_parses_items_lazily(self):
+        with MockBackend() as backend:
+            self.f = frontends.XMLFrontend(backend)
+            type_ = jclib.storage.common.StorageType.CACHE
+            account = aioxmpp.JID.fromstr("account@server.example")
+            peers = [
+                aioxmpp.JID.fromstr("peer{}@server.example".format(i))
+                for i in range(5)
+            ]
+
+            for i, peer in enumerate(peers):
+                self._put_data1(type_, frontends.PeerLevel(account, peer),
+                                str(i))
+            self.f.flush_all()
+
+            self.f = frontends.XMLFrontend(backend)
+            d1, = self.f.get_all(
+                type_, frontends.PeerLevel(account, peers[2]), Data1,
+            )
+            self.assertEqual(d1.foo, "2")
+
+            storage = self.f._open(type_, frontends.PeerLevel(account,
+                                                              peers[2]))
+            self.assertEqual(storage.items.nparsed, 1)
+            self.assertCountEqual(
+                list(storage.items),
+                [(account, peer) for peer in peers],
+            )
+            self.assertEqual(storage.items.nparsed, 1)
+
+            self._put_data1(type_, frontends.PeerLevel(account, peers[0]),
+                            "changed")
+            self.f.flush_all()
+
+            self.f = frontends.XMLFrontend(backend)
+            for i, peer in enumerate(peers):
+                d1, = self.f.get_all(
+                    type_, frontends.PeerLevel(account, peer), Data1,
+                )
+                self.assertEqual(d1.foo, "changed" if i == 0 else str(i))
+
+    def test_writeback_copies_unparsed_items_without_parsing(self):
+        with MockBackend() as backend:
+            self.f = frontends.XMLFrontend(backend)
+            type_ = jclib.storage.common.StorageType.CACHE
+            account = aioxmpp.JID.fromstr("account@server.example")
+            peers = [
+                aioxmpp.JID.fromstr("peer{}@server.example".format(i))
+                for i in range(5)
+            ]
+
+            for i, peer in enumerate(peers):
+                self._put_data1(type_, frontends.PeerLevel(account, peer),
+                                str(i))
+            self.f.flush_all()
+
+            self.f = frontends.XMLFrontend(backend)
+            self._put_data1(type_, frontends.PeerLevel(account, peers[0]),
+                            "changed")
+            storage = self.f._open(type_, frontends.PeerLevel(account,
+                                                              peers[0]))
+
+            with unittest.mock.patch(
+                    "aioxmpp.xml.read_single_xso") as read_single_xso:
+                snapshots, _ = self.f._take_snapshots()
+                self.f._write_snapshots(snapshots)
+
+            read_single_xso.assert_not_called()
+            self.assertEqual(storage.items.nparsed, 1)
+
+            self.f = frontends.XMLFrontend(backend)
+            for i, peer in enumerate(peers):
+                d1, = self.f.get_all(
+                    type_, frontends.PeerLevel(account, peer), Data1,
+                )
+                self.assertEqual(d1.foo, "changed" if i == 0 else str(i))
+
+    def test_writeback_keeps_unparsed_items_with_prefixed_root(self):
+        a = aioxmpp.JID.fromstr("a@b")
+        c = aioxmpp.JID.fromstr("c@d")
+        type_ = jclib.storage.common.StorageType.CACHE
+
+        with MockBackend() as backend:
+            self.f = frontends.XMLFrontend(backend)
+            path = self.f._get_path(type_, frontends.StorageLevel.ACCOUNT)
+            path.parent.mkdir(parents=True)
+            path.write_bytes(
+                b'<?xml version="1.0"?>\n<s:accounts xmlns:s="' +
+                jclib.utils.jabbercat_ns.xml_storage_account.encode() +
+                b'">\n  <s:account jid="a@b"><data1 xmlns="' +
+                NS.encode() + b'" foo="x">text</data1></s:account>\n'
+                b'</s:accounts>\n'
+            )
+
+            self._put_data1(type_, frontends.AccountLevel(c), "y")
+            self.f.flush_all()
+
+            self.f = frontends.XMLFrontend(backend)
+            d1, = self.f.get_all(type_, frontends.AccountLevel(a), Data1)
+            self.assertEqual(d1.foo, "x")
+            self.assertEqual(d1.bar, "text")
+            d1, = self.f.get_all(type_, frontends.AccountLevel(c), Data1)
+            self.assertEqual(d1.foo, "y")
+
+    def test__XMLItemIndex_extracts_single_item_documents(self):
+        raw = (
+            b'<?xml version="1.0"?>\n<accounts xmlns="' +
+            jclib.utils.jabbercat_ns.xml_storage_account.encode() +
+            b'">\n  <account jid="a@b"><data1 xmlns="' + NS.encode() +
+            b'" foo="x&gt;y">text</data1></account>\n'
+            b'  <account jid="c@d"/>\n</accounts>\n'
+        )
+
+        index = frontends._XMLItemIndex(
+            raw,
+            jclib.storage.account_model.XMLStorage,
+        )
+
+        a = aioxmpp.JID.fromstr("a@b")
+        c = aioxmpp.JID.fromstr("c@d")
+        self.assertCountEqual(index.ranges, [a, c])
+
+        storage = aioxmpp.xml.read_single_xso(
+            io.BytesIO(index.extract(a)),
+            jclib.storage.account_model.XMLStorage,
+        )
+        self.assertEqual(list(storage.items), [a])
+        d1, = storage.items[a][Data1.TAG]
+        self.assertEqual(d1.foo, "x>y")
+        self.assertEqual(d1.bar, "text")
+
+        storage = aioxmpp.xml.read_single_xso(
+            io.BytesIO(index.extract(c)),
+            jclib.storage.account_model.XMLStorage,
+        )
+        self.assertEqual(list(storage.items), [c])
+
+    def test__XMLItemIndex_skips_items_with_invalid_keys(self):
+        raw = (
+            b'<?xml version="1.0"?>\n<peers xmlns="' +
+            jclib.utils.jabbercat_ns.xml_storage_peer.encode() +
+            b'">\n  <peer account="a@b"/>\n'
+            b'  <peer account="a@b" peer="@d"/>\n'
+            b'  <peer account="a@b" peer="c@d"/>\n</peers>\n'
         )
 
+        index = frontends._XMLItemIndex(
+            raw,
+            jclib.storage.peer_model.XMLStorage,
+        )
+
+        a = aioxmpp.JID.fromstr("a@b")
+        c = aioxmpp.JID.fromstr("c@d")
+        self.assertCountEqual(index.ranges, [(a, c)])
+        self.assertEqual(
+            index.skipped,
+            [raw.index(b"<peer "), raw.index(b'<peer account="a@b" peer=')],
+        )
+
+    def test__load_from_file_drops_items_with_invalid_keys(self):
+        with MockBackend() as backend:
+            self.f = frontends.XMLFrontend(backend)
+            type_ = jclib.storage.common.StorageType.CACHE
+            a = aioxmpp.JID.fromstr("a@b")
+            c = aioxmpp.JID.fromstr("c@d")
+
+            self._put_data1(type_, frontends.AccountLevel(a), "x")
+            self._put_data1(type_, frontends.AccountLevel(c), "y")
+            self.f.flush_all()
+
+            path = self.f._get_path(type_, frontends.StorageLevel.ACCOUNT)
+            path.write_bytes(
+                path.read_bytes().replace(b'jid="a@b"', b'jid="@b"')
+            )
+
+            self.f = frontends.XMLFrontend(backend)
+            with self.assertLogs(self.f.logger, "WARNING"):
+                self.assertEqual(
+                    self.f.get_all(type_, frontends.AccountLevel(a), Data1),
+                    [],
+                )
+            d1, = self.f.get_all(type_, frontends.AccountLevel(c), Data1)
+            self.assertEqual(d1.foo, "y")
+
     def test__load_from_file_returns_fresh_object_if_not_found(self):
         storage_cls = unittest.mock.Mock()
 
@@ -2383,10 +4578,10 @@ class TestXMLFrontend(unittest.TestCase):
         storage_cls = unittest.mock.Mock()
 
         with contextlib.ExitStack() as stack:
-            read_single_xso = stack.enter_context(
-                unittest.mock.patch("aioxmpp.xml.read_single_xso"),
+            _XMLItemIndex = stack.enter_context(
+                unittest.mock.patch("jclib.storage.frontends._XMLItemIndex"),
             )
-            read_single_xso.side_effect = xml.sax.SAXException("")
+            _XMLItemIndex.side_effect = xml.parsers.expat.ExpatError("")
 
             os_replace = stack.enter_context(
                 unittest.mock.patch("os.replace"),
@@ -2407,8 +4602,8 @@ class TestXMLFrontend(unittest.TestCase):
             "rb",
         )
 
-        read_single_xso.assert_called_once_with(
-            file_,
+        _XMLItemIndex.assert_called_once_with(
+            file_.read(),
             storage_cls,
         )
 
@@ -2440,10 +4635,10 @@ class TestXMLFrontend(unittest.TestCase):
         storage_cls = unittest.mock.Mock()
 
         with contextlib.ExitStack() as stack:
-            read_single_xso = stack.enter_context(
-                unittest.mock.patch("aioxmpp.xml.read_single_xso"),
+            _XMLItemIndex = stack.enter_context(
+                unittest.mock.patch("jclib.storage.frontends._XMLItemIndex"),
             )
-            read_single_xso.side_effect = xml.sax.SAXException("")
+            _XMLItemIndex.side_effect = xml.parsers.expat.ExpatError("")
 
             os_replace = stack.enter_context(
                 unittest.mock.patch("os.replace"),
@@ -2465,8 +4660,8 @@ class TestXMLFrontend(unittest.TestCase):
             "rb",
         )
 
-        read_single_xso.assert_called_once_with(
-            file_,
+        _XMLItemIndex.assert_called_once_with(
+            file_.read(),
             storage_cls,
         )
 
@@ -3183,206 +5378,592 @@ class TestXMLFrontend(unittest.TestCase):
                 unittest.mock.patch("aioxmpp.xso.model.XSOList")
             )
 
-            self.f.put(
-                unittest.mock.sentinel.type_,
-                level,
-                unittest.mock.sentinel.xso,
+            self.f.put(
+                unittest.mock.sentinel.type_,
+                level,
+                unittest.mock.sentinel.xso,
+            )
+
+        _open.assert_called_once_with(
+            unittest.mock.sentinel.type_,
+            level,
+        )
+
+        _put_into.assert_called_once_with(
+            storage.items,
+            (account, unittest.mock.sentinel.peer),
+            unittest.mock.sentinel.xso,
+        )
+
+    def test__save(self):
+        with contextlib.ExitStack() as stack:
+            _get_path = stack.enter_context(
+                unittest.mock.patch.object(self.f, "_get_path")
+            )
+
+            _discard_journal = stack.enter_context(
+                unittest.mock.patch.object(self.f, "_discard_journal")
+            )
+
+            write_single_xso = stack.enter_context(
+                unittest.mock.patch("aioxmpp.xml.write_single_xso")
+            )
+
+            mkdir_exist_ok = stack.enter_context(
+                unittest.mock.patch("jclib.utils.mkdir_exist_ok")
+            )
+
+            GroupWriter = stack.enter_context(
+                unittest.mock.patch("jclib.utils.GroupWriter")
+            )
+            group = GroupWriter().__enter__()
+            GroupWriter.reset_mock()
+
+            result = self.f._save(
+                unittest.mock.sentinel.data,
+                unittest.mock.sentinel.type_,
+                unittest.mock.sentinel.level_type,
+                unittest.mock.sentinel.identities,
+            )
+
+        _get_path.assert_called_once_with(
+            unittest.mock.sentinel.type_,
+            unittest.mock.sentinel.level_type,
+            unittest.mock.sentinel.identities,
+        )
+
+        mkdir_exist_ok.assert_called_once_with(
+            _get_path().parent,
+        )
+
+        GroupWriter.assert_called_once_with()
+        GroupWriter().__exit__.assert_called_once_with(None, None, None)
+
+        group.open.assert_called_once_with(
+            _get_path()
+        )
+
+        write_single_xso.assert_called_once_with(
+            unittest.mock.sentinel.data,
+            group.open().__enter__(),
+        )
+
+        _discard_journal.assert_called_once_with(_get_path())
+        self.assertEqual(result, _get_path())
+
+    def test__save_stages_in_group(self):
+        group = unittest.mock.MagicMock()
+
+        with contextlib.ExitStack() as stack:
+            _get_path = stack.enter_context(
+                unittest.mock.patch.object(self.f, "_get_path")
+            )
+
+            _discard_journal = stack.enter_context(
+                unittest.mock.patch.object(self.f, "_discard_journal")
+            )
+
+            write_single_xso = stack.enter_context(
+                unittest.mock.patch("aioxmpp.xml.write_single_xso")
+            )
+
+            stack.enter_context(
+                unittest.mock.patch("jclib.utils.mkdir_exist_ok")
+            )
+
+            GroupWriter = stack.enter_context(
+                unittest.mock.patch("jclib.utils.GroupWriter")
+            )
+
+            result = self.f._save(
+                unittest.mock.sentinel.data,
+                unittest.mock.sentinel.type_,
+                unittest.mock.sentinel.level_type,
+                group=group,
+            )
+
+        GroupWriter.assert_not_called()
+        group.open.assert_called_once_with(_get_path())
+        write_single_xso.assert_called_once_with(
+            unittest.mock.sentinel.data,
+            group.open().__enter__(),
+        )
+        # the file is not replaced yet
+        _discard_journal.assert_not_called()
+        self.assertEqual(result, _get_path())
+
+    def test_flush_all_commits_storages_together(self):
+        levels = [
+            frontends.AccountLevel(
+                aioxmpp.JID.fromstr("romeo@montague.lit"),
+            ),
+            frontends.PeerLevel(
+                aioxmpp.JID.fromstr("romeo@montague.lit"),
+                aioxmpp.JID.fromstr("juliet@capulet.lit"),
+            ),
+        ]
+
+        with MockBackend() as backend:
+            self.f = frontends.XMLFrontend(backend)
+            type_ = jclib.storage.common.StorageType.CACHE
+            for level in levels:
+                self._put_data1(type_, level, "x")
+
+            with contextlib.ExitStack() as stack:
+                GroupWriter = stack.enter_context(unittest.mock.patch(
+                    "jclib.utils.GroupWriter",
+                    wraps=jclib.utils.GroupWriter,
+                ))
+                fsync_dir = stack.enter_context(unittest.mock.patch(
+                    "jclib.utils.fsync_dir",
+                    wraps=jclib.utils.fsync_dir,
+                ))
+
+                nbytes = self.f.flush_all()
+
+            paths = [
+                self.f._get_path(type_, level.level,
+                                 getattr(level, "account", None))
+                for level in levels
+            ]
+            self.assertEqual(
+                nbytes,
+                sum(path.stat().st_size for path in paths),
+            )
+            GroupWriter.assert_called_once_with()
+            # each directory is synced once
+            self.assertCountEqual(
+                [call[0][0] for call in fsync_dir.call_args_list],
+                {path.parent for path in paths},
+            )
+
+            self.f = frontends.XMLFrontend(backend)
+            for level in levels:
+                self.assertEqual(
+                    [d.foo for d in self.f.get_all(type_, level, Data1)],
+                    ["x"],
+                )
+
+    def _put_data1(self, type_, level, foo):
+        d1 = Data1()
+        d1.foo = foo
+        d1.bar = "bar"
+        self.f.put(type_, level, d1)
+
+    def test_flush_all_writes_only_dirty_storages(self):
+        level1 = frontends.AccountLevel(
+            aioxmpp.JID.fromstr("romeo@montague.lit"),
+        )
+
+        level2 = frontends.PeerLevel(
+            aioxmpp.JID.fromstr("romeo@montague.lit"),
+            aioxmpp.JID.fromstr("juliet@capulet.lit"),
+        )
+
+        with contextlib.ExitStack() as stack:
+            _save = stack.enter_context(
+                unittest.mock.patch.object(self.f, "_save")
+            )
+
+            _load = stack.enter_context(
+                unittest.mock.patch.object(self.f, "_load"),
+            )
+            _load.side_effect = lambda type_, level: \
+                self.f.LEVEL_INFO[level.level][0]()
+
+            self.f._open(unittest.mock.sentinel.type1, level1)
+            self._put_data1(unittest.mock.sentinel.type1, level2, "x")
+
+            self.f.flush_all()
+
+            _save.assert_called_once_with(
+                unittest.mock.ANY,
+                unittest.mock.sentinel.type1,
+                level2.level,
+                level2.account,
+                group=unittest.mock.ANY,
+            )
+            _save.reset_mock()
+
+            self.f.flush_all()
+
+            _save.assert_not_called()
+
+    def test_flush_all_writes_snapshot(self):
+        level = frontends.AccountLevel(
+            aioxmpp.JID.fromstr("romeo@montague.lit"),
+        )
+        written = []
+
+        with contextlib.ExitStack() as stack:
+            _save = stack.enter_context(
+                unittest.mock.patch.object(self.f, "_save")
+            )
+
+            _load = stack.enter_context(
+                unittest.mock.patch.object(self.f, "_load"),
             )
+            _load.return_value = jclib.storage.account_model.XMLStorage()
 
-        _open.assert_called_once_with(
-            unittest.mock.sentinel.type_,
-            level,
+            self._put_data1(unittest.mock.sentinel.type_, level, "x")
+            snapshots, _ = self.f._take_snapshots()
+            self._put_data1(unittest.mock.sentinel.type_, level, "y")
+
+        (_, _, snapshot, _), = snapshots
+        self.assertIsNot(snapshot, _load.return_value)
+        self.assertEqual(
+            [d.foo for d in snapshot.items[level.account][Data1.TAG]],
+            ["x"],
+        )
+        self.assertEqual(
+            [d.foo for d in self.f.get_all(
+                unittest.mock.sentinel.type_, level, Data1)],
+            ["y"],
         )
 
-        _put_into.assert_called_once_with(
-            storage.items,
-            (account, unittest.mock.sentinel.peer),
-            unittest.mock.sentinel.xso,
+    def test_flush_all_async_writes_in_worker_thread(self):
+        level = frontends.AccountLevel(
+            aioxmpp.JID.fromstr("romeo@montague.lit"),
         )
+        threads = []
 
-    def test__save(self):
         with contextlib.ExitStack() as stack:
-            _get_path = stack.enter_context(
-                unittest.mock.patch.object(self.f, "_get_path")
+            _save = stack.enter_context(
+                unittest.mock.patch.object(self.f, "_save")
             )
 
-            write_single_xso = stack.enter_context(
-                unittest.mock.patch("aioxmpp.xml.write_single_xso")
-            )
+            def save(*args, **kwargs):
+                threads.append(threading.current_thread())
+                return unittest.mock.DEFAULT
 
-            mkdir_exist_ok = stack.enter_context(
-                unittest.mock.patch("jclib.utils.mkdir_exist_ok")
-            )
+            _save.side_effect = save
 
-            safe_writer = stack.enter_context(
-                unittest.mock.patch("jclib.utils.safe_writer")
+            _load = stack.enter_context(
+                unittest.mock.patch.object(self.f, "_load"),
             )
-            safe_writer.return_value = unittest.mock.MagicMock([
-                "__enter__",
-                "__exit__",
-            ])
+            _load.return_value = jclib.storage.account_model.XMLStorage()
 
-            self.f._save(
-                unittest.mock.sentinel.data,
-                unittest.mock.sentinel.type_,
-                unittest.mock.sentinel.level_type,
-                unittest.mock.sentinel.identities,
-            )
+            self._put_data1(unittest.mock.sentinel.type_, level, "x")
 
-        _get_path.assert_called_once_with(
-            unittest.mock.sentinel.type_,
-            unittest.mock.sentinel.level_type,
-            unittest.mock.sentinel.identities,
-        )
+            run_coroutine(self.f.flush_all_async())
 
-        mkdir_exist_ok.assert_called_once_with(
-            _get_path().parent,
-        )
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
 
-        safe_writer.assert_called_once_with(
-            _get_path()
-        )
+    def test_close_stops_worker_thread(self):
+        started = threading.Event()
+        finished = []
 
-        safe_writer().__enter__.assert_called_once_with()
+        def work():
+            started.set()
+            time.sleep(0.05)
+            finished.append(True)
 
-        write_single_xso.assert_called_once_with(
-            unittest.mock.sentinel.data,
-            safe_writer().__enter__(),
-        )
+        self.f._executor.submit(work)
+        started.wait()
 
-    def test__writeback_uses__save(self):
-        level = frontends.PeerLevel(
-            unittest.mock.sentinel.identity,
-            unittest.mock.sentinel.peer,
+        self.f.close()
+
+        self.assertEqual(finished, [True])
+        with self.assertRaises(RuntimeError):
+            self.f._executor.submit(int)
+
+    def test_failed_writeback_keeps_storage_dirty(self):
+        level = frontends.AccountLevel(
+            aioxmpp.JID.fromstr("romeo@montague.lit"),
         )
 
         with contextlib.ExitStack() as stack:
             _save = stack.enter_context(
                 unittest.mock.patch.object(self.f, "_save")
             )
+            _save.side_effect = OSError()
 
             _load = stack.enter_context(
-                unittest.mock.patch.object(self.f, "_load")
+                unittest.mock.patch.object(self.f, "_load"),
             )
+            _load.return_value = jclib.storage.account_model.XMLStorage()
 
-            data = self.f._open(
-                unittest.mock.sentinel.type_,
-                level,
-            )
+            self._put_data1(unittest.mock.sentinel.type_, level, "x")
 
-            _save.assert_not_called()
-            _open = stack.enter_context(
-                unittest.mock.patch.object(self.f, "_open")
-            )
+            with self.assertRaises(OSError):
+                run_coroutine(self.f.flush_all_async())
 
-            self.f._writeback(
-                unittest.mock.sentinel.type_,
-                (
-                    level.level,
-                    level.account,
-                )
-            )
+            _save.side_effect = None
+            _save.reset_mock()
+
+            self.f.flush_all()
 
         _save.assert_called_once_with(
-            data,
+            unittest.mock.ANY,
             unittest.mock.sentinel.type_,
             level.level,
-            level.account,
+            group=unittest.mock.ANY,
         )
 
-        _open.assert_not_called()
+    def test_sharded_put_get_cycle_and_write_amplification(self):
+        with MockBackend() as backend:
+            self.f = frontends.XMLFrontend(backend, shards=4)
+            type_ = jclib.storage.common.StorageType.CACHE
+            account = aioxmpp.JID.fromstr("account@server.example")
+            peers = [
+                aioxmpp.JID.fromstr("peer{}@server.example".format(i))
+                for i in range(16)
+            ]
 
-    def test__writeback_is_noop_if_not_open(self):
-        level = unittest.mock.Mock()
-        level.level = frontends.StorageLevel.ACCOUNT
+            for i, peer in enumerate(peers):
+                self._put_data1(type_, frontends.PeerLevel(account, peer),
+                                str(i))
+            self.f.flush_all()
 
-        with contextlib.ExitStack() as stack:
-            _save = stack.enter_context(
-                unittest.mock.patch.object(self.f, "_save")
-            )
+            shard_files = list(self.f._get_path(
+                type_, frontends.StorageLevel.PEER, account, 0,
+            ).parent.iterdir())
+            self.assertGreater(len(shard_files), 1)
+            self.assertLessEqual(len(shard_files), 4)
 
-            _load = stack.enter_context(
-                unittest.mock.patch.object(self.f, "_load")
+            with unittest.mock.patch.object(self.f, "_save") as _save:
+                self._put_data1(type_, frontends.PeerLevel(account, peers[3]),
+                                "changed")
+                self.f.flush_all()
+
+            _save.assert_called_once_with(
+                unittest.mock.ANY,
+                type_,
+                frontends.StorageLevel.PEER,
+                account,
+                self.f._shard_of(peers[3]),
+                group=unittest.mock.ANY,
             )
+            # the patched _save did not write anything
+            self._put_data1(type_, frontends.PeerLevel(account, peers[3]),
+                            "changed")
+            self.f.flush_all()
 
-            data = self.f._open(
-                unittest.mock.sentinel.type_,
-                level,
+            self.f = frontends.XMLFrontend(backend, shards=4)
+            for i, peer in enumerate(peers):
+                d1, = self.f.get_all(
+                    type_, frontends.PeerLevel(account, peer), Data1
+                )
+                self.assertEqual(d1.foo, "changed" if i == 3 else str(i))
+
+    def test_sharded_layout_migrates_single_file_layout(self):
+        with MockBackend() as backend:
+            self.f = frontends.XMLFrontend(backend)
+            type_ = jclib.storage.common.StorageType.CACHE
+            accounts = [
+                aioxmpp.JID.fromstr("account{}@server.example".format(i))
+                for i in range(8)
+            ]
+
+            for i, account in enumerate(accounts):
+                self._put_data1(type_, frontends.AccountLevel(account), str(i))
+            self.f.flush_all()
+
+            legacy_path = self.f._get_path(
+                type_, frontends.StorageLevel.ACCOUNT,
             )
+            self.assertTrue(legacy_path.exists())
 
-            _save.assert_not_called()
-            _open = stack.enter_context(
-                unittest.mock.patch.object(self.f, "_open")
+            self.f = frontends.XMLFrontend(backend, shards=4)
+            d1, = self.f.get_all(
+                type_, frontends.AccountLevel(accounts[0]), Data1
             )
+            self.assertEqual(d1.foo, "0")
+            self.f.flush_all()
 
-            self.f._writeback(
-                unittest.mock.sentinel.other_type,
-                level,
+            self.assertFalse(legacy_path.exists())
+            self.assertTrue(
+                legacy_path.with_name(legacy_path.name + ".migrated").exists()
             )
 
-        _save.assert_not_called()
-        _open.assert_not_called()
+            self.f = frontends.XMLFrontend(backend, shards=4)
+            for i, account in enumerate(accounts):
+                d1, = self.f.get_all(
+                    type_, frontends.AccountLevel(account), Data1
+                )
+                self.assertEqual(d1.foo, str(i))
 
-    def test_flush_all_calls_writeback_for_open_stuff(self):
-        level1 = frontends.AccountLevel(
-            unittest.mock.sentinel.account1,
-        )
+    def test_journaled_writeback_appends_changed_items_only(self):
+        with MockBackend() as backend:
+            type_ = jclib.storage.common.StorageType.CACHE
+            account = aioxmpp.JID.fromstr("account@server.example")
+            peers = [
+                aioxmpp.JID.fromstr("peer{}@server.example".format(i))
+                for i in range(4)
+            ]
 
-        level3 = frontends.PeerLevel(
-            unittest.mock.sentinel.account1,
-            unittest.mock.sentinel.peer1,
-        )
+            self.f = frontends.XMLFrontend(backend, journal=True)
+            for i, peer in enumerate(peers):
+                self._put_data1(type_, frontends.PeerLevel(account, peer),
+                                str(i))
+            self.f.flush_all()
 
-        level4 = frontends.PeerLevel(
-            unittest.mock.sentinel.account1,
-            unittest.mock.sentinel.peer2,
-        )
+            path = self.f._get_path(type_, frontends.StorageLevel.PEER,
+                                    account)
+            journal_path = self.f._journal_path(path)
+            self.assertFalse(path.exists())
+            size = journal_path.stat().st_size
 
-        with contextlib.ExitStack() as stack:
-            _writeback = stack.enter_context(
-                unittest.mock.patch.object(self.f, "_writeback")
-            )
+            with unittest.mock.patch.object(self.f, "_save") as _save:
+                self._put_data1(type_, frontends.PeerLevel(account, peers[1]),
+                                "changed")
+                self.f.flush_all()
 
-            _load = stack.enter_context(
-                unittest.mock.patch.object(self.f, "_load"),
-            )
+            _save.assert_not_called()
+            delta_size = journal_path.stat().st_size - size
+            self.assertLess(delta_size, size)
 
-            self.f._open(
-                unittest.mock.sentinel.type1,
-                level3,
+            self.f = frontends.XMLFrontend(backend)
+            for i, peer in enumerate(peers):
+                d1, = self.f.get_all(
+                    type_, frontends.PeerLevel(account, peer), Data1,
+                )
+                self.assertEqual(d1.foo, "changed" if i == 1 else str(i))
+
+            # a full rewrite folds the journal
+            self._put_data1(type_, frontends.PeerLevel(account, peers[2]),
+                            "again")
+            self.f.flush_all()
+            self.assertTrue(path.exists())
+            self.assertFalse(journal_path.exists())
+
+    def test_journal_is_checkpointed_beyond_threshold(self):
+        with MockBackend() as backend:
+            type_ = jclib.storage.common.StorageType.CACHE
+            level = frontends.AccountLevel(
+                aioxmpp.JID.fromstr("romeo@montague.lit"),
             )
 
-            self.f._open(
-                unittest.mock.sentinel.type1,
-                level4,
+            self.f = frontends.XMLFrontend(backend, journal=True,
+                                           journal_threshold=512)
+            path = self.f._get_path(type_, frontends.StorageLevel.ACCOUNT)
+            journal_path = self.f._journal_path(path)
+
+            for i in range(32):
+                self._put_data1(type_, level, str(i))
+                self.f.flush_all()
+                if path.exists():
+                    break
+            else:
+                self.fail("journal was never checkpointed")
+
+            self.assertFalse(journal_path.exists())
+
+            self.f = frontends.XMLFrontend(backend)
+            d1, = self.f.get_all(type_, level, Data1)
+            self.assertEqual(d1.foo, str(i))
+
+    def test_torn_journal_record_is_discarded(self):
+        with MockBackend() as backend:
+            type_ = jclib.storage.common.StorageType.CACHE
+            level = frontends.AccountLevel(
+                aioxmpp.JID.fromstr("romeo@montague.lit"),
             )
 
-            self.f._open(
-                unittest.mock.sentinel.type2,
-                level1,
+            self.f = frontends.XMLFrontend(backend, journal=True)
+            self._put_data1(type_, level, "x")
+            self.f.flush_all()
+            journal_path = self.f._journal_path(
+                self.f._get_path(type_, frontends.StorageLevel.ACCOUNT)
             )
+            size = journal_path.stat().st_size
 
+            self._put_data1(type_, level, "y")
             self.f.flush_all()
+            with journal_path.open("r+b") as f:
+                f.truncate(journal_path.stat().st_size - 3)
 
+            self.f = frontends.XMLFrontend(backend, journal=True)
+            d1, = self.f.get_all(type_, level, Data1)
+            self.assertEqual(d1.foo, "x")
+            self.assertEqual(journal_path.stat().st_size, size)
 
-        self.assertCountEqual(
-            _writeback.mock_calls,
-            [
-                unittest.mock.call(
-                    unittest.mock.sentinel.type1,
-                    (
-                        level3.level,
-                        level3.account,
-                    )
-                ),
-                unittest.mock.call(
-                    unittest.mock.sentinel.type2,
-                    (
-                        level1.level,
-                    )
-                ),
-            ]
-        )
+            self._put_data1(type_, level, "z")
+            self.f.flush_all()
+
+            self.f = frontends.XMLFrontend(backend)
+            d1, = self.f.get_all(type_, level, Data1)
+            self.assertEqual(d1.foo, "z")
+
+    def test_backup(self):
+        type_ = jclib.storage.common.StorageType.DATA
+        account = aioxmpp.JID.fromstr("account@server.example")
+        peer = aioxmpp.JID.fromstr("peer@server.example")
+
+        with MockBackend() as backend, \
+                tempfile.TemporaryDirectory() as dest:
+            dest = pathlib.Path(dest)
+            self.f = frontends.XMLFrontend(backend, shards=4, journal=True)
+            self._put_data1(type_, frontends.AccountLevel(account), "x")
+            self._put_data1(type_, frontends.PeerLevel(account, peer), "y")
+
+            run_coroutine(self.f.backup(type_, dest / type_.value))
+
+            restored = frontends.XMLFrontend(DirectoryBackend(dest),
+                                             shards=4)
+            d1, = restored.get_all(type_, frontends.AccountLevel(account),
+                                   Data1)
+            self.assertEqual(d1.foo, "x")
+            d1, = restored.get_all(type_, frontends.PeerLevel(account, peer),
+                                   Data1)
+            self.assertEqual(d1.foo, "y")
+
+    def test_usage_and_clear(self):
+        with MockBackend() as backend:
+            type_ = jclib.storage.common.StorageType.CACHE
+            account = aioxmpp.JID.fromstr("account@server.example")
+            other = aioxmpp.JID.fromstr("other@server.example")
+            peer = aioxmpp.JID.fromstr("peer@server.example")
+
+            self.f = frontends.XMLFrontend(backend, shards=4)
+            for level in [frontends.AccountLevel(account),
+                          frontends.AccountLevel(other),
+                          frontends.PeerLevel(account, peer),
+                          frontends.PeerLevel(other, peer)]:
+                self._put_data1(type_, level, "x")
+            self.f.flush_all()
+
+            usage = run_coroutine(self.f.usage(type_))
+            self.assertCountEqual(
+                usage,
+                [(frontends.StorageLevel.ACCOUNT, jclib.utils.jabbercat_ns.core),
+                 (frontends.StorageLevel.PEER, jclib.utils.jabbercat_ns.core)],
+            )
+
+            run_coroutine(self.f.clear(frontends.AccountLevel(account)))
+
+            self.assertFalse(self.f._get_path(
+                type_, frontends.StorageLevel.PEER, account,
+            ).parent.exists())
+
+            self.f = frontends.XMLFrontend(backend, shards=4)
+            self.assertEqual(
+                list(self.f.get_all(
+                    type_, frontends.AccountLevel(account), Data1,
+                )),
+                [],
+            )
+            self.assertEqual(
+                list(self.f.get_all(
+                    type_, frontends.PeerLevel(account, peer), Data1,
+                )),
+                [],
+            )
+            d1, = self.f.get_all(type_, frontends.AccountLevel(other), Data1)
+            self.assertEqual(d1.foo, "x")
+            d1, = self.f.get_all(type_, frontends.PeerLevel(other, peer),
+                                 Data1)
+            self.assertEqual(d1.foo, "x")
+
+            run_coroutine(self.f.clear(frontends.PeerLevel(other, peer)))
+            self.f = frontends.XMLFrontend(backend, shards=4)
+            self.assertEqual(
+                list(self.f.get_all(
+                    type_, frontends.PeerLevel(other, peer), Data1,
+                )),
+                [],
+            )
 
     def test_register_registers_XSO_child_for_account(self):
         class Foo(aioxmpp.xso.XSO):
@@ -3539,3 +6120,219 @@ class TestXMLFrontend(unittest.TestCase):
                     d1s[i].bar,
                     i,
                 )
+
+    def _record_loads(self, stack):
+        threads = []
+        load_from_file = self.f._load_from_file
+
+        def record(*args):
+            threads.append(threading.current_thread())
+            return load_from_file(*args)
+
+        stack.enter_context(unittest.mock.patch.object(
+            self.f, "_load_from_file", side_effect=record,
+        ))
+        return threads
+
+    def test_async_accessors_open_storage_on_worker_thread(self):
+        type_ = jclib.storage.common.StorageType.CACHE
+        level = frontends.AccountLevel(
+            aioxmpp.JID.fromstr("romeo@montague.lit"),
+        )
+
+        with MockBackend() as backend:
+            self.f = frontends.XMLFrontend(backend)
+            self._put_data1(type_, level, "x")
+            self.f.flush_all()
+
+            self.f = frontends.XMLFrontend(backend)
+            with contextlib.ExitStack() as stack:
+                threads = self._record_loads(stack)
+
+                d1 = run_coroutine(self.f.get_async(type_, level, Data1))
+                self.assertEqual(d1.foo, "x")
+
+                d1 = Data1()
+                d1.foo = "y"
+                d1.bar = "bar"
+                run_coroutine(self.f.put_async(type_, level, d1))
+                d1, = run_coroutine(
+                    self.f.get_all_async(type_, level, Data1)
+                )
+                self.assertEqual(d1.foo, "y")
+                self.f.flush_all()
+
+            self.assertEqual(len(threads), 1)
+            self.assertIsNot(threads[0], threading.current_thread())
+
+            self.f = frontends.XMLFrontend(backend)
+            d1, = self.f.get_all(type_, level, Data1)
+            self.assertEqual(d1.foo, "y")
+
+    def test_preload_loads_each_storage_once(self):
+        type_ = jclib.storage.common.StorageType.CACHE
+        levels = [
+            frontends.AccountLevel(
+                aioxmpp.JID.fromstr("account{}@server.example".format(i))
+            )
+            for i in range(8)
+        ]
+
+        with MockBackend() as backend:
+            self.f = frontends.XMLFrontend(backend, shards=4)
+            for i, level in enumerate(levels):
+                self._put_data1(type_, level, str(i))
+            self.f.flush_all()
+
+            self.f = frontends.XMLFrontend(backend, shards=4)
+            with contextlib.ExitStack() as stack:
+                threads = self._record_loads(stack)
+
+                run_coroutine(self.f.preload(type_, levels))
+                self.assertEqual(
+                    len(threads),
+                    len({self.f._cache_key(level) for level in levels}),
+                )
+
+                for i, level in enumerate(levels):
+                    d1, = self.f.get_all(type_, level, Data1)
+                    self.assertEqual(d1.foo, str(i))
+
+                self.assertEqual(
+                    len(threads),
+                    len({self.f._cache_key(level) for level in levels}),
+                )
+
+    def test_async_open_migrates_single_file_layout(self):
+        type_ = jclib.storage.common.StorageType.CACHE
+        level = frontends.AccountLevel(
+            aioxmpp.JID.fromstr("romeo@montague.lit"),
+        )
+
+        with MockBackend() as backend:
+            self.f = frontends.XMLFrontend(backend)
+            self._put_data1(type_, level, "x")
+            self.f.flush_all()
+
+            self.f = frontends.XMLFrontend(backend, shards=4)
+            with contextlib.ExitStack() as stack:
+                threads = self._record_loads(stack)
+                d1, = run_coroutine(
+                    self.f.get_all_async(type_, level, Data1)
+                )
+
+            self.assertEqual(d1.foo, "x")
+            # the legacy file and the shard
+            self.assertEqual(len(threads), 2)
+            for thread in threads:
+                self.assertIsNot(thread, threading.current_thread())
+            self.f.flush_all()
+
+            self.assertFalse(
+                self.f._get_path(type_, level.level).exists()
+            )
+
+            self.f = frontends.XMLFrontend(backend, shards=4)
+            d1, = self.f.get_all(type_, level, Data1)
+            self.assertEqual(d1.foo, "x")
+
+    def test_async_open_migrates_once_for_concurrent_shards(self):
+        type_ = jclib.storage.common.StorageType.CACHE
+        levels = [
+            frontends.AccountLevel(
+                aioxmpp.JID.fromstr("account{}@server.example".format(i))
+            )
+            for i in range(8)
+        ]
+
+        with MockBackend() as backend:
+            self.f = frontends.XMLFrontend(backend)
+            for i, level in enumerate(levels):
+                self._put_data1(type_, level, str(i))
+            self.f.flush_all()
+
+            self.f = frontends.XMLFrontend(backend, shards=4)
+            with unittest.mock.patch.object(
+                    self.f, "_read_migration",
+                    wraps=self.f._read_migration) as _read_migration:
+                run_coroutine(self.f.preload(type_, levels))
+
+            _read_migration.assert_called_once_with(
+                type_, frontends.StorageLevel.ACCOUNT, None,
+                unittest.mock.ANY,
+            )
+            for i, level in enumerate(levels):
+                d1, = self.f.get_all(type_, level, Data1)
+                self.assertEqual(d1.foo, str(i))
+
+    def test_clear_loads_storages_in_executor(self):
+        type_ = jclib.storage.common.StorageType.CACHE
+        level = frontends.AccountLevel(
+            aioxmpp.JID.fromstr("romeo@montague.lit"),
+        )
+
+        with MockBackend() as backend:
+            self.f = frontends.XMLFrontend(backend)
+            self._put_data1(type_, level, "x")
+            self.f.flush_all()
+
+            self.f = frontends.XMLFrontend(backend)
+            threads = set()
+            load_from_file = self.f._load_from_file
+
+            def record_thread(path, storage_cls):
+                threads.add(threading.get_ident())
+                return load_from_file(path, storage_cls)
+
+            with unittest.mock.patch.object(self.f, "_load_from_file",
+                                            side_effect=record_thread):
+                run_coroutine(self.f.clear(level))
+
+            self.assertTrue(threads)
+            self.assertNotIn(threading.get_ident(), threads)
+
+            self.f = frontends.XMLFrontend(backend)
+            self.assertSequenceEqual(self.f.get_all(type_, level, Data1), [])
+
+    def test_clear_does_not_keep_peer_storages_being_loaded(self):
+        type_ = jclib.storage.common.StorageType.CACHE
+        account = aioxmpp.JID.fromstr("romeo@montague.lit")
+        level = frontends.PeerLevel(
+            account,
+            aioxmpp.JID.fromstr("juliet@capulet.lit"),
+        )
+
+        cleared = threading.Event()
+
+        async def run():
+            loading = asyncio.ensure_future(
+                self.f.get_all_async(type_, level, Data1)
+            )
+            await asyncio.sleep(0)
+            await self.f.clear(frontends.AccountLevel(account))
+            cleared.set()
+            await loading
+
+        with MockBackend() as backend:
+            self.f = frontends.XMLFrontend(backend)
+            self._put_data1(type_, level, "x")
+            self.f.flush_all()
+
+            self.f = frontends.XMLFrontend(backend)
+            load_from_file = self.f._load_from_file
+
+            def load_before_clear(path, storage_cls):
+                # the old data has been read when the clear happens
+                result = load_from_file(path, storage_cls)
+                if path.stem == frontends.StorageLevel.PEER.value:
+                    cleared.wait(5)
+                return result
+
+            with unittest.mock.patch.object(self.f, "_load_from_file",
+                                            side_effect=load_before_clear):
+                run_coroutine(run())
+
+            self.assertSequenceEqual(
+                self.f.get_all(type_, level, Data1),
+                [],
+            )
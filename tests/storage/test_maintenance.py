@@ -0,0 +1,356 @@
+import contextlib
+import pathlib
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+
+import jclib.storage.maintenance as maintenance
+
+from jclib.storage.common import StorageType
+
+from aioxmpp.testutils import run_coroutine
+
+
+def create_database(path, nrows=100, *, auto_vacuum=None):
+    conn = sqlite3.connect(str(path), isolation_level=None)
+    try:
+        if auto_vacuum is not None:
+            conn.execute("PRAGMA auto_vacuum = {}".format(auto_vacuum))
+        conn.execute("CREATE TABLE foo (id INTEGER PRIMARY KEY, bar BLOB)")
+        conn.execute("CREATE INDEX foo_bar ON foo (bar)")
+        conn.executemany("INSERT INTO foo (bar) VALUES (?)",
+                         [(bytes(1000) + str(i).encode(),)
+                          for i in range(nrows)])
+    finally:
+        conn.close()
+
+
+def query(path, statement):
+    conn = sqlite3.connect(str(path), isolation_level=None)
+    try:
+        return conn.execute(statement).fetchall()
+    finally:
+        conn.close()
+
+
+class Testmaintain_database(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = pathlib.Path(self.tmpdir.name) / "test.sqlite"
+
+    def _maintain(self, **kwargs):
+        return maintenance.maintain_database(
+            self.path,
+            time.monotonic() + 60,
+            **kwargs
+        )
+
+    def test_checks_and_analyzes(self):
+        create_database(self.path)
+
+        result = self._maintain()
+
+        self.assertEqual(result.path, self.path)
+        self.assertIs(result.ok, True)
+        self.assertEqual(result.errors, [])
+        self.assertTrue(result.analyzed)
+        self.assertEqual(result.freed_pages, 0)
+        self.assertTrue(result.complete)
+        self.assertTrue(query(self.path, "SELECT * FROM sqlite_stat1"))
+
+        # the second time, PRAGMA optimize is used
+        result = self._maintain()
+        self.assertTrue(result.complete)
+        self.assertTrue(result.analyzed)
+
+    def test_vacuums_and_switches_to_incremental_vacuum(self):
+        create_database(self.path, 1000)
+        query(self.path, "DELETE FROM foo WHERE id > 100")
+        pages, = query(self.path, "PRAGMA page_count")[0]
+
+        result = self._maintain()
+
+        self.assertTrue(result.complete)
+        self.assertGreater(result.freed_pages, 0)
+        self.assertEqual(query(self.path, "PRAGMA page_count"),
+                         [(pages - result.freed_pages,)])
+        self.assertEqual(query(self.path, "PRAGMA freelist_count"), [(0,)])
+        self.assertEqual(query(self.path, "PRAGMA auto_vacuum"), [(2,)])
+        self.assertEqual(query(self.path, "SELECT COUNT(*) FROM foo"),
+                         [(100,)])
+
+    def test_does_not_vacuum_below_threshold(self):
+        create_database(self.path, 1000)
+        query(self.path, "DELETE FROM foo WHERE id > 900")
+
+        result = self._maintain()
+
+        self.assertTrue(result.complete)
+        self.assertEqual(result.freed_pages, 0)
+        self.assertEqual(query(self.path, "PRAGMA auto_vacuum"), [(0,)])
+
+    def test_incremental_vacuum_is_limited(self):
+        create_database(self.path, 1000, auto_vacuum="INCREMENTAL")
+        query(self.path, "DELETE FROM foo WHERE id > 100")
+        pages, = query(self.path, "PRAGMA page_count")[0]
+
+        result = self._maintain(vacuum_pages=10)
+
+        self.assertTrue(result.complete)
+        self.assertEqual(result.freed_pages, 10)
+        self.assertEqual(query(self.path, "PRAGMA page_count"),
+                         [(pages - 10,)])
+        self.assertTrue(query(self.path, "PRAGMA freelist_count")[0][0])
+
+    def test_stops_at_deadline(self):
+        create_database(self.path)
+
+        with unittest.mock.patch.object(maintenance, "_PROGRESS_STEPS", 1):
+            result = maintenance.maintain_database(self.path,
+                                                   time.monotonic() - 1)
+
+        self.assertFalse(result.complete)
+        self.assertIsNone(result.ok)
+        self.assertFalse(result.analyzed)
+
+    def test_stops_when_aborted(self):
+        create_database(self.path)
+        abort = threading.Event()
+        abort.set()
+
+        with unittest.mock.patch.object(maintenance, "_PROGRESS_STEPS", 1):
+            result = self._maintain(abort=abort)
+
+        self.assertFalse(result.complete)
+
+    def test_skips_locked_database(self):
+        create_database(self.path)
+
+        conn = sqlite3.connect(str(self.path), isolation_level=None)
+        try:
+            conn.execute("BEGIN EXCLUSIVE")
+            result = self._maintain()
+        finally:
+            conn.close()
+
+        self.assertFalse(result.complete)
+
+    def test_reports_broken_database(self):
+        with self.path.open("wb") as f:
+            f.write(b"garbage" * 1000)
+
+        result = self._maintain()
+
+        self.assertTrue(result.complete)
+        self.assertIs(result.ok, False)
+        self.assertTrue(result.errors)
+        self.assertFalse(result.analyzed)
+
+    def test_does_not_create_missing_database(self):
+        with self.assertRaises(FileNotFoundError):
+            self._maintain()
+
+        self.assertFalse(self.path.exists())
+
+
+class TestDatabaseMaintainer(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        base = pathlib.Path(self.tmpdir.name)
+        self.paths = [base / "a.sqlite", base / "b.sqlite"]
+        for path in self.paths:
+            create_database(path)
+
+        self.frontend = unittest.mock.Mock()
+        self.frontend._database_paths.side_effect = \
+            lambda type_: self.paths if type_ == StorageType.CACHE else []
+        self.other_frontend = unittest.mock.Mock()
+        self.other_frontend._database_paths.return_value = []
+        self.accounting = unittest.mock.Mock()
+        self.accounting.frontends = {
+            "a": self.frontend,
+            "b": self.other_frontend,
+        }
+
+        self.m = maintenance.DatabaseMaintainer(
+            self.accounting,
+            idle_delay=10,
+        )
+
+        stack = contextlib.ExitStack()
+        self.addCleanup(stack.close)
+        self.idle_time = stack.enter_context(unittest.mock.patch(
+            "jclib.storage.frontends.idle_time",
+            return_value=10,
+        ))
+
+    def test_run_maintains_all_databases(self):
+        self.assertEqual(run_coroutine(self.m.run()), 2)
+
+        for type_ in StorageType:
+            self.frontend._database_paths.assert_any_call(type_)
+            self.other_frontend._database_paths.assert_any_call(type_)
+
+        self.assertCountEqual(self.m.results, self.paths)
+        self.assertTrue(all(result.complete
+                            for result in self.m.results.values()))
+        self.assertEqual(self.m.metrics["runs"], 1)
+        self.assertEqual(self.m.metrics["databases"], 2)
+        self.assertEqual(self.m.metrics["analyzed"], 2)
+        self.assertEqual(self.m.metrics["integrity_failures"], 0)
+
+    def test_run_resumes_after_time_budget(self):
+        self.m.time_budget = 1
+
+        def maintain(path, deadline, **kwargs):
+            return maintenance.MaintenanceResult(
+                path=path,
+                ok=True,
+                errors=[],
+                analyzed=True,
+                freed_pages=0,
+                duration=1,
+                complete=True,
+            )
+
+        with unittest.mock.patch(
+                "jclib.storage.maintenance.maintain_database",
+                side_effect=maintain) as maintain_database:
+            self.assertEqual(run_coroutine(self.m.run()), 1)
+            maintain_database.assert_called_once_with(
+                self.paths[0], unittest.mock.ANY, abort=unittest.mock.ANY,
+            )
+            maintain_database.reset_mock()
+
+            self.assertEqual(run_coroutine(self.m.run()), 1)
+            maintain_database.assert_called_once_with(
+                self.paths[1], unittest.mock.ANY, abort=unittest.mock.ANY,
+            )
+            maintain_database.reset_mock()
+
+            # starts over
+            self.assertEqual(run_coroutine(self.m.run()), 1)
+            maintain_database.assert_called_once_with(
+                self.paths[0], unittest.mock.ANY, abort=unittest.mock.ANY,
+            )
+
+    def test_run_retries_busy_databases(self):
+        conn = sqlite3.connect(str(self.paths[0]), isolation_level=None)
+        try:
+            conn.execute("BEGIN EXCLUSIVE")
+            self.assertEqual(run_coroutine(self.m.run()), 1)
+        finally:
+            conn.close()
+
+        self.assertEqual(self.m.metrics["incomplete"], 1)
+        self.assertFalse(self.m.results[self.paths[0]].complete)
+
+        self.assertEqual(run_coroutine(self.m.run()), 1)
+        self.assertTrue(self.m.results[self.paths[0]].complete)
+        self.assertEqual(self.m.metrics["databases"], 2)
+
+    def test_run_retries_incomplete_databases_last(self):
+        self.paths.append(self.paths[0].parent / "c.sqlite")
+        create_database(self.paths[-1])
+        self.m.time_budget = 1
+
+        def maintain(path, deadline, **kwargs):
+            return maintenance.MaintenanceResult(
+                path=path,
+                ok=None,
+                errors=[],
+                analyzed=False,
+                freed_pages=0,
+                duration=1,
+                complete=path != self.paths[0],
+            )
+
+        with unittest.mock.patch(
+                "jclib.storage.maintenance.maintain_database",
+                side_effect=maintain) as maintain_database:
+            for _ in range(3):
+                run_coroutine(self.m.run())
+
+        self.assertEqual(
+            [call[0][0] for call in maintain_database.call_args_list],
+            [self.paths[0], self.paths[1], self.paths[2]],
+        )
+
+    def test_run_skips_databases_which_never_finish(self):
+        self.m.max_attempts = 2
+
+        def maintain(path, deadline, **kwargs):
+            return maintenance.MaintenanceResult(
+                path=path,
+                ok=None,
+                errors=[],
+                analyzed=False,
+                freed_pages=0,
+                duration=0,
+                complete=path != self.paths[0],
+            )
+
+        with unittest.mock.patch(
+                "jclib.storage.maintenance.maintain_database",
+                side_effect=maintain) as maintain_database:
+            self.assertEqual(run_coroutine(self.m.run()), 1)
+            self.assertEqual(self.m.metrics["skipped"], 0)
+
+            with self.assertLogs("jclib.storage.maintenance", "WARNING"):
+                self.assertEqual(run_coroutine(self.m.run()), 0)
+            self.assertEqual(maintain_database.call_count, 3)
+            self.assertEqual(self.m.metrics["skipped"], 1)
+            self.assertEqual(self.m.metrics["incomplete"], 2)
+            maintain_database.reset_mock()
+
+            # starts over
+            self.assertEqual(run_coroutine(self.m.run()), 1)
+            self.assertEqual(
+                [call[0][0] for call in maintain_database.call_args_list],
+                self.paths,
+            )
+
+    def test_run_drops_deleted_databases(self):
+        self.paths[0].unlink()
+
+        self.assertEqual(run_coroutine(self.m.run()), 1)
+        self.assertNotIn(self.paths[0], self.m.results)
+        self.assertFalse(self.paths[0].exists())
+
+    def test_run_counts_integrity_failures(self):
+        with self.paths[0].open("wb") as f:
+            f.write(b"garbage" * 1000)
+
+        with self.assertLogs("jclib.storage.maintenance", "ERROR"):
+            run_coroutine(self.m.run())
+
+        self.assertEqual(self.m.metrics["integrity_failures"], 1)
+
+    def test_run_waits_for_idle_storage(self):
+        self.idle_time.side_effect = [3, 10, 10]
+        delays = []
+
+        async def sleep(delay):
+            delays.append(delay)
+
+        with unittest.mock.patch("asyncio.sleep", new=sleep):
+            run_coroutine(self.m.run())
+
+        self.assertEqual(delays, [7])
+
+    def test_start_and_stop(self):
+        with unittest.mock.patch("jclib.tasks.manager") as manager:
+            self.m.start()
+            self.m.start()
+
+            manager.start.assert_called_once_with(unittest.mock.ANY)
+            coro = manager.start.call_args[0][0]
+            coro.close()
+
+            self.m.stop()
+            manager.start().asyncio_task.cancel.assert_called_once_with()
@@ -1,5 +1,6 @@
 import asyncio
 import contextlib
+import threading
 import unittest
 
 from datetime import timedelta
@@ -7,6 +8,7 @@ from datetime import timedelta
 from aioxmpp.testutils import (
     make_listener,
     run_coroutine,
+    CoroutineMock,
 )
 
 import jclib.storage.manager
@@ -51,20 +53,21 @@ class TestWriteManager(unittest.TestCase):
         not_called = False
 
         with contextlib.ExitStack() as stack:
-            flush_all = stack.enter_context(unittest.mock.patch.object(
+            flush_all_async = stack.enter_context(unittest.mock.patch.object(
                 jclib.storage.xml,
-                "flush_all",
+                "flush_all_async",
+                new=CoroutineMock(),
             ))
 
             def check_not_called():
-                nonlocal not_called, flush_all
+                nonlocal not_called, flush_all_async
                 try:
-                    flush_all.assert_not_called()
+                    flush_all_async.assert_not_called()
                     not_called = True
                 except Exception:
                     pass
 
-            flush_all.assert_not_called()
+            flush_all_async.assert_not_called()
             self.m.on_writeback.connect(
                 check_not_called,
             )
@@ -72,4 +75,339 @@ class TestWriteManager(unittest.TestCase):
             run_coroutine(asyncio.sleep(self.delay*1.1))
             self.listener.on_writeback.assert_called_once_with()
             self.assertTrue(not_called, "flush is called before on_writeback")
-            flush_all.assert_called_once_with()
+            flush_all_async.assert_called_once_with()
+
+    def test_force_writeback_flushes_xml_frontend_synchronously(self):
+        with unittest.mock.patch.object(
+                jclib.storage.xml,
+                "flush_all") as flush_all:
+            self.m.force_writeback()
+
+        self.listener.on_writeback.assert_called_once_with()
+        flush_all.assert_called_once_with()
+
+    def test_flushes_append_frontend_after_writeback(self):
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(unittest.mock.patch.object(
+                jclib.storage.xml,
+                "flush_all",
+            ))
+
+            flush_all = stack.enter_context(unittest.mock.patch.object(
+                jclib.storage.append,
+                "flush_all",
+            ))
+
+            self.m.force_writeback()
+
+        flush_all.assert_called_once_with(sync=True)
+
+    def test_scheduled_writeback_flushes_storages_asynchronously(self):
+        with contextlib.ExitStack() as stack:
+            xml_flush_all = stack.enter_context(unittest.mock.patch.object(
+                jclib.storage.xml,
+                "flush_all",
+            ))
+            xml_flush_all_async = stack.enter_context(
+                unittest.mock.patch.object(
+                    jclib.storage.xml,
+                    "flush_all_async",
+                    new=CoroutineMock(return_value=0),
+                )
+            )
+            append_flush_all = stack.enter_context(unittest.mock.patch.object(
+                jclib.storage.append,
+                "flush_all",
+            ))
+            append_flush_all_async = stack.enter_context(
+                unittest.mock.patch.object(
+                    jclib.storage.append,
+                    "flush_all_async",
+                    new=CoroutineMock(return_value=0),
+                )
+            )
+
+            self.m._xml_handle.request_writeback()
+            run_coroutine(self.m._append_handle.request_writeback())
+
+        xml_flush_all.assert_not_called()
+        append_flush_all.assert_not_called()
+        xml_flush_all_async.assert_called_once_with()
+        append_flush_all_async.assert_called_once_with()
+        self.assertFalse(self.m._xml_handle.dirty)
+        self.assertFalse(self.m._append_handle.dirty)
+
+    def test_failed_append_flush_is_retried_with_next_writeback(self):
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(unittest.mock.patch.object(
+                jclib.storage.xml,
+                "flush_all_async",
+                new=CoroutineMock(return_value=0),
+            ))
+
+            flush_all_async = stack.enter_context(unittest.mock.patch.object(
+                jclib.storage.append,
+                "flush_all_async",
+                new=CoroutineMock(),
+            ))
+            flush_all_async.side_effect = OSError()
+
+            with self.assertLogs("jclib.storage.manager", "ERROR"):
+                fut = self.m.request_writeback()
+                run_coroutine(fut)
+
+            handle = self.m._append_handle
+            self.assertTrue(handle.dirty)
+            self.assertEqual(handle.metrics["failures"], 1)
+            self.listener.on_writeback.assert_called_once_with()
+
+            flush_all_async.side_effect = None
+            flush_all_async.return_value = 10
+            # retried without another request
+            run_coroutine(asyncio.sleep(self.delay*1.5))
+
+        self.assertFalse(handle.dirty)
+        self.assertEqual(handle.metrics["bytes"], 10)
+        self.assertEqual(len(self.listener.on_writeback.mock_calls), 2)
+
+    def test_register_returns_handle(self):
+        cb = unittest.mock.Mock()
+
+        handle = self.m.register("foo", cb)
+
+        self.assertIsInstance(handle, jclib.storage.manager.WritebackHandle)
+        self.assertEqual(handle.name, "foo")
+        self.assertFalse(handle.dirty)
+        self.assertIn(handle, self.m.handles)
+        cb.assert_not_called()
+
+    def test_writeback_runs_only_dirty_handles(self):
+        cb1 = unittest.mock.Mock()
+        cb1.return_value = 123
+        cb2 = unittest.mock.Mock()
+        handle1 = self.m.register("foo", cb1)
+        handle2 = self.m.register("bar", cb2)
+
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(unittest.mock.patch.object(
+                jclib.storage.xml,
+                "flush_all_async",
+                new=CoroutineMock(return_value=0),
+            ))
+
+            handle1.request_writeback()
+            handle1.request_writeback()
+            self.assertTrue(handle1.dirty)
+            run_coroutine(asyncio.sleep(self.delay*1.1))
+
+        cb1.assert_called_once_with()
+        cb2.assert_not_called()
+        self.assertFalse(handle1.dirty)
+        self.assertEqual(handle1.metrics["writebacks"], 1)
+        self.assertEqual(handle1.metrics["bytes"], 123)
+        self.assertGreaterEqual(handle1.metrics["time"], 0)
+        self.assertEqual(handle2.metrics["writebacks"], 0)
+        self.listener.on_writeback.assert_called_once_with()
+
+    def test_force_writeback_runs_dirty_handles_before_flush(self):
+        mock = unittest.mock.Mock()
+        mock.xml_flush_all.return_value = 42
+        mock.append_flush_all.return_value = 23
+        mock.cb.return_value = None
+        handle = self.m.register("foo", mock.cb)
+
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(unittest.mock.patch.object(
+                jclib.storage.xml,
+                "flush_all",
+                new=mock.xml_flush_all,
+            ))
+            stack.enter_context(unittest.mock.patch.object(
+                jclib.storage.append,
+                "flush_all",
+                new=mock.append_flush_all,
+            ))
+
+            handle.request_writeback()
+            self.m.force_writeback()
+            self.m.force_writeback()
+
+        self.assertSequenceEqual(
+            mock.mock_calls,
+            [
+                unittest.mock.call.cb(),
+                unittest.mock.call.append_flush_all(sync=True),
+                unittest.mock.call.xml_flush_all(),
+                unittest.mock.call.append_flush_all(sync=True),
+                unittest.mock.call.xml_flush_all(),
+            ]
+        )
+
+        metrics = {handle.name: handle.metrics for handle in self.m.handles}
+        self.assertEqual(metrics["foo"]["writebacks"], 1)
+        self.assertEqual(metrics["XML storage"]["writebacks"], 2)
+        self.assertEqual(metrics["XML storage"]["bytes"], 84)
+        self.assertEqual(metrics["append storage"]["bytes"], 46)
+
+    def test_failed_handle_is_retried_with_next_writeback(self):
+        cb = unittest.mock.Mock()
+        cb.side_effect = OSError()
+        cb.return_value = None
+        handle = self.m.register("foo", cb)
+
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(unittest.mock.patch.object(
+                jclib.storage.xml,
+                "flush_all",
+            ))
+
+            handle.request_writeback()
+            with self.assertLogs("jclib.storage.manager", "ERROR"):
+                self.m.force_writeback()
+
+            self.assertTrue(handle.dirty)
+            self.assertEqual(handle.metrics["failures"], 1)
+
+            cb.side_effect = None
+            self.m.force_writeback()
+
+        self.assertEqual(cb.call_count, 2)
+        self.assertFalse(handle.dirty)
+        self.assertEqual(handle.metrics["writebacks"], 1)
+
+    def test_failed_write_is_retried_without_another_request(self):
+        write = unittest.mock.Mock()
+        write.side_effect = [OSError(), 10]
+        handle = self.m.register("foo", lambda: write)
+
+        with unittest.mock.patch.object(
+                jclib.storage.xml,
+                "flush_all_async",
+                new=CoroutineMock(return_value=0)):
+            with self.assertLogs("jclib.storage.manager", "ERROR"):
+                run_coroutine(handle.request_writeback())
+            self.assertTrue(handle.dirty)
+
+            run_coroutine(asyncio.sleep(self.delay*1.5))
+
+        self.assertEqual(write.call_count, 2)
+        self.assertFalse(handle.dirty)
+        self.assertEqual(handle.metrics["failures"], 1)
+        self.assertEqual(handle.metrics["bytes"], 10)
+
+    def test_close_drops_handle(self):
+        cb = unittest.mock.Mock()
+        handle = self.m.register("foo", cb)
+        handle.request_writeback()
+
+        handle.close()
+
+        with unittest.mock.patch.object(jclib.storage.xml, "flush_all"):
+            self.m.force_writeback()
+
+        cb.assert_not_called()
+        self.assertNotIn(handle, self.m.handles)
+
+    def test_dirty_handle_is_kept_alive(self):
+        cb = unittest.mock.Mock()
+        cb.return_value = None
+        handle = self.m.register("foo", cb)
+        handle.request_writeback()
+        del handle
+
+        with unittest.mock.patch.object(jclib.storage.xml, "flush_all"):
+            self.m.force_writeback()
+
+        cb.assert_called_once_with()
+
+    def test_writes_snapshot_in_writeback_thread(self):
+        threads = []
+
+        def write():
+            threads.append(("write", threading.current_thread()))
+            return 10
+
+        def snapshot():
+            threads.append(("snapshot", threading.current_thread()))
+            return write
+
+        handle = self.m.register("foo", snapshot)
+
+        with unittest.mock.patch.object(
+                jclib.storage.xml,
+                "flush_all_async",
+                new=CoroutineMock(return_value=0)):
+            fut = handle.request_writeback()
+            run_coroutine(fut)
+
+        self.assertEqual(
+            threads,
+            [
+                ("snapshot", threading.current_thread()),
+                ("write", unittest.mock.ANY),
+            ]
+        )
+        self.assertIsNot(threads[1][1], threading.current_thread())
+        self.assertEqual(handle.metrics["writebacks"], 1)
+        self.assertEqual(handle.metrics["bytes"], 10)
+        self.assertGreaterEqual(handle.metrics["write_time"], 0)
+
+    def test_request_writeback_returns_future_of_next_writeback(self):
+        with unittest.mock.patch.object(
+                jclib.storage.xml,
+                "flush_all_async",
+                new=CoroutineMock(return_value=0)) as flush_all_async:
+            fut1 = self.m.request_writeback()
+            fut2 = self.m.request_writeback()
+            self.assertIs(fut1, fut2)
+            self.assertFalse(fut1.done())
+
+            run_coroutine(fut1)
+            flush_all_async.assert_called_once_with()
+
+            fut3 = self.m.request_writeback()
+            self.assertIsNot(fut3, fut1)
+            run_coroutine(fut3)
+
+    def test_future_raises_if_xml_storage_cannot_be_written(self):
+        class FooException(Exception):
+            pass
+
+        with unittest.mock.patch.object(
+                jclib.storage.xml,
+                "flush_all_async",
+                new=CoroutineMock()) as flush_all_async:
+            flush_all_async.side_effect = FooException()
+
+            fut = self.m.request_writeback()
+            with self.assertRaises(FooException):
+                run_coroutine(fut)
+
+        metrics = {handle.name: handle.metrics for handle in self.m.handles}
+        self.assertEqual(metrics["XML storage"]["failures"], 1)
+
+    def test_failed_write_is_retried_with_next_writeback(self):
+        write = unittest.mock.Mock()
+        write.side_effect = [OSError(), None]
+        handle = self.m.register("foo", lambda: write)
+
+        with unittest.mock.patch.object(jclib.storage.xml, "flush_all"):
+            handle.request_writeback()
+            with self.assertLogs("jclib.storage.manager", "ERROR"):
+                self.m.force_writeback()
+            self.assertTrue(handle.dirty)
+
+            self.m.force_writeback()
+
+        self.assertEqual(write.call_count, 2)
+        self.assertFalse(handle.dirty)
+        self.assertEqual(handle.metrics["failures"], 1)
+        self.assertEqual(handle.metrics["writebacks"], 1)
+
+    def test_force_writeback_completes_pending_future(self):
+        with unittest.mock.patch.object(jclib.storage.xml, "flush_all"):
+            fut = self.m.request_writeback()
+            self.m.force_writeback()
+
+        self.assertTrue(fut.done())
+        self.assertIsNone(fut.result())
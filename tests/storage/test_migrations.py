@@ -0,0 +1,250 @@
+import pathlib
+import tempfile
+import unittest
+import unittest.mock
+
+import sqlalchemy
+
+import jclib.storage.frontends as frontends
+import jclib.storage.migrations as migrations
+import jclib.storage.peer_model as peer_model
+
+
+metadata = sqlalchemy.MetaData()
+
+items = sqlalchemy.Table(
+    "items", metadata,
+    sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("value", sqlalchemy.Integer),
+    sqlalchemy.Column("doubled", sqlalchemy.Integer),
+)
+
+extra = sqlalchemy.Table(
+    "extra", metadata,
+    sqlalchemy.Column("id", sqlalchemy.Integer, primary_key=True),
+)
+
+
+def create_v0(connection):
+    connection.execute(
+        "CREATE TABLE items (id INTEGER PRIMARY KEY, value INTEGER)"
+    )
+
+
+def add_doubled(connection):
+    connection.execute("ALTER TABLE items ADD COLUMN doubled INTEGER")
+
+
+class Testupgrade(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.engine = frontends._get_engine(
+            pathlib.Path(self.tmpdir.name) / "test.sqlite"
+        )
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.tmpdir.cleanup()
+
+    def _version(self):
+        with self.engine.connect() as connection:
+            return migrations.get_schema_version(connection)
+
+    def _tables(self):
+        return set(sqlalchemy.inspect(self.engine).get_table_names())
+
+    def test_creates_empty_database_at_current_version(self):
+        migration = unittest.mock.Mock()
+
+        migrations.upgrade(self.engine, metadata, [migration, migration])
+
+        migration.assert_not_called()
+        self.assertEqual(self._version(), 2)
+        self.assertEqual(self._tables(), {"items", "extra"})
+
+    def test_runs_pending_migrations_in_order(self):
+        with self.engine.begin() as connection:
+            create_v0(connection)
+
+        calls = []
+
+        def first(connection):
+            calls.append(("first", migrations.get_schema_version(connection)))
+            add_doubled(connection)
+
+        def second(connection):
+            calls.append(("second",
+                          migrations.get_schema_version(connection)))
+
+        migrations.upgrade(self.engine, metadata, [first, second])
+
+        self.assertEqual(calls, [("first", 0), ("second", 1)])
+        self.assertEqual(self._version(), 2)
+        # missing tables are created afterwards
+        self.assertEqual(self._tables(), {"items", "extra"})
+
+    def test_skips_applied_migrations(self):
+        with self.engine.begin() as connection:
+            create_v0(connection)
+            migrations.set_schema_version(connection, 1)
+
+        first = unittest.mock.Mock()
+        second = unittest.mock.Mock()
+
+        migrations.upgrade(self.engine, metadata, [first, second])
+
+        first.assert_not_called()
+        second.assert_called_once_with(unittest.mock.ANY)
+        self.assertEqual(self._version(), 2)
+
+    def test_rejects_newer_schema(self):
+        with self.engine.begin() as connection:
+            create_v0(connection)
+            migrations.set_schema_version(connection, 3)
+
+        migration = unittest.mock.Mock()
+
+        with self.assertRaisesRegex(RuntimeError,
+                                    "version 3 is newer .* version 1"):
+            migrations.upgrade(self.engine, metadata, [migration])
+
+        migration.assert_not_called()
+        self.assertEqual(self._version(), 3)
+
+    def test_failed_migration_is_rolled_back(self):
+        with self.engine.begin() as connection:
+            create_v0(connection)
+
+        def failing(connection):
+            add_doubled(connection)
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            migrations.upgrade(self.engine, metadata, [failing])
+
+        self.assertEqual(self._version(), 0)
+        columns = {
+            column["name"]
+            for column in sqlalchemy.inspect(self.engine).get_columns("items")
+        }
+        self.assertNotIn("doubled", columns)
+
+    def test_batched_migration_commits_between_batches(self):
+        with self.engine.begin() as connection:
+            create_v0(connection)
+            add_doubled(connection)
+            for i in range(10):
+                connection.execute(
+                    "INSERT INTO items (value) VALUES (?)", i,
+                )
+
+        def backfill(connection):
+            yield from migrations.run_batched(
+                connection,
+                "UPDATE items SET doubled = value * 2 WHERE id IN ("
+                "SELECT id FROM items WHERE doubled IS NULL "
+                "LIMIT :batch_size)",
+                batch_size=3,
+            )
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            migrations.upgrade(self.engine, metadata, [backfill])
+
+        self.assertEqual(self._version(), 0)
+        with self.engine.connect() as connection:
+            # the first three full batches are kept
+            self.assertEqual(
+                connection.execute(
+                    "SELECT COUNT(*) FROM items WHERE doubled IS NOT NULL"
+                ).scalar(),
+                9,
+            )
+
+        def resume(connection):
+            yield from migrations.run_batched(
+                connection,
+                "UPDATE items SET doubled = value * 2 WHERE id IN ("
+                "SELECT id FROM items WHERE doubled IS NULL "
+                "LIMIT :batch_size)",
+                batch_size=3,
+            )
+
+        migrations.upgrade(self.engine, metadata, [resume])
+
+        self.assertEqual(self._version(), 1)
+        with self.engine.connect() as connection:
+            self.assertEqual(
+                list(connection.execute(
+                    "SELECT value, doubled FROM items ORDER BY id"
+                )),
+                [(i, i * 2) for i in range(10)],
+            )
+
+
+class Testrun_batched(unittest.TestCase):
+    def test_yields_after_each_full_batch(self):
+        connection = unittest.mock.Mock()
+        connection.execute.side_effect = [
+            unittest.mock.Mock(rowcount=2),
+            unittest.mock.Mock(rowcount=2),
+            unittest.mock.Mock(rowcount=1),
+        ]
+
+        batches = list(migrations.run_batched(
+            connection,
+            unittest.mock.sentinel.statement,
+            batch_size=2,
+            foo=unittest.mock.sentinel.foo,
+        ))
+
+        self.assertEqual(len(batches), 2)
+        self.assertSequenceEqual(
+            connection.execute.mock_calls,
+            [
+                unittest.mock.call(
+                    unittest.mock.sentinel.statement,
+                    batch_size=2,
+                    foo=unittest.mock.sentinel.foo,
+                )
+            ] * 3,
+        )
+
+
+class TestSmallBlobMigrations(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.engine = frontends._get_engine(
+            pathlib.Path(self.tmpdir.name) / "peer.sqlite"
+        )
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.tmpdir.cleanup()
+
+    def test_upgrades_jid_columns(self):
+        with self.engine.begin() as connection:
+            connection.execute(
+                "CREATE TABLE smallblobs (account VARCHAR(2047), "
+                "peer VARCHAR(2047), name VARCHAR(255), data BLOB, "
+                "st_birthtime DATETIME, st_mtime DATETIME, "
+                "st_atime DATETIME, PRIMARY KEY (account, peer, name))"
+            )
+
+        migrations.upgrade(self.engine, peer_model.Base.metadata,
+                           peer_model.MIGRATIONS)
+
+        with self.engine.connect() as connection:
+            self.assertEqual(
+                migrations.get_schema_version(connection),
+                len(peer_model.MIGRATIONS),
+            )
+
+        columns = {
+            column["name"]
+            for column in sqlalchemy.inspect(self.engine).get_columns(
+                "smallblobs"
+            )
+        }
+        self.assertIn("account_id", columns)
+        self.assertNotIn("account", columns)
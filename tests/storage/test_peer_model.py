@@ -1,7 +1,10 @@
+import functools
 import unittest
 import unittest.mock
 import uuid
 
+from datetime import datetime
+
 import aioxmpp
 
 import sqlalchemy.sql
@@ -27,11 +30,29 @@ class TestSmallBlob(unittest.TestCase):
         self.db = inmemory_database(peer_model.Base)
 
     def test_from_level_descriptor(self):
-        descriptor = unittest.mock.Mock(["account", "peer"])
-        blob = peer_model.SmallBlob.from_level_descriptor(descriptor)
-        self.assertIsInstance(blob, peer_model.SmallBlob)
-        self.assertEqual(blob.account, descriptor.account)
-        self.assertEqual(blob.peer, descriptor.peer)
+        descriptor = jclib.storage.frontends.PeerLevel(
+            self.account,
+            self.peer,
+        )
+
+        with session_scope(self.db) as session:
+            blob = peer_model.SmallBlob.from_level_descriptor(
+                session, descriptor
+            )
+            self.assertIsInstance(blob, peer_model.SmallBlob)
+            self.assertEqual(
+                blob.account_id,
+                jclib.storage.common.jid_id(
+                    session, peer_model.JIDEntry, self.account,
+                ),
+            )
+            self.assertEqual(
+                blob.peer_id,
+                jclib.storage.common.jid_id(
+                    session, peer_model.JIDEntry, self.peer,
+                ),
+            )
+            self.assertNotEqual(blob.account_id, blob.peer_id)
 
     def test_filter_selects_by_primary_key(self):
         descriptor = jclib.storage.frontends.PeerLevel(
@@ -40,7 +61,7 @@ class TestSmallBlob(unittest.TestCase):
         )
 
         with session_scope(self.db) as session:
-            blob = peer_model.SmallBlob.from_level_descriptor(descriptor)
+            blob = peer_model.SmallBlob.from_level_descriptor(session, descriptor)
             blob.data = b"foo"
             blob.name = "name"
             session.add(blob)
@@ -85,7 +106,7 @@ class TestSmallBlob(unittest.TestCase):
         )
 
         with session_scope(self.db) as session:
-            blob = peer_model.SmallBlob.from_level_descriptor(descriptor)
+            blob = peer_model.SmallBlob.from_level_descriptor(session, descriptor)
             blob.data = b"foo"
             blob.name = "name"
             session.add(blob)
@@ -101,7 +122,7 @@ class TestSmallBlob(unittest.TestCase):
         )
 
         with session_scope(self.db) as session:
-            blob = peer_model.SmallBlob.from_level_descriptor(descriptor)
+            blob = peer_model.SmallBlob.from_level_descriptor(session, descriptor)
             blob.data = b"foo"
             blob.name = "name"
             session.add(blob)
@@ -134,7 +155,7 @@ class TestSmallBlob(unittest.TestCase):
         )
 
         with session_scope(self.db) as session:
-            blob = peer_model.SmallBlob.from_level_descriptor(descriptor)
+            blob = peer_model.SmallBlob.from_level_descriptor(session, descriptor)
             blob.data = b"foo"
             blob.name = "foo"
             session.add(blob)
@@ -156,3 +177,172 @@ class TestSmallBlob(unittest.TestCase):
                     descriptor,
                     "othername"
                 )
+
+    def test_load_many(self):
+        levels = [
+            jclib.storage.frontends.PeerLevel(self.account, peer)
+            for peer in [self.peer, other_jid]
+        ]
+        stranger = jclib.storage.frontends.PeerLevel(
+            other_jid, self.peer,
+        )
+        unknown = jclib.storage.frontends.PeerLevel(
+            self.account,
+            aioxmpp.JID.fromstr("unknown@server.example"),
+        )
+        old = datetime(2000, 1, 1)
+        now = datetime(2020, 1, 1)
+
+        with session_scope(self.db) as session:
+            for level in levels + [stranger]:
+                for name in ["a", "b"]:
+                    blob = peer_model.SmallBlob.from_level_descriptor(
+                        session, level,
+                    )
+                    blob.data = "{}/{}".format(level.peer, name).encode()
+                    blob.name = name
+                    blob.accessed = old
+                    session.add(blob)
+
+        with session_scope(self.db) as session:
+            result = peer_model.SmallBlob.load_many(
+                session, levels + [unknown], ["b"], now=now,
+            )
+
+        self.assertCountEqual(
+            result,
+            [
+                (level, "b", "{}/b".format(level.peer).encode())
+                for level in levels
+            ]
+        )
+
+        with session_scope(self.db) as session:
+            accessed = sorted(
+                blob.accessed
+                for blob in session.query(peer_model.SmallBlob)
+            )
+        self.assertEqual(accessed, [old] * 4 + [now] * 2)
+
+    def test_load_many_orders_by_primary_key(self):
+        peers = [
+            aioxmpp.JID.fromstr("peer{}@server.example".format(i))
+            for i in range(5)
+        ]
+        levels = [
+            jclib.storage.frontends.PeerLevel(self.account, peer)
+            for peer in peers
+        ]
+
+        with session_scope(self.db) as session:
+            for level in reversed(levels):
+                blob = peer_model.SmallBlob.from_level_descriptor(
+                    session, level,
+                )
+                blob.data = b"x"
+                blob.name = "name"
+                session.add(blob)
+
+        with session_scope(self.db) as session:
+            result = peer_model.SmallBlob.load_many(session, levels)
+            peer_ids = [
+                jclib.storage.common.jid_id(
+                    session, peer_model.JIDEntry, level.peer,
+                )
+                for level, _, _ in result
+            ]
+
+        self.assertEqual(len(result), 5)
+        self.assertEqual(peer_ids, sorted(peer_ids))
+
+    def test_load_many_budgets_peers_and_names_per_statement(self):
+        peers = [
+            aioxmpp.JID.fromstr("peer{}@server.example".format(i))
+            for i in range(5)
+        ]
+        levels = [
+            jclib.storage.frontends.PeerLevel(self.account, peer)
+            for peer in peers
+        ]
+        names = ["a", "b", "c"]
+
+        with session_scope(self.db) as session:
+            for level in reversed(levels):
+                for name in names:
+                    blob = peer_model.SmallBlob.from_level_descriptor(
+                        session, level,
+                    )
+                    blob.data = "{}/{}".format(level.peer, name).encode()
+                    blob.name = name
+                    session.add(blob)
+
+        statements = []
+
+        def record_statement(conn, cursor, statement, parameters, context,
+                             executemany):
+            statements.append((statement, parameters))
+
+        engine = self.db.kw["bind"]
+        sqlalchemy.event.listen(engine, "before_cursor_execute",
+                                record_statement)
+        jclib.storage.common._jid_id_caches.clear()
+        with session_scope(self.db) as session, \
+                unittest.mock.patch(
+                    "jclib.storage.peer_model.chunked_in",
+                    new=functools.partial(jclib.storage.common.chunked_in,
+                                          size=4)):
+            result = peer_model.SmallBlob.load_many(session, levels, names)
+            ids = {
+                peer: jclib.storage.common.jid_id(
+                    session, peer_model.JIDEntry, peer,
+                )
+                for peer in peers
+            }
+        sqlalchemy.event.remove(engine, "before_cursor_execute",
+                                record_statement)
+
+        self.assertEqual(
+            result,
+            sorted(
+                [
+                    (level, name,
+                     "{}/{}".format(level.peer, name).encode())
+                    for level in levels
+                    for name in names
+                ],
+                key=lambda row: (ids[row[0].peer], row[1]),
+            ),
+        )
+        self.assertEqual(
+            len([statement for statement, _ in statements
+                 if "FROM jids" in statement]),
+            1,
+        )
+        for statement, parameters in statements:
+            if "smallblobs" in statement:
+                self.assertLessEqual(len(parameters), 4)
+
+    def test_iter_keys(self):
+        other = aioxmpp.JID.fromstr("nurse@capulet.lit")
+        levels = [
+            jclib.storage.frontends.PeerLevel(self.account, peer)
+            for peer in [self.peer, other]
+        ]
+
+        with session_scope(self.db) as session:
+            for level, name in [(levels[0], "a"), (levels[0], "b"),
+                                (levels[1], "a")]:
+                blob = peer_model.SmallBlob.from_level_descriptor(
+                    session, level,
+                )
+                blob.data = b"x"
+                blob.name = name
+                session.add(blob)
+
+        with session_scope(self.db) as session:
+            keys = set(peer_model.SmallBlob.iter_keys(session))
+
+        self.assertEqual(
+            keys,
+            {(levels[0], "a"), (levels[0], "b"), (levels[1], "a")},
+        )
@@ -0,0 +1,247 @@
+import asyncio
+import collections
+import functools
+import pathlib
+import unittest
+import unittest.mock
+
+from aioxmpp.testutils import (
+    run_coroutine,
+    CoroutineMock,
+)
+
+import jclib.storage.space as space
+
+from jclib.storage.common import StorageLevel, StorageType
+from jclib.storage.frontends import EvictionCandidate
+
+
+class TestStorageAccounting(unittest.TestCase):
+    def setUp(self):
+        self.f1 = unittest.mock.Mock()
+        self.f1.usage = CoroutineMock()
+        self.f1.clear = CoroutineMock()
+        self.f2 = unittest.mock.Mock()
+        self.f2.usage = CoroutineMock()
+        self.f2.clear = CoroutineMock()
+        self.a = space.StorageAccounting({
+            "f1": self.f1,
+            "f2": self.f2,
+        })
+
+    def test_usage_collects_usage_of_all_frontends(self):
+        self.f1.usage.return_value = collections.Counter({
+            (StorageLevel.PEER, "urn:a"): 10,
+        })
+        self.f2.usage.side_effect = NotImplementedError()
+
+        result = run_coroutine(self.a.usage(StorageType.CACHE))
+
+        self.assertEqual(result, {"f1": self.f1.usage.return_value})
+        self.f1.usage.assert_called_once_with(StorageType.CACHE)
+        self.f2.usage.assert_called_once_with(StorageType.CACHE)
+
+    def test_total_usage(self):
+        self.f1.usage.return_value = collections.Counter({
+            (StorageLevel.PEER, "urn:a"): 10,
+            (StorageLevel.ACCOUNT, "urn:a"): 5,
+        })
+        self.f2.usage.return_value = collections.Counter({
+            (StorageLevel.PEER, "urn:b"): 7,
+        })
+
+        self.assertEqual(
+            run_coroutine(self.a.total_usage(StorageType.CACHE)),
+            22,
+        )
+
+    def test_total_usage_of_evictable_frontends(self):
+        self.f1.EVICTABLE = True
+        self.f1.usage.return_value = collections.Counter({
+            (StorageLevel.PEER, "urn:a"): 10,
+        })
+        self.f2.EVICTABLE = False
+
+        self.assertEqual(
+            run_coroutine(self.a.total_usage(StorageType.CACHE,
+                                             evictable=True)),
+            10,
+        )
+        self.f2.usage.assert_not_called()
+
+    def test_clear_runs_concurrently_and_reraises_first_error(self):
+        started = []
+        finished = []
+        exc = OSError()
+
+        async def clear(name, level):
+            started.append(name)
+            await asyncio.sleep(0)
+            # both have been started before either finishes
+            self.assertEqual(len(started), 2)
+            finished.append(name)
+            if name == "f1":
+                raise exc
+
+        self.f1.clear = functools.partial(clear, "f1")
+        self.f2.clear = functools.partial(clear, "f2")
+
+        with self.assertRaises(OSError) as ctx:
+            run_coroutine(self.a.clear(unittest.mock.sentinel.level))
+
+        self.assertIs(ctx.exception, exc)
+        self.assertCountEqual(finished, ["f1", "f2"])
+
+    def test_backup_backs_up_each_type_into_subdirectory(self):
+        self.f1.backup = CoroutineMock()
+        self.f2.backup = CoroutineMock()
+        self.f2.backup.side_effect = NotImplementedError()
+        destination = pathlib.Path("/backup")
+
+        run_coroutine(self.a.backup(
+            destination,
+            [StorageType.DATA, StorageType.CACHE],
+        ))
+
+        self.assertSequenceEqual(
+            self.f1.backup.mock_calls,
+            [
+                unittest.mock.call(StorageType.DATA, destination / "data"),
+                unittest.mock.call(StorageType.CACHE, destination / "cache"),
+            ]
+        )
+        self.assertEqual(len(self.f2.backup.mock_calls), 2)
+
+    def test_backup_defaults_to_all_types(self):
+        self.f1.backup = CoroutineMock()
+        self.f2.backup = CoroutineMock()
+
+        run_coroutine(self.a.backup(pathlib.Path("/backup")))
+
+        self.assertCountEqual(
+            [type_ for (type_, _), _ in self.f1.backup.call_args_list],
+            list(StorageType),
+        )
+
+    def test_backup_continues_and_reraises_first_error(self):
+        exc = OSError()
+        self.f1.backup = CoroutineMock()
+        self.f1.backup.side_effect = [exc, OSError()]
+        self.f2.backup = CoroutineMock()
+
+        with self.assertRaises(OSError) as ctx:
+            run_coroutine(self.a.backup(
+                pathlib.Path("/backup"),
+                [StorageType.DATA, StorageType.CACHE],
+            ))
+
+        self.assertIs(ctx.exception, exc)
+        self.assertEqual(len(self.f2.backup.mock_calls), 2)
+
+    def test_evict_deletes_least_recently_accessed_first(self):
+        evicted = []
+
+        def candidate(atime, size):
+            def evict():
+                evicted.append(atime)
+                return size
+
+            return EvictionCandidate(
+                atime=atime,
+                size=size,
+                evict=evict,
+            )
+
+        self.f1._eviction_candidates.return_value = [
+            candidate(3, 10),
+            candidate(1, 10),
+        ]
+        self.f2._eviction_candidates.return_value = [
+            candidate(2, 10),
+            candidate(4, 10),
+        ]
+
+        freed = run_coroutine(self.a.evict(StorageType.CACHE, 15))
+
+        self.assertEqual(freed, 20)
+        self.assertEqual(evicted, [1, 2])
+        self.f1._eviction_candidates.assert_called_once_with(
+            StorageType.CACHE,
+        )
+
+    def test_evict_skips_failing_candidates(self):
+        def fail():
+            raise OSError()
+
+        evict = unittest.mock.Mock(return_value=10)
+        self.f1._eviction_candidates.return_value = [
+            EvictionCandidate(atime=1, size=10, evict=fail),
+            EvictionCandidate(atime=2, size=10, evict=evict),
+        ]
+        self.f2._eviction_candidates.return_value = []
+
+        freed = run_coroutine(self.a.evict(StorageType.CACHE, 10))
+
+        self.assertEqual(freed, 10)
+        evict.assert_called_once_with()
+
+    def test_evict_counts_only_freed_bytes(self):
+        spared = unittest.mock.Mock(return_value=0)
+        evict = unittest.mock.Mock(return_value=10)
+        self.f1._eviction_candidates.return_value = [
+            EvictionCandidate(atime=1, size=10, evict=spared),
+            EvictionCandidate(atime=2, size=10, evict=evict),
+        ]
+        self.f2._eviction_candidates.return_value = []
+
+        freed = run_coroutine(self.a.evict(StorageType.CACHE, 10))
+
+        self.assertEqual(freed, 10)
+        spared.assert_called_once_with()
+        evict.assert_called_once_with()
+
+
+class TestCacheEvictor(unittest.TestCase):
+    def setUp(self):
+        self.accounting = unittest.mock.Mock()
+        self.accounting.total_usage = CoroutineMock()
+        self.accounting.evict = CoroutineMock()
+        self.e = space.CacheEvictor(
+            self.accounting,
+            1000,
+            low_watermark=0.5,
+        )
+
+    def test_check_does_nothing_within_quota(self):
+        self.accounting.total_usage.return_value = 1000
+
+        self.assertEqual(run_coroutine(self.e.check()), 0)
+
+        self.accounting.total_usage.assert_called_once_with(
+            StorageType.CACHE,
+            evictable=True,
+        )
+        self.accounting.evict.assert_not_called()
+
+    def test_check_evicts_down_to_low_watermark(self):
+        self.accounting.total_usage.return_value = 1200
+        self.accounting.evict.return_value = 700
+
+        self.assertEqual(run_coroutine(self.e.check()), 700)
+
+        self.accounting.evict.assert_called_once_with(
+            StorageType.CACHE,
+            700,
+        )
+
+    def test_start_and_stop(self):
+        with unittest.mock.patch("jclib.tasks.manager") as manager:
+            self.e.start()
+            self.e.start()
+
+            manager.start.assert_called_once_with(unittest.mock.ANY)
+            coro = manager.start.call_args[0][0]
+            coro.close()
+
+            self.e.stop()
+            manager.start().asyncio_task.cancel.assert_called_once_with()
@@ -0,0 +1,326 @@
+import contextlib
+import io
+import pathlib
+import tempfile
+import unittest
+import unittest.mock
+
+import aioxmpp
+import aioxmpp.xso
+
+import jclib.storage.frontends as frontends
+import jclib.storage.transfer as transfer
+
+from jclib.storage.common import StorageLevel, StorageType
+
+from aioxmpp.testutils import (
+    run_coroutine,
+    CoroutineMock,
+)
+
+from .test_frontends import MockBackend
+
+
+NS = "https://xmlns.jabbercat.org/test/transfer"
+
+
+class Item(aioxmpp.xso.XSO):
+    TAG = (NS, "item")
+
+    value = aioxmpp.xso.Attr("value")
+
+
+frontends.XMLFrontend.register(StorageLevel.ACCOUNT, Item)
+
+
+ACCOUNT = aioxmpp.JID.fromstr("juliet@capulet.lit")
+
+LEVELS = [
+    frontends.PeerLevel(
+        ACCOUNT,
+        aioxmpp.JID.fromstr("peer{}@server.example".format(i)),
+    )
+    for i in range(5)
+]
+
+
+class Testtransfer(unittest.TestCase):
+    def setUp(self):
+        self.backend = MockBackend().__enter__()
+        self.addCleanup(self.backend.__exit__, None, None, None)
+        self.type_ = StorageType.CACHE
+        self.small = transfer.SmallBlobEndpoint(
+            frontends.SmallBlobFrontend(self.backend)
+        )
+        self.large = transfer.LargeBlobEndpoint(
+            frontends.LargeBlobFrontend(self.backend)
+        )
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.checkpoint_path = pathlib.Path(self.tmpdir.name) / "checkpoint"
+
+    def _fill_small_blobs(self):
+        for i, level in enumerate(LEVELS):
+            run_coroutine(self.small.frontend.store(
+                self.type_, level, "urn:test", "avatar",
+                "data{}".format(i).encode(),
+            ))
+
+    def _checkpoint(self):
+        checkpoint = transfer.Checkpoint(self.checkpoint_path)
+        self.addCleanup(checkpoint.close)
+        return checkpoint
+
+    def test_small_blob_keys(self):
+        self._fill_small_blobs()
+
+        self.assertCountEqual(
+            run_coroutine(self.small.keys(self.type_)),
+            transfer.make_keys(self.type_, LEVELS, "urn:test", ["avatar"]),
+        )
+
+    def test_moves_small_blobs_to_large_blobs(self):
+        self._fill_small_blobs()
+        keys = run_coroutine(self.small.keys(self.type_))
+
+        result = run_coroutine(transfer.transfer(
+            self.small, self.large, keys,
+            checkpoint=self._checkpoint(),
+            move=True,
+            batch_size=2,
+        ))
+
+        self.assertEqual(result, transfer.TransferResult(
+            transferred=5, skipped=0, missing=0, mismatched=[],
+        ))
+        for i, level in enumerate(LEVELS):
+            key = transfer.Key(self.type_, level, "urn:test", "avatar")
+            self.assertEqual(
+                run_coroutine(self.large.read(key)),
+                "data{}".format(i).encode(),
+            )
+            with self.assertRaises(KeyError):
+                run_coroutine(self.small.read(key))
+
+    def test_copies_large_blobs_to_small_blobs(self):
+        keys = transfer.make_keys(self.type_, LEVELS, "urn:test",
+                                  ["avatar"])
+        run_coroutine(self.large.write(keys[0], b"foo"))
+
+        result = run_coroutine(transfer.transfer(
+            self.large, self.small, keys,
+        ))
+
+        self.assertEqual(result.transferred, 1)
+        self.assertEqual(result.missing, 4)
+        self.assertEqual(run_coroutine(self.small.read(keys[0])), b"foo")
+        self.assertEqual(run_coroutine(self.large.read(keys[0])), b"foo")
+
+    def test_resumes_from_checkpoint(self):
+        self._fill_small_blobs()
+        keys = sorted(run_coroutine(self.small.keys(self.type_)),
+                      key=lambda key: str(key.level.peer))
+
+        read = self.small.read
+
+        async def read_failing_at_fourth(key):
+            if key == keys[3]:
+                raise RuntimeError()
+            return await read(key)
+
+        with unittest.mock.patch.object(self.small, "read",
+                                        new=read_failing_at_fourth):
+            with self.assertRaises(RuntimeError):
+                run_coroutine(transfer.transfer(
+                    self.small, self.large, keys,
+                    checkpoint=self._checkpoint(),
+                    move=True,
+                    batch_size=2,
+                ))
+
+        # only the first batch is complete
+        for key in keys[:2]:
+            with self.assertRaises(KeyError):
+                run_coroutine(self.small.read(key))
+        for key in keys[2:]:
+            run_coroutine(self.small.read(key))
+
+        result = run_coroutine(transfer.transfer(
+            self.small, self.large, keys,
+            checkpoint=self._checkpoint(),
+            move=True,
+        ))
+
+        self.assertEqual(result.skipped, 2)
+        self.assertEqual(result.transferred, 3)
+
+    def test_keeps_source_of_mismatched_data(self):
+        self._fill_small_blobs()
+        keys = run_coroutine(self.small.keys(self.type_))
+
+        destination = unittest.mock.Mock(spec=transfer.Endpoint)
+        destination.write_file = CoroutineMock()
+        destination.flush = CoroutineMock()
+        destination.open = CoroutineMock(
+            side_effect=lambda key: io.BytesIO(b"garbage"),
+        )
+
+        with self.assertLogs("jclib.storage.transfer", "ERROR"):
+            result = run_coroutine(transfer.transfer(
+                self.small, destination, keys,
+                checkpoint=self._checkpoint(),
+                move=True,
+            ))
+
+        self.assertEqual(result.transferred, 0)
+        self.assertCountEqual(result.mismatched, keys)
+        self.assertEqual(len(self._checkpoint()), 0)
+        for key in keys:
+            run_coroutine(self.small.read(key))
+
+    def test_rejects_move_from_endpoint_without_removal(self):
+        xml = frontends.XMLFrontend(self.backend)
+        endpoint = transfer.XMLEndpoint(xml, [Item])
+        level = frontends.AccountLevel(ACCOUNT)
+        item = Item()
+        item.value = "a"
+        xml.put(self.type_, level, [item])
+        key = transfer.Key(self.type_, level, *Item.TAG)
+        checkpoint = self._checkpoint()
+
+        with self.assertRaises(ValueError):
+            run_coroutine(transfer.transfer(
+                endpoint, self.small, [key],
+                checkpoint=checkpoint,
+                move=True,
+            ))
+
+        self.assertEqual(len(checkpoint), 0)
+        with self.assertRaises(KeyError):
+            run_coroutine(self.small.read(key))
+
+    def test_streams_large_blobs_in_chunks(self):
+        keys = transfer.make_keys(self.type_, LEVELS[:1], "urn:test",
+                                  ["avatar"])
+        data = bytes(range(256)) * 4
+        run_coroutine(self.large.write(keys[0], data))
+
+        other_backend = MockBackend().__enter__()
+        self.addCleanup(other_backend.__exit__, None, None, None)
+        destination = transfer.LargeBlobEndpoint(
+            frontends.LargeBlobFrontend(other_backend),
+        )
+
+        sizes = []
+        open_ = self.large.open
+
+        async def open_recording_reads(key):
+            f = await open_(key)
+            read = f.read
+
+            def recording_read(size=-1):
+                sizes.append(size)
+                return read(size)
+
+            f.read = recording_read
+            return f
+
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(unittest.mock.patch.object(
+                transfer, "CHUNK_SIZE", 100,
+            ))
+            stack.enter_context(unittest.mock.patch.object(
+                self.large, "open", new=open_recording_reads,
+            ))
+            read = stack.enter_context(unittest.mock.patch.object(
+                self.large, "read",
+            ))
+            write = stack.enter_context(unittest.mock.patch.object(
+                destination, "write",
+            ))
+
+            result = run_coroutine(transfer.transfer(
+                self.large, destination, keys,
+            ))
+
+        read.assert_not_called()
+        write.assert_not_called()
+        self.assertEqual(result.transferred, 1)
+        self.assertTrue(sizes)
+        self.assertTrue(all(size == 100 for size in sizes))
+        self.assertEqual(run_coroutine(destination.read(keys[0])), data)
+
+    def test_xml_round_trip(self):
+        xml = frontends.XMLFrontend(self.backend)
+        endpoint = transfer.XMLEndpoint(xml, [Item])
+        level = frontends.AccountLevel(ACCOUNT)
+        items = []
+        for value in ["a", "b"]:
+            item = Item()
+            item.value = value
+            items.append(item)
+        xml.put(self.type_, level, items)
+
+        key = transfer.Key(self.type_, level, *Item.TAG)
+        result = run_coroutine(transfer.transfer(
+            endpoint, self.small, [key],
+        ))
+        self.assertEqual(result.transferred, 1)
+
+        xml = frontends.XMLFrontend(self.backend)
+        endpoint = transfer.XMLEndpoint(xml, [Item])
+        other = transfer.Key(
+            self.type_,
+            frontends.AccountLevel(aioxmpp.JID.fromstr("romeo@montague.lit")),
+            *Item.TAG
+        )
+        run_coroutine(self.small.write(other,
+                                       run_coroutine(self.small.read(key))))
+
+        result = run_coroutine(transfer.transfer(
+            self.small, endpoint, [other],
+        ))
+        self.assertEqual(result.transferred, 1)
+
+        self.assertEqual(
+            [item.value
+             for item in frontends.XMLFrontend(self.backend).get_all(
+                 self.type_, other.level, Item,
+             )],
+            ["a", "b"],
+        )
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = pathlib.Path(self.tmpdir.name) / "sub" / "checkpoint"
+        self.keys = transfer.make_keys(StorageType.CACHE, LEVELS, "urn:test",
+                                       ["a", "b"])
+
+    def test_persists_keys(self):
+        checkpoint = transfer.Checkpoint(self.path)
+        checkpoint.add(self.keys[:3])
+        checkpoint.add(self.keys[:1])
+        checkpoint.close()
+
+        checkpoint = transfer.Checkpoint(self.path)
+        self.assertEqual(len(checkpoint), 3)
+        for key in self.keys[:3]:
+            self.assertIn(key, checkpoint)
+        self.assertNotIn(self.keys[3], checkpoint)
+        checkpoint.close()
+
+    def test_ignores_torn_record(self):
+        checkpoint = transfer.Checkpoint(self.path)
+        checkpoint.add(self.keys[:1])
+        checkpoint.close()
+
+        with self.path.open("a") as f:
+            f.write(transfer._encode_key(self.keys[1])[:-1])
+
+        checkpoint = transfer.Checkpoint(self.path)
+        self.assertIn(self.keys[0], checkpoint)
+        self.assertNotIn(self.keys[1], checkpoint)
+        checkpoint.close()
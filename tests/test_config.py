@@ -1,5 +1,6 @@
 import contextlib
 import pathlib
+import tempfile
 import unittest
 import unittest.mock
 import traceback
@@ -580,6 +581,70 @@ class TestConfigManager(unittest.TestCase):
 
         cb.assert_called_with()
 
+    def test_writer_uses_safe_writer_outside_writeback(self):
+        with unittest.mock.patch("jclib.utils.safe_writer") as safe_writer:
+            result = self.cm.writer(unittest.mock.sentinel.path)
+
+        safe_writer.assert_called_once_with(unittest.mock.sentinel.path)
+        self.assertEqual(result, safe_writer())
+
+    def test_writeback_commits_files_of_handlers_together(self):
+        with contextlib.ExitStack() as stack:
+            GroupWriter = stack.enter_context(
+                unittest.mock.patch("jclib.utils.GroupWriter")
+            )
+            safe_writer = stack.enter_context(
+                unittest.mock.patch("jclib.utils.safe_writer")
+            )
+
+            def cb():
+                self.cm.writer(unittest.mock.sentinel.path1)
+                self.cm.writer(unittest.mock.sentinel.path2)
+                GroupWriter().commit.assert_not_called()
+                return True
+
+            self.cm.on_writeback.connect(cb)
+            self.cm.writeback()
+
+            GroupWriter().open.assert_has_calls([
+                unittest.mock.call(unittest.mock.sentinel.path1),
+                unittest.mock.call(unittest.mock.sentinel.path2),
+            ])
+            GroupWriter().commit.assert_called_once_with()
+            safe_writer.assert_not_called()
+
+            # the group is only used during the writeback
+            self.cm.writer(unittest.mock.sentinel.path3)
+            safe_writer.assert_called_once_with(unittest.mock.sentinel.path3)
+
+    def test_writeback_writes_files(self):
+        with contextlib.ExitStack() as stack:
+            tmpdir = pathlib.Path(stack.enter_context(
+                tempfile.TemporaryDirectory()
+            ))
+            paths = [tmpdir / "a", tmpdir / "b"]
+
+            def cb():
+                for path in paths:
+                    with self.cm.writer(path) as f:
+                        f.write(path.name.encode())
+                self.assertFalse(any(path.exists() for path in paths))
+                return True
+
+            self.cm.on_writeback.connect(cb)
+            self.cm.writeback()
+
+            for path in paths:
+                with path.open("rb") as f:
+                    self.assertEqual(f.read(), path.name.encode())
+
+    def test_writeback_logs_failed_commit(self):
+        with unittest.mock.patch("jclib.utils.GroupWriter") as GroupWriter:
+            GroupWriter().commit.side_effect = OSError()
+
+            with self.assertLogs("jclib.config", "ERROR"):
+                self.cm.writeback()
+
     def tearDown(self):
         del self.cm
 
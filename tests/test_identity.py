@@ -290,3 +290,19 @@ class TestAccounts(unittest.TestCase):
             self.c.lookup_jid(acc12_new.jid),
             acc12_new,
         )
+
+    def test__enabled_jids_from_xso(self):
+        tmp = identity.Accounts()
+
+        acc11 = tmp.new_account(TEST_JID.replace(localpart="acc1"),
+                                (100, 200, 300))
+        tmp.new_account(TEST_JID.replace(localpart="acc2"),
+                        (10, 20, 30))
+
+        tmp.set_account_enabled(acc11, False)
+
+        self.assertEqual(
+            self.c._enabled_jids_from_xso(tmp._do_save_xso()),
+            [TEST_JID.replace(localpart="acc2")],
+        )
+        self.assertEqual(len(self.c), 0)
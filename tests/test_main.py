@@ -7,6 +7,8 @@ import stat
 import unittest
 import unittest.mock
 
+import aioxmpp
+
 from aioxmpp.testutils import (
     run_coroutine,
     CoroutineMock
@@ -14,6 +16,7 @@ from aioxmpp.testutils import (
 
 import jclib.main as main
 import jclib.config as config
+import jclib.storage
 
 
 skip_without_unix = unittest.skipUnless(
@@ -691,9 +694,49 @@ class TestMain(unittest.TestCase):
 
         base.mock_calls.clear()
 
+        storage = unittest.mock.Mock()
+
         with contextlib.ExitStack() as stack:
+            stack.enter_context(unittest.mock.patch(
+                "jclib.storage.engines.stop",
+                new=storage.engines_stop,
+            ))
+            stack.enter_context(unittest.mock.patch.object(
+                instance.writeman,
+                "force_writeback",
+                new=storage.force_writeback,
+            ))
+            stack.enter_context(unittest.mock.patch(
+                "jclib.storage.append.close",
+                new=storage.append_close,
+            ))
+            stack.enter_context(unittest.mock.patch(
+                "jclib.storage.xml.close",
+                new=storage.xml_close,
+            ))
+            stack.enter_context(unittest.mock.patch(
+                "jclib.storage.databases.close",
+                new=storage.databases_close,
+            ))
+            stack.enter_context(unittest.mock.patch(
+                "jclib.storage.engines.close_all",
+                new=storage.engines_close_all,
+            ))
+
             instance.teardown()
 
+        self.assertSequenceEqual(
+            storage.mock_calls,
+            [
+                unittest.mock.call.engines_stop(),
+                unittest.mock.call.force_writeback(),
+                unittest.mock.call.append_close(),
+                unittest.mock.call.xml_close(),
+                unittest.mock.call.databases_close(),
+                unittest.mock.call.engines_close_all(),
+            ]
+        )
+
         self.assertFalse(hasattr(instance, "main_future"))
 
         calls = list(base.mock_calls)
@@ -705,6 +748,46 @@ class TestMain(unittest.TestCase):
             ]
         )
 
+    def test_preload_storage_opens_storage_of_enabled_accounts(self):
+        jids = [
+            aioxmpp.JID.fromstr("romeo@montague.lit"),
+            aioxmpp.JID.fromstr("juliet@capulet.lit"),
+        ]
+
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(unittest.mock.patch.object(
+                self.main.accounts,
+                "stored_enabled_jids",
+                return_value=jids,
+            ))
+
+            preload = stack.enter_context(unittest.mock.patch(
+                "jclib.storage.xml.preload",
+                new=CoroutineMock(),
+            ))
+
+            run_coroutine(self.main.preload_storage())
+
+        preload.assert_called_once_with(
+            jclib.storage.StorageType.CACHE,
+            [jclib.storage.AccountLevel(jid) for jid in jids],
+        )
+
+    def test_preload_storage_ignores_errors(self):
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(unittest.mock.patch.object(
+                self.main.accounts,
+                "stored_enabled_jids",
+                return_value=[],
+            ))
+
+            stack.enter_context(unittest.mock.patch(
+                "jclib.storage.xml.preload",
+                new=CoroutineMock(side_effect=OSError()),
+            ))
+
+            run_coroutine(self.main.preload_storage())
+
     def test_acquire_singleton_starts_get_singleton_impl(self):
         base = unittest.mock.Mock()
 
@@ -827,6 +910,7 @@ class TestMain(unittest.TestCase):
 
     def test_run_call_sequence(self):
         base = unittest.mock.Mock()
+        base.preload_storage = CoroutineMock()
 
         obj = object()
 
@@ -862,6 +946,12 @@ class TestMain(unittest.TestCase):
                 new=base.teardown
             ))
 
+            preload_storage = stack.enter_context(unittest.mock.patch.object(
+                self.main,
+                "preload_storage",
+                new=base.preload_storage
+            ))
+
             result = run_coroutine(self.main.run())
 
         calls = list(base.mock_calls)
@@ -870,6 +960,7 @@ class TestMain(unittest.TestCase):
             [
                 unittest.mock.call.setup(),
                 unittest.mock.call.acquire_singleton(),
+                unittest.mock.call.preload_storage(),
                 unittest.mock.call.run_core(),
                 unittest.mock.call.acquire_singleton().stop(),
                 unittest.mock.call.teardown(),
@@ -883,6 +974,7 @@ class TestMain(unittest.TestCase):
 
     def test_run_handle_None_singleton(self):
         base = unittest.mock.Mock()
+        base.preload_storage = CoroutineMock()
 
         obj = object()
 
@@ -918,6 +1010,12 @@ class TestMain(unittest.TestCase):
                 new=base.teardown
             ))
 
+            preload_storage = stack.enter_context(unittest.mock.patch.object(
+                self.main,
+                "preload_storage",
+                new=base.preload_storage
+            ))
+
             result = run_coroutine(self.main.run())
 
         calls = list(base.mock_calls)
@@ -926,6 +1024,7 @@ class TestMain(unittest.TestCase):
             [
                 unittest.mock.call.setup(),
                 unittest.mock.call.acquire_singleton(),
+                unittest.mock.call.preload_storage(),
                 unittest.mock.call.run_core(),
                 unittest.mock.call.teardown(),
             ]
@@ -938,6 +1037,7 @@ class TestMain(unittest.TestCase):
 
     def test_run_handle_False_singleton(self):
         base = unittest.mock.Mock()
+        base.preload_storage = CoroutineMock()
 
         obj = object()
 
@@ -973,6 +1073,12 @@ class TestMain(unittest.TestCase):
                 new=base.teardown
             ))
 
+            preload_storage = stack.enter_context(unittest.mock.patch.object(
+                self.main,
+                "preload_storage",
+                new=base.preload_storage
+            ))
+
             result = run_coroutine(self.main.run())
 
         calls = list(base.mock_calls)
@@ -992,6 +1098,7 @@ class TestMain(unittest.TestCase):
 
     def test_run_handle_core_exception(self):
         base = unittest.mock.Mock()
+        base.preload_storage = CoroutineMock()
 
         exc = Exception()
 
@@ -1026,6 +1133,12 @@ class TestMain(unittest.TestCase):
                 new=base.teardown
             ))
 
+            preload_storage = stack.enter_context(unittest.mock.patch.object(
+                self.main,
+                "preload_storage",
+                new=base.preload_storage
+            ))
+
             result = run_coroutine(self.main.run())
 
         calls = list(base.mock_calls)
@@ -1034,6 +1147,7 @@ class TestMain(unittest.TestCase):
             [
                 unittest.mock.call.setup(),
                 unittest.mock.call.acquire_singleton(),
+                unittest.mock.call.preload_storage(),
                 unittest.mock.call.run_core(),
                 unittest.mock.call.acquire_singleton().stop(),
                 unittest.mock.call.teardown()
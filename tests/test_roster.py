@@ -725,10 +725,10 @@ class TestContactRosterService(unittest.TestCase):
     def test_not_writable_by_default(self):
         self.assertFalse(self.rs.is_writable)
 
-    def test_connects_weakly_to_write_manager(self):
-        self.writeman.on_writeback.connect.assert_called_once_with(
+    def test_registers_with_write_manager(self):
+        self.writeman.register.assert_called_once_with(
+            unittest.mock.ANY,
             self.rs.save,
-            self.writeman.on_writeback.WEAK
         )
 
     def test_prepare_client_summons_roster_and_connects_signals(self):
@@ -840,7 +840,7 @@ class TestContactRosterService(unittest.TestCase):
         self.assertEqual(len(self.rs), 1)
         self.assertEqual(self.rs[0], wrap())
 
-        self.writeman.request_writeback.assert_called_once_with()
+        self.writeman.register().request_writeback.assert_called_once_with()
 
     def test__on_entry_removed_removes_item(self):
         upstream_item1_ver1 = unittest.mock.Mock()
@@ -856,9 +856,9 @@ class TestContactRosterService(unittest.TestCase):
         self.rs._on_entry_added(upstream_item1_ver1)
         self.rs._on_entry_added(upstream_item2)
 
-        self.writeman.request_writeback.reset_mock()
+        self.writeman.register().request_writeback.reset_mock()
         self.rs._on_entry_removed(upstream_item1_ver2)
-        self.writeman.request_writeback.assert_called_once_with()
+        self.writeman.register().request_writeback.assert_called_once_with()
 
         self.assertEqual(len(self.rs), 1)
         self.assertEqual(self.rs[0].address, TEST_JID2)
@@ -878,7 +878,7 @@ class TestContactRosterService(unittest.TestCase):
         self.rs._on_entry_added(upstream_item2)
         self.rs._on_entry_added(upstream_item1_ver1)
 
-        self.writeman.request_writeback.reset_mock()
+        self.writeman.register().request_writeback.reset_mock()
         with unittest.mock.patch.object(self.rs[1], "update") as update:
             self.rs._on_entry_changed(upstream_item1_ver2)
 
@@ -886,7 +886,7 @@ class TestContactRosterService(unittest.TestCase):
 
         self.assertEqual(len(self.rs), 2)
 
-        self.writeman.request_writeback.assert_called_once_with()
+        self.writeman.register().request_writeback.assert_called_once_with()
         self.listener.data_changed.assert_called_once_with(
             None,
             1, 1,
@@ -909,7 +909,7 @@ class TestContactRosterService(unittest.TestCase):
         self.rs._on_entry_added(upstream_item2)
         self.rs._on_entry_added(upstream_item1_ver1)
 
-        self.writeman.request_writeback.reset_mock()
+        self.writeman.register().request_writeback.reset_mock()
         with unittest.mock.patch.object(self.rs[1], "update") as update:
             self.rs._on_entry_changed(upstream_item1_ver2, "fnord")
 
@@ -917,7 +917,7 @@ class TestContactRosterService(unittest.TestCase):
 
         self.assertEqual(len(self.rs), 2)
 
-        self.writeman.request_writeback.assert_called_once_with()
+        self.writeman.register().request_writeback.assert_called_once_with()
         self.listener.data_changed.assert_called_once_with(
             None,
             1, 1,
@@ -1390,10 +1390,10 @@ class TestConferenceBookmarkService(unittest.TestCase):
     def test_not_writable_by_default(self):
         self.assertFalse(self.rs.is_writable)
 
-    def test_connects_weakly_to_write_manager(self):
-        self.writeman.on_writeback.connect.assert_called_once_with(
+    def test_registers_with_write_manager(self):
+        self.writeman.register.assert_called_once_with(
+            unittest.mock.ANY,
             self.rs.save,
-            self.writeman.on_writeback.WEAK
         )
 
     def test_prepare_client_summons_roster_and_connects_signals(self):
@@ -1459,7 +1459,7 @@ class TestConferenceBookmarkService(unittest.TestCase):
         self.assertEqual(len(self.rs), 1)
         self.assertEqual(self.rs[0], wrap())
 
-        self.writeman.request_writeback.assert_called_once_with()
+        self.writeman.register().request_writeback.assert_called_once_with()
 
     def test__on_bookmark_removed_removes_item(self):
         upstream_item1_ver1 = unittest.mock.Mock()
@@ -1474,9 +1474,9 @@ class TestConferenceBookmarkService(unittest.TestCase):
         self.rs._on_bookmark_added(upstream_item1_ver1)
         self.rs._on_bookmark_added(upstream_item2)
 
-        self.writeman.request_writeback.reset_mock()
+        self.writeman.register().request_writeback.reset_mock()
         self.rs._on_bookmark_removed(upstream_item1_ver2)
-        self.writeman.request_writeback.assert_called_once_with()
+        self.writeman.register().request_writeback.assert_called_once_with()
 
         self.assertEqual(len(self.rs), 1)
         self.assertEqual(self.rs[0].address, TEST_JID2)
@@ -1534,7 +1534,7 @@ class TestConferenceBookmarkService(unittest.TestCase):
 
             self.rs._on_bookmark_added(unittest.mock.sentinel.upstream_item)
 
-        self.writeman.request_writeback.reset_mock()
+        self.writeman.register().request_writeback.reset_mock()
 
         wrap.assert_called_once_with(
             self.account,
@@ -1559,7 +1559,7 @@ class TestConferenceBookmarkService(unittest.TestCase):
             None,
         )
 
-        self.writeman.request_writeback.assert_called_once_with()
+        self.writeman.register().request_writeback.assert_called_once_with()
 
 
 class TestSubscriptionRequestService(unittest.TestCase):
@@ -2018,6 +2018,57 @@ class TestRosterManager(unittest.TestCase):
             _items.mock_calls,
         )
 
+    def test__prepare_client_starts_peer_blob_warmups(self):
+        client = unittest.mock.Mock(spec=aioxmpp.Client)
+        account = unittest.mock.Mock(spec=jclib.identity.Account)
+        account.jid = aioxmpp.JID.fromstr("juliet@capulet.lit")
+        contacts = [
+            unittest.mock.Mock(
+                address=aioxmpp.JID.fromstr("romeo@montague.lit"),
+            ),
+            unittest.mock.Mock(
+                address=aioxmpp.JID.fromstr("nurse@capulet.lit"),
+            ),
+        ]
+
+        self.gr.add_peer_blob_warmup(
+            unittest.mock.sentinel.type_,
+            "urn:example:avatar",
+            ["hash"],
+        )
+
+        with contextlib.ExitStack() as stack:
+            ContactRosterService = stack.enter_context(
+                unittest.mock.patch("jclib.roster.ContactRosterService")
+            )
+            ContactRosterService().__iter__.side_effect = \
+                lambda: iter(contacts)
+
+            stack.enter_context(
+                unittest.mock.patch.object(self.gr, "_backend")
+            )
+
+            _warm_peer_blobs = stack.enter_context(
+                unittest.mock.patch.object(self.gr, "_warm_peer_blobs")
+            )
+
+            start = stack.enter_context(
+                unittest.mock.patch("jclib.tasks.manager.start")
+            )
+
+            self.gr._prepare_client(account, client)
+
+        _warm_peer_blobs.assert_called_once_with(
+            unittest.mock.sentinel.type_,
+            [
+                jclib.storage.PeerLevel(account.jid, item.address)
+                for item in contacts
+            ],
+            "urn:example:avatar",
+            ["hash"],
+        )
+        start.assert_called_once_with(_warm_peer_blobs())
+
     def test__prepare_client_creates_subscription_service_and_links_it(self):
         client = unittest.mock.Mock(spec=aioxmpp.Client)
         account = unittest.mock.Mock(spec=jclib.identity.Account)
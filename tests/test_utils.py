@@ -1,7 +1,10 @@
 import asyncio
+import concurrent.futures
 import contextlib
 import os.path
 import pathlib
+import tempfile
+import threading
 import unittest
 import unittest.mock
 import xml.sax.handler
@@ -734,6 +737,207 @@ class Testsafe_writer(unittest.TestCase):
         )
 
 
+class Testfsync_all(unittest.TestCase):
+    def test_syncs_all_file_descriptors(self):
+        with unittest.mock.patch("os.fsync") as fsync:
+            utils.fsync_all([1, 2, 3])
+
+        self.assertCountEqual(
+            fsync.mock_calls,
+            [
+                unittest.mock.call(1),
+                unittest.mock.call(2),
+                unittest.mock.call(3),
+            ]
+        )
+
+    def test_syncs_in_calling_thread_with_single_thread(self):
+        with contextlib.ExitStack() as stack:
+            fsync = stack.enter_context(unittest.mock.patch("os.fsync"))
+            ThreadPoolExecutor = stack.enter_context(unittest.mock.patch(
+                "concurrent.futures.ThreadPoolExecutor"
+            ))
+
+            utils.fsync_all([1, 2], max_threads=1)
+            utils.fsync_all([3])
+
+        ThreadPoolExecutor.assert_not_called()
+        self.assertSequenceEqual(
+            fsync.mock_calls,
+            [
+                unittest.mock.call(1),
+                unittest.mock.call(2),
+                unittest.mock.call(3),
+            ]
+        )
+
+    def test_reraises_exception(self):
+        class FooException(Exception):
+            pass
+
+        with unittest.mock.patch("os.fsync") as fsync:
+            fsync.side_effect = [None, FooException(), None]
+
+            with self.assertRaises(FooException):
+                utils.fsync_all([1, 2, 3])
+
+    def test_reuses_threads(self):
+        threads = set()
+
+        def fsync(fd):
+            threads.add(threading.current_thread())
+
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(unittest.mock.patch("os.fsync", new=fsync))
+            stack.enter_context(unittest.mock.patch.object(
+                utils, "_fsync_executor", None,
+            ))
+            ThreadPoolExecutor = stack.enter_context(unittest.mock.patch(
+                "concurrent.futures.ThreadPoolExecutor",
+                wraps=concurrent.futures.ThreadPoolExecutor,
+            ))
+
+            utils.fsync_all(range(utils.FSYNC_THREADS * 2))
+            utils.fsync_all([1, 2])
+            utils._fsync_executor.shutdown()
+
+        ThreadPoolExecutor.assert_called_once_with(
+            max_workers=utils.FSYNC_THREADS,
+            thread_name_prefix="fsync",
+        )
+        self.assertLessEqual(len(threads), utils.FSYNC_THREADS)
+        self.assertNotIn(threading.current_thread(), threads)
+
+
+class TestGroupWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.base = pathlib.Path(self.tmpdir.name)
+        (self.base / "a").mkdir()
+        (self.base / "b").mkdir()
+        self.paths = [
+            self.base / "a" / "x",
+            self.base / "a" / "y",
+            self.base / "b" / "z",
+        ]
+        with self.paths[0].open("wb") as f:
+            f.write(b"old")
+
+    def _read(self, path):
+        with path.open("rb") as f:
+            return f.read()
+
+    def _stage(self, group):
+        for path in self.paths:
+            with group.open(path) as f:
+                f.write(path.name.encode())
+
+    def test_replaces_files_on_commit(self):
+        group = utils.GroupWriter()
+        self._stage(group)
+
+        self.assertEqual(self._read(self.paths[0]), b"old")
+        self.assertFalse(self.paths[1].exists())
+
+        group.commit()
+
+        for path in self.paths:
+            self.assertEqual(self._read(path), path.name.encode())
+        self.assertCountEqual(
+            [path.name for path in self.base.glob("*/*")],
+            ["x", "y", "z"],
+        )
+
+    def test_syncs_files_together_and_directories_once(self):
+        with contextlib.ExitStack() as stack:
+            fsync_all = stack.enter_context(unittest.mock.patch(
+                "jclib.utils.fsync_all",
+            ))
+            fsync_dir = stack.enter_context(unittest.mock.patch(
+                "jclib.utils.fsync_dir",
+            ))
+
+            with utils.GroupWriter() as group:
+                self._stage(group)
+
+        fsync_all.assert_called_once_with(unittest.mock.ANY)
+        self.assertSequenceEqual(
+            fsync_dir.mock_calls,
+            [
+                unittest.mock.call(self.base / "a"),
+                unittest.mock.call(self.base / "b"),
+            ]
+        )
+
+    def test_does_not_sync_directories_if_disabled(self):
+        with unittest.mock.patch("jclib.utils.fsync_dir") as fsync_dir:
+            with utils.GroupWriter(sync_dirs=False) as group:
+                self._stage(group)
+
+        fsync_dir.assert_not_called()
+        self.assertEqual(self._read(self.paths[0]), b"x")
+
+    def test_discards_file_on_exception_in_open(self):
+        class FooException(Exception):
+            pass
+
+        group = utils.GroupWriter()
+        with self.assertRaises(FooException):
+            with group.open(self.paths[0]) as f:
+                f.write(b"new")
+                raise FooException()
+        group.commit()
+
+        self.assertEqual(self._read(self.paths[0]), b"old")
+        self.assertEqual(len(list(self.base.glob("*/*"))), 1)
+
+    def test_aborts_on_exception(self):
+        class FooException(Exception):
+            pass
+
+        with self.assertRaises(FooException):
+            with utils.GroupWriter() as group:
+                self._stage(group)
+                raise FooException()
+
+        self.assertEqual(self._read(self.paths[0]), b"old")
+        self.assertEqual(len(list(self.base.glob("*/*"))), 1)
+
+    def test_replaces_nothing_if_sync_fails(self):
+        group = utils.GroupWriter()
+        self._stage(group)
+
+        with unittest.mock.patch("jclib.utils.fsync_all") as fsync_all:
+            fsync_all.side_effect = OSError()
+            with self.assertRaises(OSError):
+                group.commit()
+
+        self.assertEqual(self._read(self.paths[0]), b"old")
+        self.assertEqual(len(list(self.base.glob("*/*"))), 1)
+
+    def test_discards_remaining_files_if_replace_fails(self):
+        group = utils.GroupWriter()
+        self._stage(group)
+
+        replace = os.replace
+
+        def fail_second(src, dst):
+            if dst == str(self.paths[1]):
+                raise OSError()
+            replace(src, dst)
+
+        with unittest.mock.patch("os.replace", new=fail_second):
+            with self.assertRaises(OSError):
+                group.commit()
+
+        self.assertEqual(self._read(self.paths[0]), b"x")
+        self.assertCountEqual(
+            [path.name for path in self.base.glob("*/*")],
+            ["x"],
+        )
+
+
 class TestDelayedInvocation(unittest.TestCase):
     def setUp(self):
         self.sink = unittest.mock.Mock()
@@ -849,6 +1053,25 @@ class TestDelayedInvocation(unittest.TestCase):
             [(("arg2",), {})]
         )
 
+    def test_schedules_again_after_max_delay_was_reached(self):
+        self.dac.max_delay = self.delay*3/4
+
+        # the second call finds the first scheduled at max_delay already
+        self.dac("arg1")
+        run_coroutine(asyncio.sleep(self.delay/2))
+        self.dac("arg2")
+        run_coroutine(asyncio.sleep(self.delay/2))
+
+        self.sink.assert_called_once()
+        self.sink.reset_mock()
+
+        self.dac("arg3")
+        run_coroutine(asyncio.sleep(self.delay*1.1))
+
+        self.sink.assert_called_once_with(
+            [(("arg3",), {})]
+        )
+
     def test_max_delay_can_be_passed_via_constructor(self):
         dac = utils.DelayedInvocation(
             self.sink,
@@ -0,0 +1,58 @@
+#!/usr/bin/python3
+"""
+Back up the storage of JabberCat.
+
+The backup can be taken while the client is running. Running it again with
+the same destination only copies what has changed in the meantime.
+"""
+import argparse
+import asyncio
+import logging
+import pathlib
+
+import jclib.storage
+
+from jclib.storage.common import StorageType
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument(
+        "destination",
+        type=pathlib.Path,
+        help="Directory to store the backup in",
+    )
+    parser.add_argument(
+        "-t", "--type",
+        dest="types",
+        action="append",
+        choices=[type_.value for type_ in StorageType],
+        help="Storage type to back up (may be given multiple times; "
+        "default: all types)",
+    )
+    parser.add_argument(
+        "-v", "--verbose",
+        action="count",
+        default=0,
+        help="Increase verbosity",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level={
+            0: logging.WARNING,
+            1: logging.INFO,
+        }.get(args.verbose, logging.DEBUG),
+    )
+
+    types = None
+    if args.types:
+        types = [StorageType(value) for value in args.types]
+
+    asyncio.get_event_loop().run_until_complete(
+        jclib.storage.accounting.backup(args.destination, types)
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,412 @@
+#!/usr/bin/python3
+"""
+Benchmark the storage frontends of JabberCat.
+
+Synthetic accounts and peers are generated in a scratch directory (never the
+storage of the user) and the frontend operations are timed for each number of
+keys. The results (operations per second and latency percentiles) are written
+as JSON, so that the results before and after a change can be compared.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import math
+import pathlib
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+import aioxmpp
+import aioxmpp.xso
+
+import sqlalchemy
+
+import jclib.storage.backends as backends
+import jclib.storage.frontends as frontends
+
+from jclib.storage.common import StorageLevel, StorageType
+
+
+logger = logging.getLogger("storagebench")
+
+
+NAMESPACE = "https://xmlns.jabbercat.org/storage/bench"
+
+
+class Item(aioxmpp.xso.XSO):
+    TAG = (NAMESPACE, "item")
+
+    value = aioxmpp.xso.Attr("value")
+
+
+frontends.XMLFrontend.register(StorageLevel.PEER, Item)
+
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def decorator(f):
+        BENCHMARKS[name] = f
+        return f
+    return decorator
+
+
+def percentile(sorted_values, p):
+    """
+    Return the `p`-th percentile of `sorted_values` (nearest rank).
+    """
+    rank = max(math.ceil(p / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+class Timer:
+    def __init__(self):
+        super().__init__()
+        self.latencies = []
+        self.seconds = 0
+
+    @contextlib.contextmanager
+    def op(self):
+        t0 = time.perf_counter()
+        yield
+        latency = time.perf_counter() - t0
+        self.latencies.append(latency)
+        self.seconds += latency
+
+    def result(self):
+        latencies = sorted(self.latencies)
+        return {
+            "ops": len(latencies),
+            "seconds": self.seconds,
+            "ops_per_sec": (len(latencies) / self.seconds
+                            if self.seconds else None),
+            "latency": {
+                "p50": percentile(latencies, 50),
+                "p90": percentile(latencies, 90),
+                "p99": percentile(latencies, 99),
+                "max": latencies[-1],
+            },
+        }
+
+
+class Workload:
+    """
+    The synthetic data of one benchmark run.
+
+    :param directory: The scratch directory to store the data in.
+    :param nkeys: The number of keys (one peer per key).
+    :param naccounts: The number of accounts the peers are spread across.
+    :param nsamples: The maximum number of operations timed for benchmarks
+        which read existing data.
+    """
+
+    TYPE = StorageType.CACHE
+
+    def __init__(self, directory, nkeys, naccounts, nsamples, blob_size,
+                 large_blob_size, rng):
+        super().__init__()
+        self.directory = directory
+        self.backend = backends.DirectoryBackend(directory)
+        self.rng = rng
+        self.nsamples = nsamples
+        self.blob = bytes(blob_size)
+        self.large_blob = bytes(large_blob_size)
+        accounts = [
+            aioxmpp.JID.fromstr("account{}@bench.example".format(i))
+            for i in range(naccounts)
+        ]
+        self.levels = [
+            frontends.PeerLevel(
+                accounts[i % naccounts],
+                aioxmpp.JID.fromstr("peer{}@bench.example".format(i)),
+            )
+            for i in range(nkeys)
+        ]
+        self._frontends = {}
+
+    def frontend(self, cls):
+        try:
+            return self._frontends[cls]
+        except KeyError:
+            frontend = cls(self.backend)
+            self._frontends[cls] = frontend
+            return frontend
+
+    def sample(self):
+        if len(self.levels) <= self.nsamples:
+            return list(self.levels)
+        return self.rng.sample(self.levels, self.nsamples)
+
+    def close(self):
+        for frontend in self._frontends.values():
+            close = getattr(frontend, "close", None)
+            if close is not None:
+                close()
+        self._frontends.clear()
+        frontends.engines.close_all()
+
+
+@benchmark("smallblob.store")
+async def bench_smallblob_store(workload):
+    frontend = workload.frontend(frontends.SmallBlobFrontend)
+    timer = Timer()
+    for level in workload.levels:
+        with timer.op():
+            await frontend.store(workload.TYPE, level, NAMESPACE, "blob",
+                                 workload.blob)
+    return timer
+
+
+@benchmark("smallblob.load")
+async def bench_smallblob_load(workload):
+    frontend = workload.frontend(frontends.SmallBlobFrontend)
+    timer = Timer()
+    for level in workload.sample():
+        with timer.op():
+            await frontend.load(workload.TYPE, level, NAMESPACE, "blob")
+    return timer
+
+
+@benchmark("smallblob.stat")
+async def bench_smallblob_stat(workload):
+    frontend = workload.frontend(frontends.SmallBlobFrontend)
+    timer = Timer()
+    for level in workload.sample():
+        with timer.op():
+            await frontend.stat(workload.TYPE, level, NAMESPACE, "blob")
+    return timer
+
+
+@benchmark("largeblob.write")
+async def bench_largeblob_write(workload):
+    frontend = workload.frontend(frontends.LargeBlobFrontend)
+    timer = Timer()
+    for level in workload.levels:
+        with timer.op():
+            f = await frontend.open(workload.TYPE, level, NAMESPACE, "blob",
+                                    "wb")
+            with f:
+                f.write(workload.large_blob)
+    return timer
+
+
+@benchmark("largeblob.open_read")
+async def bench_largeblob_open_read(workload):
+    frontend = workload.frontend(frontends.LargeBlobFrontend)
+    timer = Timer()
+    for level in workload.sample():
+        with timer.op():
+            f = await frontend.open(workload.TYPE, level, NAMESPACE, "blob",
+                                    "rb")
+            with f:
+                f.read()
+    return timer
+
+
+@benchmark("append.submit")
+async def bench_append_submit(workload):
+    frontend = workload.frontend(frontends.AppendFrontend)
+    timer = Timer()
+    for level in workload.levels:
+        with timer.op():
+            frontend.submit(workload.TYPE, level, NAMESPACE, "log",
+                            workload.blob)
+    # the buffered records are part of the cost of submitting them
+    with timer.op():
+        await frontend.flush_all_async()
+    return timer
+
+
+def _item(value):
+    item = Item()
+    item.value = value
+    return item
+
+
+@benchmark("xml.put")
+async def bench_xml_put(workload):
+    frontend = workload.frontend(frontends.XMLFrontend)
+    timer = Timer()
+    for i, level in enumerate(workload.levels):
+        with timer.op():
+            frontend.put(workload.TYPE, level, _item(str(i)))
+    return timer
+
+
+@benchmark("xml.flush_all")
+async def bench_xml_flush_all(workload):
+    frontend = workload.frontend(frontends.XMLFrontend)
+    for i, level in enumerate(workload.levels):
+        frontend.put(workload.TYPE, level, _item(str(i)))
+    frontend.flush_all()
+
+    # the typical writeback: a single item has changed since the last one
+    timer = Timer()
+    for level in workload.sample():
+        frontend.put(workload.TYPE, level, _item("changed"))
+        with timer.op():
+            frontend.flush_all()
+    return timer
+
+
+async def run(directory, args):
+    results = []
+    rng = random.Random(args.seed)
+    for nkeys in args.keys:
+        for name in args.benchmarks:
+            # a fresh directory for each benchmark, so that they can be run
+            # in any combination
+            workload = Workload(
+                pathlib.Path(tempfile.mkdtemp(dir=str(directory))),
+                nkeys,
+                min(args.accounts, nkeys),
+                args.samples,
+                args.blob_size,
+                args.large_blob_size,
+                rng,
+            )
+            try:
+                if name in ("smallblob.load", "smallblob.stat"):
+                    await bench_smallblob_store(workload)
+                elif name == "largeblob.open_read":
+                    await bench_largeblob_write(workload)
+                logger.info("running %s with %d keys", name, nkeys)
+                timer = await BENCHMARKS[name](workload)
+            finally:
+                workload.close()
+
+            result = {"benchmark": name, "keys": nkeys}
+            result.update(timer.result())
+            logger.info("%s with %d keys: %.1f ops/s, p99 %.3f ms",
+                        name, nkeys,
+                        result["ops_per_sec"] or 0,
+                        result["latency"]["p99"] * 1000)
+            results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument(
+        "-o", "--output",
+        type=pathlib.Path,
+        default=None,
+        help="File to write the JSON results to (default: standard output)",
+    )
+    parser.add_argument(
+        "-k", "--keys",
+        type=int,
+        action="append",
+        help="Number of keys (may be given multiple times; default: 1000, "
+        "10000 and 100000)",
+    )
+    parser.add_argument(
+        "-b", "--benchmark",
+        dest="benchmarks",
+        action="append",
+        choices=sorted(BENCHMARKS),
+        help="Benchmark to run (may be given multiple times; default: all "
+        "benchmarks)",
+    )
+    parser.add_argument(
+        "--accounts",
+        type=int,
+        default=10,
+        help="Number of accounts the peers are spread across (default: 10)",
+    )
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=1000,
+        help="Maximum number of operations timed by benchmarks which access "
+        "existing keys (default: 1000)",
+    )
+    parser.add_argument(
+        "--blob-size",
+        type=int,
+        default=1024,
+        help="Size of small blobs and append records in bytes "
+        "(default: 1024)",
+    )
+    parser.add_argument(
+        "--large-blob-size",
+        type=int,
+        default=1024*1024,
+        help="Size of large blobs in bytes (default: 1048576)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed for choosing the sampled keys (default: 0)",
+    )
+    parser.add_argument(
+        "-d", "--directory",
+        type=pathlib.Path,
+        default=None,
+        help="Directory to create the scratch directories in (default: the "
+        "system temporary directory)",
+    )
+    parser.add_argument(
+        "-v", "--verbose",
+        action="count",
+        default=0,
+        help="Increase verbosity",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level={
+            0: logging.WARNING,
+            1: logging.INFO,
+        }.get(args.verbose, logging.DEBUG),
+    )
+
+    if not args.keys:
+        args.keys = [1000, 10000, 100000]
+    if not args.benchmarks:
+        args.benchmarks = list(BENCHMARKS)
+
+    with tempfile.TemporaryDirectory(
+            prefix="storagebench-",
+            dir=str(args.directory) if args.directory is not None else None,
+            ) as directory:
+        results = asyncio.get_event_loop().run_until_complete(
+            run(pathlib.Path(directory), args)
+        )
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "sqlalchemy": sqlalchemy.__version__,
+            "platform": platform.platform(),
+            "arguments": {
+                "keys": args.keys,
+                "accounts": args.accounts,
+                "samples": args.samples,
+                "blob_size": args.blob_size,
+                "large_blob_size": args.large_blob_size,
+                "seed": args.seed,
+            },
+        },
+        "results": results,
+    }
+
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        with args.output.open("w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,16 @@
 #!/usr/bin/python3
 import asyncio
+import pathlib
 import aioxmpp
 import uuid
 import jclib.storage.frontends as frontends
 import jclib.storage.backends as backends
+import jclib.storage.transfer as transfer
 from jclib.storage.common import StorageLevel, StorageType
 from jclib.storage.frontends import PeerLevel, GlobalLevel, AccountLevel
 b = backends.XDGBackend("jabbercat.org")
 smallblobs = frontends.SmallBlobFrontend(b)
+largeblobs = frontends.LargeBlobFrontend(b)
 append = frontends.AppendFrontend(b)
 xml = frontends.XMLFrontend(b)
 peer = aioxmpp.JID.fromstr("romeo@montague.lit")
@@ -15,3 +18,27 @@ account = aioxmpp.JID.fromstr("juliet@capulet.lit")
 
 def await_(fut):
     return asyncio.get_event_loop().run_until_complete(fut)
+
+
+def migrate(source, destination, keys, checkpoint_path=None, **kwargs):
+    """
+    Move data between frontends, e.g. all small blobs to large blobs::
+
+        >>> src = transfer.SmallBlobEndpoint(smallblobs)
+        >>> migrate(src, transfer.LargeBlobEndpoint(largeblobs),
+        ...         await_(src.keys(StorageType.CACHE)), move=True)
+
+    See :func:`jclib.storage.transfer.transfer` for the keyword arguments.
+    """
+    checkpoint = None
+    if checkpoint_path is not None:
+        checkpoint = transfer.Checkpoint(pathlib.Path(checkpoint_path))
+    try:
+        return await_(transfer.transfer(
+            source, destination, keys,
+            checkpoint=checkpoint,
+            **kwargs
+        ))
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()